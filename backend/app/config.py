@@ -31,6 +31,9 @@ class Settings(BaseSettings):
     
     # Gemini
     gemini_api_base: str = "https://generativelanguage.googleapis.com"
+    # GeminiCLI (Code Assist) 上游和 OAuth token 刷新地址（压测时指向 scripts/loadtest 的模拟上游）
+    code_assist_endpoint: str = "https://cloudcode-pa.googleapis.com"
+    google_token_url: str = "https://oauth2.googleapis.com/token"
     
     # 用户配额
     default_daily_quota: int = 100  # 新用户默认配额
@@ -100,6 +103,21 @@ class Settings(BaseSettings):
     
     # 日志保留
     log_retention_days: int = 7  # 日志保留天数（0=永久保留）
+    log_retention_interval: int = 3600  # 清理间隔（秒）
+    log_retention_batch_size: int = 5000  # 每批删除行数
+    log_retention_batch_pause: float = 0.5  # 批之间暂停（秒），给正常写入让出锁
+    log_retention_archive: bool = False  # 删除前写入归档文件
+    log_archive_dir: str = "data/log_archive"
+    # PostgreSQL 按天分区 usage_logs（开启后启动时在线迁移，保留策略改为直接删除过期分区）
+    usage_logs_partitioned: bool = False
+    usage_logs_partition_premake: int = 7  # 提前创建未来几天的分区
+    usage_logs_partition_batch: int = 20000  # 在线迁移每批复制行数
+    # 旧库 usage_logs 上的大字段（请求内容/错误信息等）迁移到侧表时每批行数
+    log_payload_migrate_batch: int = 2000
+    # 迁移完成后删除 usage_logs 上的旧大字段列（不可逆，删除后无法回滚到旧版本；确认不再回滚后再开启）
+    log_payload_drop_legacy_columns: bool = False
+    # 没有日志引用的去重文本至少存在多久才清理（秒）
+    log_text_prune_grace: int = 3600
     
     # 公告
     announcement_enabled: bool = False
@@ -168,6 +186,75 @@ You are Antigravity, a powerful agentic AI coding assistant designed by the Goog
     anthropic_base_rpm: int = 10                   # 默认 RPM
     anthropic_contributor_rpm: int = 20            # 贡献者 RPM
     
+    # 凭证池加权公平调度（并发占满时按用户通道排队）
+    fair_scheduler_enabled: bool = False           # 是否启用公平调度
+    fair_scheduler_max_concurrency: int = 32       # GeminiCLI 凭证池最大并发请求数
+    fair_scheduler_agy_max_concurrency: int = 32   # Antigravity 凭证池最大并发请求数
+    fair_scheduler_max_wait: int = 60              # 最长排队时间（秒），超时返回 503
+    fair_scheduler_plus_min_creds: int = 3         # 公开凭证数达到此值进入高级贡献者通道
+    # 通道权重（数值越大分到的名额越多）
+    fair_scheduler_weight_admin: int = 8
+    fair_scheduler_weight_contributor_plus: int = 4
+    fair_scheduler_weight_contributor: int = 2
+    fair_scheduler_weight_base: int = 1
+
+    # 非流式请求对冲（首个请求迟迟不返回时，换凭证再发一次，先到先用）
+    hedge_enabled: bool = False                    # 是否启用对冲
+    hedge_percentile: int = 95                     # 超过该模型历史延迟的第几百分位后发起对冲
+    hedge_min_delay: float = 5.0                   # 对冲最短等待时间（秒）
+    hedge_min_samples: int = 20                    # 该模型至少有多少条延迟样本才启用对冲
+    hedge_budget_percent: int = 10                 # 对冲预算：额外请求最多占正常请求的百分比
+
+    # 相同非流式请求合并（同一用户同时发起的相同请求只调用一次上游，默认关闭）
+    coalesce_enabled: bool = False
+
+    # 确定性请求响应缓存（temperature=0 / topK=1 的非流式请求，命中时不占用凭证）
+    response_cache_enabled: bool = False
+    response_cache_scope: str = "user"             # user=按用户隔离, global=全站共享
+    response_cache_ttl: int = 3600                 # 缓存有效期（秒）
+    response_cache_max_bytes: int = 64 * 1024 * 1024        # 内存层字节预算
+    response_cache_disk_max_bytes: int = 512 * 1024 * 1024  # 磁盘层字节预算（0=不溢出到磁盘）
+    response_cache_dir: str = "data/response_cache"
+
+    # 对话前缀转换缓存（多轮对话只转换新增的消息，历史部分复用上一轮的转换结果）
+    prefix_cache_enabled: bool = True
+    prefix_cache_entries_per_user: int = 4         # 每个用户保留的对话数（并行的多个会话）
+    prefix_cache_max_users: int = 256              # 最多缓存多少个用户
+    prefix_cache_max_entry_bytes: int = 8 * 1024 * 1024  # 单个对话超过该大小（估算）不缓存
+    prefix_cache_max_bytes: int = 256 * 1024 * 1024     # 所有用户合计（估算）超过时淘汰最久未用的对话
+
+    # 请求中的内联图片（base64 / data URL），单张解码后超过该大小（MB）的图片不转发给上游
+    inline_image_max_mb: int = 20
+
+    # 生成图片落盘（分块解码，在线程池中写入，不阻塞事件循环）
+    image_write_concurrency: int = 4               # 同时写入的图片数
+    image_write_budget_mb: int = 64                # 正在写入的图片总大小上限（MB），超过时新的写入排队
+    image_expiry_state_file: str = "data/image_expiry.json"  # 图片待删除列表（重启后继续按原时间删除）
+
+    # 本地 token 估算（按中日韩/其它文字分别计数，用上游 usageMetadata 校准）
+    count_tokens_local: bool = False               # Anthropic count_tokens 一律本地估算，不转发给 Anthropic 上游
+    token_estimate_cache_size: int = 4096          # 按内容哈希缓存的单条消息统计数
+
+    # 模型目录缓存（后台刷新上游动态模型列表，/v1/models 直接读内存）
+    model_catalog_ttl: int = 600                   # 刷新间隔（秒）
+
+    # 凭证配额后台轮询（管理页面和凭证选择优先读快照）
+    quota_poller_enabled: bool = True
+    quota_poll_interval: int = 1800                # 正常轮询间隔（秒）
+    quota_poll_interval_low: int = 300             # 剩余配额低于 20% 时的轮询间隔（秒）
+    quota_poll_interval_max: int = 21600           # 查询失败退避的最大间隔（秒）
+    quota_poll_concurrency: int = 4                # 同时查询的凭证数
+    quota_snapshot_max_age: int = 600              # 配额接口直接返回快照的最大快照年龄（秒）
+
+    # 配额耗尽预测（按请求计数 + 学到的每日额度，在凭证耗尽前提前停止路由）
+    quota_forecast_enabled: bool = True
+    quota_forecast_stop_ratio: float = 0.97        # 已用达到预计额度的该比例后跳过该凭证
+
+    # 统计概览快照（/stats/overview 与 /api/public/stats 共用）
+    stats_snapshot_ttl: int = 10                   # 快照有效期（秒），过期后后台刷新、期间返回旧快照
+    # 用户汇总表（管理后台用户列表）全量校准间隔（秒），平时由写日志/凭证变更增量更新
+    user_summary_reconcile_interval: int = 600
+
     # 统计时区设置 (server=服务器时区午夜重置, utc=UTC午夜重置(北京下午4点), utc8=北京时间午夜重置)
     stats_timezone: str = "server"
     
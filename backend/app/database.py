@@ -97,10 +97,6 @@ async def init_db(skip_migration_check: bool = False):
                 "ALTER TABLE credentials ADD COLUMN last_used_pro DATETIME",
                 "ALTER TABLE credentials ADD COLUMN last_used_30 DATETIME",
                 "ALTER TABLE usage_logs ADD COLUMN cd_seconds INTEGER",
-                "ALTER TABLE usage_logs ADD COLUMN error_message TEXT",
-                "ALTER TABLE usage_logs ADD COLUMN request_body TEXT",
-                "ALTER TABLE usage_logs ADD COLUMN client_ip VARCHAR(50)",
-                "ALTER TABLE usage_logs ADD COLUMN user_agent VARCHAR(500)",
                 # 错误分类字段（新增）
                 "ALTER TABLE usage_logs ADD COLUMN error_type VARCHAR(50)",
                 "ALTER TABLE usage_logs ADD COLUMN error_code VARCHAR(100)",
@@ -110,6 +106,7 @@ async def init_db(skip_migration_check: bool = False):
                 "ALTER TABLE credentials ADD COLUMN credential_type VARCHAR(20) DEFAULT 'oauth'",
                 "ALTER TABLE credentials ADD COLUMN model_tier VARCHAR(20)",
                 "ALTER TABLE credentials ADD COLUMN model_cooldowns TEXT",
+                "ALTER TABLE credentials ADD COLUMN quota_limits TEXT",
                 # Antigravity 用户配额
                 "ALTER TABLE users ADD COLUMN quota_antigravity INTEGER DEFAULT 100",
                 "ALTER TABLE users ADD COLUMN used_antigravity INTEGER DEFAULT 0",
@@ -123,6 +120,12 @@ async def init_db(skip_migration_check: bool = False):
                 "ALTER TABLE users ADD COLUMN quota_agy_claude INTEGER DEFAULT 0",
                 "ALTER TABLE users ADD COLUMN quota_agy_gemini INTEGER DEFAULT 0",
                 "ALTER TABLE users ADD COLUMN quota_agy_banana INTEGER DEFAULT 0",
+                # 响应缓存命中标记
+                "ALTER TABLE usage_logs ADD COLUMN cache_hit BOOLEAN DEFAULT 0",
+                # 模型分类列
+                "ALTER TABLE usage_logs ADD COLUMN api_type VARCHAR(20)",
+                "ALTER TABLE usage_logs ADD COLUMN quota_class VARCHAR(20)",
+                "ALTER TABLE usage_logs ADD COLUMN model_family VARCHAR(20)",
             ]
         else:
             # PostgreSQL 迁移（使用 IF NOT EXISTS 语法）
@@ -139,10 +142,6 @@ async def init_db(skip_migration_check: bool = False):
                 "ALTER TABLE credentials ADD COLUMN IF NOT EXISTS last_used_pro TIMESTAMP",
                 "ALTER TABLE credentials ADD COLUMN IF NOT EXISTS last_used_30 TIMESTAMP",
                 "ALTER TABLE usage_logs ADD COLUMN IF NOT EXISTS cd_seconds INTEGER",
-                "ALTER TABLE usage_logs ADD COLUMN IF NOT EXISTS error_message TEXT",
-                "ALTER TABLE usage_logs ADD COLUMN IF NOT EXISTS request_body TEXT",
-                "ALTER TABLE usage_logs ADD COLUMN IF NOT EXISTS client_ip VARCHAR(50)",
-                "ALTER TABLE usage_logs ADD COLUMN IF NOT EXISTS user_agent VARCHAR(500)",
                 # 错误分类字段（新增）
                 "ALTER TABLE usage_logs ADD COLUMN IF NOT EXISTS error_type VARCHAR(50)",
                 "ALTER TABLE usage_logs ADD COLUMN IF NOT EXISTS error_code VARCHAR(100)",
@@ -152,6 +151,7 @@ async def init_db(skip_migration_check: bool = False):
                 "ALTER TABLE credentials ADD COLUMN IF NOT EXISTS credential_type VARCHAR(20) DEFAULT 'oauth'",
                 "ALTER TABLE credentials ADD COLUMN IF NOT EXISTS model_tier VARCHAR(20)",
                 "ALTER TABLE credentials ADD COLUMN IF NOT EXISTS model_cooldowns TEXT",
+                "ALTER TABLE credentials ADD COLUMN IF NOT EXISTS quota_limits TEXT",
                 # Antigravity 用户配额
                 "ALTER TABLE users ADD COLUMN IF NOT EXISTS quota_antigravity INTEGER DEFAULT 100",
                 "ALTER TABLE users ADD COLUMN IF NOT EXISTS used_antigravity INTEGER DEFAULT 0",
@@ -165,6 +165,12 @@ async def init_db(skip_migration_check: bool = False):
                 "ALTER TABLE users ADD COLUMN IF NOT EXISTS quota_agy_claude INTEGER DEFAULT 0",
                 "ALTER TABLE users ADD COLUMN IF NOT EXISTS quota_agy_gemini INTEGER DEFAULT 0",
                 "ALTER TABLE users ADD COLUMN IF NOT EXISTS quota_agy_banana INTEGER DEFAULT 0",
+                # 响应缓存命中标记
+                "ALTER TABLE usage_logs ADD COLUMN IF NOT EXISTS cache_hit BOOLEAN DEFAULT FALSE",
+                # 模型分类列
+                "ALTER TABLE usage_logs ADD COLUMN IF NOT EXISTS api_type VARCHAR(20)",
+                "ALTER TABLE usage_logs ADD COLUMN IF NOT EXISTS quota_class VARCHAR(20)",
+                "ALTER TABLE usage_logs ADD COLUMN IF NOT EXISTS model_family VARCHAR(20)",
             ]
         
         for sql in migrations:
@@ -190,6 +196,13 @@ async def init_db(skip_migration_check: bool = False):
             "CREATE INDEX IF NOT EXISTS idx_usage_logs_date_error ON usage_logs(created_at, error_type)",
             # Antigravity 索引（新增）
             "CREATE INDEX IF NOT EXISTS idx_credentials_api_type ON credentials(api_type)",
+            # 模型分类索引（与 index=True 同名，新库不会重复创建）
+            "CREATE INDEX IF NOT EXISTS ix_usage_logs_api_type ON usage_logs(api_type)",
+            "CREATE INDEX IF NOT EXISTS ix_usage_logs_quota_class ON usage_logs(quota_class)",
+            "CREATE INDEX IF NOT EXISTS ix_usage_logs_model_family ON usage_logs(model_family)",
+            "CREATE INDEX IF NOT EXISTS idx_usage_logs_user_class ON usage_logs(user_id, created_at, api_type, quota_class)",
+            # 日志列表 keyset 翻页 (created_at, id)
+            "CREATE INDEX IF NOT EXISTS idx_usage_logs_created_id ON usage_logs(created_at, id)",
         ]
         
         for sql in indexes:
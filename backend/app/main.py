@@ -9,7 +9,7 @@ from app.database import init_db, async_session
 from app.models.user import User
 from app.services.auth import get_password_hash
 from app.config import settings, load_config_from_db
-from app.routers import auth, proxy, admin, oauth, ws, manage, error_config
+from app.routers import auth, proxy, admin, oauth, ws, manage, error_config, images
 from app.routers.test import router as test_router
 from app.routers import antigravity_proxy, antigravity_manage, antigravity_oauth
 from app.routers import antigravity_anthropic, antigravity_gemini
@@ -21,9 +21,6 @@ from sqlalchemy import select, update
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     import asyncio
-    from datetime import datetime, timedelta
-    from sqlalchemy import delete
-    from app.models.user import UsageLog
     
     # 启动时初始化
     await init_db()
@@ -106,39 +103,55 @@ async def lifespan(app: FastAPI):
         
         await db.commit()
     
-    # 定时清理过期日志的后台任务
-    async def cleanup_old_logs():
-        while True:
-            try:
-                retention_days = settings.log_retention_days
-                if retention_days > 0:
-                    cutoff_date = datetime.utcnow() - timedelta(days=retention_days)
-                    async with async_session() as db:
-                        result = await db.execute(
-                            delete(UsageLog).where(UsageLog.created_at < cutoff_date)
-                        )
-                        deleted_count = result.rowcount
-                        await db.commit()
-                        if deleted_count > 0:
-                            print(f"🗑️ 自动清理了 {deleted_count} 条过期日志（{retention_days}天前）")
-            except Exception as e:
-                print(f"⚠️ 日志清理失败: {e}")
-            
-            # 每24小时执行一次
-            await asyncio.sleep(86400)
-    
-    # 启动后台清理任务
-    cleanup_task = asyncio.create_task(cleanup_old_logs())
+    # 启动过期日志分批清理任务
+    from app.services.log_retention import log_retention
+    cleanup_task = asyncio.create_task(log_retention.run_forever())
     print("✅ 已启动日志自动清理任务")
     
+    # 启动 usage_logs 分区维护任务（仅 PostgreSQL 且开启分区时生效）
+    from app.services.log_partitions import log_partitioner
+    partition_task = asyncio.create_task(log_partitioner.run_forever())
+    
+    # 启动模型目录后台刷新任务
+    from app.services.model_catalog import model_catalog
+    catalog_task = asyncio.create_task(model_catalog.run_forever())
+    print("✅ 已启动模型目录刷新任务")
+    
+    # 为历史日志补全模型分类列（后台执行，不阻塞启动）
+    from app.services.model_classifier import backfill_model_classes
+    backfill_task = asyncio.create_task(backfill_model_classes())
+    
+    # 把旧库 usage_logs 上的大字段迁移到侧表（后台执行，不阻塞启动）
+    from app.services.log_payloads import run_migration as migrate_log_payloads
+    payload_task = asyncio.create_task(migrate_log_payloads())
+    
+    # 启动用户汇总校准任务（启动时先全量重建一次）
+    from app.services.user_summary import user_summary
+    summary_task = asyncio.create_task(user_summary.run_forever())
+    
+    # 从今天的使用日志恢复配额预测计数
+    from app.services.quota_forecast import quota_forecaster
+    async with async_session() as db:
+        await quota_forecaster.load_from_db(db)
+    
+    # 启动生成图片的过期删除任务（恢复重启前的待删除列表）
+    from app.services.image_storage import image_expiry
+    image_task = asyncio.create_task(image_expiry.run_forever())
+    
+    # 启动凭证配额后台轮询任务
+    from app.services.quota_poller import quota_poller
+    quota_task = asyncio.create_task(quota_poller.run_forever())
+    print("✅ 已启动凭证配额轮询任务")
+    
     yield
     
     # 关闭时取消后台任务
-    cleanup_task.cancel()
-    try:
-        await cleanup_task
-    except asyncio.CancelledError:
-        pass
+    for task in (cleanup_task, partition_task, catalog_task, quota_task, backfill_task, payload_task, summary_task, image_task):
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
 
 
 app = FastAPI(
@@ -177,6 +190,7 @@ app.include_router(antigravity_manage.router)  # Antigravity 凭证管理
 app.include_router(antigravity_oauth.router)  # Antigravity OAuth 凭证获取
 app.include_router(anthropic_proxy_router.router)  # Anthropic API 反代
 app.include_router(anthropic_manage.router)  # Anthropic 凭证管理
+app.include_router(images.router)  # 生成图片访问 (/images，按内容寻址，带缓存头)
 
 
 @app.get("/api/health")
@@ -186,63 +200,23 @@ async def health():
 
 @app.get("/api/public/stats")
 async def public_stats():
-    """公共统计信息（无需登录）"""
-    from sqlalchemy import select, func
-    from app.models.user import User, Credential, UsageLog
-    from datetime import date
+    """公共统计信息（无需登录，读取统计快照，频繁请求也不会打到数据库）"""
+    from app.services.stats_snapshot import stats_snapshot
+    snapshot = await stats_snapshot.get()
+    requests = snapshot["requests"]
+    credentials = snapshot["credentials"]
     
-    async with async_session() as db:
-        user_count = (await db.execute(select(func.count(User.id)))).scalar() or 0
-        active_credentials = (await db.execute(
-            select(func.count(Credential.id)).where(Credential.is_active == True)
-        )).scalar() or 0
-        
-        # CLI/AGY 凭证统计（兼容旧数据库，可能没有 api_type 列）
-        cli_credentials = 0
-        agy_credentials = 0
-        try:
-            # CLI 凭证（api_type 为空、None 或 'geminicli'）
-            cli_credentials = (await db.execute(
-                select(func.count(Credential.id))
-                .where(Credential.is_active == True)
-                .where((Credential.api_type == None) | (Credential.api_type == "") | (Credential.api_type == "geminicli"))
-            )).scalar() or 0
-            
-            # AGY 凭证（api_type = "antigravity"）
-            agy_credentials = (await db.execute(
-                select(func.count(Credential.id))
-                .where(Credential.is_active == True)
-                .where(Credential.api_type == "antigravity")
-            )).scalar() or 0
-        except Exception:
-            # 旧数据库可能没有 api_type 列，降级处理
-            cli_credentials = active_credentials
-            agy_credentials = 0
-        
-        today = date.today()
-        today_requests = (await db.execute(
-            select(func.count(UsageLog.id)).where(func.date(UsageLog.created_at) == today)
-        )).scalar() or 0
-        
-        # 成功/失败统计
-        today_success = (await db.execute(
-            select(func.count(UsageLog.id))
-            .where(func.date(UsageLog.created_at) == today)
-            .where(UsageLog.status_code == 200)
-        )).scalar() or 0
-        today_failed = today_requests - today_success
-        
-        return {
-            "user_count": user_count,
-            "active_credentials": active_credentials,
-            "credentials": {
-                "cli": cli_credentials,
-                "agy": agy_credentials,
-            },
-            "today_requests": today_requests,
-            "today_success": today_success,
-            "today_failed": today_failed
-        }
+    return {
+        "user_count": snapshot["users"]["total"],
+        "active_credentials": credentials["active"],
+        "credentials": {
+            "cli": credentials["cli"],
+            "agy": credentials["agy"],
+        },
+        "today_requests": requests["today"],
+        "today_success": requests["today_success"],
+        "today_failed": requests["today_failed"]
+    }
 
 
 # 静态文件服务 (前端)
@@ -250,11 +224,6 @@ frontend_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "static
 if os.path.exists(frontend_path):
     app.mount("/assets", StaticFiles(directory=os.path.join(frontend_path, "assets")), name="assets")
     
-    # 图片存储目录
-    images_path = os.path.join(frontend_path, "images")
-    os.makedirs(images_path, exist_ok=True)
-    app.mount("/images", StaticFiles(directory=images_path), name="images")
-    
     @app.get("/{full_path:path}")
     async def serve_frontend(full_path: str):
         file_path = os.path.join(frontend_path, full_path)
@@ -1,5 +1,6 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Text, Float
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Text, Float, LargeBinary, event
 from sqlalchemy.orm import relationship
+from sqlalchemy.orm.attributes import flag_dirty, get_history
 from datetime import datetime
 import secrets
 from app.database import Base
@@ -60,6 +61,28 @@ class APIKey(Base):
         return f"tc-{secrets.token_hex(24)}"
 
 
+class _PayloadField:
+    """
+    UsageLog 上存放在侧表的字段
+
+    赋值只暂存在实例上并把实例标记为脏，flush 时由 after_insert/after_update 写入 usage_log_payloads；
+    从数据库查出的日志不会自动带上这些字段。
+    """
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        return obj.__dict__.get("_payload", {}).get(self.name)
+
+    def __set__(self, obj, value):
+        obj.__dict__.setdefault("_payload", {})[self.name] = value
+        obj.__dict__.setdefault("_payload_pending", set()).add(self.name)
+        flag_dirty(obj)
+
+
 class UsageLog(Base):
     """使用记录表"""
     __tablename__ = "usage_logs"
@@ -76,22 +99,90 @@ class UsageLog(Base):
     latency_ms = Column(Float, nullable=True)
     cd_seconds = Column(Integer, nullable=True)  # 429 时设置的 CD 秒数
     created_at = Column(DateTime, default=datetime.utcnow)
-    # 详细报错信息
-    error_message = Column(Text, nullable=True)  # 错误信息
-    request_body = Column(Text, nullable=True)   # 请求内容（截断保存）
-    client_ip = Column(String(50), nullable=True)  # 客户端 IP
-    user_agent = Column(String(500), nullable=True)  # User Agent
     # 错误分类字段（新增）
     error_type = Column(String(50), nullable=True, index=True)  # 错误类型：AUTH_ERROR, RATE_LIMIT, QUOTA_EXHAUSTED 等
     error_code = Column(String(100), nullable=True)  # 错误码：PERMISSION_DENIED, RESOURCE_EXHAUSTED 等
     credential_email = Column(String(100), nullable=True)  # 使用的凭证邮箱（方便排查）
     retry_count = Column(Integer, default=0)  # 重试次数：0表示首次成功，>0表示经过重试
+    cache_hit = Column(Boolean, default=False)  # 是否命中响应缓存（命中时未调用上游）
+    # 模型分类（写入时由 model_classifier 计算，统计和配额查询直接按这些列过滤）
+    api_type = Column(String(20), nullable=True, index=True)      # geminicli / antigravity
+    quota_class = Column(String(20), nullable=True, index=True)   # flash / pro / tier3
+    model_family = Column(String(20), nullable=True, index=True)  # claude / gemini / banana / other
+    
+    # 详细报错信息（存放在 usage_log_payloads 侧表，读取用 log_payloads.load_payloads）
+    error_message = _PayloadField()  # 错误信息
+    request_body = _PayloadField()   # 请求内容（截断保存）
+    client_ip = _PayloadField()      # 客户端 IP
+    user_agent = _PayloadField()     # User Agent
     
     # 关系
     user = relationship("User", back_populates="usage_logs")
     credential = relationship("Credential")
 
 
+@event.listens_for(UsageLog, "before_insert")
+@event.listens_for(UsageLog, "before_update")
+def _classify_usage_log(mapper, connection, target):
+    """写入日志时计算模型分类（占位记录之后改了 model 也会重新计算）"""
+    from app.services.model_classifier import apply_classification
+    apply_classification(target)
+
+
+@event.listens_for(UsageLog, "after_insert")
+@event.listens_for(UsageLog, "after_update")
+def _save_usage_log_payload(mapper, connection, target):
+    """在同一事务中把本次赋值过的大字段写入侧表"""
+    pending = target.__dict__.get("_payload_pending")
+    if not pending:
+        return
+    from app.services.log_payloads import save_payload
+    values = target.__dict__.get("_payload", {})
+    save_payload(connection, target.id, {name: values.get(name) for name in pending})
+    pending.clear()
+
+
+@event.listens_for(UsageLog, "after_insert")
+@event.listens_for(UsageLog, "after_update")
+def _record_quota_use(mapper, connection, target):
+    """日志状态变为 200 时计入凭证的配额使用（只算真正成功的请求，与启动时从日志恢复的口径一致）"""
+    if target.status_code != 200 or not target.credential_id:
+        return
+    if not get_history(target, "status_code").added:
+        return
+    from app.services.quota_forecast import quota_forecaster
+    quota_forecaster.record_use(target.credential_id, target.api_type or "geminicli", target.model or "")
+
+
+@event.listens_for(UsageLog, "after_insert")
+def _count_usage_log(mapper, connection, target):
+    """累加用户汇总中的今日用量"""
+    from app.services.user_summary import record_log
+    record_log(connection, target)
+
+
+class UsageLogPayload(Base):
+    """使用记录的大字段（请求内容/错误信息/UA/IP），只在查看日志详情时读取"""
+    __tablename__ = "usage_log_payloads"
+    
+    # 不加外键：usage_logs 可能是分区表（主键为 (id, created_at)），清理日志时一并删除
+    log_id = Column(Integer, primary_key=True)
+    request_body = Column(LargeBinary, nullable=True)  # zlib 压缩后的请求内容
+    error_text_id = Column(Integer, nullable=True, index=True)       # usage_log_texts.id
+    user_agent_text_id = Column(Integer, nullable=True, index=True)  # usage_log_texts.id
+    client_ip = Column(String(50), nullable=True)
+
+
+class UsageLogText(Base):
+    """去重存放的长文本（错误信息、User Agent），按内容哈希共享"""
+    __tablename__ = "usage_log_texts"
+    
+    id = Column(Integer, primary_key=True)
+    hash = Column(String(64), unique=True, nullable=False)  # sha256
+    content = Column(LargeBinary, nullable=False)           # zlib 压缩后的文本
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
 class Credential(Base):
     """Gemini凭证池
     
@@ -132,11 +223,94 @@ class Credential(Base):
     last_used_30 = Column(DateTime, nullable=True)     # 3.0 模型组 CD
     # 模型级 CD 机制（JSON 格式 {"model_name": "timestamp"}）
     model_cooldowns = Column(Text, nullable=True)
+    # 从 429 学到的每日额度（JSON 格式 {"配额组": 额度}）
+    quota_limits = Column(Text, nullable=True)
     
     # 关系
     owner = relationship("User", back_populates="credentials")
 
 
+class CredentialQuotaSnapshot(Base):
+    """凭证配额快照（后台配额轮询器定时刷新）"""
+    __tablename__ = "credential_quota_snapshots"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    credential_id = Column(Integer, ForeignKey("credentials.id", ondelete="CASCADE"), unique=True, index=True, nullable=False)
+    api_type = Column(String(20), nullable=True)
+    success = Column(Boolean, default=False)
+    data = Column(Text, nullable=True)          # 各模型配额 JSON {"model": {"remaining": 0.95, "resetTime": "..."}}
+    error = Column(Text, nullable=True)         # 最近一次失败原因
+    fetched_at = Column(DateTime, default=datetime.utcnow)
+    next_poll_at = Column(DateTime, nullable=True)
+
+
+class UserSummary(Base):
+    """
+    用户汇总（管理后台用户列表用）
+
+    今日用量由写日志时增量累加，凭证数量在凭证增删改时重算；
+    user_summary 后台任务定期全量校准。day 不是今天时今日用量视为 0。
+    """
+    __tablename__ = "user_summaries"
+    
+    # 不加外键：删除用户时一并删除，避免外键约束影响删除顺序
+    user_id = Column(Integer, primary_key=True)
+    day = Column(String(20), nullable=False, server_default="")  # 今日用量对应的统计日（get_start_of_day）
+    # 今日用量
+    usage_total = Column(Integer, nullable=False, server_default="0")
+    usage_cli = Column(Integer, nullable=False, server_default="0")
+    usage_agy = Column(Integer, nullable=False, server_default="0")
+    usage_flash = Column(Integer, nullable=False, server_default="0")   # CLI 按配额类别
+    usage_pro = Column(Integer, nullable=False, server_default="0")
+    usage_tier3 = Column(Integer, nullable=False, server_default="0")
+    usage_claude = Column(Integer, nullable=False, server_default="0")  # Antigravity 按模型品牌
+    usage_gemini = Column(Integer, nullable=False, server_default="0")
+    usage_banana = Column(Integer, nullable=False, server_default="0")
+    # 活跃凭证数量
+    cli_cred_count = Column(Integer, nullable=False, server_default="0")
+    cli_cred_30_count = Column(Integer, nullable=False, server_default="0")
+    agy_cred_count = Column(Integer, nullable=False, server_default="0")
+    agy_public_cred_count = Column(Integer, nullable=False, server_default="0")
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+
+_SUMMARY_CREDENTIAL_FIELDS = ("user_id", "is_active", "api_type", "model_tier", "is_public")
+
+
+def _credential_summary_users(target, check_history: bool) -> set:
+    """凭证变更影响到的用户（只有影响计数的字段变了才需要重算）"""
+    from sqlalchemy import inspect
+    state = inspect(target)
+    user_ids = {target.user_id}
+    if check_history:
+        changed = False
+        for name in _SUMMARY_CREDENTIAL_FIELDS:
+            history = state.attrs[name].history
+            if history.has_changes():
+                changed = True
+                if name == "user_id":
+                    user_ids.update(history.deleted)
+        if not changed:
+            return set()
+    user_ids.discard(None)
+    return user_ids
+
+
+@event.listens_for(Credential, "after_insert")
+@event.listens_for(Credential, "after_delete")
+def _credential_summary_insert_delete(mapper, connection, target):
+    from app.services.user_summary import refresh_credential_counts
+    refresh_credential_counts(connection, _credential_summary_users(target, check_history=False))
+
+
+@event.listens_for(Credential, "after_update")
+def _credential_summary_update(mapper, connection, target):
+    user_ids = _credential_summary_users(target, check_history=True)
+    if user_ids:
+        from app.services.user_summary import refresh_credential_counts
+        refresh_credential_counts(connection, user_ids)
+
+
 class SystemConfig(Base):
     """系统配置表（持久化存储）"""
     __tablename__ = "system_config"
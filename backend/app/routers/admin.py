@@ -33,204 +33,203 @@ class UserPasswordUpdate(BaseModel):
     new_password: str
 
 
-@router.get("/users")
-async def list_users(
-    admin: User = Depends(get_current_admin),
-    db: AsyncSession = Depends(get_db)
-):
-    """获取所有用户（优化版：批量查询）"""
+def _build_user_item(u: User, summary, today: str) -> dict:
+    """根据用户汇总计算列表中的一行（配额公式与 auth.get_me 一致）"""
     from app.config import settings
     
-    # 1. 获取所有用户
-    result = await db.execute(select(User).order_by(User.created_at.desc()))
-    users = result.scalars().all()
-    
-    if not users:
-        return {"users": [], "total": 0}
+    same_day = summary is not None and summary.day == today
+    today_usage = summary.usage_total if same_day else 0
+    cli_usage = summary.usage_cli if same_day else 0
+    agy_usage = summary.usage_agy if same_day else 0
+    credential_count = summary.cli_cred_count if summary else 0
+    cred_30_count = summary.cli_cred_30_count if summary else 0
+    agy_credential_count = summary.agy_cred_count if summary else 0
+    agy_public_cred_count = summary.agy_public_cred_count if summary else 0
+    
+    # 计算 CLI 真实配额
+    if u.quota_flash and u.quota_flash > 0:
+        quota_flash = u.quota_flash
+    elif credential_count > 0:
+        quota_flash = credential_count * settings.quota_flash
+    else:
+        quota_flash = settings.no_cred_quota_flash
     
-    user_ids = [u.id for u in users]
+    if u.quota_25pro and u.quota_25pro > 0:
+        quota_25pro = u.quota_25pro
+    elif credential_count > 0:
+        quota_25pro = credential_count * settings.quota_25pro
+    else:
+        quota_25pro = settings.no_cred_quota_25pro
+    
+    if u.quota_30pro and u.quota_30pro > 0:
+        quota_30pro = u.quota_30pro
+    elif cred_30_count > 0:
+        quota_30pro = cred_30_count * settings.quota_30pro
+    elif credential_count > 0:
+        quota_30pro = settings.cred25_quota_30pro
+    else:
+        quota_30pro = settings.no_cred_quota_30pro
+    
+    cli_total_quota = quota_flash + quota_25pro + quota_30pro
+    
+    # 计算 Antigravity 各模型配额
+    def calc_agy_quota(custom_quota: int) -> int:
+        """计算 Antigravity 配额"""
+        # 优先使用用户自定义配额
+        if custom_quota and custom_quota > 0:
+            return custom_quota
+        # 大锅饭模式：基础配额 + 公开凭证奖励
+        if settings.antigravity_pool_mode == "full_shared":
+            return settings.antigravity_quota_default + (agy_public_cred_count * settings.antigravity_quota_per_cred)
+        # 有公开凭证使用贡献者配额
+        if agy_public_cred_count > 0:
+            return settings.antigravity_quota_contributor
+        # 无公开凭证使用默认配额
+        return settings.antigravity_quota_default
+    
+    agy_quota_claude = calc_agy_quota(u.quota_agy_claude)
+    agy_quota_gemini = calc_agy_quota(u.quota_agy_gemini)
+    
+    # Banana 配额
+    if u.quota_agy_banana and u.quota_agy_banana > 0:
+        agy_quota_banana = u.quota_agy_banana
+    elif settings.antigravity_pool_mode == "full_shared":
+        agy_quota_banana = settings.banana_quota_default + (agy_public_cred_count * settings.banana_quota_per_cred)
+    elif agy_public_cred_count > 0:
+        agy_quota_banana = settings.banana_quota_default + settings.banana_quota_per_cred
+    else:
+        agy_quota_banana = settings.banana_quota_default
     
-    # 根据 stats_timezone 配置计算今日开始时间
-    start_of_day = settings.get_start_of_day()
+    # 总 AGY 配额 = Claude + Gemini + Banana
+    agy_quota = agy_quota_claude + agy_quota_gemini + agy_quota_banana
     
-    # 2. 批量查询今日使用量（总量）
-    usage_result = await db.execute(
-        select(UsageLog.user_id, func.count(UsageLog.id))
-        .where(UsageLog.user_id.in_(user_ids))
-        .where(UsageLog.created_at >= start_of_day)
-        .group_by(UsageLog.user_id)
-    )
-    usage_map = {row[0]: row[1] for row in usage_result.fetchall()}
-    
-    # 2.1 批量查询今日 CLI 使用量（不包含 antigravity 端点）
-    cli_usage_result = await db.execute(
-        select(UsageLog.user_id, func.count(UsageLog.id))
-        .where(UsageLog.user_id.in_(user_ids))
-        .where(UsageLog.created_at >= start_of_day)
-        .where(~UsageLog.endpoint.ilike('%/agy/%'))
-        .where(~UsageLog.endpoint.ilike('%/antigravity/%'))
-        .group_by(UsageLog.user_id)
+    return {
+        "id": u.id,
+        "username": u.username,
+        "email": u.email,
+        "is_active": u.is_active,
+        "is_admin": u.is_admin,
+        # CLI
+        "daily_quota": cli_total_quota,
+        "quota_flash": u.quota_flash or 0,  # 原始配置值
+        "quota_25pro": u.quota_25pro or 0,
+        "quota_30pro": u.quota_30pro or 0,
+        "today_usage": cli_usage,
+        "credential_count": credential_count,
+        # Antigravity
+        "agy_quota": agy_quota,  # 总配额 (Claude + Gemini + Banana)
+        "agy_quota_claude": agy_quota_claude,  # 计算后的配额
+        "agy_quota_gemini": agy_quota_gemini,
+        "agy_quota_banana": agy_quota_banana,
+        "quota_agy_claude": u.quota_agy_claude or 0,  # 原始配置值（0=使用系统公式）
+        "quota_agy_gemini": u.quota_agy_gemini or 0,
+        "quota_agy_banana": u.quota_agy_banana or 0,
+        "agy_usage": agy_usage,
+        "agy_credential_count": agy_credential_count,
+        "agy_public_cred_count": agy_public_cred_count,
+        # 总量（兼容旧版）
+        "total_usage": today_usage,
+        # 其他
+        "discord_id": u.discord_id,
+        "discord_name": u.discord_name,
+        "custom_rpm": u.custom_rpm or 0,
+        "created_at": u.created_at
+    }
+
+
+def _user_sort_expressions(today: str):
+    """用户列表可排序的字段（今日用量/配额在 SQL 中按与 _build_user_item 相同的规则计算）"""
+    from sqlalchemy import case
+    from app.config import settings
+    from app.models.user import UserSummary
+    
+    same_day = UserSummary.day == today
+    cred = func.coalesce(UserSummary.cli_cred_count, 0)
+    cred_30 = func.coalesce(UserSummary.cli_cred_30_count, 0)
+    quota_flash = case(
+        (User.quota_flash > 0, User.quota_flash),
+        (cred > 0, cred * settings.quota_flash),
+        else_=settings.no_cred_quota_flash,
     )
-    cli_usage_map = {row[0]: row[1] for row in cli_usage_result.fetchall()}
-    
-    # 2.2 批量查询今日 Antigravity 使用量（通过 endpoint 判断，与 auth.py 保持一致）
-    agy_usage_result = await db.execute(
-        select(UsageLog.user_id, func.count(UsageLog.id))
-        .where(UsageLog.user_id.in_(user_ids))
-        .where(UsageLog.created_at >= start_of_day)
-        .where(or_(
-            UsageLog.endpoint.ilike('%/agy/%'),
-            UsageLog.endpoint.ilike('%/antigravity/%')
-        ))
-        .group_by(UsageLog.user_id)
+    quota_25pro = case(
+        (User.quota_25pro > 0, User.quota_25pro),
+        (cred > 0, cred * settings.quota_25pro),
+        else_=settings.no_cred_quota_25pro,
     )
-    agy_usage_map = {row[0]: row[1] for row in agy_usage_result.fetchall()}
-    
-    # 3. 批量查询 CLI 凭证数量
-    cred_result = await db.execute(
-        select(Credential.user_id, func.count(Credential.id))
-        .where(Credential.user_id.in_(user_ids))
-        .where(Credential.is_active == True)
-        .where(Credential.api_type != "antigravity")  # CLI 凭证
-        .group_by(Credential.user_id)
+    quota_30pro = case(
+        (User.quota_30pro > 0, User.quota_30pro),
+        (cred_30 > 0, cred_30 * settings.quota_30pro),
+        (cred > 0, settings.cred25_quota_30pro),
+        else_=settings.no_cred_quota_30pro,
     )
-    cred_map = {row[0]: row[1] for row in cred_result.fetchall()}
+    return {
+        "id": User.id,
+        "username": func.lower(User.username),
+        "created_at": User.created_at,
+        "today_usage": case((same_day, UserSummary.usage_cli), else_=0),
+        "agy_usage": case((same_day, UserSummary.usage_agy), else_=0),
+        "total_usage": case((same_day, UserSummary.usage_total), else_=0),
+        "credential_count": cred,
+        "agy_credential_count": func.coalesce(UserSummary.agy_cred_count, 0),
+        "daily_quota": quota_flash + quota_25pro + quota_30pro,
+    }
+
+
+@router.get("/users")
+async def list_users(
+    page: int = 1,
+    page_size: int = 0,       # 每页数量（0=返回全部，兼容旧调用）
+    search: str = None,       # 用户名 / Discord 名 / Discord ID / 用户 ID
+    sort: str = "created_at",
+    order: str = "desc",      # asc / desc
+    admin: User = Depends(get_current_admin),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    获取用户列表（服务端分页、搜索、排序）
+    
+    今日用量和凭证数量来自 user_summaries 汇总表，一页只需一次 join 查询加一次计数。
+    """
+    from sqlalchemy import cast, String
+    from app.models.user import UserSummary
+    from app.services.user_summary import today_key
+    
+    today = today_key()
+    query = select(User, UserSummary).outerjoin(UserSummary, UserSummary.user_id == User.id)
+    count_query = select(func.count(User.id))
+    
+    if search and search.strip():
+        keyword = f"%{search.strip()}%"
+        condition = or_(
+            User.username.ilike(keyword),
+            User.discord_name.ilike(keyword),
+            User.discord_id.like(keyword),
+            cast(User.id, String).like(keyword),
+        )
+        query = query.where(condition)
+        count_query = count_query.where(condition)
     
-    # 3.1 批量查询 Antigravity 凭证数量
-    agy_cred_result = await db.execute(
-        select(Credential.user_id, func.count(Credential.id))
-        .where(Credential.user_id.in_(user_ids))
-        .where(Credential.is_active == True)
-        .where(Credential.api_type == "antigravity")
-        .group_by(Credential.user_id)
-    )
-    agy_cred_map = {row[0]: row[1] for row in agy_cred_result.fetchall()}
+    sort_columns = _user_sort_expressions(today)
+    sort_column = sort_columns.get(sort, User.created_at)
+    if order == "asc":
+        query = query.order_by(sort_column.asc(), User.id.asc())
+    else:
+        query = query.order_by(sort_column.desc(), User.id.desc())
     
-    # 3.2 批量查询公开 Antigravity 凭证数量
-    agy_public_cred_result = await db.execute(
-        select(Credential.user_id, func.count(Credential.id))
-        .where(Credential.user_id.in_(user_ids))
-        .where(Credential.is_active == True)
-        .where(Credential.api_type == "antigravity")
-        .where(Credential.is_public == True)
-        .group_by(Credential.user_id)
-    )
-    agy_public_cred_map = {row[0]: row[1] for row in agy_public_cred_result.fetchall()}
+    total = (await db.execute(count_query)).scalar() or 0
+    if page_size > 0:
+        query = query.offset((max(page, 1) - 1) * page_size).limit(page_size)
     
-    # 3.5 批量查询3.0凭证数量
-    from sqlalchemy import case
-    cred_30_result = await db.execute(
-        select(Credential.user_id, func.count(Credential.id))
-        .where(Credential.user_id.in_(user_ids))
-        .where(Credential.is_active == True)
-        .where(Credential.model_tier == "3")
-        .where(Credential.api_type != "antigravity")  # CLI 凭证
-        .group_by(Credential.user_id)
-    )
-    cred_30_map = {row[0]: row[1] for row in cred_30_result.fetchall()}
-    
-    # 4. 构建用户列表
-    user_list = []
-    for u in users:
-        today_usage = usage_map.get(u.id, 0)
-        cli_usage = cli_usage_map.get(u.id, 0)
-        agy_usage = agy_usage_map.get(u.id, 0)
-        credential_count = cred_map.get(u.id, 0)
-        agy_credential_count = agy_cred_map.get(u.id, 0)
-        agy_public_cred_count = agy_public_cred_map.get(u.id, 0)
-        cred_30_count = cred_30_map.get(u.id, 0)
-        
-        # 计算 CLI 真实配额
-        if u.quota_flash and u.quota_flash > 0:
-            quota_flash = u.quota_flash
-        elif credential_count > 0:
-            quota_flash = credential_count * settings.quota_flash
-        else:
-            quota_flash = settings.no_cred_quota_flash
-        
-        if u.quota_25pro and u.quota_25pro > 0:
-            quota_25pro = u.quota_25pro
-        elif credential_count > 0:
-            quota_25pro = credential_count * settings.quota_25pro
-        else:
-            quota_25pro = settings.no_cred_quota_25pro
-        
-        if u.quota_30pro and u.quota_30pro > 0:
-            quota_30pro = u.quota_30pro
-        elif cred_30_count > 0:
-            quota_30pro = cred_30_count * settings.quota_30pro
-        elif credential_count > 0:
-            quota_30pro = settings.cred25_quota_30pro
-        else:
-            quota_30pro = settings.no_cred_quota_30pro
-        
-        cli_total_quota = quota_flash + quota_25pro + quota_30pro
-        
-        # 计算 Antigravity 各模型配额
-        def calc_agy_quota(custom_quota: int) -> int:
-            """计算 Antigravity 配额"""
-            # 优先使用用户自定义配额
-            if custom_quota and custom_quota > 0:
-                return custom_quota
-            # 大锅饭模式：基础配额 + 公开凭证奖励
-            if settings.antigravity_pool_mode == "full_shared":
-                return settings.antigravity_quota_default + (agy_public_cred_count * settings.antigravity_quota_per_cred)
-            # 有公开凭证使用贡献者配额
-            if agy_public_cred_count > 0:
-                return settings.antigravity_quota_contributor
-            # 无公开凭证使用默认配额
-            return settings.antigravity_quota_default
-        
-        agy_quota_claude = calc_agy_quota(u.quota_agy_claude)
-        agy_quota_gemini = calc_agy_quota(u.quota_agy_gemini)
-        
-        # Banana 配额
-        if u.quota_agy_banana and u.quota_agy_banana > 0:
-            agy_quota_banana = u.quota_agy_banana
-        elif settings.antigravity_pool_mode == "full_shared":
-            agy_quota_banana = settings.banana_quota_default + (agy_public_cred_count * settings.banana_quota_per_cred)
-        elif agy_public_cred_count > 0:
-            agy_quota_banana = settings.banana_quota_default + settings.banana_quota_per_cred
-        else:
-            agy_quota_banana = settings.banana_quota_default
-        
-        # 总 AGY 配额 = Claude + Gemini + Banana
-        agy_quota = agy_quota_claude + agy_quota_gemini + agy_quota_banana
-        
-        user_list.append({
-            "id": u.id,
-            "username": u.username,
-            "email": u.email,
-            "is_active": u.is_active,
-            "is_admin": u.is_admin,
-            # CLI
-            "daily_quota": cli_total_quota,
-            "quota_flash": u.quota_flash or 0,  # 原始配置值
-            "quota_25pro": u.quota_25pro or 0,
-            "quota_30pro": u.quota_30pro or 0,
-            "today_usage": cli_usage,
-            "credential_count": credential_count,
-            # Antigravity
-            "agy_quota": agy_quota,  # 总配额 (Claude + Gemini + Banana)
-            "agy_quota_claude": agy_quota_claude,  # 计算后的配额
-            "agy_quota_gemini": agy_quota_gemini,
-            "agy_quota_banana": agy_quota_banana,
-            "quota_agy_claude": u.quota_agy_claude or 0,  # 原始配置值（0=使用系统公式）
-            "quota_agy_gemini": u.quota_agy_gemini or 0,
-            "quota_agy_banana": u.quota_agy_banana or 0,
-            "agy_usage": agy_usage,
-            "agy_credential_count": agy_credential_count,
-            "agy_public_cred_count": agy_public_cred_count,
-            # 总量（兼容旧版）
-            "total_usage": today_usage,
-            # 其他
-            "discord_id": u.discord_id,
-            "discord_name": u.discord_name,
-            "custom_rpm": u.custom_rpm or 0,
-            "created_at": u.created_at
-        })
+    rows = (await db.execute(query)).all()
+    user_list = [_build_user_item(row.User, row.UserSummary, today) for row in rows]
     
-    return {"users": user_list, "total": len(user_list)}
+    return {
+        "users": user_list,
+        "total": total,
+        "page": page,
+        "page_size": page_size,
+        "pages": (total + page_size - 1) // page_size if page_size > 0 else 1,
+    }
 
 
 @router.put("/users/{user_id}")
@@ -300,6 +299,9 @@ async def delete_user(
             delete(Credential).where(Credential.user_id == user_id)
         )
     
+    from app.models.user import UserSummary
+    await db.execute(delete(UserSummary).where(UserSummary.user_id == user_id))
+    
     await db.delete(user)
     await db.commit()
     await notify_user_update()
@@ -772,99 +774,211 @@ async def get_stats(
     }
 
 
-@router.get("/logs")
-async def get_logs(
-    limit: int = 100,
-    page: int = 1,
-    start_date: str = None,  # YYYY-MM-DD
-    end_date: str = None,    # YYYY-MM-DD
+def _apply_log_filters(
+    query,
+    start_date: str = None,
+    end_date: str = None,
     username: str = None,
     model: str = None,
-    status: str = None,      # success, error, all
-    error_type: str = None,  # 按错误类型筛选
-    admin: User = Depends(get_current_admin),
-    db: AsyncSession = Depends(get_db)
+    status: str = None,
+    error_type: str = None,
 ):
-    """获取使用日志（支持分页和筛选）"""
-    from datetime import datetime
-    
-    query = select(UsageLog, User.username).join(User, UsageLog.user_id == User.id)
-    count_query = select(func.count(UsageLog.id)).select_from(UsageLog).join(User, UsageLog.user_id == User.id)
-    
+    """日志列表/导出共用的筛选条件（query 需已 join User）"""
     # 时间范围筛选
     if start_date:
         try:
             start_dt = datetime.strptime(start_date, "%Y-%m-%d")
             query = query.where(UsageLog.created_at >= start_dt)
-            count_query = count_query.where(UsageLog.created_at >= start_dt)
         except: pass
     
     if end_date:
         try:
             end_dt = datetime.strptime(end_date, "%Y-%m-%d") + timedelta(days=1)
             query = query.where(UsageLog.created_at < end_dt)
-            count_query = count_query.where(UsageLog.created_at < end_dt)
         except: pass
     
     # 用户名筛选
     if username:
         query = query.where(User.username.ilike(f"%{username}%"))
-        count_query = count_query.where(User.username.ilike(f"%{username}%"))
     
     # 模型筛选
     if model:
         query = query.where(UsageLog.model.ilike(f"%{model}%"))
-        count_query = count_query.where(UsageLog.model.ilike(f"%{model}%"))
     
     # 状态筛选
     if status == "success":
         query = query.where(UsageLog.status_code == 200)
-        count_query = count_query.where(UsageLog.status_code == 200)
     elif status == "error":
         query = query.where(UsageLog.status_code != 200)
-        count_query = count_query.where(UsageLog.status_code != 200)
     
     # 错误类型筛选
     if error_type:
         query = query.where(UsageLog.error_type == error_type)
-        count_query = count_query.where(UsageLog.error_type == error_type)
-    
-    # 获取总数
-    total_result = await db.execute(count_query)
-    total = total_result.scalar() or 0
+    return query
+
+
+def _encode_log_cursor(log: UsageLog) -> str:
+    return f"{log.created_at.isoformat()}_{log.id}"
+
+
+def _decode_log_cursor(cursor: str):
+    try:
+        created_at, log_id = cursor.rsplit("_", 1)
+        return datetime.fromisoformat(created_at), int(log_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="cursor 无效")
+
+
+_LOG_EXPORT_COLUMNS = [
+    "id", "username", "model", "endpoint", "status_code", "error_type", "error_type_name",
+    "error_code", "credential_email", "latency_ms", "cd_seconds", "cache_hit", "created_at",
+]
+
+
+def _serialize_log(log: UsageLog, username: str) -> dict:
+    return {
+        "id": log.id,
+        "username": username,
+        "model": log.model,
+        "endpoint": log.endpoint,
+        "status_code": log.status_code,
+        "error_type": log.error_type,
+        "error_type_name": get_error_type_name(log.error_type) if log.error_type else None,
+        "error_code": log.error_code,
+        "credential_email": log.credential_email,
+        "latency_ms": log.latency_ms,
+        "cd_seconds": log.cd_seconds,
+        "cache_hit": bool(log.cache_hit),
+        "created_at": log.created_at.isoformat() + "Z" if log.created_at else None
+    }
+
+
+@router.get("/logs")
+async def get_logs(
+    limit: int = 100,
+    page: int = 1,
+    cursor: str = None,      # 上一页返回的 next_cursor，传入时按游标翻页（不再计算总数）
+    start_date: str = None,  # YYYY-MM-DD
+    end_date: str = None,    # YYYY-MM-DD
+    username: str = None,
+    model: str = None,
+    status: str = None,      # success, error, all
+    error_type: str = None,  # 按错误类型筛选
+    admin: User = Depends(get_current_admin),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    获取使用日志（支持分页和筛选）
+    
+    按 (created_at, id) 倒序。传 cursor 时用 keyset 翻页，翻得再深也只扫描 limit 行；
+    不传时兼容旧的 page 分页。两种方式都返回 next_cursor。
+    """
+    limit = max(1, limit)
+    filters = dict(
+        start_date=start_date, end_date=end_date, username=username,
+        model=model, status=status, error_type=error_type,
+    )
+    query = _apply_log_filters(
+        select(UsageLog, User.username).join(User, UsageLog.user_id == User.id), **filters
+    )
     
-    # 分页
-    offset = (page - 1) * limit
-    query = query.order_by(UsageLog.created_at.desc()).offset(offset).limit(limit)
+    total = None
+    if cursor:
+        cursor_created_at, cursor_id = _decode_log_cursor(cursor)
+        query = query.where(or_(
+            UsageLog.created_at < cursor_created_at,
+            (UsageLog.created_at == cursor_created_at) & (UsageLog.id < cursor_id),
+        ))
+    else:
+        # 获取总数
+        count_query = _apply_log_filters(
+            select(func.count(UsageLog.id)).select_from(UsageLog).join(User, UsageLog.user_id == User.id),
+            **filters,
+        )
+        total = (await db.execute(count_query)).scalar() or 0
+        if page > 1:
+            query = query.offset((page - 1) * limit)
     
+    query = query.order_by(UsageLog.created_at.desc(), UsageLog.id.desc()).limit(limit)
     result = await db.execute(query)
     logs = result.all()
     
+    next_cursor = None
+    if len(logs) == limit and logs[-1].UsageLog.created_at:
+        next_cursor = _encode_log_cursor(logs[-1].UsageLog)
+    
     return {
-        "logs": [
-            {
-                "id": log.UsageLog.id,
-                "username": log.username,
-                "model": log.UsageLog.model,
-                "endpoint": log.UsageLog.endpoint,
-                "status_code": log.UsageLog.status_code,
-                "error_type": log.UsageLog.error_type,
-                "error_type_name": get_error_type_name(log.UsageLog.error_type) if log.UsageLog.error_type else None,
-                "error_code": log.UsageLog.error_code,
-                "credential_email": log.UsageLog.credential_email,
-                "latency_ms": log.UsageLog.latency_ms,
-                "cd_seconds": log.UsageLog.cd_seconds,
-                "created_at": log.UsageLog.created_at.isoformat() + "Z"
-            }
-            for log in logs
-        ],
+        "logs": [_serialize_log(log.UsageLog, log.username) for log in logs],
         "total": total,
         "page": page,
         "limit": limit,
-        "pages": (total + limit - 1) // limit if limit > 0 else 1
+        "pages": (total + limit - 1) // limit if total is not None else None,
+        "next_cursor": next_cursor,
     }
 
 
+@router.get("/logs/export")
+async def export_logs(
+    format: str = "csv",     # csv / ndjson
+    start_date: str = None,  # YYYY-MM-DD
+    end_date: str = None,    # YYYY-MM-DD
+    username: str = None,
+    model: str = None,
+    status: str = None,
+    error_type: str = None,
+    admin: User = Depends(get_current_admin),
+):
+    """
+    流式导出筛选后的日志（CSV 或 NDJSON）
+    
+    用服务端游标逐批读取并边读边写，不会把整个结果集加载到内存。
+    """
+    import csv
+    import io
+    import json
+    from fastapi.responses import StreamingResponse
+    from app.database import async_session
+    
+    if format not in ("csv", "ndjson"):
+        raise HTTPException(status_code=400, detail="format 只支持 csv 或 ndjson")
+    
+    query = _apply_log_filters(
+        select(UsageLog, User.username).join(User, UsageLog.user_id == User.id),
+        start_date=start_date, end_date=end_date, username=username,
+        model=model, status=status, error_type=error_type,
+    ).order_by(UsageLog.created_at.desc(), UsageLog.id.desc())
+    
+    async def generate():
+        # 响应开始后请求的数据库会话已经关闭，这里单独开一个
+        async with async_session() as session:
+            result = await session.stream(query.execution_options(yield_per=1000))
+            buffer = io.StringIO()
+            writer = csv.DictWriter(buffer, fieldnames=_LOG_EXPORT_COLUMNS)
+            if format == "csv":
+                buffer.write("\ufeff")  # Excel 识别 UTF-8
+                writer.writeheader()
+            async for partition in result.partitions(1000):
+                for row in partition:
+                    item = _serialize_log(row.UsageLog, row.username)
+                    if format == "csv":
+                        writer.writerow(item)
+                    else:
+                        buffer.write(json.dumps(item, ensure_ascii=False) + "\n")
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate(0)
+            if buffer.tell():
+                yield buffer.getvalue()
+    
+    filename = f"usage_logs_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.{format}"
+    media_type = "text/csv; charset=utf-8" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        generate(),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
 @router.get("/logs/{log_id}/detail")
 async def get_log_detail(
     log_id: int,
@@ -885,6 +999,8 @@ async def get_log_detail(
     log = row.UsageLog
     username = row.username
     cred_email = row.cred_email
+    from app.services.log_payloads import load_payload
+    payload = await load_payload(db, log.id)
     
     return {
         "id": log.id,
@@ -897,12 +1013,13 @@ async def get_log_detail(
         "error_type": log.error_type,
         "error_type_name": get_error_type_name(log.error_type) if log.error_type else None,
         "error_code": log.error_code,
-        "error_message": log.error_message,  # 完整错误信息
-        "request_body": log.request_body,
-        "client_ip": log.client_ip,
-        "user_agent": log.user_agent,
+        "error_message": payload["error_message"],  # 完整错误信息
+        "request_body": payload["request_body"],
+        "client_ip": payload["client_ip"],
+        "user_agent": payload["user_agent"],
         "latency_ms": log.latency_ms,
         "cd_seconds": log.cd_seconds,
+        "cache_hit": bool(log.cache_hit),
         "created_at": log.created_at.isoformat() + "Z"
     }
 
@@ -914,6 +1031,7 @@ async def clear_logs(
     db: AsyncSession = Depends(get_db)
 ):
     """清除使用日志（支持按日期清除或全部清除）"""
+    from app.services.log_payloads import delete_orphan_payloads, prune_orphan_texts
     query = delete(UsageLog)
     
     if before_date:
@@ -922,7 +1040,9 @@ async def clear_logs(
             query = query.where(UsageLog.created_at < cutoff)
             result = await db.execute(query)
             deleted_count = result.rowcount
+            await delete_orphan_payloads(db)
             await db.commit()
+            await prune_orphan_texts()
             return {"message": f"已清除 {before_date} 之前的 {deleted_count} 条日志"}
         except ValueError:
             raise HTTPException(status_code=400, detail="日期格式无效，应为 YYYY-MM-DD")
@@ -930,7 +1050,9 @@ async def clear_logs(
         # 清除所有日志
         result = await db.execute(query)
         deleted_count = result.rowcount
+        await delete_orphan_payloads(db)
         await db.commit()
+        await prune_orphan_texts()
         return {"message": f"已清除所有日志，共 {deleted_count} 条"}
 
 
@@ -1088,3 +1210,183 @@ async def batch_update_quota(
     await db.commit()
     await notify_user_update()
     return {"message": f"已将所有用户配额设为 {data.quota}"}
+
+
+# ===== 公平调度 =====
+@router.get("/scheduler/stats")
+async def get_scheduler_stats(
+    admin: User = Depends(get_current_admin)
+):
+    """获取凭证池公平调度各通道的排队统计"""
+    from app.services.fair_scheduler import get_all_stats
+    return get_all_stats()
+
+
+@router.get("/hedge/stats")
+async def get_hedge_stats(
+    admin: User = Depends(get_current_admin)
+):
+    """获取非流式请求对冲统计（对冲次数、预算、各模型触发阈值）"""
+    from app.services.hedging import get_stats
+    return get_stats()
+
+
+@router.get("/coalesce/stats")
+async def get_coalesce_stats(
+    admin: User = Depends(get_current_admin)
+):
+    """获取相同在途请求合并统计"""
+    from app.services.request_coalescer import request_coalescer
+    return request_coalescer.get_stats()
+
+
+@router.get("/response-cache/stats")
+async def get_response_cache_stats(
+    admin: User = Depends(get_current_admin)
+):
+    """获取响应缓存统计"""
+    from app.services.response_cache import response_cache
+    return response_cache.get_stats()
+
+
+@router.delete("/response-cache")
+async def clear_response_cache(
+    admin: User = Depends(get_current_admin)
+):
+    """清空响应缓存（内存和磁盘）"""
+    from app.services.response_cache import response_cache
+    await response_cache.clear()
+    return {"message": "响应缓存已清空"}
+
+
+@router.get("/prefix-cache/stats")
+async def get_prefix_cache_stats(
+    admin: User = Depends(get_current_admin)
+):
+    """获取对话前缀转换缓存统计"""
+    from app.services.prefix_cache import prefix_cache
+    return prefix_cache.get_stats()
+
+
+@router.get("/images/stats")
+async def get_image_storage_stats(
+    admin: User = Depends(get_current_admin)
+):
+    """获取生成图片存储统计（图片数、磁盘占用、待删除数）"""
+    from app.services.image_storage import ImageStorage
+    return ImageStorage.get_stats()
+
+
+@router.get("/token-estimator/stats")
+async def get_token_estimator_stats(
+    admin: User = Depends(get_current_admin)
+):
+    """获取本地 token 估算统计（校准后的系数、消息缓存命中情况）"""
+    from app.services.token_estimator import token_estimator
+    return token_estimator.get_stats()
+
+
+@router.get("/model-catalog")
+async def get_model_catalog_status(
+    admin: User = Depends(get_current_admin)
+):
+    """获取模型目录缓存状态"""
+    from app.services.model_catalog import model_catalog
+    return model_catalog.get_status()
+
+
+@router.post("/model-catalog/refresh")
+async def refresh_model_catalog(
+    admin: User = Depends(get_current_admin)
+):
+    """立即刷新模型目录"""
+    from app.services.model_catalog import model_catalog
+    success = await model_catalog.refresh_antigravity()
+    return {"success": success, **model_catalog.get_status()}
+
+
+@router.get("/quota/pool")
+async def get_quota_pool_capacity(
+    admin: User = Depends(get_current_admin)
+):
+    """获取凭证池各模型组的剩余配额容量（来自后台轮询快照）"""
+    from app.services.quota_poller import quota_poller
+    return quota_poller.get_pool_capacity()
+
+
+@router.get("/quota/forecast")
+async def get_quota_forecast(
+    admin: User = Depends(get_current_admin),
+    db: AsyncSession = Depends(get_db)
+):
+    """预测凭证池各配额组何时耗尽（基于使用计数和学到的每日额度）"""
+    from app.services.quota_forecast import quota_forecaster
+    result = await db.execute(
+        select(Credential)
+        .where(Credential.is_active == True)
+        .where(Credential.api_type.in_(["geminicli", "antigravity"]))
+    )
+    return quota_forecaster.get_pool_forecast(result.scalars().all())
+
+
+@router.get("/log-retention")
+async def get_log_retention_status(
+    admin: User = Depends(get_current_admin)
+):
+    """获取日志清理进度"""
+    from app.services.log_retention import log_retention
+    return log_retention.get_status()
+
+
+@router.post("/log-retention/run")
+async def run_log_retention(
+    admin: User = Depends(get_current_admin)
+):
+    """立即在后台执行一轮日志清理"""
+    import asyncio
+    from app.services.log_retention import log_retention
+    if not log_retention.running:
+        asyncio.create_task(log_retention.run_once())
+    return {"message": "已开始清理", **log_retention.get_status()}
+
+
+@router.get("/log-partitions")
+async def get_log_partitions(
+    admin: User = Depends(get_current_admin)
+):
+    """获取 usage_logs 分区状态（PostgreSQL）"""
+    from app.services.log_partitions import log_partitioner
+    return await log_partitioner.get_status()
+
+
+@router.get("/log-archive")
+async def get_log_archive_summary(
+    admin: User = Depends(get_current_admin)
+):
+    """获取日志归档概况（按天的文件数、行数、大小）"""
+    import asyncio
+    from app.services.log_archive import log_archive
+    return await asyncio.to_thread(log_archive.get_summary)
+
+
+@router.get("/log-archive/query")
+async def query_log_archive(
+    start: date,
+    end: date,
+    group_by: Optional[str] = None,  # 逗号分隔，如 "date,model"
+    api_type: Optional[str] = None,
+    admin: User = Depends(get_current_admin)
+):
+    """统计归档日志（[start, end) 日期范围内按列分组计数）"""
+    from app.services.log_archive import log_archive
+    columns = [c.strip() for c in group_by.split(",") if c.strip()] if group_by else []
+    where = {"api_type": api_type} if api_type else None
+    counts = await log_archive.aggregate(
+        datetime.combine(start, datetime.min.time()),
+        datetime.combine(end, datetime.min.time()),
+        columns,
+        where,
+    )
+    rows = [{**dict(zip(columns, key)), "count": count} for key, count in counts.items()]
+    rows.sort(key=lambda r: -r["count"])
+    return {"start": start.isoformat(), "end": end.isoformat(), "group_by": columns, "rows": rows}
@@ -17,6 +17,7 @@ from app.models.user import User, UsageLog
 from app.services.auth import get_user_by_api_key
 from app.services.credential_pool import CredentialPool
 from app.services.antigravity_client import AntigravityClient
+from app.services.inline_media import json_request
 from app.services.websocket import notify_log_update, notify_stats_update
 from app.services.error_classifier import classify_error_simple
 from app.services.anthropic2gemini import (
@@ -30,6 +31,7 @@ from app.services.hi_check import (
 )
 from app.services.token_estimator import estimate_input_tokens
 from app.services.gemini_fix import normalize_gemini_request, get_base_model_name
+from app.services.response_cache import response_cache, cache_key_for, record_cache_hit
 from app.config import settings
 import re
 
@@ -150,6 +152,31 @@ async def anthropic_messages(
     await db.refresh(placeholder_log)
     placeholder_log_id = placeholder_log.id
     
+    # 转换请求为 Gemini 格式（不依赖凭证，先于选凭证完成）
+    try:
+        gemini_request = await anthropic_to_gemini_request(body, cache_key=user.id)
+        gemini_request["model"] = real_model
+        gemini_request = await normalize_gemini_request(gemini_request, mode="antigravity")
+        
+        api_request = {
+            "model": gemini_request.pop("model", real_model),
+            "request": gemini_request
+        }
+    except Exception as e:
+        placeholder_log.status_code = 400
+        placeholder_log.error_message = str(e)[:2000]
+        await db.commit()
+        raise HTTPException(status_code=400, detail=f"请求转换失败: {e}")
+    
+    # 确定性非流式请求先查响应缓存，命中时不占用凭证
+    cache_key = None
+    if not stream:
+        cache_key = cache_key_for(user.id, "/antigravity/v1/messages", model, api_request["request"])
+    cached = await response_cache.get(cache_key) if cache_key else None
+    if cached is not None:
+        await record_cache_hit(db, placeholder_log, user.username, start_time)
+        return JSONResponse(content=cached)
+    
     # 获取凭证
     max_retries = settings.error_retry_count
     tried_credential_ids = set()
@@ -177,22 +204,6 @@ async def anthropic_messages(
         await db.commit()
         raise HTTPException(status_code=503, detail="Token 刷新失败或无 project_id")
     
-    # 转换请求为 Gemini 格式
-    try:
-        gemini_request = await anthropic_to_gemini_request(body)
-        gemini_request["model"] = real_model
-        gemini_request = await normalize_gemini_request(gemini_request, mode="antigravity")
-        
-        api_request = {
-            "model": gemini_request.pop("model", real_model),
-            "request": gemini_request
-        }
-    except Exception as e:
-        placeholder_log.status_code = 400
-        placeholder_log.error_message = str(e)[:2000]
-        await db.commit()
-        raise HTTPException(status_code=400, detail=f"请求转换失败: {e}")
-    
     client = AntigravityClient(access_token, project_id)
     
     # 非流式处理
@@ -213,8 +224,7 @@ async def anthropic_messages(
                     
                     response = await http_client.post(
                         url,
-                        headers=headers,
-                        json=api_request
+                        **json_request(api_request, headers)
                     )
                     
                     if response.status_code != 200:
@@ -225,6 +235,8 @@ async def anthropic_messages(
                 
                 # 转换响应为 Anthropic 格式
                 anthropic_response = gemini_to_anthropic_response(gemini_response, real_model, 200)
+                if cache_key:
+                    await response_cache.set(cache_key, anthropic_response)
                 
                 latency = (time.time() - start_time) * 1000
                 placeholder_log.credential_id = credential.id
@@ -301,8 +313,7 @@ async def anthropic_messages(
                         async with http_client.stream(
                             "POST",
                             url,
-                            headers=headers,
-                            json=stream_request
+                            **json_request(stream_request, headers)
                         ) as response:
                             if response.status_code != 200:
                                 error_text = await response.aread()
@@ -18,9 +18,12 @@ from app.models.user import User, UsageLog
 from app.services.auth import get_user_by_api_key
 from app.services.credential_pool import CredentialPool
 from app.services.antigravity_client import AntigravityClient
+from app.services.inline_media import json_request
+from app.services.token_estimator import estimate_input_tokens
 from app.services.websocket import notify_log_update, notify_stats_update
 from app.services.hi_check import is_health_check_request, create_health_check_response
 from app.services.gemini_fix import normalize_gemini_request, get_base_model_name
+from app.services.response_cache import response_cache, cache_key_for, record_cache_hit
 from app.services.fake_stream import (
     parse_response_for_fake_stream,
     build_gemini_fake_stream_chunks,
@@ -163,7 +166,6 @@ async def gemini_generate_content(
     start_of_day = settings.get_start_of_day()
     
     # 根据模型类型计算配额和检查使用量
-    from sqlalchemy import or_
     if settings.antigravity_quota_enabled and not user.is_admin:
         if is_banana_model:
             # Banana 模型
@@ -176,7 +178,8 @@ async def gemini_generate_content(
                 select(func.count(UsageLog.id))
                 .where(UsageLog.user_id == user.id)
                 .where(UsageLog.created_at >= start_of_day)
-                .where(UsageLog.model.like('%image%'))
+                .where(UsageLog.api_type == "antigravity")
+                .where(UsageLog.model_family == "banana")
                 .where(UsageLog.status_code == 200)
             )
             quota_type = "Banana"
@@ -196,10 +199,8 @@ async def gemini_generate_content(
                 select(func.count(UsageLog.id))
                 .where(UsageLog.user_id == user.id)
                 .where(UsageLog.created_at >= start_of_day)
-                .where(or_(
-                    UsageLog.model.like('antigravity/%claude%'),
-                    UsageLog.model.like('antigravity-gemini/%claude%')
-                ))
+                .where(UsageLog.api_type == "antigravity")
+                .where(UsageLog.model_family == "claude")
                 .where(UsageLog.status_code == 200)
             )
             quota_type = "Claude"
@@ -219,12 +220,8 @@ async def gemini_generate_content(
                 select(func.count(UsageLog.id))
                 .where(UsageLog.user_id == user.id)
                 .where(UsageLog.created_at >= start_of_day)
-                .where(or_(
-                    UsageLog.model.like('antigravity/%'),
-                    UsageLog.model.like('antigravity-gemini/%')
-                ))
-                .where(~UsageLog.model.like('%claude%'))
-                .where(~UsageLog.model.like('%image%'))
+                .where(UsageLog.api_type == "antigravity")
+                .where(UsageLog.model_family.in_(["gemini", "other"]))
                 .where(UsageLog.status_code == 200)
             )
             quota_type = "Gemini"
@@ -253,6 +250,27 @@ async def gemini_generate_content(
     await db.commit()
     await db.refresh(placeholder_log)
     
+    # 规范化请求 - 使用与 AntigravityClient.generate_content 相同的逻辑（不依赖凭证，先于选凭证完成）
+    body["model"] = model  # 保留完整模型名（含 -high/-low 等后缀）用于 thinking 配置
+    try:
+        normalized_request = await normalize_gemini_request(body, mode="antigravity")
+        # normalized_request 中包含处理后的 model（可能被映射）
+        final_model = normalized_request.pop("model", real_model)
+    except Exception as e:
+        placeholder_log.status_code = 400
+        placeholder_log.error_message = str(e)[:2000]
+        await db.commit()
+        raise HTTPException(status_code=400, detail=f"请求规范化失败: {e}")
+    
+    # 确定性请求先查响应缓存，命中时不占用凭证（图片模型走心跳流程，不缓存）
+    cache_key = None
+    if "image" not in final_model.lower():
+        cache_key = cache_key_for(user.id, "/antigravity/v1beta/generateContent", model, normalized_request)
+    cached = await response_cache.get(cache_key) if cache_key else None
+    if cached is not None:
+        await record_cache_hit(db, placeholder_log, user.username, start_time)
+        return JSONResponse(content=cached)
+    
     # 获取凭证
     max_retries = settings.error_retry_count
     tried_credential_ids = set()
@@ -280,18 +298,6 @@ async def gemini_generate_content(
         await db.commit()
         raise HTTPException(status_code=503, detail="Token 刷新失败或无 project_id")
     
-    # 规范化请求 - 使用与 AntigravityClient.generate_content 相同的逻辑
-    body["model"] = model  # 保留完整模型名（含 -high/-low 等后缀）用于 thinking 配置
-    try:
-        normalized_request = await normalize_gemini_request(body, mode="antigravity")
-        # normalized_request 中包含处理后的 model（可能被映射）
-        final_model = normalized_request.pop("model", real_model)
-    except Exception as e:
-        placeholder_log.status_code = 400
-        placeholder_log.error_message = str(e)[:2000]
-        await db.commit()
-        raise HTTPException(status_code=400, detail=f"请求规范化失败: {e}")
-    
     client = AntigravityClient(access_token, project_id)
     
     # 检查是否是图片模型 - 图片模型不支持流式端点，必须使用真正的非流式端点
@@ -323,8 +329,7 @@ async def gemini_generate_content(
                             
                             response = await http_client.post(
                                 url,
-                                headers=headers,
-                                json=payload,
+                                **json_request(payload, headers),
                                 timeout=300.0
                             )
                             return response
@@ -487,8 +492,7 @@ async def gemini_generate_content(
                 async with http_client.stream(
                     "POST",
                     url,
-                    headers=headers,
-                    json=payload,
+                    **json_request(payload, headers),
                     timeout=300.0
                 ) as response:
                     if response.status_code != 200:
@@ -564,6 +568,9 @@ async def gemini_generate_content(
             if model_version:
                 gemini_response["modelVersion"] = model_version
             
+            if cache_key:
+                await response_cache.set(cache_key, gemini_response)
+            
             latency = (time.time() - start_time) * 1000
             placeholder_log.credential_id = credential.id
             placeholder_log.status_code = 200
@@ -705,7 +712,6 @@ async def gemini_stream_generate_content(
     start_of_day = settings.get_start_of_day()
     
     # 根据模型类型计算配额和检查使用量
-    from sqlalchemy import or_
     if settings.antigravity_quota_enabled and not user.is_admin:
         if is_banana_model:
             # Banana 模型
@@ -718,7 +724,8 @@ async def gemini_stream_generate_content(
                 select(func.count(UsageLog.id))
                 .where(UsageLog.user_id == user.id)
                 .where(UsageLog.created_at >= start_of_day)
-                .where(UsageLog.model.like('%image%'))
+                .where(UsageLog.api_type == "antigravity")
+                .where(UsageLog.model_family == "banana")
                 .where(UsageLog.status_code == 200)
             )
             quota_type = "Banana"
@@ -738,10 +745,8 @@ async def gemini_stream_generate_content(
                 select(func.count(UsageLog.id))
                 .where(UsageLog.user_id == user.id)
                 .where(UsageLog.created_at >= start_of_day)
-                .where(or_(
-                    UsageLog.model.like('antigravity/%claude%'),
-                    UsageLog.model.like('antigravity-gemini/%claude%')
-                ))
+                .where(UsageLog.api_type == "antigravity")
+                .where(UsageLog.model_family == "claude")
                 .where(UsageLog.status_code == 200)
             )
             quota_type = "Claude"
@@ -761,12 +766,8 @@ async def gemini_stream_generate_content(
                 select(func.count(UsageLog.id))
                 .where(UsageLog.user_id == user.id)
                 .where(UsageLog.created_at >= start_of_day)
-                .where(or_(
-                    UsageLog.model.like('antigravity/%'),
-                    UsageLog.model.like('antigravity-gemini/%')
-                ))
-                .where(~UsageLog.model.like('%claude%'))
-                .where(~UsageLog.model.like('%image%'))
+                .where(UsageLog.api_type == "antigravity")
+                .where(UsageLog.model_family.in_(["gemini", "other"]))
                 .where(UsageLog.status_code == 200)
             )
             quota_type = "Gemini"
@@ -865,8 +866,7 @@ async def gemini_stream_generate_content(
                     
                     response = await http_client.post(
                         url,
-                        headers=headers,
-                        json=payload,
+                        **json_request(payload, headers),
                         timeout=300.0
                     )
                     
@@ -1012,8 +1012,7 @@ async def gemini_stream_generate_content(
                     async with http_client.stream(
                         "POST",
                         url,
-                        headers=headers,
-                        json=payload,
+                        **json_request(payload, headers),
                         timeout=300.0
                     ) as response:
                         if response.status_code != 200:
@@ -1174,26 +1173,10 @@ async def gemini_count_tokens(
     except:
         raise HTTPException(status_code=400, detail="无效的JSON请求体")
     
-    total_tokens = 0
-    
-    # 如果有 contents 字段
-    if "contents" in request_data:
-        for content in request_data["contents"]:
-            if "parts" in content:
-                for part in content["parts"]:
-                    if "text" in part:
-                        text_length = len(part["text"])
-                        total_tokens += max(1, text_length // 4)
+    if not isinstance(request_data, dict):
+        raise HTTPException(status_code=400, detail="请求体必须为 JSON object")
     
-    # 如果有 generateContentRequest 字段
-    elif "generateContentRequest" in request_data:
-        gen_request = request_data["generateContentRequest"]
-        if "contents" in gen_request:
-            for content in gen_request["contents"]:
-                if "parts" in content:
-                    for part in content["parts"]:
-                        if "text" in part:
-                            text_length = len(part["text"])
-                            total_tokens += max(1, text_length // 4)
+    # 本地估算（contents / generateContentRequest，含 systemInstruction 和 tools）
+    total_tokens = estimate_input_tokens(request_data)
     
     return JSONResponse(content={"totalTokens": total_tokens})
\ No newline at end of file
@@ -714,11 +714,13 @@ async def export_all_my_antigravity_credentials(
 @router.get("/credentials/{cred_id}/quota")
 async def get_antigravity_credential_quota(
     cred_id: int,
+    refresh: bool = False,
     user: User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
-    """获取 Antigravity 凭证的额度信息（各模型的剩余配额和重置时间）"""
+    """获取 Antigravity 凭证的额度信息（各模型的剩余配额和重置时间，优先读后台轮询的快照）"""
     from datetime import timedelta
+    from app.services.quota_poller import quota_poller
     
     result = await db.execute(
         select(Credential)
@@ -730,21 +732,8 @@ async def get_antigravity_credential_quota(
     if not cred:
         raise HTTPException(status_code=404, detail="凭证不存在")
     
-    # 获取 access token
-    try:
-        access_token = await CredentialPool.get_access_token(cred, db)
-    except Exception as e:
-        return {"success": False, "error": f"获取 token 失败: {str(e)[:50]}", "models": {}}
-    
-    if not access_token:
-        return {"success": False, "error": "无法获取 access token", "models": {}}
-    
-    # 使用 AntigravityClient 获取配额信息
-    from app.services.antigravity_client import AntigravityClient
-    client = AntigravityClient(access_token, cred.project_id)
-    
     try:
-        quota_result = await client.fetch_quota_info()
+        quota_result = await quota_poller.get_quota(cred, db, refresh=refresh)
         
         if quota_result.get("success"):
             # 转换重置时间为北京时间格式
@@ -777,7 +766,9 @@ async def get_antigravity_credential_quota(
             return {
                 "success": True,
                 "filename": cred.email or f"credential-{cred.id}",
-                "models": models
+                "models": models,
+                "cached": quota_result.get("cached", False),
+                "fetched_at": quota_result.get("fetched_at")
             }
         else:
             return {
@@ -1345,17 +1336,13 @@ async def get_antigravity_stats(
             else:
                 banana_quota = settings.banana_quota_default + user_public_creds * settings.banana_quota_per_cred
             
-            # 查询今天的 Banana 使用量（同时匹配 OpenAI 格式和 Gemini 格式）
-            from sqlalchemy import or_
+            # 查询今天的 Banana 使用量（OpenAI 格式和 Gemini 格式都归类为 banana）
             banana_usage_result = await db.execute(
                 select(func.count(UsageLog.id))
                 .where(UsageLog.user_id == user.id)
                 .where(UsageLog.created_at >= start_of_day)
-                .where(or_(
-                    UsageLog.model.like('antigravity/agy-gemini-3-pro-image%'),
-                    UsageLog.model.like('antigravity-gemini/agy-gemini-3-pro-image%'),
-                    UsageLog.model.like('%image%')  # 兜底匹配
-                ))
+                .where(UsageLog.api_type == "antigravity")
+                .where(UsageLog.model_family == "banana")
                 .where(UsageLog.status_code == 200)
             )
             banana_used = banana_usage_result.scalar() or 0
@@ -1414,17 +1401,13 @@ async def get_antigravity_stats(
             else:
                 banana_quota = settings.banana_quota_default + user_public * settings.banana_quota_per_cred
             
-            # 查询今天的 Banana 使用量（同时匹配 OpenAI 格式和 Gemini 格式）
-            from sqlalchemy import or_
+            # 查询今天的 Banana 使用量（OpenAI 格式和 Gemini 格式都归类为 banana）
             banana_usage_result = await db.execute(
                 select(func.count(UsageLog.id))
                 .where(UsageLog.user_id == user.id)
                 .where(UsageLog.created_at >= start_of_day)
-                .where(or_(
-                    UsageLog.model.like('antigravity/agy-gemini-3-pro-image%'),
-                    UsageLog.model.like('antigravity-gemini/agy-gemini-3-pro-image%'),
-                    UsageLog.model.like('%image%')  # 兜底匹配
-                ))
+                .where(UsageLog.api_type == "antigravity")
+                .where(UsageLog.model_family == "banana")
                 .where(UsageLog.status_code == 200)
             )
             banana_used = banana_usage_result.scalar() or 0
@@ -1,7 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException, Request, BackgroundTasks
 from fastapi.responses import StreamingResponse, JSONResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func, or_, and_
+from sqlalchemy import select, func, and_
 from datetime import datetime, timedelta
 import json
 import time
@@ -12,9 +12,13 @@ from app.models.user import User, UsageLog, Credential
 from app.services.auth import get_user_by_api_key
 from app.services.credential_pool import CredentialPool
 from app.services.antigravity_client import AntigravityClient
+from app.services.inline_media import InlineImageError, check_message_images, preview_json
 from app.services.websocket import notify_log_update, notify_stats_update
 from app.services.error_classifier import classify_error_simple
 from app.services.error_message_service import get_custom_error_message
+from app.services.fair_scheduler import acquire_pool_slot, release_when_done
+from app.services.model_catalog import model_catalog
+from app.services.response_cache import response_cache, cache_key_for, record_cache_hit
 from app.config import settings
 import re
 
@@ -149,7 +153,7 @@ async def get_user_from_api_key(request: Request, db: AsyncSession = Depends(get
             select(func.count(UsageLog.id).label("total_usage"))
             .where(UsageLog.user_id == user.id)
             .where(UsageLog.created_at >= start_of_day)
-            .where(UsageLog.model.like('antigravity/%'))  # 只统计 Antigravity 请求
+            .where(UsageLog.api_type == "antigravity")  # 只统计 Antigravity 请求
         )
         usage_stats = usage_stats_result.one()
         total_usage = usage_stats.total_usage or 0
@@ -184,145 +188,14 @@ async def options_handler():
 @router.get("/v1/models")
 @router.get("/models")
 async def list_models(request: Request, user: User = Depends(get_user_from_api_key), db: AsyncSession = Depends(get_db)):
-    """列出可用模型 (OpenAI兼容) - Antigravity"""
-    from app.models.user import Credential
-    
-    # 检查是否有可用的 3.0 Antigravity 凭证
-    has_tier3 = await CredentialPool.has_tier3_credentials(user, db, mode="antigravity")
-    
-    # 尝试从 Antigravity API 获取动态模型列表
-    user_has_public = await CredentialPool.check_user_has_public_creds(db, user.id, mode="antigravity")
-    credential = await CredentialPool.get_available_credential(
-        db, user_id=user.id, user_has_public_creds=user_has_public, model="gemini-2.5-flash",
-        mode="antigravity"  # 使用 Antigravity 凭证
-    )
+    """列出可用模型 (OpenAI兼容) - Antigravity
     
-    if credential:
-        access_token = await CredentialPool.get_access_token(credential, db)
-        if access_token:
-            project_id = credential.project_id or ""
-            client = AntigravityClient(access_token, project_id)
-            try:
-                dynamic_models = await client.fetch_available_models()
-                if dynamic_models:
-                    print(f"[Antigravity] 🔍 动态模型数量: {len(dynamic_models)}", flush=True)
-                    
-                    # 过滤掉不需要的测试/内部模型
-                    # 只保留标准的 gemini, claude, gpt 模型
-                    def is_valid_model(model_id: str) -> bool:
-                        model_lower = model_id.lower()
-                        # 排除条件：包含这些关键字的跳过
-                        invalid_patterns = [
-                            "chat_", "rev", "tab_", "uic", "test", "exp", "lite_preview",
-                            "gcli-", "search"  # search模型反重力不支持
-                        ]
-                        for pattern in invalid_patterns:
-                            if pattern in model_lower:
-                                return False
-                        # 特殊排除：gemini-2.5-pro（Antigravity 无法使用）
-                        if "gemini-2.5-pro" in model_lower or "gemini-2.5pro" in model_lower:
-                            return False
-                        # 允许条件：必须是 gemini, claude, gpt 开头的模型
-                        # 反重力支持 gemini-2.5 和 gemini-3 系列
-                        valid_prefixes = [
-                            "gemini-2.5", "gemini-3", "claude", "gpt-oss",
-                            "agy-gemini-2.5", "agy-gemini-3", "agy-claude", "agy-gpt"
-                        ]
-                        for prefix in valid_prefixes:
-                            if model_lower.startswith(prefix):
-                                return True
-                        return False
-                    
-                    # 添加流式抗截断变体（假非流已自动处理，不需要单独列出）
-                    models = []
-                    for m in dynamic_models:
-                        model_id = m.get("id", "")
-                        # 过滤无效模型
-                        if not is_valid_model(model_id):
-                            continue
-                        models.append({"id": model_id, "object": "model", "owned_by": "google"})
-                        models.append({"id": f"流式抗截断/{model_id}", "object": "model", "owned_by": "google"})
-                        
-                        if "image" in model_id.lower() and "2k" not in model_id.lower() and "4k" not in model_id.lower():
-                            models.append({"id": f"{model_id}-2k", "object": "model", "owned_by": "google"})
-                            models.append({"id": f"{model_id}-4k", "object": "model", "owned_by": "google"})
-                            if not model_id.startswith("agy-"):
-                                models.append({"id": f"agy-{model_id}-2k", "object": "model", "owned_by": "google"})
-                                models.append({"id": f"agy-{model_id}-4k", "object": "model", "owned_by": "google"})
-                    
-                    # 强制添加 Claude 模型的不带 -thinking 后缀版本
-                    claude_base_models = [
-                        "claude-opus-4-5", "agy-claude-opus-4-5",
-                        "claude-sonnet-4-5", "agy-claude-sonnet-4-5",
-                    ]
-                    existing_ids = {m["id"] for m in models}
-                    for base_model in claude_base_models:
-                        if base_model not in existing_ids:
-                            models.append({"id": base_model, "object": "model", "owned_by": "google"})
-                            models.append({"id": f"流式抗截断/{base_model}", "object": "model", "owned_by": "google"})
-                            print(f"[Antigravity] ✅ 强制添加 Claude 基础模型: {base_model}", flush=True)
-                    
-                    image_variants = [
-                        "gemini-3-pro-image", "agy-gemini-3-pro-image",
-                        "gemini-3-pro-image-2k", "agy-gemini-3-pro-image-2k",
-                        "流式抗截断/gemini-3-pro-image-2k", "流式抗截断/agy-gemini-3-pro-image-2k",
-                        "gemini-3-pro-image-4k", "agy-gemini-3-pro-image-4k",
-                        "流式抗截断/gemini-3-pro-image-4k", "流式抗截断/agy-gemini-3-pro-image-4k",
-                    ]
-                    existing_ids = {m["id"] for m in models}
-                    for variant in image_variants:
-                        if variant not in existing_ids:
-                            models.append({"id": variant, "object": "model", "owned_by": "google"})
-                            print(f"[Antigravity] ✅ 强制添加图片模型变体: {variant}", flush=True)
-                    
-                    # 调试：打印所有图片相关模型
-                    image_models = [m["id"] for m in models if "image" in m["id"].lower()]
-                    print(f"[Antigravity] 📷 图片模型列表: {image_models}", flush=True)
-                    
-                    return {"object": "list", "data": models}
-            except Exception as e:
-                print(f"[Antigravity] 获取动态模型列表失败: {e}", flush=True)
-    
-    # 回退到静态模型列表
-    # 注意：不包含 gemini-2.5-pro，因为 Antigravity 无法使用
-    base_models = [
-        # Gemini 2.5 模型（不含 2.5-pro）
-        "gemini-2.5-flash",
-        "gemini-2.5-flash-lite",
-        "gemini-2.5-flash-thinking",
-        # Gemini 3.0 模型
-        "gemini-3-flash",
-        "gemini-3-pro-low",
-        "gemini-3-pro-high",
-        # Gemini 3.0 图片生成模型
-        "gemini-3-pro-image",
-        "gemini-3-pro-image-2k",
-        "gemini-3-pro-image-4k",
-        # Claude 模型 (Antigravity 独有)
-        "claude-sonnet-4-5",
-        "claude-opus-4-5",
-        # GPT-OSS 模型 (Antigravity 独有)
-        "gpt-oss-120b",
+    模型列表由 model_catalog 后台刷新并缓存，这里只读内存，不占用凭证、不访问上游
+    """
+    models = [
+        {"id": model_id, "object": "model", "owned_by": "google"}
+        for model_id in model_catalog.get_ids("antigravity")
     ]
-    
-    thinking_suffixes = ["-maxthinking", "-nothinking", "-thinking"]
-    # search_suffix 已移除 - 反重力API不支持联网搜索
-    
-    models = []
-    for base in base_models:
-        # 基础模型
-        models.append({"id": f"agy-{base}", "object": "model", "owned_by": "google"})
-        models.append({"id": base, "object": "model", "owned_by": "google"})
-        models.append({"id": f"流式抗截断/{base}", "object": "model", "owned_by": "google"})
-        
-        # 思维模式变体 (仅 Claude 和部分 Gemini)
-        if base.startswith("claude") or "pro" in base:
-            for suffix in thinking_suffixes:
-                models.append({"id": f"agy-{base}{suffix}", "object": "model", "owned_by": "google"})
-                models.append({"id": f"{base}{suffix}", "object": "model", "owned_by": "google"})
-        
-        # 搜索变体已移除 - 反重力API不支持联网搜索
-    
     return {"object": "list", "data": models}
 
 
@@ -345,7 +218,7 @@ async def chat_completions(
     except:
         return openai_error_response(400, "无效的JSON请求体", "invalid_request_error")
     
-    request_body_str = json.dumps(body, ensure_ascii=False)[:2000] if body else None
+    request_body_str = preview_json(body, 2000) if body else None
     
     model = body.get("model", "gemini-2.5-flash")
     # 去除 agy- 前缀（用于标识 Antigravity 模型，但 API 不需要它）
@@ -356,6 +229,10 @@ async def chat_completions(
     
     if not messages:
         return openai_error_response(400, "messages不能为空", "invalid_request_error")
+    try:
+        check_message_images(messages)
+    except InlineImageError as e:
+        return openai_error_response(400, str(e), "invalid_request_error")
     
     # 检查用户是否有公开的 Antigravity 凭证
     user_has_public = await CredentialPool.check_user_has_public_creds(db, user.id, mode="antigravity")
@@ -415,7 +292,8 @@ async def chat_completions(
                 select(func.count(UsageLog.id))
                 .where(UsageLog.user_id == user.id)
                 .where(UsageLog.created_at >= start_of_day)
-                .where(UsageLog.model.like('%image%'))
+                .where(UsageLog.api_type == "antigravity")
+                .where(UsageLog.model_family == "banana")
                 .where(UsageLog.status_code == 200)
             )
             quota_type = "Banana"
@@ -435,10 +313,8 @@ async def chat_completions(
                 select(func.count(UsageLog.id))
                 .where(UsageLog.user_id == user.id)
                 .where(UsageLog.created_at >= start_of_day)
-                .where(or_(
-                    UsageLog.model.like('antigravity/%claude%'),
-                    UsageLog.model.like('antigravity-gemini/%claude%')
-                ))
+                .where(UsageLog.api_type == "antigravity")
+                .where(UsageLog.model_family == "claude")
                 .where(UsageLog.status_code == 200)
             )
             quota_type = "Claude"
@@ -459,12 +335,8 @@ async def chat_completions(
                 select(func.count(UsageLog.id))
                 .where(UsageLog.user_id == user.id)
                 .where(UsageLog.created_at >= start_of_day)
-                .where(or_(
-                    UsageLog.model.like('antigravity/%'),
-                    UsageLog.model.like('antigravity-gemini/%')
-                ))
-                .where(~UsageLog.model.like('%claude%'))
-                .where(~UsageLog.model.like('%image%'))
+                .where(UsageLog.api_type == "antigravity")
+                .where(UsageLog.model_family.in_(["gemini", "other"]))
                 .where(UsageLog.status_code == 200)
             )
             quota_type = "Gemini"
@@ -498,96 +370,131 @@ async def chat_completions(
     await db.refresh(placeholder_log)
     placeholder_log_id = placeholder_log.id
     
-    # 获取 Antigravity 凭证
-    max_retries = settings.error_retry_count
-    tried_credential_ids = set()
-    preheat_task = None  # 凭证预热任务
-    
-    credential = await CredentialPool.get_available_credential(
-        db,
-        user_id=user.id,
-        user_has_public_creds=user_has_public,
-        model=model,
-        exclude_ids=tried_credential_ids,
-        mode="antigravity"  # 使用 Antigravity 凭证
-    )
-    if not credential:
-        required_tier = CredentialPool.get_required_tier(model)
-        placeholder_log.status_code = 503
-        placeholder_log.latency_ms = (time.time() - start_time) * 1000
-        placeholder_log.error_type = "NO_CREDENTIAL"
-        placeholder_log.error_code = "NO_CREDENTIAL"
-        if required_tier == "3":
-            placeholder_log.error_message = "没有可用的 Gemini 3 等级凭证"
-            await db.commit()
-            return openai_error_response(
-                503,
-                "没有可用的 Gemini 3 等级凭证。该模型需要有 Gemini 3 资格的凭证。",
-                "server_error"
-            )
-        if not user_has_public:
-            placeholder_log.error_message = "用户没有可用的 Antigravity 凭证"
-            await db.commit()
-            return openai_error_response(
-                503,
-                "您没有可用的 Antigravity 凭证。请在 Antigravity 凭证管理页面上传凭证，或捐赠凭证以使用公共池。",
-                "server_error"
-            )
-        placeholder_log.error_message = "暂无可用凭证"
-        await db.commit()
-        return openai_error_response(503, "暂无可用凭证，请稍后重试", "server_error")
-    
-    tried_credential_ids.add(credential.id)
+    # 确定性非流式请求先查响应缓存，命中时不占用凭证
+    # 转换结果同时用于缓存键和实际请求，保证键与发出的内容一致
+    cache_key = None
+    prepared = None
+    if not stream and settings.response_cache_enabled:
+        request_kwargs = {k: v for k, v in body.items() if k not in ["model", "messages", "stream"]}
+        prepared = await AntigravityClient("", user_id=user.id).build_request_payload(model, messages, **request_kwargs)
+        cache_key = cache_key_for(user.id, "/antigravity/v1/chat/completions", model, prepared)
+        cached = await response_cache.get(cache_key) if cache_key else None
+        if cached is not None:
+            await record_cache_hit(db, placeholder_log, user.username, start_time)
+            return JSONResponse(content=cached)
     
-    # 使用 Antigravity 模式获取 token 和 project_id
-    access_token, project_id = await CredentialPool.get_access_token_and_project(credential, db, mode="antigravity")
-    if not access_token:
-        await CredentialPool.mark_credential_error(db, credential.id, "Token 刷新失败")
-        placeholder_log.status_code = 503
-        placeholder_log.latency_ms = (time.time() - start_time) * 1000
-        placeholder_log.error_type = "TOKEN_ERROR"
-        placeholder_log.error_code = "TOKEN_REFRESH_FAILED"
-        placeholder_log.error_message = "Token 刷新失败"
-        placeholder_log.credential_id = credential.id
-        placeholder_log.credential_email = credential.email
-        await db.commit()
-        return openai_error_response(503, "Token 刷新失败", "server_error")
-    
-    if not project_id:
-        await CredentialPool.mark_credential_error(db, credential.id, "无法获取 Antigravity project_id")
+    # 公平调度：凭证池并发占满时按用户通道排队
+    try:
+        ticket = await acquire_pool_slot(db, user, "antigravity")
+    except asyncio.TimeoutError:
         placeholder_log.status_code = 503
         placeholder_log.latency_ms = (time.time() - start_time) * 1000
-        placeholder_log.error_type = "CONFIG_ERROR"
-        placeholder_log.error_code = "NO_ANTIGRAVITY_PROJECT"
-        placeholder_log.error_message = "无法获取 Antigravity project_id"
-        placeholder_log.credential_id = credential.id
-        placeholder_log.credential_email = credential.email
+        placeholder_log.error_type = "QUEUE_TIMEOUT"
+        placeholder_log.error_code = "QUEUE_TIMEOUT"
+        placeholder_log.error_message = "凭证池排队超时"
         await db.commit()
-        return openai_error_response(503, "凭证未激活 Antigravity，无法获取 project_id", "server_error")
-    first_credential_id = credential.id
-    first_credential_email = credential.email
-    print(f"[Antigravity Proxy] ★★★ 凭证信息 ★★★", flush=True)
-    print(f"[Antigravity Proxy] ★ 凭证邮箱: {credential.email}", flush=True)
-    print(f"[Antigravity Proxy] ★ Project ID: {project_id}", flush=True)
-    print(f"[Antigravity Proxy] ★ 请求模型: {model}", flush=True)
-    print(f"[Antigravity Proxy] ★ Token前20字符: {access_token[:20] if access_token else 'None'}...", flush=True)
-    print(f"[Antigravity Proxy] ★★★★★★★★★★★★★★★", flush=True)
+        return openai_error_response(503, "当前请求过多，排队超时，请稍后重试", "server_error")
     
-    # 启动凭证预热任务（并行获取下一个可用凭证）
-    tried_credential_ids.add(credential.id)
-    if max_retries > 0:
-        preheat_task = CredentialPool.create_preheat_task(
+    try:
+        # 获取 Antigravity 凭证
+        max_retries = settings.error_retry_count
+        tried_credential_ids = set()
+        preheat_task = None  # 凭证预热任务
+        
+        credential = await CredentialPool.get_available_credential(
+            db,
             user_id=user.id,
             user_has_public_creds=user_has_public,
             model=model,
-            exclude_ids=tried_credential_ids.copy(),
-            mode="antigravity"
+            exclude_ids=tried_credential_ids,
+            mode="antigravity"  # 使用 Antigravity 凭证
         )
-        print(f"[Antigravity Proxy] 🔥 已启动凭证预热任务", flush=True)
-    
-    client = AntigravityClient(access_token, project_id)
-    print(f"[Antigravity Proxy] AntigravityClient 已创建, api_base: {client.api_base}", flush=True)
-    use_fake_streaming = client.is_fake_streaming(model)
+        if not credential:
+            required_tier = CredentialPool.get_required_tier(model)
+            placeholder_log.status_code = 503
+            placeholder_log.latency_ms = (time.time() - start_time) * 1000
+            placeholder_log.error_type = "NO_CREDENTIAL"
+            placeholder_log.error_code = "NO_CREDENTIAL"
+            if required_tier == "3":
+                placeholder_log.error_message = "没有可用的 Gemini 3 等级凭证"
+                ticket.release()
+                await db.commit()
+                return openai_error_response(
+                    503,
+                    "没有可用的 Gemini 3 等级凭证。该模型需要有 Gemini 3 资格的凭证。",
+                    "server_error"
+                )
+            if not user_has_public:
+                placeholder_log.error_message = "用户没有可用的 Antigravity 凭证"
+                ticket.release()
+                await db.commit()
+                return openai_error_response(
+                    503,
+                    "您没有可用的 Antigravity 凭证。请在 Antigravity 凭证管理页面上传凭证，或捐赠凭证以使用公共池。",
+                    "server_error"
+                )
+            placeholder_log.error_message = "暂无可用凭证"
+            ticket.release()
+            await db.commit()
+            return openai_error_response(503, "暂无可用凭证，请稍后重试", "server_error")
+        
+        tried_credential_ids.add(credential.id)
+        
+        # 使用 Antigravity 模式获取 token 和 project_id
+        access_token, project_id = await CredentialPool.get_access_token_and_project(credential, db, mode="antigravity")
+        if not access_token:
+            await CredentialPool.mark_credential_error(db, credential.id, "Token 刷新失败")
+            placeholder_log.status_code = 503
+            placeholder_log.latency_ms = (time.time() - start_time) * 1000
+            placeholder_log.error_type = "TOKEN_ERROR"
+            placeholder_log.error_code = "TOKEN_REFRESH_FAILED"
+            placeholder_log.error_message = "Token 刷新失败"
+            placeholder_log.credential_id = credential.id
+            placeholder_log.credential_email = credential.email
+            ticket.release()
+            await db.commit()
+            return openai_error_response(503, "Token 刷新失败", "server_error")
+        
+        if not project_id:
+            await CredentialPool.mark_credential_error(db, credential.id, "无法获取 Antigravity project_id")
+            placeholder_log.status_code = 503
+            placeholder_log.latency_ms = (time.time() - start_time) * 1000
+            placeholder_log.error_type = "CONFIG_ERROR"
+            placeholder_log.error_code = "NO_ANTIGRAVITY_PROJECT"
+            placeholder_log.error_message = "无法获取 Antigravity project_id"
+            placeholder_log.credential_id = credential.id
+            placeholder_log.credential_email = credential.email
+            ticket.release()
+            await db.commit()
+            return openai_error_response(503, "凭证未激活 Antigravity，无法获取 project_id", "server_error")
+        first_credential_id = credential.id
+        first_credential_email = credential.email
+        print(f"[Antigravity Proxy] ★★★ 凭证信息 ★★★", flush=True)
+        print(f"[Antigravity Proxy] ★ 凭证邮箱: {credential.email}", flush=True)
+        print(f"[Antigravity Proxy] ★ Project ID: {project_id}", flush=True)
+        print(f"[Antigravity Proxy] ★ 请求模型: {model}", flush=True)
+        print(f"[Antigravity Proxy] ★ Token前20字符: {access_token[:20] if access_token else 'None'}...", flush=True)
+        print(f"[Antigravity Proxy] ★★★★★★★★★★★★★★★", flush=True)
+        
+        # 启动凭证预热任务（并行获取下一个可用凭证）
+        tried_credential_ids.add(credential.id)
+        if max_retries > 0:
+            preheat_task = CredentialPool.create_preheat_task(
+                user_id=user.id,
+                user_has_public_creds=user_has_public,
+                model=model,
+                exclude_ids=tried_credential_ids.copy(),
+                mode="antigravity"
+            )
+            print(f"[Antigravity Proxy] 🔥 已启动凭证预热任务", flush=True)
+        
+        client = AntigravityClient(access_token, project_id, user_id=user.id)
+        print(f"[Antigravity Proxy] AntigravityClient 已创建, api_base: {client.api_base}", flush=True)
+        use_fake_streaming = client.is_fake_streaming(model)
+    except BaseException:
+        # 选凭证、刷新 token 时出错（含取消）也要归还名额，release() 可重复调用
+        ticket.release()
+        raise
     last_error = None
     
     # 非流式处理
@@ -599,9 +506,12 @@ async def chat_completions(
                 result = await client.chat_completions(
                     model=model,
                     messages=messages,
+                    prepared=prepared,
                     server_base_url=str(request.base_url).rstrip("/"),
                     **{k: v for k, v in body.items() if k not in ["model", "messages", "stream"]}
                 )
+                if cache_key:
+                    await response_cache.set(cache_key, result)
                 
                 latency = (time.time() - start_time) * 1000
                 
@@ -612,9 +522,10 @@ async def chat_completions(
                 placeholder_log.retry_count = retry_attempt
                 await db.commit()
                 
-                credential.total_requests = (credential.total_requests or 0) + 1
-                credential.last_used_at = datetime.utcnow()
-                await db.commit()
+                if not client.last_call_shared:
+                    credential.total_requests = (credential.total_requests or 0) + 1
+                    credential.last_used_at = datetime.utcnow()
+                    await db.commit()
                 
                 await notify_log_update({
                     "username": user.username,
@@ -656,7 +567,7 @@ async def chat_completions(
                         from app.services.crypto import encrypt_credential
                         credential.api_key = encrypt_credential(new_token)
                         await db.commit()
-                        client = AntigravityClient(new_token, project_id)
+                        client = AntigravityClient(new_token, project_id, user_id=user.id)
                         print(f"[Antigravity Proxy] ✅ Token 刷新成功，使用相同凭证重试: {credential.email}", flush=True)
                         continue
                     else:
@@ -719,7 +630,7 @@ async def chat_completions(
                         credential = new_credential
                         access_token = new_token
                         project_id = new_project
-                        client = AntigravityClient(access_token, project_id)
+                        client = AntigravityClient(access_token, project_id, user_id=user.id)
                         print(f"[Antigravity Proxy] 🔄 切换到凭证: {credential.email}", flush=True)
                         
                         # 启动下一个预热任务
@@ -797,6 +708,7 @@ async def chat_completions(
                 async for chunk in client.chat_completions_stream(
                     model=model,
                     messages=messages,
+                    prepared=prepared,
                     server_base_url=str(request.base_url).rstrip("/"),
                     **{k: v for k, v in body.items() if k not in ["model", "messages", "stream"]}
                 ):
@@ -873,13 +785,13 @@ async def chat_completions(
                             log.credential_email = credential.email
                             log.retry_count = retry_attempt
                         
-                        # 更新凭证使用次数
+                        # 更新凭证使用次数（结果共享自其他相同请求时本凭证没有调用上游）
                         from app.models.user import Credential as CredentialModel
                         cred_result = await bg_db.execute(
                             select(CredentialModel).where(CredentialModel.id == credential.id)
                         )
                         cred = cred_result.scalar_one_or_none()
-                        if cred:
+                        if cred and not client.last_call_shared:
                             cred.total_requests = (cred.total_requests or 0) + 1
                             cred.last_used_at = datetime.utcnow()
                         
@@ -933,6 +845,8 @@ async def chat_completions(
                     }],
                     "usage": usage_data
                 }
+                if cache_key:
+                    await response_cache.set(cache_key, result)
                 yield json.dumps(result)
                 return
                 
@@ -976,7 +890,7 @@ async def chat_completions(
                                     cred_obj.api_key = encrypt_credential(new_token)
                                     await bg_db.commit()
                                     access_token = new_token
-                                    client = AntigravityClient(new_token, project_id)
+                                    client = AntigravityClient(new_token, project_id, user_id=user.id)
                                     print(f"[Antigravity Proxy] ✅ 假非流 Token 刷新成功: {credential.email}", flush=True)
                                     continue
                                 else:
@@ -1045,7 +959,7 @@ async def chat_completions(
                         credential = new_cred
                         access_token = new_token
                         project_id = new_project
-                        client = AntigravityClient(access_token, project_id)
+                        client = AntigravityClient(access_token, project_id, user_id=user.id)
                         print(f"[Antigravity Proxy] 🔄 假非流切换到凭证: {credential.email}", flush=True)
                         
                         # 启动下一个预热任务
@@ -1177,13 +1091,13 @@ async def chat_completions(
                             log.credential_email = credential.email
                             log.retry_count = retry_attempt
                         
-                        # 更新凭证使用次数
+                        # 更新凭证使用次数（结果共享自其他相同请求时本凭证没有调用上游）
                         from app.models.user import Credential as CredentialModel
                         cred_result = await bg_db.execute(
                             select(CredentialModel).where(CredentialModel.id == credential.id)
                         )
                         cred = cred_result.scalar_one_or_none()
-                        if cred:
+                        if cred and not client.last_call_shared:
                             cred.total_requests = (cred.total_requests or 0) + 1
                             cred.last_used_at = datetime.utcnow()
                         
@@ -1241,7 +1155,7 @@ async def chat_completions(
                                     cred_obj.api_key = encrypt_credential(new_token)
                                     await bg_db.commit()
                                     access_token = new_token
-                                    client = AntigravityClient(new_token, project_id)
+                                    client = AntigravityClient(new_token, project_id, user_id=user.id)
                                     print(f"[Antigravity Proxy] ✅ 图片模型 Token 刷新成功: {credential.email}", flush=True)
                                     continue
                                 else:
@@ -1308,7 +1222,7 @@ async def chat_completions(
                         credential = new_cred
                         access_token = new_token
                         project_id = new_project
-                        client = AntigravityClient(access_token, project_id)
+                        client = AntigravityClient(access_token, project_id, user_id=user.id)
                         print(f"[Antigravity Proxy] 🔄 图片模型切换到凭证: {credential.email}", flush=True)
                         
                         # 启动下一个预热任务
@@ -1369,7 +1283,7 @@ async def chat_completions(
         # 图片模型非流式：使用假非流模式（非流式端点 + 心跳机制）
         print(f"[Antigravity Proxy] 🖼️ 图片模型检测到，使用假非流模式（非流式端点 + 心跳） (model={model}, stream={stream})", flush=True)
         return StreamingResponse(
-            image_fake_non_stream_generator(),
+            release_when_done(ticket, image_fake_non_stream_generator()),
             media_type="application/json",
             headers={"Cache-Control": "no-cache"}
         )
@@ -1382,7 +1296,7 @@ async def chat_completions(
     if use_fake_streaming or not stream:
         print(f"[Antigravity Proxy] 🔄 使用假非流模式 (use_fake_streaming={use_fake_streaming}, stream={stream})", flush=True)
         return StreamingResponse(
-            fake_non_stream_generator(),
+            release_when_done(ticket, fake_non_stream_generator()),
             media_type="application/json",
             headers={"Cache-Control": "no-cache"}
         )
@@ -1416,7 +1330,7 @@ async def chat_completions(
                     log.retry_count = log_data.get("retry_count", 0)
                 
                 cred_id = log_data.get("cred_id")
-                if cred_id:
+                if cred_id and not log_data.get("shared"):
                     from app.models.user import Credential
                     cred_result = await bg_db.execute(
                         select(Credential).where(Credential.id == cred_id)
@@ -1470,7 +1384,8 @@ async def chat_completions(
                     "cred_id": current_cred_id,
                     "cred_email": current_cred_email,
                     "latency_ms": latency,
-                    "retry_count": stream_retry
+                    "retry_count": stream_retry,
+                    "shared": client.last_call_shared
                 })
                 yield "data: [DONE]\n\n"
                 return
@@ -1513,7 +1428,7 @@ async def chat_completions(
                                     cred_obj.api_key = encrypt_credential(new_token)
                                     await stream_db.commit()
                                     access_token = new_token
-                                    client = AntigravityClient(new_token, project_id)
+                                    client = AntigravityClient(new_token, project_id, user_id=user.id)
                                     print(f"[Antigravity Proxy] ✅ 流式 Token 刷新成功: {current_cred_email}", flush=True)
                                     continue
                                 else:
@@ -1581,7 +1496,7 @@ async def chat_completions(
                         current_cred_email = new_credential.email
                         access_token = new_token
                         project_id = new_project_id
-                        client = AntigravityClient(access_token, project_id)
+                        client = AntigravityClient(access_token, project_id, user_id=user.id)
                         print(f"[Antigravity Proxy] 🔄 流式切换到凭证: {current_cred_email}", flush=True)
                         
                         # 启动下一个预热任务
@@ -1611,7 +1526,7 @@ async def chat_completions(
                 return
     
     return StreamingResponse(
-        stream_generator_with_retry(),
+        release_when_done(ticket, stream_generator_with_retry()),
         media_type="text/event-stream",
         headers={"Cache-Control": "no-cache", "Connection": "keep-alive"}
     )
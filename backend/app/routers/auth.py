@@ -129,109 +129,38 @@ async def get_me(user: User = Depends(get_current_user), db: AsyncSession = Depe
     )
     today_usage = result.scalar() or 0
     
-    # 按模型分类统计今日使用量 —— 仅统计非 AGY 端点的请求（CLI 端点）
-    # 先定义 AGY 端点排除条件
-    from sqlalchemy import or_, and_
-    cli_endpoint_condition = and_(
-        UsageLog.endpoint.notilike('%/agy/%'),
-        UsageLog.endpoint.notilike('%/antigravity/%')
-    )
-    
-    flash_result = await db.execute(
-        select(func.count(UsageLog.id))
-        .where(UsageLog.user_id == user.id)
-        .where(UsageLog.created_at >= start_of_day)
-        .where(cli_endpoint_condition)  # 只统计 CLI 端点
-        .where(UsageLog.model.notlike('%pro%'))
-    )
-    flash_usage = flash_result.scalar() or 0
-    
-    pro25_result = await db.execute(
-        select(func.count(UsageLog.id))
-        .where(UsageLog.user_id == user.id)
-        .where(UsageLog.created_at >= start_of_day)
-        .where(cli_endpoint_condition)  # 只统计 CLI 端点
-        .where(UsageLog.model.like('%pro%'))
-        .where(UsageLog.model.notlike('%3%'))
-    )
-    pro25_usage = pro25_result.scalar() or 0
-    
-    # 3.0 模型用量：包含 "3" 但排除 3-flash（3-flash 算 flash 额度）
-    pro30_result = await db.execute(
-        select(func.count(UsageLog.id))
-        .where(UsageLog.user_id == user.id)
-        .where(UsageLog.created_at >= start_of_day)
-        .where(cli_endpoint_condition)  # 只统计 CLI 端点
-        .where(UsageLog.model.like('%3%'))
-        .where(UsageLog.model.notlike('%3-flash%'))  # 排除 gemini-3-flash
-        .where(UsageLog.model.notlike('%3flash%'))   # 排除没有连字符的变体
-    )
-    pro30_usage = pro30_result.scalar() or 0
-    
-    # 按 Provider 分类统计（Claude / Gemini / 其他）—— 仅统计 AGY 端点的请求
-    
-    # AGY 端点条件（用于所有 AGY Provider 统计）
-    agy_endpoint_condition = or_(
-        UsageLog.endpoint.ilike('%/agy/%'),
-        UsageLog.endpoint.ilike('%/antigravity/%')
-    )
-    
-    # AGY Claude 使用量（仅 AGY 端点 + Claude 模型）
-    claude_result = await db.execute(
-        select(func.count(UsageLog.id))
-        .where(UsageLog.user_id == user.id)
-        .where(UsageLog.created_at >= start_of_day)
-        .where(agy_endpoint_condition)
-        .where(UsageLog.model.ilike('%claude%'))
-    )
-    claude_usage = claude_result.scalar() or 0
-    
-    # AGY Gemini 使用量（仅 AGY 端点 + Gemini 模型）
-    gemini_result = await db.execute(
-        select(func.count(UsageLog.id))
-        .where(UsageLog.user_id == user.id)
-        .where(UsageLog.created_at >= start_of_day)
-        .where(agy_endpoint_condition)
-        .where(or_(
-            UsageLog.model.ilike('%gemini%'),
-            UsageLog.model.ilike('%flash%'),
-            UsageLog.model.ilike('%pro%'),
-            UsageLog.model.ilike('%agy-%')
-        ))
-        .where(UsageLog.model.notilike('%claude%'))  # 排除 claude
-    )
-    gemini_usage = gemini_result.scalar() or 0
-    
-    # AGY 其他使用量（仅 AGY 端点 + 非 Claude/Gemini）
-    agy_other_result = await db.execute(
-        select(func.count(UsageLog.id))
+    # 按模型分类统计今日使用量（api_type / quota_class / model_family 在写日志时已分类）
+    class_result = await db.execute(
+        select(UsageLog.api_type, UsageLog.quota_class, UsageLog.model_family, func.count(UsageLog.id))
         .where(UsageLog.user_id == user.id)
         .where(UsageLog.created_at >= start_of_day)
-        .where(agy_endpoint_condition)
-        .where(UsageLog.model.notilike('%claude%'))
-        .where(UsageLog.model.notilike('%gemini%'))
-        .where(UsageLog.model.notilike('%flash%'))
-        .where(UsageLog.model.notilike('%pro%'))
-        .where(UsageLog.model.notilike('%agy-%'))
+        .group_by(UsageLog.api_type, UsageLog.quota_class, UsageLog.model_family)
     )
-    other_usage = agy_other_result.scalar() or 0
-    
-    # 按 API 类型分类（CLI vs Antigravity）
-    # Antigravity 请求通过 /agy/ 或 /antigravity/ 端点
-    antigravity_result = await db.execute(
-        select(func.count(UsageLog.id))
-        .where(UsageLog.user_id == user.id)
-        .where(UsageLog.created_at >= start_of_day)
-        .where(or_(
-            UsageLog.endpoint.ilike('%/agy/%'),
-            UsageLog.endpoint.ilike('%/antigravity/%')
-        ))
-    )
-    antigravity_usage = antigravity_result.scalar() or 0
+    flash_usage = pro25_usage = pro30_usage = 0
+    claude_usage = gemini_usage = other_usage = 0
+    antigravity_usage = 0
+    for row_api_type, quota_class, model_family, count in class_result.all():
+        if row_api_type == "antigravity":
+            # 按 Provider 分类统计（Claude / Gemini / 其他）—— 仅统计 AGY 请求
+            antigravity_usage += count
+            if model_family == "claude":
+                claude_usage += count
+            elif model_family in ("gemini", "banana"):
+                gemini_usage += count
+            else:
+                other_usage += count
+        elif quota_class == "tier3":
+            pro30_usage += count
+        elif quota_class == "pro":
+            pro25_usage += count
+        else:
+            flash_usage += count
     
     # CLI 使用量 = 总使用量 - Antigravity 使用量
     cli_usage = max(0, today_usage - antigravity_usage)
     
+    from sqlalchemy import or_
+    
     # 获取用户 CLI 凭证数量（排除 antigravity 类型）
     cred_result = await db.execute(
         select(func.count(Credential.id))
@@ -671,7 +600,7 @@ async def upload_credentials(
                     if access_token:
                         async with httpx.AsyncClient(timeout=15) as client:
                             # 使用 cloudcode-pa 端点测试（与 gcli2api 一致）
-                            test_url = "https://cloudcode-pa.googleapis.com/v1internal:generateContent"
+                            test_url = f"{settings.code_assist_endpoint}/v1internal:generateContent"
                             headers = {"Authorization": f"Bearer {access_token}", "Content-Type": "application/json"}
                         
                             # 先测试 2.5 判断凭证是否有效
@@ -1132,7 +1061,7 @@ async def verify_my_credential(
         async with httpx.AsyncClient(timeout=15) as client:
             # 使用 cloudcode-pa 端点测试（与 gcli2api 一致）
             try:
-                test_url = "https://cloudcode-pa.googleapis.com/v1internal:generateContent"
+                test_url = f"{settings.code_assist_endpoint}/v1internal:generateContent"
                 headers = {"Authorization": f"Bearer {access_token}", "Content-Type": "application/json"}
                 
                 # 先测试 2.5 判断凭证是否有效
@@ -1239,7 +1168,7 @@ async def refresh_credential_project_id(
             new_project_id = await fetch_project_id(
                 access_token=access_token,
                 user_agent="CatieCli/1.0",
-                api_base_url="https://cloudcode-pa.googleapis.com"
+                api_base_url=settings.code_assist_endpoint
             )
             if new_project_id:
                 print(f"[刷新项目ID] ✅ fetch_project_id 获取到: {new_project_id}", flush=True)
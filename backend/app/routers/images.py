@@ -0,0 +1,97 @@
+"""
+生成图片访问 (/images)
+
+图片按内容寻址（见 services/image_storage.py），同一个 URL 的内容不会变化，
+所以返回强 ETag 和一年的 immutable 缓存头，客户端重复打开同一张图片时直接用本地缓存；
+支持 If-None-Match（304）和单段 Range 请求（206），方便断点续传和分段加载大图。
+"""
+import asyncio
+import mimetypes
+import os
+import re
+from typing import Optional, Tuple
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import FileResponse, Response
+
+from app.services.image_storage import ImageStorage
+
+router = APIRouter(prefix="/images", tags=["生成图片"])
+
+_CACHE_CONTROL = "public, max-age=31536000, immutable"
+_IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".gif", ".webp")
+_RANGE_RE = re.compile(r"bytes=(\d*)-(\d*)")
+
+
+def _parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    解析单段 Range，返回 [start, end]（含 end）
+
+    多段 Range 或格式不支持时返回 None（按完整响应处理）；范围无法满足时抛出 ValueError。
+    """
+    match = _RANGE_RE.fullmatch(header.strip())
+    if not match or not (match.group(1) or match.group(2)):
+        return None
+    start, end = match.group(1), match.group(2)
+    if start:
+        start = int(start)
+        end = min(int(end), size - 1) if end else size - 1
+    else:
+        # bytes=-N：最后 N 个字节
+        start = max(0, size - int(end))
+        end = size - 1
+    if start > end or start >= size:
+        raise ValueError(header)
+    return start, end
+
+
+def _read_range(path: str, start: int, length: int) -> bytes:
+    with open(path, "rb") as f:
+        f.seek(start)
+        return f.read(length)
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    return any(tag.strip().removeprefix("W/") in (etag, "*") for tag in header.split(","))
+
+
+@router.api_route("/{filename}", methods=["GET", "HEAD"])
+async def get_image(filename: str, request: Request):
+    """获取生成的图片"""
+    if "/" in filename or "\\" in filename or filename.startswith(".") or not filename.lower().endswith(_IMAGE_EXTENSIONS):
+        raise HTTPException(status_code=404, detail="图片不存在或已过期")
+    path = str(ImageStorage.STORAGE_DIR / filename)
+    try:
+        stat = await asyncio.to_thread(os.stat, path)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="图片不存在或已过期")
+
+    etag = f'"{os.path.splitext(filename)[0]}"'
+    media_type = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    headers = {"ETag": etag, "Cache-Control": _CACHE_CONTROL, "Accept-Ranges": "bytes"}
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (not if_range or if_range.strip() == etag):
+        try:
+            byte_range = _parse_range(range_header, stat.st_size)
+        except ValueError:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{stat.st_size}"})
+        if byte_range is not None:
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{stat.st_size}"
+            if request.method == "HEAD":
+                return Response(status_code=206, headers={**headers, "Content-Length": str(end - start + 1)}, media_type=media_type)
+            try:
+                data = await asyncio.to_thread(_read_range, path, start, end - start + 1)
+            except FileNotFoundError:
+                raise HTTPException(status_code=404, detail="图片不存在或已过期")
+            return Response(content=data, status_code=206, headers=headers, media_type=media_type)
+
+    if request.method == "HEAD":
+        return Response(headers={**headers, "Content-Length": str(stat.st_size)}, media_type=media_type)
+    return FileResponse(path, media_type=media_type, headers=headers, stat_result=stat)
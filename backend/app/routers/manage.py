@@ -291,7 +291,7 @@ async def verify_credential(
     async with httpx.AsyncClient(timeout=15) as client:
         # 使用 cloudcode-pa 端点测试（与 gcli2api 一致）
         try:
-            test_url = "https://cloudcode-pa.googleapis.com/v1internal:generateContent"
+            test_url = f"{settings.code_assist_endpoint}/v1internal:generateContent"
             headers = {"Authorization": f"Bearer {access_token}", "Content-Type": "application/json"}
             
             # 先测试 3.0（优先）
@@ -516,7 +516,7 @@ async def verify_all_credentials(
                     account_type = "unknown"
                     
                     async with httpx.AsyncClient(timeout=10) as client:
-                        test_url = "https://cloudcode-pa.googleapis.com/v1internal:generateContent"
+                        test_url = f"{settings.code_assist_endpoint}/v1internal:generateContent"
                         headers = {"Authorization": f"Bearer {access_token}", "Content-Type": "application/json"}
                         
                         # 测试 2.5
@@ -607,12 +607,12 @@ PREMIUM_MODELS = ["gemini-2.5-pro", "gemini-3-pro", "gemini-3-pro-preview", "gem
 @router.get("/credentials/{credential_id}/quota")
 async def get_credential_quota(
     credential_id: int,
+    refresh: bool = False,
     user: User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db)
 ):
-    """获取单个凭证的配额使用情况（优先从 Google API 获取实时配额）"""
-    from app.services.credential_pool import CredentialPool
-    from app.services.gemini_client import GeminiClient
+    """获取单个凭证的配额使用情况（优先读后台轮询的快照，refresh=true 时实时查询）"""
+    from app.services.quota_poller import quota_poller
     from datetime import timedelta
     
     # 检查凭证权限
@@ -628,44 +628,38 @@ async def get_credential_quota(
     api_error_message = None
     
     try:
-        access_token = await CredentialPool.get_access_token(cred, db)
-        if access_token and cred.project_id:
-            client = GeminiClient(access_token, cred.project_id)
-            quota_result = await client.fetch_quota_info()
-            
-            if quota_result.get("success"):
-                api_quota_success = True
-                # 转换模型配额数据（转换百分比和北京时间）
-                for model_id, quota_data in quota_result.get("models", {}).items():
-                    remaining = quota_data.get("remaining", 0)
-                    reset_time_raw = quota_data.get("resetTime", "")
-                    
-                    # 转换为北京时间
-                    reset_time_beijing = "N/A"
-                    if reset_time_raw:
-                        try:
-                            from datetime import datetime as dt
-                            if reset_time_raw.endswith("Z"):
-                                utc_date = dt.fromisoformat(reset_time_raw.replace("Z", "+00:00"))
-                            else:
-                                utc_date = dt.fromisoformat(reset_time_raw)
-                            # 转换为北京时间 (UTC+8)
-                            beijing_date = utc_date + timedelta(hours=8)
-                            reset_time_beijing = beijing_date.strftime("%m-%d %H:%M")
-                        except Exception as e:
-                            print(f"[Quota] 解析重置时间失败: {e}", flush=True)
-                    
-                    api_quota_models[model_id] = {
-                        "remaining": round(remaining * 100, 1),  # 转换为百分比
-                        "resetTime": reset_time_beijing,
-                        "resetTimeRaw": reset_time_raw
-                    }
-            else:
-                # API 返回错误（如 403）
-                api_error_message = quota_result.get("error", "未知错误")
-                print(f"[Quota] API 配额查询失败: {api_error_message}", flush=True)
+        quota_result = await quota_poller.get_quota(cred, db, refresh=refresh)
+        if quota_result.get("success"):
+            api_quota_success = True
+            # 转换模型配额数据（转换百分比和北京时间）
+            for model_id, quota_data in quota_result.get("models", {}).items():
+                remaining = quota_data.get("remaining", 0)
+                reset_time_raw = quota_data.get("resetTime", "")
+                
+                # 转换为北京时间
+                reset_time_beijing = "N/A"
+                if reset_time_raw:
+                    try:
+                        from datetime import datetime as dt
+                        if reset_time_raw.endswith("Z"):
+                            utc_date = dt.fromisoformat(reset_time_raw.replace("Z", "+00:00"))
+                        else:
+                            utc_date = dt.fromisoformat(reset_time_raw)
+                        # 转换为北京时间 (UTC+8)
+                        beijing_date = utc_date + timedelta(hours=8)
+                        reset_time_beijing = beijing_date.strftime("%m-%d %H:%M")
+                    except Exception as e:
+                        print(f"[Quota] 解析重置时间失败: {e}", flush=True)
+                
+                api_quota_models[model_id] = {
+                    "remaining": round(remaining * 100, 1),  # 转换为百分比
+                    "resetTime": reset_time_beijing,
+                    "resetTimeRaw": reset_time_raw
+                }
         else:
-            api_error_message = "无法获取 access_token 或缺少 project_id"
+            # API 返回错误（如 403）
+            api_error_message = quota_result.get("error", "未知错误")
+            print(f"[Quota] API 配额查询失败: {api_error_message}", flush=True)
     except Exception as e:
         api_error_message = str(e)
         print(f"[Quota] 从 Google API 获取配额异常: {e}", flush=True)
@@ -699,6 +693,8 @@ async def get_credential_quota(
             "email": cred.email,
             "account_type": "pro" if is_pro else "free",
             "source": "google_api",  # 标记数据来源
+            "cached": quota_result.get("cached", False),  # 是否来自后台轮询快照
+            "fetched_at": quota_result.get("fetched_at"),
             "reset_time": reset_time,
             "flash": {
                 "percentage": round(flash_remaining, 1),
@@ -820,83 +816,22 @@ async def get_stats_overview(
     user: User = Depends(get_current_admin),
     db: AsyncSession = Depends(get_db)
 ):
-    """获取统计概览"""
-    now = datetime.utcnow()
-    week_ago = now - timedelta(days=7)
-    month_ago = now - timedelta(days=30)
-    
-    # 根据 stats_timezone 配置计算今日开始时间
-    start_of_day = settings.get_start_of_day()
-    
-    # 今日请求数（基于 UTC 07:00 重置）
-    today_result = await db.execute(
-        select(func.count(UsageLog.id)).where(UsageLog.created_at >= start_of_day)
-    )
-    today_requests = today_result.scalar() or 0
-    
-    # 本周请求数
-    week_result = await db.execute(
-        select(func.count(UsageLog.id)).where(UsageLog.created_at >= week_ago)
-    )
-    week_requests = week_result.scalar() or 0
-    
-    # 本月请求数
-    month_result = await db.execute(
-        select(func.count(UsageLog.id)).where(UsageLog.created_at >= month_ago)
-    )
-    month_requests = month_result.scalar() or 0
-    
-    # 总请求数
-    total_result = await db.execute(select(func.count(UsageLog.id)))
-    total_requests = total_result.scalar() or 0
-    
-    # 活跃用户数
-    active_users_result = await db.execute(
-        select(func.count(func.distinct(UsageLog.user_id))).where(UsageLog.created_at >= week_ago)
-    )
-    active_users = active_users_result.scalar() or 0
-    
-    # 凭证统计
-    cred_result = await db.execute(select(func.count(Credential.id)))
-    total_credentials = cred_result.scalar() or 0
-    
-    active_cred_result = await db.execute(
-        select(func.count(Credential.id)).where(Credential.is_active == True)
-    )
-    active_credentials = active_cred_result.scalar() or 0
-    
-    # CLI 凭证（api_type 为空、None 或 'geminicli'）
-    cli_cred_result = await db.execute(
-        select(func.count(Credential.id))
-        .where(Credential.is_active == True)
-        .where((Credential.api_type == None) | (Credential.api_type == "") | (Credential.api_type == "geminicli"))
-    )
-    cli_credentials = cli_cred_result.scalar() or 0
-    
-    # AGY 凭证（api_type = "antigravity"）
-    agy_cred_result = await db.execute(
-        select(func.count(Credential.id))
-        .where(Credential.is_active == True)
-        .where(Credential.api_type == "antigravity")
-    )
-    agy_credentials = agy_cred_result.scalar() or 0
+    """获取统计概览（读取统计快照，见 stats_snapshot）"""
+    from app.services.stats_snapshot import stats_snapshot
+    snapshot = await stats_snapshot.get()
+    requests = snapshot["requests"]
     
     return {
         "requests": {
-            "today": today_requests,
-            "week": week_requests,
-            "month": month_requests,
-            "total": total_requests,
+            "today": requests["today"],
+            "week": requests["week"],
+            "month": requests["month"],
+            "total": requests["total"],
         },
         "users": {
-            "active_this_week": active_users,
+            "active_this_week": snapshot["users"]["active_this_week"],
         },
-        "credentials": {
-            "total": total_credentials,
-            "active": active_credentials,
-            "cli": cli_credentials,
-            "agy": agy_credentials,
-        }
+        "credentials": snapshot["credentials"],
     }
 
 
@@ -906,6 +841,7 @@ async def get_stats_by_model(
     page: int = 1,
     page_size: int = 10,
     api_type: str = "all",  # all, cli, antigravity
+    include_archive: bool = False,  # 合并已清理日志的归档数据
     user: User = Depends(get_current_admin),
     db: AsyncSession = Depends(get_db)
 ):
@@ -915,9 +851,9 @@ async def get_stats_by_model(
     # 构建 API 类型过滤条件
     def build_api_type_filter():
         if api_type == "cli":
-            return UsageLog.model.notlike('antigravity/%')
+            return UsageLog.api_type == "geminicli"
         elif api_type == "antigravity":
-            return UsageLog.model.like('antigravity/%')
+            return UsageLog.api_type == "antigravity"
         else:
             return True
     
@@ -942,11 +878,24 @@ async def get_stats_by_model(
     
     # 分页查询
     offset = (page - 1) * page_size
-    result = await db.execute(base_query.offset(offset).limit(page_size))
+    if include_archive:
+        # 合并归档后在内存中排序分页（模型种类很少）
+        from app.services.log_archive import merge_archived_counts
+        counts = {row[0]: row[1] for row in (await db.execute(base_query)).all()}
+        where = {"api_type": "geminicli" if api_type == "cli" else "antigravity"} if api_type != "all" else None
+        for (model,), count in (await merge_archived_counts(db, since, ["model"], where)).items():
+            counts[model] = counts.get(model, 0) + count
+        rows = sorted(counts.items(), key=lambda x: -x[1])
+        total = len(rows)
+        total_pages = (total + page_size - 1) // page_size if page_size > 0 else 1
+        rows = rows[offset:offset + page_size]
+    else:
+        result = await db.execute(base_query.offset(offset).limit(page_size))
+        rows = result.all()
     
     return {
         "period_days": days,
-        "models": [{"model": row[0] or "unknown", "count": row[1]} for row in result.all()],
+        "models": [{"model": row[0] or "unknown", "count": row[1]} for row in rows],
         "total": total,
         "page": page,
         "page_size": page_size,
@@ -957,12 +906,31 @@ async def get_stats_by_model(
 @router.get("/stats/by-user")
 async def get_stats_by_user(
     days: int = 7,
+    include_archive: bool = False,  # 合并已清理日志的归档数据
     user: User = Depends(get_current_admin),
     db: AsyncSession = Depends(get_db)
 ):
     """按用户统计使用量"""
     since = datetime.utcnow() - timedelta(days=days)
     
+    if include_archive:
+        from app.services.log_archive import merge_archived_counts
+        result = await db.execute(
+            select(UsageLog.user_id, func.count(UsageLog.id))
+            .where(UsageLog.created_at >= since)
+            .group_by(UsageLog.user_id)
+        )
+        counts = {row[0]: row[1] for row in result.all()}
+        for (user_id,), count in (await merge_archived_counts(db, since, ["user_id"])).items():
+            counts[user_id] = counts.get(user_id, 0) + count
+        top = sorted(counts.items(), key=lambda x: -x[1])[:20]
+        names_result = await db.execute(
+            select(User.id, User.username).where(User.id.in_([uid for uid, _ in top]))
+        )
+        names = {row[0]: row[1] for row in names_result.all()}
+        users = [{"username": names.get(uid, f"#{uid}"), "count": count} for uid, count in top]
+        return {"period_days": days, "users": users}
+    
     result = await db.execute(
         select(User.username, func.count(UsageLog.id).label("count"))
         .join(User, UsageLog.user_id == User.id)
@@ -981,6 +949,7 @@ async def get_stats_by_user(
 @router.get("/stats/daily")
 async def get_daily_stats(
     days: int = 30,
+    include_archive: bool = False,  # 合并已清理日志的归档数据
     user: User = Depends(get_current_admin),
     db: AsyncSession = Depends(get_db)
 ):
@@ -997,9 +966,16 @@ async def get_daily_stats(
         .order_by(func.date(UsageLog.created_at))
     )
     
+    daily = {str(row[0]): row[1] for row in result.all()}
+    
+    if include_archive:
+        from app.services.log_archive import merge_archived_counts
+        for (day,), count in (await merge_archived_counts(db, since, ["date"])).items():
+            daily[day] = daily.get(day, 0) + count
+    
     return {
         "period_days": days,
-        "daily": [{"date": str(row[0]), "count": row[1]} for row in result.all()]
+        "daily": [{"date": day, "count": count} for day, count in sorted(daily.items())]
     }
 
 
@@ -1509,9 +1485,9 @@ async def get_global_stats(
     # 构建 API 类型过滤条件
     def build_api_type_filter():
         if api_type == "cli":
-            return UsageLog.model.notlike('antigravity/%')
+            return UsageLog.api_type == "geminicli"
         elif api_type == "antigravity":
-            return UsageLog.model.like('antigravity/%')
+            return UsageLog.api_type == "antigravity"
         else:
             return True  # 不过滤
     
@@ -1526,59 +1502,29 @@ async def get_global_stats(
     )
     model_stats = [{"model": row[0] or "unknown", "count": row[1]} for row in model_stats_result.all()]
     
-    # 分类汇总 - 根据 API 类型使用不同分类方式
+    # 分类汇总 - 根据 API 类型使用不同分类方式（分类列在写日志时已计算）
     if api_type == "antigravity":
         # Antigravity 分类：按模型品牌 (Claude/Gemini/其他/Banana)
-        def is_banana(model: str) -> bool:
-            """检测是否为 Banana 模型（图片生成模型）
-            
-            匹配格式：
-            - antigravity/agy-gemini-3-pro-image*（OpenAI 格式代理）
-            - antigravity-gemini/*image*（Gemini 原生格式代理）
-            """
-            m = model.lower()
-            return "agy-gemini-3-pro-image" in m or "gemini-3-pro-image" in m or ("antigravity-gemini/" in m and "image" in m)
-        
-        def is_claude(model: str) -> bool:
-            m = model.lower()
-            return "claude" in m
-        
-        def is_gemini(model: str) -> bool:
-            m = model.lower()
-            # Gemini 但不包括 Banana 模型
-            return "gemini" in m and not is_banana(model)
-        
-        def is_other(model: str) -> bool:
-            return not is_claude(model) and not is_gemini(model) and not is_banana(model)
-        
-        claude_count = sum(s["count"] for s in model_stats if is_claude(s["model"]))
-        gemini_count = sum(s["count"] for s in model_stats if is_gemini(s["model"]))
-        other_count = sum(s["count"] for s in model_stats if is_other(s["model"]))
-        banana_count = sum(s["count"] for s in model_stats if is_banana(s["model"]))
-        # 使用相同的字段名以兼容前端
-        flash_count = claude_count  # 对应前端 flash -> Claude
-        pro_count = gemini_count    # 对应前端 pro -> Gemini
-        tier3_count = other_count   # 对应前端 tier3 -> 其他
+        class_column = UsageLog.model_family
     else:
         # CLI/全部 分类：按 Gemini 模型等级（互斥分类：3.0 > Pro > Flash）
-        def is_tier3(model: str) -> bool:
-            m = model.lower()
-            # gemini-3-flash 应该算 flash 额度，不算 tier3
-            if "3-flash" in m or "3flash" in m:
-                return False
-            return "gemini-3" in m or "3.0" in m or "tier3" in m or m.startswith("3-") or "/gemini-3" in m
-        
-        def is_pro(model: str) -> bool:
-            m = model.lower()
-            return "pro" in m and not is_tier3(model)
-        
-        def is_flash(model: str) -> bool:
-            m = model.lower()
-            return "flash" in m and not is_tier3(model)
-        
-        tier3_count = sum(s["count"] for s in model_stats if is_tier3(s["model"]))
-        pro_count = sum(s["count"] for s in model_stats if is_pro(s["model"]))
-        flash_count = sum(s["count"] for s in model_stats if is_flash(s["model"]))
+        class_column = UsageLog.quota_class
+    class_query = select(class_column, func.count(UsageLog.id)).where(UsageLog.created_at >= start_of_day)
+    if api_type != "all":
+        class_query = class_query.where(api_filter)
+    class_result = await db.execute(class_query.group_by(class_column))
+    class_counts = {row[0]: row[1] for row in class_result.all()}
+    
+    if api_type == "antigravity":
+        # 使用相同的字段名以兼容前端
+        flash_count = class_counts.get("claude", 0)  # 对应前端 flash -> Claude
+        pro_count = class_counts.get("gemini", 0)    # 对应前端 pro -> Gemini
+        tier3_count = class_counts.get("other", 0)   # 对应前端 tier3 -> 其他
+        banana_count = class_counts.get("banana", 0)
+    else:
+        tier3_count = class_counts.get("tier3", 0)
+        pro_count = class_counts.get("pro", 0)
+        flash_count = class_counts.get("flash", 0)
         banana_count = 0  # CLI 模式下没有 banana
     
     # 最近1小时请求数
@@ -1913,6 +1859,8 @@ async def get_log_detail(
         raise HTTPException(status_code=404, detail="日志不存在")
     
     log = row.UsageLog
+    from app.services.log_payloads import load_payload
+    payload = await load_payload(db, log.id)
     return {
         "id": log.id,
         "username": row.username,
@@ -1922,11 +1870,12 @@ async def get_log_detail(
         "status_code": log.status_code,
         "latency_ms": log.latency_ms,
         "cd_seconds": log.cd_seconds,
-        "error_message": log.error_message,
-        "request_body": log.request_body,
-        "client_ip": log.client_ip,
-        "user_agent": log.user_agent,
+        "error_message": payload["error_message"],
+        "request_body": payload["request_body"],
+        "client_ip": payload["client_ip"],
+        "user_agent": payload["user_agent"],
         "retry_count": getattr(log, 'retry_count', 0) or 0,  # 重试次数
+        "cache_hit": bool(getattr(log, 'cache_hit', False)),  # 是否命中响应缓存
         "created_at": log.created_at.isoformat() + "Z" if log.created_at else None
     }
 
@@ -2001,6 +1950,11 @@ async def get_error_stats(
     # 分页
     query = query.order_by(UsageLog.created_at.desc()).offset((page - 1) * page_size).limit(page_size)
     result = await db.execute(query)
+    rows = result.all()
+    
+    # 错误信息在侧表中，按本页日志 id 批量读取
+    from app.services.log_payloads import load_payloads
+    payloads = await load_payloads(db, [row.UsageLog.id for row in rows])
     
     errors = [
         {
@@ -2012,10 +1966,10 @@ async def get_error_stats(
             "status_code": row.UsageLog.status_code,
             "latency_ms": row.UsageLog.latency_ms,
             "cd_seconds": row.UsageLog.cd_seconds,
-            "error_message": row.UsageLog.error_message,
+            "error_message": payloads.get(row.UsageLog.id, {}).get("error_message"),
             "created_at": row.UsageLog.created_at.isoformat() + "Z" if row.UsageLog.created_at else None
         }
-        for row in result.all()
+        for row in rows
     ]
     
     return {
@@ -244,7 +244,7 @@ async def credential_from_callback_url(
             project_id = await fetch_project_id(
                 access_token=access_token,
                 user_agent="CatieCli/1.0",
-                api_base_url="https://cloudcode-pa.googleapis.com"
+                api_base_url=settings.code_assist_endpoint
             )
             if project_id:
                 print(f"[fetch_project_id] ✅ 获取到 project_id: {project_id}", flush=True)
@@ -360,7 +360,7 @@ async def credential_from_callback_url(
         try:
             async with httpx.AsyncClient(timeout=30.0) as test_client:
                 # 用简单请求测试凭证有效性
-                test_url = "https://cloudcode-pa.googleapis.com/v1internal:generateContent"
+                test_url = f"{settings.code_assist_endpoint}/v1internal:generateContent"
                 test_payload = {
                     "model": "gemini-2.5-flash",
                     "project": project_id,
@@ -520,7 +520,7 @@ async def credential_from_callback_url_discord(
             project_id = await fetch_project_id(
                 access_token=access_token,
                 user_agent="CatieCli-Discord/1.0",
-                api_base_url="https://cloudcode-pa.googleapis.com"
+                api_base_url=settings.code_assist_endpoint
             )
             if project_id:
                 print(f"[Discord OAuth] [fetch_project_id] ✅ 获取到 project_id: {project_id}", flush=True)
@@ -614,7 +614,7 @@ async def credential_from_callback_url_discord(
         detected_tier = "2.5"
         try:
             async with httpx.AsyncClient(timeout=30.0) as test_client:
-                test_url = "https://cloudcode-pa.googleapis.com/v1internal:generateContent"
+                test_url = f"{settings.code_assist_endpoint}/v1internal:generateContent"
                 test_response = await test_client.post(
                     test_url,
                     headers={"Authorization": f"Bearer {access_token}", "Content-Type": "application/json"},
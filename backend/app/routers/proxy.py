@@ -1,19 +1,26 @@
 from fastapi import APIRouter, Depends, HTTPException, Request, BackgroundTasks
 from fastapi.responses import StreamingResponse, JSONResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, func, or_, and_
+from sqlalchemy import select, func, and_
 from datetime import datetime, timedelta
 import json
 import time
+import asyncio
 
 from app.database import get_db, async_session
 from app.models.user import User, UsageLog
 from app.services.auth import get_user_by_api_key
 from app.services.credential_pool import CredentialPool
 from app.services.gemini_client import GeminiClient
+from app.services.inline_media import InlineImageError, check_message_images, json_request, preview_json
 from app.services.websocket import notify_log_update, notify_stats_update
 from app.services.error_classifier import classify_error_simple
 from app.services.error_message_service import get_custom_error_message
+from app.services.fair_scheduler import acquire_pool_slot, release_when_done
+from app.services.hedging import run_hedged
+from app.services.response_cache import response_cache, cache_key_for, record_cache_hit
+from app.services.model_catalog import model_catalog
+from app.services.model_classifier import classify_quota_class
 from app.config import settings
 import re
 
@@ -145,27 +152,30 @@ async def get_user_from_api_key(request: Request, db: AsyncSession = Depends(get
     # 判断用户是否有3.0资格（用于决定是否允许使用3.0模型）
     has_30_access = cred_30_count > 0 or (user.quota_30pro and user.quota_30pro > 0)
 
+    if required_tier == "3" and not has_30_access:
+        raise HTTPException(status_code=403, detail="无 3.0 模型使用配额")
+
     # 确定当前请求的模型类别和对应配额
-    if required_tier == "3":
-        if not has_30_access:
-            raise HTTPException(status_code=403, detail="无 3.0 模型使用配额")
+    # 按写日志时的同一分类选额度，保证检查的类别就是这次请求计入的类别
+    quota_class = classify_quota_class(model)
+    if quota_class == "tier3":
         quota_limit = user_quota_pro
         # 2.5pro和3.0共享配额，统计所有pro模型（含2.5pro和3.0）
-        model_filter = or_(UsageLog.model.like('%pro%'), UsageLog.model.like('%3%'))
+        model_filter = and_(UsageLog.api_type == "geminicli", UsageLog.quota_class.in_(["pro", "tier3"]))
         quota_name = "Pro模型(2.5pro+3.0共享)"
-    elif "pro" in model.lower():
+    elif quota_class == "pro":
         quota_limit = user_quota_pro
         # 2.5pro和3.0共享配额
         if has_30_access:
-            model_filter = or_(UsageLog.model.like('%pro%'), UsageLog.model.like('%3%'))
+            model_filter = and_(UsageLog.api_type == "geminicli", UsageLog.quota_class.in_(["pro", "tier3"]))
             quota_name = "Pro模型(2.5pro+3.0共享)"
         else:
-            model_filter = UsageLog.model.like('%pro%')
+            model_filter = and_(UsageLog.api_type == "geminicli", UsageLog.quota_class == "pro")
             quota_name = "2.5 Pro模型"
     else:
         quota_limit = user_quota_flash
         # Flash配额：排除pro和3.0模型
-        model_filter = and_(UsageLog.model.notlike('%pro%'), UsageLog.model.notlike('%3%'))
+        model_filter = and_(UsageLog.api_type == "geminicli", UsageLog.quota_class == "flash")
         quota_name = "Flash模型"
 
     # 合并使用量查询（模型类别和总量一次性查询）
@@ -337,10 +347,11 @@ async def anthropic_count_tokens_proxy(
     model = body.get("model", "claude-sonnet-4-5")
     use_antigravity = model.startswith("agy-")
     
-    if use_antigravity:
-        if not settings.antigravity_enabled:
-            raise HTTPException(status_code=503, detail="Antigravity API 功能已禁用")
-        
+    if use_antigravity and not settings.antigravity_enabled:
+        raise HTTPException(status_code=503, detail="Antigravity API 功能已禁用")
+    
+    # agy- 前缀或配置了本地计数 → 本地估算
+    if use_antigravity or settings.count_tokens_local:
         from app.routers.antigravity_anthropic import anthropic_count_tokens
         return await anthropic_count_tokens(request, user, db)
     
@@ -484,142 +495,14 @@ async def list_models(request: Request, user: User = Depends(get_user_from_api_k
     # ===== GeminiCLI 模型（仅当有 CLI 凭证时显示）=====
     if has_cli_creds:
         has_cli_tier3 = await CredentialPool.has_tier3_credentials(user, db, mode="geminicli")
-        
-        base_models = ["gemini-2.5-pro", "gemini-2.5-flash"]
-        tier3_models = ["gemini-3-pro-preview", "gemini-3-flash-preview"]
-        thinking_suffixes = ["-maxthinking", "-nothinking"]
-        search_suffix = "-search"
-        
-        cli_base_models = base_models.copy()
-        if has_cli_tier3:
-            cli_base_models.extend(tier3_models)
-        
-        for base in cli_base_models:
-            # 基础模型
-            models.append({"id": f"gcli-{base}", "object": "model", "owned_by": "google"})
-            
-            # 假流式变体（使用 假流/ 前缀）
-            models.append({"id": f"gcli-假流/{base}", "object": "model", "owned_by": "google"})
-            
-            # thinking 变体
-            for suffix in thinking_suffixes:
-                models.append({"id": f"gcli-{base}{suffix}", "object": "model", "owned_by": "google"})
-                # thinking + 假流式
-                models.append({"id": f"gcli-假流/{base}{suffix}", "object": "model", "owned_by": "google"})
-            
-            # search 变体
-            models.append({"id": f"gcli-{base}{search_suffix}", "object": "model", "owned_by": "google"})
-            
-            # thinking + search 组合
-            for suffix in thinking_suffixes:
-                combined = f"{suffix}{search_suffix}"
-                models.append({"id": f"gcli-{base}{combined}", "object": "model", "owned_by": "google"})
+        for model_id in model_catalog.get_gcli_ids(has_cli_tier3):
+            models.append({"id": model_id, "object": "model", "owned_by": "google"})
     
     # ===== Antigravity 模型（仅当有 Antigravity 凭证时显示）=====
+    # 模型目录由后台任务刷新，这里只读内存，不占用凭证
     if has_agy_creds and settings.antigravity_enabled:
-        # 定义有效模型的过滤函数
-        def is_valid_agy_model(model_id: str) -> bool:
-            model_lower = model_id.lower()
-            # 排除条件：包含这些关键字的跳过（内部测试模型）
-            invalid_patterns = [
-                "chat_", "rev", "tab_", "uic", "test", "exp", "lite_preview",
-                "gcli-"  # gcli- 前缀是 GeminiCLI 模型，不是 Antigravity
-            ]
-            for pattern in invalid_patterns:
-                if pattern in model_lower:
-                    return False
-            # 排除 gemini-2.5-pro（Antigravity 有问题）
-            if "gemini-2.5-pro" in model_lower or "gemini-2.5pro" in model_lower:
-                return False
-            # 允许条件：gemini, claude, gpt 开头的模型
-            valid_prefixes = ["gemini", "claude", "gpt-oss"]
-            for prefix in valid_prefixes:
-                if model_lower.startswith(prefix):
-                    return True
-            return False
-        
-        try:
-            from app.services.antigravity_client import AntigravityClient
-            
-            # 获取一个有效的 Antigravity 凭证
-            agy_cred_result = await db.execute(
-                select(Credential)
-                .where(Credential.api_type == "antigravity")
-                .where(Credential.is_active == True)
-                .where(or_(
-                    Credential.user_id == user.id,
-                    Credential.is_public == True
-                ))
-                .limit(1)
-            )
-            agy_cred = agy_cred_result.scalar_one_or_none()
-            
-            if agy_cred:
-                access_token = await CredentialPool.get_access_token(agy_cred, db)
-                if access_token:
-                    client = AntigravityClient(access_token, agy_cred.project_id)
-                    api_models = await client.fetch_available_models()
-                    
-                    # 添加过滤后的模型
-                    for model_info in api_models:
-                        model_id = model_info.get("id", "")
-                        if model_id and is_valid_agy_model(model_id):
-                            models.append({"id": f"agy-{model_id}", "object": "model", "owned_by": "google"})
-                            # 为图片模型添加 2k/4k 变体
-                            if "image" in model_id.lower() and "2k" not in model_id.lower() and "4k" not in model_id.lower():
-                                models.append({"id": f"agy-{model_id}-2k", "object": "model", "owned_by": "google"})
-                                models.append({"id": f"agy-{model_id}-4k", "object": "model", "owned_by": "google"})
-                    
-                    existing_ids = {m["id"] for m in models}
-                    
-                    # 强制添加图片模型变体
-                    image_variants = [
-                        "agy-gemini-3-pro-image", "agy-gemini-3-pro-image-2k", "agy-gemini-3-pro-image-4k"
-                    ]
-                    for variant in image_variants:
-                        if variant not in existing_ids:
-                            models.append({"id": variant, "object": "model", "owned_by": "google"})
-                    
-                    # 强制添加 Claude 模型（基础 + thinking 变体）
-                    claude_model_variants = [
-                        "agy-claude-opus-4-5", "agy-claude-opus-4-5-thinking",
-                        "agy-claude-sonnet-4-5", "agy-claude-sonnet-4-5-thinking",
-                    ]
-                    existing_ids = {m["id"] for m in models}
-                    for variant in claude_model_variants:
-                        if variant not in existing_ids:
-                            models.append({"id": variant, "object": "model", "owned_by": "google"})
-                            print(f"[Models] ✅ 强制添加 Claude 模型变体: {variant}", flush=True)
-                    
-                    # 强制添加 Gemini 2.5 系列模型（API 动态列表可能不包含）
-                    # 注意：不添加 gemini-2.5-pro，因为 Antigravity 有问题
-                    gemini_25_variants = [
-                        "agy-gemini-2.5-flash", "agy-gemini-2.5-flash-lite",
-                        "agy-gemini-2.5-flash-thinking",
-                    ]
-                    existing_ids = {m["id"] for m in models}
-                    for variant in gemini_25_variants:
-                        if variant not in existing_ids:
-                            models.append({"id": variant, "object": "model", "owned_by": "google"})
-                            print(f"[Models] ✅ 强制添加 Gemini 2.5 模型: {variant}", flush=True)
-        except Exception as e:
-            print(f"[Models] 获取 Antigravity 模型列表失败: {e}", flush=True)
-            # 降级：使用静态模型列表
-            # 注意：不添加 gemini-2.5-pro，因为 Antigravity 有问题
-            fallback_agy_models = [
-                # Gemini 2.5 系列（不含 gemini-2.5-pro）
-                "gemini-2.5-flash", "gemini-2.5-flash-lite", "gemini-2.5-flash-thinking",
-                # Gemini 3 系列
-                "gemini-3-flash", "gemini-3-pro-low", "gemini-3-pro-high",
-                "gemini-3-pro-image", "gemini-3-pro-image-2k", "gemini-3-pro-image-4k",
-                # Claude 系列
-                "claude-opus-4-5", "claude-opus-4-5-thinking",
-                "claude-sonnet-4-5", "claude-sonnet-4-5-thinking",
-                # GPT-OSS
-                "gpt-oss-120b-medium"
-            ]
-            for base in fallback_agy_models:
-                models.append({"id": f"agy-{base}", "object": "model", "owned_by": "google"})
+        for model_id in model_catalog.get_ids("mixed"):
+            models.append({"id": model_id, "object": "model", "owned_by": "google"})
     
     return {"object": "list", "data": models}
 
@@ -643,6 +526,12 @@ async def chat_completions(
     except:
         raise HTTPException(status_code=400, detail="无效的JSON请求体")
     
+    # 内联图片过大或 mime 无效时直接返回 400，不转发
+    try:
+        check_message_images(body.get("messages"))
+    except InlineImageError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
     model = body.get("model", "gemini-2.5-flash")
     
     # 1. 提取渠道前缀（gcli- 或 agy-）
@@ -709,7 +598,7 @@ async def chat_completions(
     user_agent = request.headers.get("User-Agent", "")[:500]
     
     # 保存请求内容摘要（截断到2000字符）
-    request_body_str = json.dumps(body, ensure_ascii=False)[:2000] if body else None
+    request_body_str = preview_json(body, 2000) if body else None
     messages = body.get("messages", [])
     stream = body.get("stream", False)
     
@@ -755,73 +644,103 @@ async def chat_completions(
     await db.refresh(placeholder_log)  # 获取插入后的 ID
     placeholder_log_id = placeholder_log.id  # 保存ID，后续通过独立会话访问
     
-    # 获取首个凭证后立即释放主连接（流式响应将使用独立会话）
-    # 重试逻辑：报错时切换凭证重试
-    max_retries = settings.error_retry_count
-    last_error = None
-    tried_credential_ids = set()
-    
-    # 预先获取第一个凭证和token（使用主db）
-    credential = await CredentialPool.get_available_credential(
-        db, 
-        user_id=user.id,
-        user_has_public_creds=user_has_public,
-        model=model,
-        exclude_ids=tried_credential_ids
-    )
-    if not credential:
-        required_tier = CredentialPool.get_required_tier(model)
-        # 更新占位日志为错误状态
-        placeholder_log.status_code = 503
-        placeholder_log.latency_ms = (time.time() - start_time) * 1000
-        placeholder_log.error_type = "NO_CREDENTIAL"
-        placeholder_log.error_code = "NO_CREDENTIAL"
-        if required_tier == "3":
-            placeholder_log.error_message = "没有可用的 Gemini 3 等级凭证"
-            await db.commit()
-            raise HTTPException(
-                status_code=503, 
-                detail="没有可用的 Gemini 3 等级凭证。该模型需要有 Gemini 3 资格的凭证。"
-            )
-        if not user_has_public:
-            placeholder_log.error_message = "用户没有可用凭证"
-            await db.commit()
-            raise HTTPException(
-                status_code=503, 
-                detail="您没有可用凭证。请在凭证管理页面上传凭证，或捐赠凭证以使用公共池。"
-            )
-        placeholder_log.error_message = "暂无可用凭证"
-        await db.commit()
-        raise HTTPException(status_code=503, detail="暂无可用凭证，请稍后重试")
-    
-    tried_credential_ids.add(credential.id)
-    
-    # 获取 access_token（自动刷新）
-    access_token = await CredentialPool.get_access_token(credential, db)
-    if not access_token:
-        await CredentialPool.mark_credential_error(db, credential.id, "Token 刷新失败")
-        # 更新占位日志为错误状态
+    # 确定性非流式请求先查响应缓存，命中时不占用凭证
+    # 转换结果同时用于缓存键和实际请求，保证键与发出的内容一致
+    cache_key = None
+    prepared = None
+    if not stream and settings.response_cache_enabled:
+        request_kwargs = {k: v for k, v in body.items() if k not in ["model", "messages", "stream"]}
+        prepared = GeminiClient("", user_id=user.id).build_request_payload(model, messages, **request_kwargs)
+        cache_key = cache_key_for(user.id, "/v1/chat/completions", model, prepared)
+        cached = await response_cache.get(cache_key) if cache_key else None
+        if cached is not None:
+            await record_cache_hit(db, placeholder_log, user.username, start_time)
+            return JSONResponse(content=cached)
+    
+    # 公平调度：凭证池并发占满时按用户通道排队
+    try:
+        ticket = await acquire_pool_slot(db, user, "geminicli")
+    except asyncio.TimeoutError:
         placeholder_log.status_code = 503
         placeholder_log.latency_ms = (time.time() - start_time) * 1000
-        placeholder_log.error_type = "TOKEN_ERROR"
-        placeholder_log.error_code = "TOKEN_REFRESH_FAILED"
-        placeholder_log.error_message = "Token 刷新失败"
-        placeholder_log.credential_id = credential.id
-        placeholder_log.credential_email = credential.email
+        placeholder_log.error_type = "QUEUE_TIMEOUT"
+        placeholder_log.error_code = "QUEUE_TIMEOUT"
+        placeholder_log.error_message = "凭证池排队超时"
         await db.commit()
-        raise HTTPException(status_code=503, detail="Token 刷新失败")
+        raise HTTPException(status_code=503, detail="当前请求过多，排队超时，请稍后重试")
     
-    # 获取 project_id
-    project_id = credential.project_id or ""
-    first_credential_id = credential.id
-    first_credential_email = credential.email
-    print(f"[Proxy] 使用凭证: {credential.email}, project_id: {project_id}, model: {model}", flush=True)
-    
-    if not project_id:
-        print(f"[Proxy] ⚠️ 凭证 {credential.email} 没有 project_id!", flush=True)
-    
-    client = GeminiClient(access_token, project_id)
-    use_fake_streaming = client.is_fake_streaming(model)
+    try:
+        # 获取首个凭证后立即释放主连接（流式响应将使用独立会话）
+        # 重试逻辑：报错时切换凭证重试
+        max_retries = settings.error_retry_count
+        last_error = None
+        tried_credential_ids = set()
+        
+        # 预先获取第一个凭证和token（使用主db）
+        credential = await CredentialPool.get_available_credential(
+            db, 
+            user_id=user.id,
+            user_has_public_creds=user_has_public,
+            model=model,
+            exclude_ids=tried_credential_ids
+        )
+        if not credential:
+            required_tier = CredentialPool.get_required_tier(model)
+            # 更新占位日志为错误状态
+            placeholder_log.status_code = 503
+            placeholder_log.latency_ms = (time.time() - start_time) * 1000
+            placeholder_log.error_type = "NO_CREDENTIAL"
+            placeholder_log.error_code = "NO_CREDENTIAL"
+            if required_tier == "3":
+                placeholder_log.error_message = "没有可用的 Gemini 3 等级凭证"
+                await db.commit()
+                raise HTTPException(
+                    status_code=503, 
+                    detail="没有可用的 Gemini 3 等级凭证。该模型需要有 Gemini 3 资格的凭证。"
+                )
+            if not user_has_public:
+                placeholder_log.error_message = "用户没有可用凭证"
+                await db.commit()
+                raise HTTPException(
+                    status_code=503, 
+                    detail="您没有可用凭证。请在凭证管理页面上传凭证，或捐赠凭证以使用公共池。"
+                )
+            placeholder_log.error_message = "暂无可用凭证"
+            await db.commit()
+            raise HTTPException(status_code=503, detail="暂无可用凭证，请稍后重试")
+        
+        tried_credential_ids.add(credential.id)
+        
+        # 获取 access_token（自动刷新）
+        access_token = await CredentialPool.get_access_token(credential, db)
+        if not access_token:
+            await CredentialPool.mark_credential_error(db, credential.id, "Token 刷新失败")
+            # 更新占位日志为错误状态
+            placeholder_log.status_code = 503
+            placeholder_log.latency_ms = (time.time() - start_time) * 1000
+            placeholder_log.error_type = "TOKEN_ERROR"
+            placeholder_log.error_code = "TOKEN_REFRESH_FAILED"
+            placeholder_log.error_message = "Token 刷新失败"
+            placeholder_log.credential_id = credential.id
+            placeholder_log.credential_email = credential.email
+            await db.commit()
+            raise HTTPException(status_code=503, detail="Token 刷新失败")
+        
+        # 获取 project_id
+        project_id = credential.project_id or ""
+        first_credential_id = credential.id
+        first_credential_email = credential.email
+        print(f"[Proxy] 使用凭证: {credential.email}, project_id: {project_id}, model: {model}", flush=True)
+        
+        if not project_id:
+            print(f"[Proxy] ⚠️ 凭证 {credential.email} 没有 project_id!", flush=True)
+        
+        client = GeminiClient(access_token, project_id, user_id=user.id)
+        use_fake_streaming = client.is_fake_streaming(model)
+    except BaseException:
+        # 选凭证、刷新 token 时出错（含取消）也要归还名额，release() 可重复调用
+        ticket.release()
+        raise
     
     # 主db连接到此处结束使用，流式生成器将使用独立会话
     
@@ -830,14 +749,68 @@ async def chat_completions(
         """处理非流式请求（使用主db）"""
         nonlocal credential, access_token, project_id, client, tried_credential_ids, last_error
         
+        hedge_fired = []  # 本次尝试发出的对冲请求 [(凭证, 客户端)]
+        
+        async def start_hedge():
+            """为对冲请求准备另一个凭证"""
+            hedge_credential = await CredentialPool.get_available_credential(
+                db, user_id=user.id, user_has_public_creds=user_has_public,
+                model=model, exclude_ids=tried_credential_ids
+            )
+            if not hedge_credential:
+                return None
+            tried_credential_ids.add(hedge_credential.id)
+            hedge_token = await CredentialPool.get_access_token(hedge_credential, db)
+            if not hedge_token:
+                return None
+            hedge_client = GeminiClient(hedge_token, hedge_credential.project_id or "", user_id=user.id)
+            hedge_fired.append((hedge_credential, hedge_client))
+            return (hedge_credential, hedge_client), hedge_client.chat_completions(
+                model=model,
+                messages=messages,
+                prepared=prepared,
+                **{k: v for k, v in body.items() if k not in ["model", "messages", "stream"]}
+            )
+        
+        async def hedge_failed(tag, error: BaseException):
+            """对冲请求失败：和首个调用一样处理对冲凭证的失败"""
+            hedge_credential, _ = tag
+            hedge_fired.clear()  # 失败的请求按失败处理，不再计入使用次数
+            await CredentialPool.handle_credential_failure(db, hedge_credential.id, str(error))
+        
+        async def record_hedge_loser(loser_credential, loser_client):
+            """输掉的那一路已经向上游发出了请求，同样计入凭证使用次数和配额预测"""
+            if loser_client.last_call_shared:
+                return
+            from app.services.quota_forecast import quota_forecaster
+            loser_credential.total_requests = (loser_credential.total_requests or 0) + 1
+            loser_credential.last_used_at = datetime.utcnow()
+            quota_forecaster.record_use(loser_credential.id, "geminicli", model)
+            await db.commit()
+
         for retry_attempt in range(max_retries + 1):
             try:
-                result = await client.chat_completions(
+                call = client.chat_completions(
                     model=model,
                     messages=messages,
+                    prepared=prepared,
                     **{k: v for k, v in body.items() if k not in ["model", "messages", "stream"]}
                 )
-                
+                if settings.hedge_enabled:
+                    hedge_fired.clear()
+                    result, hedge_winner = await run_hedged(model, call, start_hedge, hedge_failed)
+                    if hedge_winner:
+                        # 对冲请求先返回，后续日志记到对冲凭证上
+                        await record_hedge_loser(credential, client)
+                        credential, client = hedge_winner
+                    elif hedge_fired:
+                        await record_hedge_loser(*hedge_fired[0])
+                else:
+                    result = await call
+
+                if cache_key:
+                    await response_cache.set(cache_key, result)
+
                 # 成功：更新占位日志
                 latency = (time.time() - start_time) * 1000
                 error_type = None
@@ -852,10 +825,11 @@ async def chat_completions(
                 placeholder_log.retry_count = retry_attempt  # 记录重试次数
                 await db.commit()
                 
-                # 更新凭证使用次数
-                credential.total_requests = (credential.total_requests or 0) + 1
-                credential.last_used_at = datetime.utcnow()
-                await db.commit()
+                # 更新凭证使用次数（结果共享自其他相同请求时本凭证没有调用上游）
+                if not client.last_call_shared:
+                    credential.total_requests = (credential.total_requests or 0) + 1
+                    credential.last_used_at = datetime.utcnow()
+                    await db.commit()
                 
                 # WebSocket 实时通知
                 await notify_log_update({
@@ -894,7 +868,7 @@ async def chat_completions(
                             credential = new_credential
                             access_token = new_token
                             project_id = new_credential.project_id or ""
-                            client = GeminiClient(access_token, project_id)
+                            client = GeminiClient(access_token, project_id, user_id=user.id)
                             print(f"[Proxy] 🔄 切换到凭证: {credential.email}", flush=True)
                         else:
                             print(f"[Proxy] ⚠️ 新凭证 Token 获取失败，使用当前凭证继续重试", flush=True)
@@ -926,7 +900,10 @@ async def chat_completions(
     
     # 流式模式的处理
     if not stream:
-        return await handle_non_stream()
+        try:
+            return await handle_non_stream()
+        finally:
+            ticket.release()
     
     # 流式响应：使用独立会话，不持有主db连接
     async def save_log_background(log_data: dict):
@@ -959,9 +936,9 @@ async def chat_completions(
                     log.request_body = request_body_str if status_code != 200 else None
                     log.retry_count = log_data.get("retry_count", 0)  # 记录重试次数
                 
-                # 更新凭证使用次数
+                # 更新凭证使用次数（结果共享自其他相同请求时本凭证没有调用上游）
                 cred_id = log_data.get("cred_id")
-                if cred_id:
+                if cred_id and not log_data.get("shared"):
                     from app.models.user import Credential
                     cred_result = await bg_db.execute(
                         select(Credential).where(Credential.id == cred_id)
@@ -1017,7 +994,8 @@ async def chat_completions(
                     "cred_id": current_cred_id,
                     "cred_email": current_cred_email,
                     "latency_ms": latency,
-                    "retry_count": stream_retry  # 记录重试次数
+                    "retry_count": stream_retry,  # 记录重试次数
+                    "shared": client.last_call_shared
                 })
                 yield "data: [DONE]\n\n"
                 return  # 成功，退出
@@ -1054,7 +1032,7 @@ async def chat_completions(
                                     current_cred_email = new_credential.email
                                     access_token = new_token
                                     project_id = new_credential.project_id or ""
-                                    client = GeminiClient(access_token, project_id)
+                                    client = GeminiClient(access_token, project_id, user_id=user.id)
                                     print(f"[Proxy] 🔄 切换到凭证: {current_cred_email}", flush=True)
                                 else:
                                     print(f"[Proxy] ⚠️ 新凭证 Token 获取失败，使用当前凭证继续重试", flush=True)
@@ -1080,7 +1058,7 @@ async def chat_completions(
                 return
     
     return StreamingResponse(
-        stream_generator_with_retry(),
+        release_when_done(ticket, stream_generator_with_retry()),
         media_type="text/event-stream",
         headers={"Cache-Control": "no-cache", "Connection": "keep-alive"}
     )
@@ -1155,114 +1133,13 @@ async def list_gemini_models(request: Request, user: User = Depends(get_user_fro
     # ===== GeminiCLI 模型（仅当有 CLI 凭证时显示）=====
     if has_cli_creds:
         has_cli_tier3 = await CredentialPool.has_tier3_credentials(user, db, mode="geminicli")
-        
-        base_models = ["gemini-2.5-pro", "gemini-2.5-flash"]
-        tier3_models = ["gemini-3-pro-preview", "gemini-3-flash-preview"]
-        thinking_suffixes = ["-maxthinking", "-nothinking"]
-        search_suffix = "-search"
-        
-        cli_base_models = base_models.copy()
-        if has_cli_tier3:
-            cli_base_models.extend(tier3_models)
-        
-        for base in cli_base_models:
-            # 基础模型
-            models.append(make_gemini_model(f"gcli-{base}"))
-            
-            # 假流式变体（使用 假流/ 前缀，GeminiClient 中 is_fake_streaming 检测此前缀）
-            models.append(make_gemini_model(f"gcli-假流/{base}"))
-            
-            # thinking 变体
-            for suffix in thinking_suffixes:
-                models.append(make_gemini_model(f"gcli-{base}{suffix}"))
-                # thinking + 假流式
-                models.append(make_gemini_model(f"gcli-假流/{base}{suffix}"))
-            
-            # search 变体
-            models.append(make_gemini_model(f"gcli-{base}{search_suffix}"))
-            
-            # thinking + search 组合
-            for suffix in thinking_suffixes:
-                combined = f"{suffix}{search_suffix}"
-                models.append(make_gemini_model(f"gcli-{base}{combined}"))
+        for model_id in model_catalog.get_gcli_ids(has_cli_tier3):
+            models.append(make_gemini_model(model_id))
     
     # ===== Antigravity 模型（仅当有 Antigravity 凭证时显示，仅 gemini 系列）=====
     if has_agy_creds and settings.antigravity_enabled:
-        # 定义过滤函数：只保留 gemini 系列模型
-        def is_valid_gemini_model(model_id: str) -> bool:
-            model_lower = model_id.lower()
-            # 排除内部测试模型
-            invalid_patterns = ["chat_", "rev", "tab_", "uic", "test", "exp", "lite_preview"]
-            if any(pattern in model_lower for pattern in invalid_patterns):
-                return False
-            # 排除 gemini-2.5-pro（Antigravity 有问题）
-            if "gemini-2.5-pro" in model_lower or "gemini-2.5pro" in model_lower:
-                return False
-            # 只允许 gemini 开头的模型
-            return model_lower.startswith("gemini")
-        
-        try:
-            from app.services.antigravity_client import AntigravityClient
-            
-            # 获取一个有效的 Antigravity 凭证
-            agy_cred_result = await db.execute(
-                select(Credential)
-                .where(Credential.api_type == "antigravity")
-                .where(Credential.is_active == True)
-                .where(or_(
-                    Credential.user_id == user.id,
-                    Credential.is_public == True
-                ))
-                .limit(1)
-            )
-            agy_cred = agy_cred_result.scalar_one_or_none()
-            
-            if agy_cred:
-                access_token = await CredentialPool.get_access_token(agy_cred, db)
-                if access_token:
-                    client = AntigravityClient(access_token, agy_cred.project_id)
-                    api_models = await client.fetch_available_models()
-                    
-                    # 添加过滤后的 gemini 模型
-                    for model_info in api_models:
-                        model_id = model_info.get("id", "")
-                        if model_id and is_valid_gemini_model(model_id):
-                            models.append(make_gemini_model(f"agy-{model_id}"))
-                            # 为图片模型添加 2k/4k 变体
-                            if "image" in model_id.lower() and "2k" not in model_id.lower() and "4k" not in model_id.lower():
-                                models.append(make_gemini_model(f"agy-{model_id}-2k"))
-                                models.append(make_gemini_model(f"agy-{model_id}-4k"))
-                    
-                    # 强制添加 Gemini 2.5 系列（不含 gemini-2.5-pro，因为 Antigravity 有问题）
-                    existing_ids = {m["name"].replace("models/", "") for m in models}
-                    gemini_25_variants = [
-                        "agy-gemini-2.5-flash", "agy-gemini-2.5-flash-lite",
-                        "agy-gemini-2.5-flash-thinking",
-                    ]
-                    for variant in gemini_25_variants:
-                        if variant not in existing_ids:
-                            models.append(make_gemini_model(variant))
-                    
-                    # 强制添加图片模型变体
-                    image_variants = [
-                        "agy-gemini-3-pro-image", "agy-gemini-3-pro-image-2k", "agy-gemini-3-pro-image-4k"
-                    ]
-                    existing_ids = {m["name"].replace("models/", "") for m in models}
-                    for variant in image_variants:
-                        if variant not in existing_ids:
-                            models.append(make_gemini_model(variant))
-        except Exception as e:
-            print(f"[v1beta/models] 获取 Antigravity 模型列表失败: {e}", flush=True)
-            # 降级：使用静态模型列表（仅 gemini 系列，不含 gemini-2.5-pro）
-            fallback_agy_models = [
-                # Gemini 2.5 系列（不含 gemini-2.5-pro）
-                "gemini-2.5-flash", "gemini-2.5-flash-lite", "gemini-2.5-flash-thinking",
-                # Gemini 3 系列
-                "gemini-3-flash", "gemini-3-pro-low", "gemini-3-pro-high",
-                "gemini-3-pro-image", "gemini-3-pro-image-2k", "gemini-3-pro-image-4k",
-            ]
-            for base in fallback_agy_models:
-                models.append(make_gemini_model(f"agy-{base}"))
+        for model_id in model_catalog.get_ids("gemini"):
+            models.append(make_gemini_model(model_id))
     
     return {"models": models}
 
@@ -1366,7 +1243,7 @@ async def gemini_generate_content(
             raise HTTPException(status_code=429, detail=f"速率限制: {max_rpm} 次/分钟")
     
     # 构建请求体（只构建一次）
-    url = "https://cloudcode-pa.googleapis.com/v1internal:generateContent"
+    url = f"{settings.code_assist_endpoint}/v1internal:generateContent"
     request_body = {"contents": contents}
     if "generationConfig" in body:
         gen_config = body["generationConfig"].copy() if isinstance(body["generationConfig"], dict) else body["generationConfig"]
@@ -1400,6 +1277,14 @@ async def gemini_generate_content(
         elif use_nothinking:
             request_body["generationConfig"]["thinkingConfig"] = {"thinkingBudget": 0}
     
+    # 确定性请求先查响应缓存，命中时不占用凭证
+    cache_key = cache_key_for(user.id, "/v1beta/generateContent", base_model, request_body)
+    cached = await response_cache.get(cache_key) if cache_key else None
+    if cached is not None:
+        log = UsageLog(user_id=user.id, model=display_model, endpoint="/v1beta/generateContent")
+        await record_cache_hit(db, log, user.username, start_time)
+        return JSONResponse(content=cached)
+    
     # 重试逻辑
     max_retries = settings.error_retry_count
     tried_credential_ids = set()
@@ -1440,8 +1325,7 @@ async def gemini_generate_content(
             async with httpx.AsyncClient(timeout=non_stream_timeout) as client:
                 response = await client.post(
                     url,
-                    headers={"Authorization": f"Bearer {access_token}", "Content-Type": "application/json"},
-                    json=payload
+                    **json_request(payload, {"Authorization": f"Bearer {access_token}", "Content-Type": "application/json"})
                 )
                 
                 if response.status_code == 200:
@@ -1477,7 +1361,9 @@ async def gemini_generate_content(
                         standard_result = result.get("response", {})
                         if "modelVersion" in result:
                             standard_result["modelVersion"] = result["modelVersion"]
-                        return JSONResponse(content=standard_result)
+                        result = standard_result
+                    if cache_key:
+                        await response_cache.set(cache_key, result)
                     return JSONResponse(content=result)
                 
                 # 请求失败
@@ -1698,7 +1584,7 @@ async def gemini_stream_generate_content(
             raise HTTPException(status_code=429, detail=f"速率限制: {max_rpm} 次/分钟")
     
     # 构建请求体（只构建一次）
-    url = "https://cloudcode-pa.googleapis.com/v1internal:streamGenerateContent?alt=sse"
+    url = f"{settings.code_assist_endpoint}/v1internal:streamGenerateContent?alt=sse"
     request_body = {"contents": contents}
     if "generationConfig" in body:
         gen_config = body["generationConfig"].copy() if isinstance(body["generationConfig"], dict) else body["generationConfig"]
@@ -1826,7 +1712,7 @@ async def gemini_stream_generate_content(
         last_error = None
         
         # 非流式 API 端点
-        non_stream_url = "https://cloudcode-pa.googleapis.com/v1internal:generateContent"
+        non_stream_url = f"{settings.code_assist_endpoint}/v1internal:generateContent"
         
         for stream_retry in range(max_retries + 1):
             payload = {"model": api_model, "project": project_id, "request": request_body}
@@ -1837,8 +1723,7 @@ async def gemini_stream_generate_content(
                     async with httpx.AsyncClient(timeout=600.0) as client:
                         return await client.post(
                             non_stream_url,
-                            headers={"Authorization": f"Bearer {access_token}", "Content-Type": "application/json"},
-                            json=payload
+                            **json_request(payload, {"Authorization": f"Bearer {access_token}", "Content-Type": "application/json"})
                         )
                 
                 api_task = asyncio.create_task(call_api())
@@ -2013,8 +1898,7 @@ async def gemini_stream_generate_content(
                 async with httpx.AsyncClient(timeout=stream_timeout) as client:
                     async with client.stream(
                         "POST", url,
-                        headers={"Authorization": f"Bearer {access_token}", "Content-Type": "application/json"},
-                        json=payload
+                        **json_request(payload, {"Authorization": f"Bearer {access_token}", "Content-Type": "application/json"})
                     ) as response:
                         if response.status_code != 200:
                             # 一开始就报错，可以重试
@@ -320,10 +320,12 @@ async def clear_test_logs(
     清除所有测试生成的报错日志（endpoint 为 /api/test/simulate 的日志）
     """
     from sqlalchemy import delete
+    from app.services.log_payloads import delete_orphan_payloads
     
     result = await db.execute(
         delete(UsageLog).where(UsageLog.endpoint == "/api/test/simulate")
     )
+    await delete_orphan_payloads(db)
     await db.commit()
     
     return {
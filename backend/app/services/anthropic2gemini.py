@@ -16,12 +16,20 @@ from app.services.converter_utils import (
     decode_tool_id_and_signature,
     merge_system_messages as base_merge_system_messages,
 )
+from app.services.inline_media import check_inline_image
+from app.services.prefix_cache import prefix_cache
+from app.services.protocol_ir import Blob, FunctionCall, FunctionResponse, GeminiResponse, Message, Part
+from app.services.token_estimator import OutputTokenCounter
+from app.services.tool_schema_cache import tool_schema_cache
 
 log = logging.getLogger(__name__)
 
 DEFAULT_TEMPERATURE = 0.4
 MIN_SIGNATURE_LENGTH = 10
 
+# 流式 SSE 事件的 JSON 编码器（json.dumps 带参数时每次都会新建编码器）
+_SSE_JSON_ENCODER = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"))
+
 
 # ============================================================================
 # Thinking 块验证和清理
@@ -251,26 +259,27 @@ def convert_tools(anthropic_tools: Optional[List[Dict[str, Any]]]) -> Optional[L
     if not anthropic_tools:
         return None
 
-    gemini_tools: List[Dict[str, Any]] = []
-    for tool in anthropic_tools:
-        name = tool.get("name", "nameless_function")
-        description = tool.get("description", "")
-        input_schema = tool.get("input_schema", {}) or {}
-        parameters = clean_json_schema(input_schema)
+    # 同样的工具定义（按内容哈希）直接复用上次的转换结果
+    gemini_tools = tool_schema_cache.convert_all(anthropic_tools, "anthropic", _convert_tool)
+
+    return gemini_tools or None
+
 
-        gemini_tools.append(
+def _convert_tool(tool: Dict[str, Any]) -> Dict[str, Any]:
+    name = tool.get("name", "nameless_function")
+    description = tool.get("description", "")
+    input_schema = tool.get("input_schema", {}) or {}
+    parameters = clean_json_schema(input_schema)
+
+    return {
+        "functionDeclarations": [
             {
-                "functionDeclarations": [
-                    {
-                        "name": name,
-                        "description": description,
-                        "parameters": parameters,
-                    }
-                ]
+                "name": name,
+                "description": description,
+                "parameters": parameters,
             }
-        )
-
-    return gemini_tools or None
+        ]
+    }
 
 
 # ============================================================================
@@ -297,145 +306,156 @@ def convert_messages_to_contents(
     include_thinking: bool = True
 ) -> List[Dict[str, Any]]:
     """将 Anthropic messages[] 转换为 Gemini contents[]"""
+    tool_use_info = _collect_tool_use_info(messages)
     contents: List[Dict[str, Any]] = []
+    for msg in messages:
+        content = _convert_message(msg, tool_use_info, include_thinking=include_thinking)
+        if content is not None:
+            contents.append(content)
+    return contents
+
+
+def _collect_tool_use_info(
+    messages: List[Dict[str, Any]],
+    tool_result_refs: Optional[List[Optional[List[str]]]] = None,
+) -> Dict[str, Tuple[str, Optional[str]]]:
+    """
+    收集所有 tool_use 的 {编码后的 ID: (工具名, thoughtSignature)}
 
+    传入 tool_result_refs 时顺便记录每条消息中未带 name、需要按 ID 查工具名的 tool_result（没有则为 None）。
+    """
     tool_use_info: Dict[str, Tuple[str, Optional[str]]] = {}
     for msg in messages:
+        refs = None
         raw_content = msg.get("content", "")
         if isinstance(raw_content, list):
             for item in raw_content:
-                if isinstance(item, dict) and item.get("type") == "tool_use":
+                if not isinstance(item, dict):
+                    continue
+                item_type = item.get("type")
+                if item_type == "tool_use":
                     encoded_tool_id = item.get("id")
                     tool_name = item.get("name")
                     if encoded_tool_id and tool_name:
                         original_id, thoughtsignature = decode_tool_id_and_signature(encoded_tool_id)
                         tool_use_info[str(encoded_tool_id)] = (tool_name, thoughtsignature)
+                elif item_type == "tool_result" and tool_result_refs is not None:
+                    if not item.get("name") and item.get("tool_use_id"):
+                        refs = refs or []
+                        refs.append(str(item["tool_use_id"]))
+        if tool_result_refs is not None:
+            tool_result_refs.append(refs)
+    return tool_use_info
+
+
+def _tool_result_dependencies(
+    tool_result_refs: List[Optional[List[str]]],
+    tool_use_info: Dict[str, Tuple[str, Optional[str]]],
+) -> List[Any]:
+    """每条消息中 tool_result 按 ID 查到的工具名（对话前缀缓存比较用）"""
+    return [
+        tuple((tool_use_info.get(ref) or (None,))[0] for ref in refs) if refs else None
+        for refs in tool_result_refs
+    ]
+
+
+def parse_anthropic_message(
+    msg: Dict[str, Any],
+    tool_use_info: Dict[str, Tuple[str, Optional[str]]],
+    *,
+    include_thinking: bool = True
+) -> Optional[Message]:
+    """将一条 Anthropic 消息解析为 IR 消息，没有内容时返回 None"""
+    role = msg.get("role", "user")
+    
+    if role == "system":
+        return None
+    
+    gemini_role = "model" if role in ("assistant", "model") else "user"
+    raw_content = msg.get("content", "")
+
+    parts: List[Part] = []
+    if isinstance(raw_content, str):
+        if _is_non_whitespace_text(raw_content):
+            parts = [Part(text=str(raw_content))]
+    elif isinstance(raw_content, list):
+        for item in raw_content:
+            if not isinstance(item, dict):
+                if _is_non_whitespace_text(item):
+                    parts.append(Part(text=str(item)))
+                continue
 
-    for msg in messages:
-        role = msg.get("role", "user")
-        
-        if role == "system":
-            continue
-        
-        gemini_role = "model" if role in ("assistant", "model") else "user"
-        raw_content = msg.get("content", "")
-
-        parts: List[Dict[str, Any]] = []
-        if isinstance(raw_content, str):
-            if _is_non_whitespace_text(raw_content):
-                parts = [{"text": str(raw_content)}]
-        elif isinstance(raw_content, list):
-            for item in raw_content:
-                if not isinstance(item, dict):
-                    if _is_non_whitespace_text(item):
-                        parts.append({"text": str(item)})
+            item_type = item.get("type")
+            if item_type == "thinking":
+                if not include_thinking:
                     continue
 
-                item_type = item.get("type")
-                if item_type == "thinking":
-                    if not include_thinking:
-                        continue
-
-                    thinking_text = item.get("thinking", "") or ""
-                    
-                    part: Dict[str, Any] = {
-                        "text": str(thinking_text),
-                        "thought": True,
-                    }
-                    
-                    thoughtsignature = item.get("thoughtSignature")
-                    if thoughtsignature:
-                        part["thoughtSignature"] = thoughtsignature
-                    
-                    parts.append(part)
-                elif item_type == "redacted_thinking":
-                    if not include_thinking:
-                        continue
-
-                    thinking_text = item.get("thinking") or item.get("data", "")
-                    
-                    part_dict: Dict[str, Any] = {
-                        "text": str(thinking_text or ""),
-                        "thought": True,
-                    }
-                    
-                    thoughtsignature = item.get("thoughtSignature")
-                    if thoughtsignature:
-                        part_dict["thoughtSignature"] = thoughtsignature
-                    
-                    parts.append(part_dict)
-                elif item_type == "text":
-                    text = item.get("text", "")
-                    if _is_non_whitespace_text(text):
-                        parts.append({"text": str(text)})
-                elif item_type == "image":
-                    source = item.get("source", {}) or {}
-                    if source.get("type") == "base64":
-                        parts.append(
-                            {
-                                "inlineData": {
-                                    "mimeType": source.get("media_type", "image/png"),
-                                    "data": source.get("data", ""),
-                                }
-                            }
-                        )
-                elif item_type == "tool_use":
-                    encoded_id = item.get("id") or ""
-                    original_id, thoughtsignature = decode_tool_id_and_signature(encoded_id)
-
-                    fc_part: Dict[str, Any] = {
-                        "functionCall": {
-                            "id": original_id,
-                            "name": item.get("name"),
-                            "args": item.get("input", {}) or {},
-                        }
-                    }
+                thinking_text = item.get("thinking", "") or ""
+                parts.append(Part(text=str(thinking_text), thought=True, signature=item.get("thoughtSignature") or None))
+            elif item_type == "redacted_thinking":
+                if not include_thinking:
+                    continue
 
-                    if thoughtsignature:
-                        fc_part["thoughtSignature"] = thoughtsignature
-                    else:
-                        fc_part["thoughtSignature"] = "skip_thought_signature_validator"
+                thinking_text = item.get("thinking") or item.get("data", "")
+                parts.append(Part(text=str(thinking_text or ""), thought=True, signature=item.get("thoughtSignature") or None))
+            elif item_type == "text":
+                text = item.get("text", "")
+                if _is_non_whitespace_text(text):
+                    parts.append(Part(text=str(text)))
+            elif item_type == "image":
+                source = item.get("source", {}) or {}
+                if source.get("type") == "base64":
+                    media_type = source.get("media_type", "image/png")
+                    data = source.get("data", "")
+                    # 不合格时抛出 InlineImageError，路由返回 400
+                    check_inline_image(media_type, data)
+                    parts.append(Part(inline_data=Blob(media_type, data)))
+            elif item_type == "tool_use":
+                encoded_id = item.get("id") or ""
+                original_id, thoughtsignature = decode_tool_id_and_signature(encoded_id)
+                # 没有签名时生成 Gemini content 会使用占位符
+                function_call = FunctionCall(original_id, item.get("name"), item.get("input", {}) or {})
+                parts.append(Part(function_call=function_call, signature=thoughtsignature or None))
+            elif item_type == "tool_result":
+                output = _extract_tool_result_output(item.get("content"))
+                encoded_tool_use_id = item.get("tool_use_id") or ""
+                
+                original_tool_use_id, _ = decode_tool_id_and_signature(encoded_tool_use_id)
+
+                func_name = item.get("name")
+                if not func_name and encoded_tool_use_id:
+                    tool_info = tool_use_info.get(str(encoded_tool_use_id))
+                    if tool_info:
+                        func_name = tool_info[0]
+                if not func_name:
+                    func_name = "unknown_function"
+                
+                parts.append(Part(function_response=FunctionResponse(original_tool_use_id, func_name, {"output": output})))
+            else:
+                parts.append(Part(text=json.dumps(item, ensure_ascii=False)))
+    else:
+        if _is_non_whitespace_text(raw_content):
+            parts = [Part(text=str(raw_content))]
 
-                    parts.append(fc_part)
-                elif item_type == "tool_result":
-                    output = _extract_tool_result_output(item.get("content"))
-                    encoded_tool_use_id = item.get("tool_use_id") or ""
-                    
-                    original_tool_use_id, _ = decode_tool_id_and_signature(encoded_tool_use_id)
-
-                    func_name = item.get("name")
-                    if not func_name and encoded_tool_use_id:
-                        tool_info = tool_use_info.get(str(encoded_tool_use_id))
-                        if tool_info:
-                            func_name = tool_info[0]
-                    if not func_name:
-                        func_name = "unknown_function"
-                    
-                    parts.append(
-                        {
-                            "functionResponse": {
-                                "id": original_tool_use_id,
-                                "name": func_name,
-                                "response": {"output": output},
-                            }
-                        }
-                    )
-                else:
-                    parts.append({"text": json.dumps(item, ensure_ascii=False)})
-        else:
-            if _is_non_whitespace_text(raw_content):
-                parts = [{"text": str(raw_content)}]
+    if not parts:
+        return None
 
-        if not parts:
-            continue
+    return Message(gemini_role, parts)
 
-        contents.append({"role": gemini_role, "parts": parts})
 
-    return contents
+def _convert_message(
+    msg: Dict[str, Any],
+    tool_use_info: Dict[str, Tuple[str, Optional[str]]],
+    *,
+    include_thinking: bool = True
+) -> Optional[Dict[str, Any]]:
+    """将一条 Anthropic 消息转换为 Gemini content，没有内容时返回 None"""
+    parsed = parse_anthropic_message(msg, tool_use_info, include_thinking=include_thinking)
+    return parsed.to_gemini() if parsed is not None else None
 
 
 def reorganize_tool_messages(contents: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
-    """重新组织消息，满足 tool_use/tool_result 约束"""
+    """重新组织消息，满足 tool_use/tool_result 约束（每个 part 单独成一条，functionResponse 紧跟对应的 functionCall）"""
     tool_results: Dict[str, Dict[str, Any]] = {}
 
     for msg in contents:
@@ -445,42 +465,27 @@ def reorganize_tool_messages(contents: List[Dict[str, Any]]) -> List[Dict[str, A
                 if tool_id:
                     tool_results[str(tool_id)] = part
 
-    flattened: List[Dict[str, Any]] = []
+    new_contents: List[Dict[str, Any]] = []
     for msg in contents:
         role = msg.get("role")
         for part in msg.get("parts", []) or []:
-            flattened.append({"role": role, "parts": [part]})
-
-    new_contents: List[Dict[str, Any]] = []
-    i = 0
-    while i < len(flattened):
-        msg = flattened[i]
-        part = msg["parts"][0]
-
-        if isinstance(part, dict) and "functionResponse" in part:
-            i += 1
-            continue
-
-        if isinstance(part, dict) and "functionCall" in part:
-            tool_id = (part.get("functionCall") or {}).get("id")
-            new_contents.append({"role": "model", "parts": [part]})
+            if isinstance(part, dict):
+                if "functionResponse" in part:
+                    continue
 
-            if tool_id is not None and str(tool_id) in tool_results:
-                new_contents.append({"role": "user", "parts": [tool_results[str(tool_id)]]})
+                if "functionCall" in part:
+                    tool_id = (part.get("functionCall") or {}).get("id")
+                    new_contents.append({"role": "model", "parts": [part]})
 
-            i += 1
-            continue
+                    if tool_id is not None and str(tool_id) in tool_results:
+                        new_contents.append({"role": "user", "parts": [tool_results[str(tool_id)]]})
+                    continue
 
-        new_contents.append(msg)
-        i += 1
+            new_contents.append({"role": role, "parts": [part]})
 
     return new_contents
 
 
-# ============================================================================
-# Tool Choice 转换
-# ============================================================================
-
 def convert_tool_choice_to_tool_config(tool_choice: Any) -> Optional[Dict[str, Any]]:
     """将 Anthropic tool_choice 转换为 Gemini toolConfig"""
     if not tool_choice:
@@ -566,8 +571,22 @@ def build_generation_config(payload: Dict[str, Any]) -> Dict[str, Any]:
 # 主要转换函数
 # ============================================================================
 
-async def anthropic_to_gemini_request(payload: Dict[str, Any]) -> Dict[str, Any]:
-    """将 Anthropic 格式请求体转换为 Gemini 格式请求体"""
+def _convert_request_message(msg: Dict[str, Any], tool_use_info: Dict[str, Tuple[str, Optional[str]]]) -> Optional[Dict[str, Any]]:
+    """请求转换用：转换一条消息并移除 model 消息尾部的无签名 thinking"""
+    content = _convert_message(msg, tool_use_info, include_thinking=True)
+    if content is not None and content.get("role", "") == "model":
+        parts = content.get("parts", [])
+        if isinstance(parts, list):
+            remove_trailing_unsigned_thinking(parts)
+    return content
+
+
+async def anthropic_to_gemini_request(payload: Dict[str, Any], cache_key: Any = None) -> Dict[str, Any]:
+    """
+    将 Anthropic 格式请求体转换为 Gemini 格式请求体
+
+    cache_key: 对话前缀缓存的键（通常是用户 ID），为 None 时不使用缓存
+    """
     payload = await base_merge_system_messages(payload)
 
     messages = payload.get("messages") or []
@@ -578,16 +597,18 @@ async def anthropic_to_gemini_request(payload: Dict[str, Any]) -> Dict[str, Any]
 
     generation_config = build_generation_config(payload)
 
-    contents = convert_messages_to_contents(messages, include_thinking=True)
-    
-    for content in contents:
-        role = content.get("role", "")
-        if role == "model":
-            parts = content.get("parts", [])
-            if isinstance(parts, list):
-                remove_trailing_unsigned_thinking(parts)
-    
-    contents = reorganize_tool_messages(contents)
+    # 逐条转换消息；带 cache_key 时复用同一用户上一轮已经转换过的历史消息
+    tool_result_refs: List[Optional[List[str]]] = []
+    tool_use_info = _collect_tool_use_info(messages, tool_result_refs)
+    converted = prefix_cache.convert(
+        cache_key,
+        messages,
+        lambda msg: _convert_request_message(msg, tool_use_info),
+        context="anthropic",
+        dependencies=_tool_result_dependencies(tool_result_refs, tool_use_info),
+    )
+    # reorganize_tool_messages 会为每个 part 生成新的 content，缓存中的 content 不会被下游改动
+    contents = reorganize_tool_messages([content for content in converted if content is not None])
 
     tools = convert_tools(payload.get("tools"))
     
@@ -619,75 +640,50 @@ def gemini_to_anthropic_response(
     if not (200 <= status_code < 300):
         return gemini_response
 
-    if "response" in gemini_response:
-        response_data = gemini_response["response"]
-    else:
-        response_data = gemini_response
-
-    candidate = response_data.get("candidates", [{}])[0] or {}
-    parts = candidate.get("content", {}).get("parts", []) or []
-
-    usage_metadata = {}
-    if "usageMetadata" in response_data:
-        usage_metadata = response_data["usageMetadata"]
-    elif "usageMetadata" in candidate:
-        usage_metadata = candidate["usageMetadata"]
+    parsed = GeminiResponse.parse(gemini_response)
+    usage_metadata = parsed.usage if parsed.usage is not None else parsed.candidate_usage
 
     content = []
     has_tool_use = False
-
-    for part in parts:
-        if not isinstance(part, dict):
-            continue
-
-        if part.get("thought") is True:
-            thinking_text = part.get("text", "") or ""
-            
-            block: Dict[str, Any] = {"type": "thinking", "thinking": str(thinking_text)}
-            
-            thoughtsignature = part.get("thoughtSignature")
-            if thoughtsignature:
-                block["thoughtSignature"] = thoughtsignature
-            
+    counter = OutputTokenCounter()
+
+    for part in parsed.parts:
+        if part.thought is True:
+            counter.add_text(part.text, thought=True)
+            block: Dict[str, Any] = {"type": "thinking", "thinking": str(part.text or "")}
+            if part.signature:
+                block["thoughtSignature"] = part.signature
             content.append(block)
-            continue
-
-        if "text" in part:
-            content.append({"type": "text", "text": part.get("text", "")})
-            continue
-
-        if "functionCall" in part:
+        elif part.text is not None:
+            counter.add_text(part.text)
+            content.append({"type": "text", "text": part.text})
+        elif part.function_call is not None:
             has_tool_use = True
-            fc = part.get("functionCall", {}) or {}
-            original_id = fc.get("id") or f"toolu_{uuid.uuid4().hex}"
-            thoughtsignature = part.get("thoughtSignature")
-            
-            encoded_id = encode_tool_id_with_signature(original_id, thoughtsignature)
+            counter.add_non_text()
+            fc = part.function_call
+            original_id = fc.id or f"toolu_{uuid.uuid4().hex}"
             content.append(
                 {
                     "type": "tool_use",
-                    "id": encoded_id,
-                    "name": fc.get("name") or "",
-                    "input": _remove_nulls_for_tool_input(fc.get("args", {}) or {}),
+                    "id": encode_tool_id_with_signature(original_id, part.signature),
+                    "name": fc.name or "",
+                    "input": _remove_nulls_for_tool_input(fc.args or {}),
                 }
             )
-            continue
-
-        if "inlineData" in part:
-            inline = part.get("inlineData", {}) or {}
+        elif part.inline_data is not None:
+            counter.add_non_text(image=True)
             content.append(
                 {
                     "type": "image",
                     "source": {
                         "type": "base64",
-                        "media_type": inline.get("mimeType", "image/png"),
-                        "data": inline.get("data", ""),
+                        "media_type": part.inline_data.mime_type,
+                        "data": part.inline_data.data,
                     },
                 }
             )
-            continue
 
-    finish_reason = candidate.get("finishReason")
+    finish_reason = parsed.finish_reason
     
     if has_tool_use and finish_reason == "STOP":
         stop_reason = "tool_use"
@@ -697,7 +693,8 @@ def gemini_to_anthropic_response(
         stop_reason = "end_turn"
 
     input_tokens = usage_metadata.get("promptTokenCount", 0) if isinstance(usage_metadata, dict) else 0
-    output_tokens = usage_metadata.get("candidatesTokenCount", 0) if isinstance(usage_metadata, dict) else 0
+    # 上游没有返回输出 token 数时用本地估算
+    output_tokens = counter.finish(usage_metadata)
 
     message_id = f"msg_{uuid.uuid4().hex}"
 
@@ -735,10 +732,12 @@ async def gemini_stream_to_anthropic_stream(
     has_tool_use = False
     input_tokens = 0
     output_tokens = 0
+    final_usage: Optional[Dict[str, Any]] = None
+    counter = OutputTokenCounter()
     finish_reason: Optional[str] = None
 
     def _sse_event(event: str, data: Dict[str, Any]) -> bytes:
-        payload = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+        payload = _SSE_JSON_ENCODER.encode(data)
         return f"event: {event}\ndata: {payload}\n\n".encode("utf-8")
 
     def _close_block() -> Optional[bytes]:
@@ -766,21 +765,15 @@ async def gemini_stream_to_anthropic_stream(
             except Exception:
                 continue
 
-            if "response" in data:
-                response = data["response"]
-            else:
-                response = data
-
-            candidate = (response.get("candidates", []) or [{}])[0] or {}
-            parts = (candidate.get("content", {}) or {}).get("parts", []) or []
+            parsed = GeminiResponse.parse(data)
 
-            if "usageMetadata" in response:
-                usage = response["usageMetadata"]
-                if isinstance(usage, dict):
-                    if "promptTokenCount" in usage:
-                        input_tokens = int(usage.get("promptTokenCount", 0) or 0)
-                    if "candidatesTokenCount" in usage:
-                        output_tokens = int(usage.get("candidatesTokenCount", 0) or 0)
+            usage = parsed.usage
+            if isinstance(usage, dict):
+                final_usage = usage
+                if "promptTokenCount" in usage:
+                    input_tokens = int(usage.get("promptTokenCount", 0) or 0)
+                if "candidatesTokenCount" in usage:
+                    output_tokens = int(usage.get("candidatesTokenCount", 0) or 0)
 
             if not message_start_sent:
                 message_start_sent = True
@@ -801,13 +794,11 @@ async def gemini_stream_to_anthropic_stream(
                     },
                 )
 
-            for part in parts:
-                if not isinstance(part, dict):
-                    continue
-
-                if part.get("thought") is True:
-                    thinking_text = part.get("text", "")
-                    thoughtsignature = part.get("thoughtSignature")
+            for part in parsed.parts:
+                if part.thought is True:
+                    thinking_text = part.text
+                    thoughtsignature = part.signature
+                    counter.add_text(thinking_text, thought=True)
                     
                     if current_block_type != "thinking":
                         close_evt = _close_block()
@@ -862,10 +853,11 @@ async def gemini_stream_to_anthropic_stream(
                         )
                     continue
 
-                if "text" in part:
-                    text = part.get("text", "")
+                if part.text is not None:
+                    text = part.text
                     if isinstance(text, str) and not text.strip():
                         continue
+                    counter.add_text(text)
 
                     if current_block_type != "text":
                         close_evt = _close_block()
@@ -895,18 +887,18 @@ async def gemini_stream_to_anthropic_stream(
                         )
                     continue
 
-                if "functionCall" in part:
+                if part.function_call is not None:
                     close_evt = _close_block()
                     if close_evt:
                         yield close_evt
 
                     has_tool_use = True
-                    fc = part.get("functionCall", {}) or {}
-                    original_id = fc.get("id") or f"toolu_{uuid.uuid4().hex}"
-                    thoughtsignature = part.get("thoughtSignature")
-                    tool_id = encode_tool_id_with_signature(original_id, thoughtsignature)
-                    tool_name = fc.get("name") or ""
-                    tool_args = _remove_nulls_for_tool_input(fc.get("args", {}) or {})
+                    counter.add_non_text()
+                    fc = part.function_call
+                    original_id = fc.id or f"toolu_{uuid.uuid4().hex}"
+                    tool_id = encode_tool_id_with_signature(original_id, part.signature)
+                    tool_name = fc.name or ""
+                    tool_args = _remove_nulls_for_tool_input(fc.args or {})
 
                     current_block_index += 1
 
@@ -940,8 +932,8 @@ async def gemini_stream_to_anthropic_stream(
                     )
                     continue
 
-            if candidate.get("finishReason"):
-                finish_reason = candidate.get("finishReason")
+            if parsed.finish_reason:
+                finish_reason = parsed.finish_reason
                 break
 
         close_evt = _close_block()
@@ -955,6 +947,9 @@ async def gemini_stream_to_anthropic_stream(
         else:
             stop_reason = "end_turn"
 
+        # 上游没有返回输出 token 数时用边转发边累计的估算值
+        output_tokens = counter.finish(final_usage)
+
         yield _sse_event(
             "message_delta",
             {
@@ -1,9 +1,20 @@
+import asyncio
+import copy
 import httpx
 import json
+import re
 import uuid
-from typing import AsyncGenerator, Optional, Dict, Any, List
+from typing import AsyncGenerator, Callable, Optional, Dict, Any, List
 from contextlib import asynccontextmanager
 from app.config import settings
+from app.services.inline_media import json_request, preview_json
+from app.services.openai2gemini_full import build_openai_tool_call
+from app.services.protocol_ir import Blob, GeminiResponse, Part
+from app.services.request_coalescer import coalesced_generate
+
+
+# Gemini API 的特殊标记（如 <-END->），不输出给客户端
+_SPECIAL_MARKER_RE = re.compile(r"<-[A-Z_]+->")
 
 
 class AntigravityClient:
@@ -16,9 +27,11 @@ class AntigravityClient:
     # 完全复制自 gcli2api gemini_fix.py 第187行
     OFFICIAL_SYSTEM_PROMPT = "Please ignore the following [ignore]You are Antigravity, a powerful agentic AI coding assistant designed by the Google Deepmind team working on Advanced Agentic Coding.You are pair programming with a USER to solve their coding task. The task may require creating a new codebase, modifying or debugging an existing codebase, or simply answering a question.**Absolute paths only****Proactiveness**[/ignore]"
     
-    def __init__(self, access_token: str, project_id: str = None):
+    def __init__(self, access_token: str, project_id: str = None, user_id: int = None):
         self.access_token = access_token
         self.project_id = project_id or ""
+        self.user_id = user_id  # 用于合并同一用户的相同在途请求
+        self.last_call_shared = False  # 最近一次非流式调用的结果是否共享自其他请求（未占用本凭证）
         self.api_base = settings.antigravity_api_base
     
     @asynccontextmanager
@@ -308,9 +321,8 @@ class AntigravityClient:
         if normalized.get("tools"):
             print(f"[AntigravityClient] tools: {json.dumps(normalized.get('tools'), ensure_ascii=False)[:500]}", flush=True)
         # 打印完整 payload
-        import json as json_module
         print(f"[AntigravityClient] ===== 完整 PAYLOAD (前5000字符) =====", flush=True)
-        print(json_module.dumps(payload, ensure_ascii=False, indent=2)[:5000], flush=True)
+        print(preview_json(payload, 5000, indent=2), flush=True)
         print(f"[AntigravityClient] ===== END PAYLOAD =====", flush=True)
         
         # 使用更细粒度的超时配置
@@ -321,16 +333,43 @@ class AntigravityClient:
             pool=30.0
         )
         async with httpx.AsyncClient(timeout=timeout) as client:
-            response = await client.post(url, headers=headers, json=payload)
+            response = await client.post(url, **json_request(payload, headers))
             
             if response.status_code != 200:
                 error_text = response.text
                 print(f"[AntigravityClient] ❌ 错误 {response.status_code}: {error_text[:500]}", flush=True)
                 raise Exception(f"API Error {response.status_code}: {error_text}")
             result = response.json()
-            print(f"[AntigravityClient] ✅ 响应: {json.dumps(result, ensure_ascii=False)[:500]}", flush=True)
+            print(f"[AntigravityClient] ✅ 响应: {preview_json(result, 500)}", flush=True)
             return result
     
+    async def generate_content_coalesced(
+        self,
+        model: str,
+        contents: list,
+        generation_config: Optional[Dict] = None,
+        system_instruction: Optional[Dict] = None,
+        tools: Optional[List] = None,
+        tool_config: Optional[Dict] = None
+    ) -> Dict[str, Any]:
+        """生成内容 (非流式)，同一用户同时发起的相同请求只调用一次上游"""
+        self.last_call_shared = False
+        payload = {
+            "contents": contents,
+            "generationConfig": generation_config,
+            "systemInstruction": system_instruction,
+            "tools": tools,
+            "toolConfig": tool_config,
+        }
+        result, self.last_call_shared = await coalesced_generate(
+            self.user_id, model, payload,
+            lambda: self.generate_content(
+                model, contents, generation_config, system_instruction,
+                tools=tools, tool_config=tool_config
+            )
+        )
+        return result
+    
     async def generate_content_stream(
         self,
         model: str,
@@ -378,7 +417,7 @@ class AntigravityClient:
         
         timeout = httpx.Timeout(connect=30.0, read=600.0, write=30.0, pool=30.0)
         async with httpx.AsyncClient(timeout=timeout) as client:
-            async with client.stream("POST", url, headers=headers, json=payload) as response:
+            async with client.stream("POST", url, **json_request(payload, headers)) as response:
                 if response.status_code != 200:
                     error_text = await response.aread()
                     print(f"[AntigravityClient] ❌ 流式错误 {response.status_code}: {error_text.decode()[:500]}", flush=True)
@@ -523,38 +562,63 @@ class AntigravityClient:
         """检测是否使用假流式模式（模型名以 假非流/ 开头）"""
         return model.startswith("假非流/")
     
-    async def chat_completions(
-        self,
-        model: str,
-        messages: list,
-        **kwargs
-    ) -> Dict[str, Any]:
-        """OpenAI兼容的chat completions (非流式) - 使用 gcli2api 风格转换"""
+    async def build_request_payload(self, model: str, messages: list, **kwargs) -> Dict[str, Any]:
+        """构建转换后的 Gemini 请求内容（只做格式转换，不需要凭证；可传给 chat_completions 的 prepared）"""
         # 1. 构建完整的 OpenAI 请求对象
         gemini_model = self._map_model_name(model)
         print(f"[AntigravityClient] 模型名映射: {model} -> {gemini_model}", flush=True)
         
-        # 提取 server_base_url
-        server_base_url = kwargs.pop("server_base_url", None)
-
         openai_request = {
             "model": gemini_model,
             "messages": messages,
-            **kwargs
+            **{k: v for k, v in kwargs.items() if k != "server_base_url"}
         }
         
         # 2. 使用 gcli2api 完整版转换器将 OpenAI 格式转换为 Gemini 格式
         from app.services.openai2gemini_full import convert_openai_to_gemini_request
-        gemini_dict = await convert_openai_to_gemini_request(openai_request)
+        gemini_dict = await convert_openai_to_gemini_request(openai_request, cache_key=self.user_id)
         
         print(f"[AntigravityClient] OpenAI->Gemini 转换完成, contents数量: {len(gemini_dict.get('contents', []))}", flush=True)
         
         # 3. 提取转换后的字段 - 包括 tools 和 toolConfig！
-        contents = gemini_dict.get("contents", [])
-        generation_config = gemini_dict.get("generationConfig", {})
-        system_instruction = gemini_dict.get("systemInstruction")
-        tools = gemini_dict.get("tools")  # 关键修复：提取工具定义
-        tool_config = gemini_dict.get("toolConfig")  # 关键修复：提取工具配置
+        return {
+            "model": gemini_model,
+            "contents": gemini_dict.get("contents", []),
+            "generationConfig": gemini_dict.get("generationConfig", {}),
+            "systemInstruction": gemini_dict.get("systemInstruction"),
+            "tools": gemini_dict.get("tools"),  # 关键修复：提取工具定义
+            "toolConfig": gemini_dict.get("toolConfig"),  # 关键修复：提取工具配置
+        }
+    
+    @staticmethod
+    def _unpack_prepared(prepared: Dict[str, Any]) -> tuple:
+        """取出 build_request_payload 的各字段；规范化会就地改写消息和 thinkingConfig，重试时复用需要各自的副本"""
+        return (
+            prepared["model"],
+            [dict(c) if isinstance(c, dict) else c for c in prepared["contents"]],
+            copy.deepcopy(prepared["generationConfig"]),
+            prepared["systemInstruction"],
+            prepared["tools"],
+            prepared["toolConfig"],
+        )
+    
+    async def chat_completions(
+        self,
+        model: str,
+        messages: list,
+        prepared: Optional[Dict[str, Any]] = None,
+        **kwargs
+    ) -> Dict[str, Any]:
+        """OpenAI兼容的chat completions (非流式) - 使用 gcli2api 风格转换
+
+        prepared: build_request_payload 的结果（调用方已转换过时传入，避免重复转换）
+        """
+        # 提取 server_base_url
+        server_base_url = kwargs.pop("server_base_url", None)
+        
+        if prepared is None:
+            prepared = await self.build_request_payload(model, messages, **kwargs)
+        gemini_model, contents, generation_config, system_instruction, tools, tool_config = self._unpack_prepared(prepared)
         
         # 打印工具信息
         if tools:
@@ -565,7 +629,7 @@ class AntigravityClient:
                     print(f"[AntigravityClient] 工具列表: {func_names}", flush=True)
         
         # 4. 调用 generate_content - 传递 tools 和 tool_config！
-        result = await self.generate_content(
+        result = await self.generate_content_coalesced(
             gemini_model, 
             contents, 
             generation_config, 
@@ -573,37 +637,25 @@ class AntigravityClient:
             tools=tools,  # 关键修复：传递工具定义
             tool_config=tool_config  # 关键修复：传递工具配置
         )
-        return self._convert_to_openai_response(result, model, server_base_url)
+        return await self._convert_to_openai_response(result, model, server_base_url)
     
     async def chat_completions_stream(
         self,
         model: str,
         messages: list,
+        prepared: Optional[Dict[str, Any]] = None,
         **kwargs
     ) -> AsyncGenerator[str, None]:
-        """OpenAI兼容的chat completions (流式) - 使用 gcli2api 风格转换"""
-        # 1. 构建完整的 OpenAI 请求对象
-        gemini_model = self._map_model_name(model)
-        
+        """OpenAI兼容的chat completions (流式) - 使用 gcli2api 风格转换
+
+        prepared: build_request_payload 的结果（调用方已转换过时传入，避免重复转换）
+        """
         # 提取 server_base_url
         server_base_url = kwargs.pop("server_base_url", None)
-
-        openai_request = {
-            "model": gemini_model,
-            "messages": messages,
-            **kwargs
-        }
         
-        # 2. 使用完整版转换器
-        from app.services.openai2gemini_full import convert_openai_to_gemini_request
-        gemini_dict = await convert_openai_to_gemini_request(openai_request)
-        
-        # 3. 提取字段 - 包括 tools 和 toolConfig！
-        contents = gemini_dict.get("contents", [])
-        generation_config = gemini_dict.get("generationConfig", {})
-        system_instruction = gemini_dict.get("systemInstruction")
-        tools = gemini_dict.get("tools")  # 关键修复：提取工具定义
-        tool_config = gemini_dict.get("toolConfig")  # 关键修复：提取工具配置
+        if prepared is None:
+            prepared = await self.build_request_payload(model, messages, **kwargs)
+        gemini_model, contents, generation_config, system_instruction, tools, tool_config = self._unpack_prepared(prepared)
         
         # 打印工具信息
         if tools:
@@ -617,7 +669,7 @@ class AntigravityClient:
             tools=tools,  # 关键修复：传递工具定义
             tool_config=tool_config  # 关键修复：传递工具配置
         ):
-            yield self._convert_to_openai_stream(chunk, model, server_base_url)
+            yield await self._convert_to_openai_stream(chunk, model, server_base_url)
     
     async def chat_completions_fake_stream(
         self,
@@ -639,7 +691,7 @@ class AntigravityClient:
         
         # 2. 使用完整版转换器
         from app.services.openai2gemini_full import convert_openai_to_gemini_request
-        gemini_dict = await convert_openai_to_gemini_request(openai_request)
+        gemini_dict = await convert_openai_to_gemini_request(openai_request, cache_key=self.user_id)
         
         # 3. 提取字段 - 包括 tools 和 toolConfig！
         contents = gemini_dict.get("contents", [])
@@ -660,7 +712,7 @@ class AntigravityClient:
         
         # 创建请求任务 - 传递 tools 和 tool_config！
         request_task = asyncio.create_task(
-            self.generate_content(
+            self.generate_content_coalesced(
                 gemini_model, 
                 contents, 
                 generation_config, 
@@ -799,87 +851,6 @@ class AntigravityClient:
                         print(f"[AntigravityClient] 已在最后一个 assistant 消息开头插入思考块（含跳过验证签名）", flush=True)
                     break
     
-    def _convert_messages_to_contents(self, messages: list) -> tuple:
-        """将OpenAI消息格式转换为Gemini contents格式"""
-        contents = []
-        system_instructions = []
-        
-        for msg in messages:
-            role = msg.get("role", "user")
-            content = msg.get("content", "")
-            
-            if role == "system":
-                if isinstance(content, str):
-                    system_instructions.append(content)
-                elif isinstance(content, list):
-                    for item in content:
-                        if isinstance(item, dict) and item.get("type") == "text":
-                            system_instructions.append(item.get("text", ""))
-                        elif isinstance(item, str):
-                            system_instructions.append(item)
-                continue
-            
-            gemini_role = "user" if role == "user" else "model"
-            
-            # 处理多模态内容
-            parts = []
-            if isinstance(content, str):
-                parts.append({"text": content})
-            elif isinstance(content, list):
-                for item in content:
-                    if isinstance(item, dict):
-                        if item.get("type") == "text":
-                            parts.append({"text": item.get("text", "")})
-                        elif item.get("type") == "image_url":
-                            image_url = item.get("image_url", {})
-                            url = image_url.get("url", "") if isinstance(image_url, dict) else image_url
-                            if url.startswith("data:"):
-                                try:
-                                    header, base64_data = url.split(",", 1)
-                                    mime_type = header.split(":")[1].split(";")[0]
-                                    parts.append({
-                                        "inlineData": {
-                                            "mimeType": mime_type,
-                                            "data": base64_data
-                                        }
-                                    })
-                                except Exception as e:
-                                    print(f"[AntigravityClient] ⚠️ 解析图片数据失败: {e}", flush=True)
-                            else:
-                                parts.append({
-                                    "fileData": {
-                                        "mimeType": "image/jpeg",
-                                        "fileUri": url
-                                    }
-                                })
-                        elif "text" in item and "type" not in item:
-                            parts.append({"text": item["text"]})
-                        elif "inlineData" in item:
-                            parts.append({"inlineData": item["inlineData"]})
-                        elif "fileData" in item:
-                            parts.append({"fileData": item["fileData"]})
-                    elif isinstance(item, str):
-                        parts.append({"text": item})
-            
-            if not parts:
-                parts.append({"text": ""})
-            
-            contents.append({
-                "role": gemini_role,
-                "parts": parts
-            })
-        
-        # 构建 systemInstruction
-        system_instruction = None
-        if system_instructions:
-            combined = "\n\n".join(system_instructions)
-            system_instruction = {"parts": [{"text": combined}]}
-        
-        if not contents:
-            contents.append({"role": "user", "parts": [{"text": "请根据系统指令回答。"}]})
-        
-        return contents, system_instruction
-    
     def _map_model_name(self, model: str) -> str:
         """映射模型名称 - 只做前缀去除，Claude映射在 _normalize_antigravity_request 中完成"""
         # 移除 agy- 前缀 (CatieCli 自定义)
@@ -918,93 +889,92 @@ class AntigravityClient:
             "total_tokens": usage_metadata.get("totalTokenCount", 0),
         }
     
-    def _convert_to_openai_response(self, gemini_response: dict, model: str, server_base_url: str = None) -> dict:
-        """将Gemini响应转换为OpenAI格式 - 支持工具调用"""
-        from app.services.openai2gemini_full import extract_tool_calls_from_parts
+    def _map_finish_reason(self, gemini_finish_reason: Optional[str], has_tool_calls: bool) -> Optional[str]:
+        """将 Gemini 的结束原因映射为 OpenAI 的 finish_reason，未知原因返回 None"""
+        if gemini_finish_reason == "STOP":
+            return "tool_calls" if has_tool_calls else "stop"
+        if gemini_finish_reason == "MAX_TOKENS":
+            return "length"
+        if gemini_finish_reason in ("SAFETY", "RECITATION"):
+            return "content_filter"
+        return None
+    
+    def _collect_openai_parts(self, parts: List[Part], is_streaming: bool, on_image: Callable[[Blob], str]) -> tuple:
+        """
+        遍历一次响应的 IR parts，提取 OpenAI 消息需要的内容
+        
+        Args:
+            parts: GeminiResponse.parse 得到的 parts
+            is_streaming: 流式响应的 tool_call 需要 index 字段
+            on_image: 处理图片（inlineData），返回要追加到 content 的文本
         
+        Returns:
+            (content, reasoning_content, tool_calls)
+        """
+        content = ""
+        reasoning_content = ""
+        tool_calls = []
+        for idx, part in enumerate(parts):
+            if part.function_call is not None:
+                tool_calls.append(build_openai_tool_call(part, idx if is_streaming else None))
+            
+            # 处理思考内容 (thought: True 或 有 thoughtSignature)
+            if part.text is not None:
+                if part.is_thinking:
+                    reasoning_content += part.text
+                # 过滤掉 Gemini API 的特殊标记（精确匹配 <-XXX-> 格式）
+                elif part.text and not _SPECIAL_MARKER_RE.fullmatch(part.text.strip()):
+                    content += part.text
+            elif part.inline_data is not None:
+                if part.inline_data.data:
+                    content += on_image(part.inline_data)
+            # 处理代码执行
+            elif part.executable_code is not None:
+                lang = part.executable_code.language.lower()
+                content += f"\n```{lang}\n{part.executable_code.code}\n```\n"
+            # 处理代码执行结果
+            elif part.code_result is not None:
+                output = part.code_result.output
+                if output:
+                    label = "output" if part.code_result.outcome == "OUTCOME_OK" else "error"
+                    content += f"\n```{label}\n{output}\n```\n"
+        return content, reasoning_content, tool_calls
+    
+    async def _save_image_markdown(self, data: str, mime_type: str, server_base_url: str = None) -> tuple:
+        """保存图片到本地，返回 (Markdown 图片文本, 相对 URL)；保存失败时内嵌 data URL，相对 URL 为 None"""
+        from app.services.image_storage import ImageStorage
+        relative_url = await ImageStorage.save_base64_image_async(data, mime_type)
+        if relative_url:
+            final_url = f"{server_base_url}{relative_url}" if server_base_url else relative_url
+            return f"![Generated Image]({final_url})", relative_url
+        return f"![Generated Image](data:{mime_type};base64,{data})", None
+    
+    async def _convert_to_openai_response(self, gemini_response: dict, model: str, server_base_url: str = None) -> dict:
+        """将Gemini响应转换为OpenAI格式 - 支持工具调用"""
         content = ""
         reasoning_content = ""
         tool_calls = []
         finish_reason = "stop"
         
-        response_data = gemini_response.get("response", gemini_response)
-        
-        # 提取 usageMetadata
-        usage_metadata = response_data.get("usageMetadata")
-        
-        if "candidates" in response_data and response_data["candidates"]:
-            candidate = response_data["candidates"][0]
-            gemini_finish_reason = candidate.get("finishReason", "STOP")
-            
-            if "content" in candidate and "parts" in candidate["content"]:
-                parts = candidate["content"]["parts"]
-                print(f"[AntigravityClient] 响应 parts 数量: {len(parts)}, 类型: {[list(p.keys()) for p in parts]}", flush=True)
-                
-                # 使用完整转换器提取工具调用
-                tool_calls, text_content = extract_tool_calls_from_parts(parts, is_streaming=False)
-                
-                # 处理其他内容
-                for part in parts:
-                    # 处理思考内容 (thought: True 或 有 thoughtSignature)
-                    is_thinking = part.get("thought", False) or "thoughtSignature" in part
-                    if "text" in part and is_thinking:
-                        reasoning_content += part.get("text", "")
-                    # 处理普通文本 (非思考)
-                    elif "text" in part and not is_thinking:
-                        text = part.get("text", "")
-                        # 过滤掉 Gemini API 的特殊标记（精确匹配 <-XXX-> 格式）
-                        import re
-                        if text and not re.fullmatch(r'^<-[A-Z_]+->$', text.strip()):
-                            content += text
-                    # 处理图片 (inlineData)
-                    elif "inlineData" in part:
-                        inline_data = part["inlineData"]
-                        mime_type = inline_data.get("mimeType", "image/png")
-                        data = inline_data.get("data", "")
-                        if data:
-                            # 保存图片到本地并获取 URL
-                            from app.services.image_storage import ImageStorage
-                            relative_url = ImageStorage.save_base64_image(data, mime_type)
-                            
-                            if relative_url:
-                                if server_base_url:
-                                    final_url = f"{server_base_url}{relative_url}"
-                                else:
-                                    final_url = relative_url
-                                content += f"![Generated Image]({final_url})"
-                            else:
-                                data_url = f"data:{mime_type};base64,{data}"
-                                content += f"![Generated Image]({data_url})"
-                    # 处理代码执行
-                    elif "executableCode" in part:
-                        exec_code = part["executableCode"]
-                        lang = exec_code.get("language", "python").lower()
-                        code = exec_code.get("code", "")
-                        content += f"\n```{lang}\n{code}\n```\n"
-                    # 处理代码执行结果
-                    elif "codeExecutionResult" in part:
-                        result = part["codeExecutionResult"]
-                        outcome = result.get("outcome")
-                        output = result.get("output", "")
-                        if output:
-                            label = "output" if outcome == "OUTCOME_OK" else "error"
-                            content += f"\n```{label}\n{output}\n```\n"
-            
-            # 确定 finish_reason
-            if tool_calls:
-                if gemini_finish_reason == "STOP":
-                    finish_reason = "tool_calls"
-                elif gemini_finish_reason == "MAX_TOKENS":
-                    finish_reason = "length"
-                elif gemini_finish_reason in ["SAFETY", "RECITATION"]:
-                    finish_reason = "content_filter"
-            else:
-                if gemini_finish_reason == "STOP":
-                    finish_reason = "stop"
-                elif gemini_finish_reason == "MAX_TOKENS":
-                    finish_reason = "length"
-                elif gemini_finish_reason in ["SAFETY", "RECITATION"]:
-                    finish_reason = "content_filter"
+        parsed = GeminiResponse.parse(gemini_response)
+        if parsed.has_candidate:
+            print(f"[AntigravityClient] 响应 parts 数量: {len(parsed.parts)}", flush=True)
+            # 先并发保存所有图片（与 _collect_openai_parts 输出图片的条件一致），再按顺序填入 content
+            blobs = [
+                part.inline_data for part in parsed.parts
+                if part.text is None and part.inline_data is not None and part.inline_data.data
+            ]
+            saved = await asyncio.gather(*(
+                self._save_image_markdown(blob.data, blob.mime_type, server_base_url) for blob in blobs
+            ))
+            markdowns = iter([markdown for markdown, _ in saved])
+            content, reasoning_content, tool_calls = self._collect_openai_parts(
+                parsed.parts,
+                is_streaming=False,
+                on_image=lambda blob: next(markdowns),
+            )
+            # 没有 finishReason 按 STOP 处理，未知原因保持 stop
+            finish_reason = self._map_finish_reason(parsed.finish_reason or "STOP", bool(tool_calls)) or "stop"
         
         # 构建消息
         message = {"role": "assistant"}
@@ -1029,138 +999,62 @@ class AntigravityClient:
                 "message": message,
                 "finish_reason": finish_reason
             }],
-            "usage": self._convert_usage_metadata(usage_metadata)
+            "usage": self._convert_usage_metadata(parsed.usage)
         }
     
-    def _get_image_hash(self, base64_data: str) -> str:
-        """计算图片 base64 数据的哈希值（用于去重）"""
-        import hashlib
-        # 使用长度 + 前1000 + 后1000 计算hash，确保能正确区分不同图片
-        data_len = len(base64_data)
-        prefix = base64_data[:1000] if data_len >= 1000 else base64_data
-        suffix = base64_data[-1000:] if data_len >= 1000 else ""
-        sample = f"{data_len}:{prefix}:{suffix}"
-        return hashlib.md5(sample.encode()).hexdigest()
+    def _stash_stream_image(self, blob: Blob) -> str:
+        """流式模式下暂存图片，只保留最大的一张（通常是最终的高分辨率版本），结束时再保存"""
+        if not hasattr(self, '_stream_pending_image'):
+            self._stream_pending_image = None
+            self._stream_image_count = 0
+        
+        self._stream_image_count += 1
+        img_size = len(blob.data)
+        if self._stream_pending_image is None or img_size > self._stream_pending_image.get("size", 0):
+            self._stream_pending_image = {
+                "data": blob.data,
+                "mime_type": blob.mime_type,
+                "size": img_size,
+                "index": self._stream_image_count
+            }
+            print(f"[Stream] 📷 暂存第{self._stream_image_count}张图片 (size={img_size//1024}KB)", flush=True)
+        else:
+            print(f"[Stream] ⏭️ 跳过较小图片 (第{self._stream_image_count}张, size={img_size//1024}KB)", flush=True)
+        return ""
+    
+    async def _flush_stream_image(self, server_base_url: str = None) -> str:
+        """流式结束时保存暂存的图片，返回要追加到 content 的文本"""
+        pending = getattr(self, '_stream_pending_image', None)
+        if not pending:
+            return ""
+        markdown, relative_url = await self._save_image_markdown(pending["data"], pending["mime_type"], server_base_url)
+        if relative_url:
+            print(f"[Stream] 🖼️ 最终图片已保存 (第{pending['index']}张, size={pending['size']//1024}KB): {relative_url}", flush=True)
+        # 清理暂存
+        self._stream_pending_image = None
+        self._stream_image_count = 0
+        return markdown
     
-    def _convert_to_openai_stream(self, chunk_data: str, model: str, server_base_url: str = None) -> str:
+    async def _convert_to_openai_stream(self, chunk_data: str, model: str, server_base_url: str = None) -> str:
         """将Gemini流式响应转换为OpenAI SSE格式 - 支持工具调用、思维链和usage统计"""
         try:
-            from app.services.openai2gemini_full import extract_tool_calls_from_parts
-            
-            data = json.loads(chunk_data)
+            parsed = GeminiResponse.parse(json.loads(chunk_data))
             content = ""
             reasoning_content = ""
             tool_calls = []
             finish_reason = None
-            usage = None
-            
-            response_data = data.get("response", data)
             
             # 提取 usageMetadata（通常在最后一个 chunk 中）
-            if "usageMetadata" in response_data:
-                usage = self._convert_usage_metadata(response_data["usageMetadata"])
+            usage = self._convert_usage_metadata(parsed.usage) if parsed.usage is not None else None
             
-            if "candidates" in response_data and response_data["candidates"]:
-                candidate = response_data["candidates"][0]
-                gemini_finish_reason = candidate.get("finishReason")
-                
-                if "content" in candidate and "parts" in candidate["content"]:
-                    parts = candidate["content"]["parts"]
-                    
-                    # 调试：打印 parts 结构
-                    # print(f"[Stream Debug] parts数量: {len(parts)}, 内容: {json.dumps(parts, ensure_ascii=False)[:500]}", flush=True)
-                    
-                    # 使用完整转换器提取工具调用 (流式需要 index)
-                    tool_calls, text_content = extract_tool_calls_from_parts(parts, is_streaming=True)
-                    
-                    for part in parts:
-                        # 处理思考内容 (thought: True 或 有 thoughtSignature)
-                        is_thinking = part.get("thought", False) or "thoughtSignature" in part
-                        if "text" in part and is_thinking:
-                            thinking_text = part.get("text", "")
-                            if thinking_text:
-                                reasoning_content += thinking_text
-                                # 调试：打印思维链内容
-                                # print(f"[Stream Debug] 🧠 检测到思维链: {thinking_text[:100]}...", flush=True)
-                        # 处理普通文本 (非思考，且未被 extract_tool_calls_from_parts 处理)
-                        elif "text" in part and not is_thinking:
-                            text = part.get("text", "")
-                            # 过滤掉 Gemini API 的特殊标记（精确匹配 <-XXX-> 格式）
-                            import re
-                            if text and not re.fullmatch(r'^<-[A-Z_]+->$', text.strip()):
-                                content += text
-                        # 处理图片 (inlineData) - 只保留最后一张（最大的）图片
-                        elif "inlineData" in part:
-                            inline_data = part["inlineData"]
-                            mime_type = inline_data.get("mimeType", "image/png")
-                            img_data = inline_data.get("data", "")
-                            if img_data:
-                                # 初始化图片暂存（流式模式下，后面的图片会覆盖前面的）
-                                if not hasattr(self, '_stream_pending_image'):
-                                    self._stream_pending_image = None
-                                    self._stream_image_count = 0
-                                
-                                self._stream_image_count += 1
-                                img_size = len(img_data)
-                                
-                                # 保存当前图片数据，等待后续判断
-                                # 优先选择更大的图片（通常是最终的高分辨率版本）
-                                if self._stream_pending_image is None or img_size > self._stream_pending_image.get("size", 0):
-                                    self._stream_pending_image = {
-                                        "data": img_data,
-                                        "mime_type": mime_type,
-                                        "size": img_size,
-                                        "index": self._stream_image_count
-                                    }
-                                    print(f"[Stream] 📷 暂存第{self._stream_image_count}张图片 (size={img_size//1024}KB)", flush=True)
-                                else:
-                                    print(f"[Stream] ⏭️ 跳过较小图片 (第{self._stream_image_count}张, size={img_size//1024}KB)", flush=True)
-                        # 处理代码执行
-                        elif "executableCode" in part:
-                            exec_code = part["executableCode"]
-                            lang = exec_code.get("language", "python").lower()
-                            code = exec_code.get("code", "")
-                            content += f"\n```{lang}\n{code}\n```\n"
-                        # 处理代码执行结果
-                        elif "codeExecutionResult" in part:
-                            result = part["codeExecutionResult"]
-                            outcome = result.get("outcome")
-                            output = result.get("output", "")
-                            if output:
-                                label = "output" if outcome == "OUTCOME_OK" else "error"
-                                content += f"\n```{label}\n{output}\n```\n"
-                
-                # 确定 finish_reason
-                if gemini_finish_reason:
-                    if tool_calls and gemini_finish_reason == "STOP":
-                        finish_reason = "tool_calls"
-                    elif gemini_finish_reason == "STOP":
-                        finish_reason = "stop"
-                    elif gemini_finish_reason == "MAX_TOKENS":
-                        finish_reason = "length"
-                    elif gemini_finish_reason in ["SAFETY", "RECITATION"]:
-                        finish_reason = "content_filter"
-                    
+            if parsed.has_candidate:
+                content, reasoning_content, tool_calls = self._collect_openai_parts(
+                    parsed.parts, is_streaming=True, on_image=self._stash_stream_image
+                )
+                if parsed.finish_reason:
+                    finish_reason = self._map_finish_reason(parsed.finish_reason, bool(tool_calls))
                     # 流式结束时，处理暂存的图片（只保存最大的那张）
-                    if hasattr(self, '_stream_pending_image') and self._stream_pending_image:
-                        pending = self._stream_pending_image
-                        from app.services.image_storage import ImageStorage
-                        relative_url = ImageStorage.save_base64_image(pending["data"], pending["mime_type"])
-                        
-                        if relative_url:
-                            if server_base_url:
-                                final_url = f"{server_base_url}{relative_url}"
-                            else:
-                                final_url = relative_url
-                            content += f"![Generated Image]({final_url})"
-                            print(f"[Stream] 🖼️ 最终图片已保存 (第{pending['index']}张, size={pending['size']//1024}KB): {relative_url}", flush=True)
-                        else:
-                            data_url = f"data:{pending['mime_type']};base64,{pending['data']}"
-                            content += f"![Generated Image]({data_url})"
-                        
-                        # 清理暂存
-                        self._stream_pending_image = None
-                        self._stream_image_count = 0
+                    content += await self._flush_stream_image(server_base_url)
             
             # 构建 delta
             delta = {}
@@ -1170,7 +1064,6 @@ class AntigravityClient:
                 delta["content"] = content
             if reasoning_content:
                 delta["reasoning_content"] = reasoning_content
-                # print(f"[Stream Debug] ✅ 返回思维链 chunk: {len(reasoning_content)} chars", flush=True)
             
             # 重要：即使没有 content 和 tool_calls，只要有 reasoning_content 也要返回
             if not delta and finish_reason is None:
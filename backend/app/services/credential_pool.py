@@ -599,6 +599,10 @@ class CredentialPool:
             cooldowns[model_group] = reset_time.isoformat()
             credential.model_cooldowns = json.dumps(cooldowns)
             
+            # 修正配额预测（429 时的计数就是实际额度）
+            from app.services.quota_forecast import quota_forecaster
+            quota_forecaster.observe_exhaustion(credential, model_group, reset_time)
+            
             await db.commit()
             
             print(f"[CredentialPool] ❄️ 凭证 {credential.email} 模型组 {model_group} 冷却至 {reset_time}", flush=True)
@@ -822,16 +826,30 @@ class CredentialPool:
         
         # 筛选不在 CD 中的凭证
         # 对于 Antigravity 模式，还需要检查模型组冷却（429 导致的）
+        from app.services.quota_poller import quota_poller
+        from app.services.quota_forecast import quota_forecaster
+        forecast_skipped = False
+        
         def is_credential_available(c):
+            nonlocal forecast_skipped
             # 检查常规 CD
             if CredentialPool.is_credential_in_cd(c, model_group):
                 return False
+            # 配额快照显示已耗尽的凭证直接跳过（不必等它返回 429）
+            if quota_poller.is_exhausted(c.id, mode, model):
+                return False
+            # 按使用计数预计即将耗尽的凭证也提前跳过
+            if quota_forecaster.is_near_exhaustion(c, mode, model):
+                forecast_skipped = True
+                return False
             # Antigravity 模式：检查模型组冷却（429 配额耗尽导致）
             if agy_model_group and CredentialPool.is_credential_in_model_group_cooldown(c, agy_model_group):
                 return False
             return True
         
         available_credentials = [c for c in credentials if is_credential_available(c)]
+        if forecast_skipped:
+            quota_forecaster.skipped += 1
         
         total_count = len(credentials)
         available_count = len(available_credentials)
@@ -923,7 +941,7 @@ class CredentialPool:
         try:
             async with httpx.AsyncClient(timeout=15) as client:
                 response = await client.post(
-                    "https://oauth2.googleapis.com/token",
+                    settings.google_token_url,
                     data={
                         "client_id": client_id,
                         "client_secret": client_secret,
@@ -1298,6 +1316,20 @@ class CredentialPool:
             else:
                 cred.last_used_flash = last_used
             
+            # 每日配额耗尽（带 quotaResetTimeStamp 或 CD 很长）时修正配额预测，普通 RPM 限速不算
+            reset_at = None
+            try:
+                reset_ts = CredentialPool.parse_quota_reset_timestamp(json.loads(error_text))
+                if reset_ts:
+                    reset_at = datetime.utcfromtimestamp(reset_ts)
+            except Exception:
+                pass
+            if reset_at or cd_seconds >= 3600:
+                from app.services.quota_forecast import get_forecast_group, quota_forecaster
+                quota_forecaster.observe_exhaustion(
+                    cred, get_forecast_group("geminicli", model), reset_at or now + timedelta(seconds=cd_seconds)
+                )
+            
             # 记录错误信息到 last_error（截取前 500 字符以保持简洁）
             cred.last_error = f"429限速 CD {cd_seconds}秒 ({model_group}) - {error_text[:300] if error_text else ''}"
             cred.failed_requests = (cred.failed_requests or 0) + 1
@@ -1454,7 +1486,7 @@ class CredentialPool:
         
         async with httpx.AsyncClient(timeout=15.0) as client:
             try:
-                load_url = "https://cloudcode-pa.googleapis.com/v1internal:loadCodeAssist"
+                load_url = f"{settings.code_assist_endpoint}/v1internal:loadCodeAssist"
                 load_payload = {
                     "metadata": {
                         "ideType": "VSCODE",
@@ -1551,7 +1583,7 @@ class CredentialPool:
             print(f"[检测账号] 使用连续请求检测 RPM 限制...", flush=True)
             
             headers["Content-Type"] = "application/json"
-            url = "https://cloudcode-pa.googleapis.com/v1internal:generateContent"
+            url = f"{settings.code_assist_endpoint}/v1internal:generateContent"
             payload = {
                 "model": "gemini-2.0-flash",
                 "project": project_id,
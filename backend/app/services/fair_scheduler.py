@@ -0,0 +1,298 @@
+"""
+凭证池加权公平调度器
+
+公共凭证池的并发能力有限，高峰期所有用户平等争抢会让捐赠凭证的用户得不到保障。
+这里按用户身份划分优先级通道（lane），通道之间按权重做加权公平排队（WFQ），
+通道内部按用户轮询，避免单个重度用户把同通道的其他人饿死。
+
+通道划分：
+- admin: 管理员
+- contributor_plus: 公开凭证数 >= fair_scheduler_plus_min_creds（或捐赠了 3.0 凭证）
+- contributor: 至少有一个公开凭证
+- base: 未捐赠凭证的用户
+
+只有在 fair_scheduler_enabled 开启且并发占满时才会排队，否则直接放行。
+"""
+import asyncio
+import time
+from collections import OrderedDict, deque
+from typing import AsyncIterator, Dict
+
+from sqlalchemy import select, func, case
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import settings
+
+
+LANES = ["admin", "contributor_plus", "contributor", "base"]
+
+LANE_NAMES = {
+    "admin": "管理员",
+    "contributor_plus": "高级贡献者",
+    "contributor": "贡献者",
+    "base": "普通用户",
+}
+
+
+def get_lane_weight(lane: str) -> int:
+    """获取通道权重（至少为 1）"""
+    weights = {
+        "admin": settings.fair_scheduler_weight_admin,
+        "contributor_plus": settings.fair_scheduler_weight_contributor_plus,
+        "contributor": settings.fair_scheduler_weight_contributor,
+        "base": settings.fair_scheduler_weight_base,
+    }
+    return max(1, weights.get(lane, 1))
+
+
+async def resolve_lane(db: AsyncSession, user, mode: str = "geminicli") -> str:
+    """根据用户的贡献情况确定调度通道"""
+    if user.is_admin:
+        return "admin"
+
+    from app.models.user import Credential
+
+    result = await db.execute(
+        select(
+            func.count(Credential.id).label("total"),
+            func.sum(case((Credential.model_tier == "3", 1), else_=0)).label("tier_30")
+        )
+        .where(Credential.user_id == user.id)
+        .where(Credential.api_type == mode)
+        .where(Credential.is_public == True)
+        .where(Credential.is_active == True)
+    )
+    row = result.one()
+    public_count = row.total or 0
+    tier3_count = row.tier_30 or 0
+
+    if public_count <= 0:
+        return "base"
+    if public_count >= settings.fair_scheduler_plus_min_creds or (mode == "geminicli" and tier3_count > 0):
+        return "contributor_plus"
+    return "contributor"
+
+
+class SchedulerTicket:
+    """调度许可，release() 可重复调用"""
+
+    __slots__ = ("scheduler", "lane", "user_id", "wait_ms", "_released")
+
+    def __init__(self, scheduler: "FairScheduler", lane: str, user_id: int, wait_ms: float = 0):
+        self.scheduler = scheduler
+        self.lane = lane
+        self.user_id = user_id
+        self.wait_ms = wait_ms
+        self._released = False
+
+    def detach(self) -> "SchedulerTicket":
+        """调度关闭时发放的许可，不占用名额"""
+        self._released = True
+        return self
+
+    def release(self):
+        """归还并发名额"""
+        if self._released:
+            return
+        self._released = True
+        self.scheduler._release()
+
+
+class _LaneState:
+    """单个通道的排队状态和统计"""
+
+    def __init__(self):
+        # {user_id: deque([future, ...])}，按用户轮询
+        self.queues: "OrderedDict[int, deque]" = OrderedDict()
+        self.queued = 0
+        self.vtime = 0.0  # 虚拟完成时间
+        # 统计
+        self.granted = 0
+        self.queued_total = 0
+        self.timeouts = 0
+        self.total_wait_ms = 0.0
+        self.max_wait_ms = 0.0
+        self.recent_waits: deque = deque(maxlen=512)
+
+    def record_wait(self, wait_ms: float):
+        self.granted += 1
+        self.total_wait_ms += wait_ms
+        self.max_wait_ms = max(self.max_wait_ms, wait_ms)
+        self.recent_waits.append(wait_ms)
+
+
+class FairScheduler:
+    """单个凭证池（geminicli / antigravity）的加权公平调度器"""
+
+    def __init__(self, mode: str):
+        self.mode = mode
+        self.inflight = 0
+        self.lanes: Dict[str, _LaneState] = {lane: _LaneState() for lane in LANES}
+
+    @property
+    def capacity(self) -> int:
+        if self.mode == "antigravity":
+            return settings.fair_scheduler_agy_max_concurrency
+        return settings.fair_scheduler_max_concurrency
+
+    def _has_waiters(self) -> bool:
+        return any(state.queued > 0 for state in self.lanes.values())
+
+    async def acquire(self, lane: str, user_id: int) -> SchedulerTicket:
+        """
+        申请一个并发名额
+
+        并发未满且无人排队时直接放行；否则进入对应通道排队，
+        超过 fair_scheduler_max_wait 秒仍未轮到则抛出 TimeoutError。
+        """
+        if lane not in self.lanes:
+            lane = "base"
+        state = self.lanes[lane]
+
+        if not settings.fair_scheduler_enabled or self.capacity <= 0:
+            return SchedulerTicket(self, lane, user_id).detach()
+
+        if self.inflight < self.capacity and not self._has_waiters():
+            self.inflight += 1
+            state.record_wait(0)
+            return SchedulerTicket(self, lane, user_id)
+
+        # 通道由空闲变为排队时，虚拟时间追平当前最小值，防止空闲期间"攒积分"
+        if state.queued == 0:
+            active = [s.vtime for s in self.lanes.values() if s.queued > 0]
+            if active:
+                state.vtime = max(state.vtime, min(active))
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        state.queues.setdefault(user_id, deque()).append(future)
+        state.queued += 1
+        state.queued_total += 1
+        enqueued_at = time.time()
+
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=settings.fair_scheduler_max_wait)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                # 恰好在超时的同时被放行，归还名额
+                self._release()
+            else:
+                future.cancel()
+                self._remove_waiter(state, user_id, future)
+            if isinstance(e, asyncio.TimeoutError):
+                state.timeouts += 1
+                print(f"[FairScheduler] ⏱️ [{self.mode}] 通道 {lane} 用户 {user_id} 排队超时", flush=True)
+            raise
+
+        wait_ms = (time.time() - enqueued_at) * 1000
+        state.record_wait(wait_ms)
+        if wait_ms > 1000:
+            print(f"[FairScheduler] [{self.mode}] 通道 {lane} 用户 {user_id} 排队 {wait_ms:.0f}ms 后获得名额", flush=True)
+        return SchedulerTicket(self, lane, user_id, wait_ms)
+
+    def _remove_waiter(self, state: _LaneState, user_id: int, future: asyncio.Future):
+        queue = state.queues.get(user_id)
+        if queue is None:
+            return
+        try:
+            queue.remove(future)
+            state.queued -= 1
+        except ValueError:
+            return
+        if not queue:
+            del state.queues[user_id]
+
+    def _release(self):
+        self.inflight = max(0, self.inflight - 1)
+        self._dispatch()
+
+    def _dispatch(self):
+        """在有空余名额时按加权公平顺序唤醒排队者"""
+        while self.inflight < max(1, self.capacity):
+            # 选虚拟时间最小的非空通道
+            candidates = [(s.vtime, LANES.index(name), name) for name, s in self.lanes.items() if s.queued > 0]
+            if not candidates:
+                return
+            _, _, lane = min(candidates)
+            state = self.lanes[lane]
+
+            # 通道内按用户轮询：取队首用户，发放后移到队尾
+            user_id, queue = next(iter(state.queues.items()))
+            future = queue.popleft()
+            state.queued -= 1
+            if queue:
+                state.queues.move_to_end(user_id)
+            else:
+                del state.queues[user_id]
+
+            if future.done():
+                continue
+
+            state.vtime += 1.0 / get_lane_weight(lane)
+            self.inflight += 1
+            future.set_result(True)
+
+    def get_stats(self) -> dict:
+        """获取各通道排队统计"""
+        lanes = {}
+        for name, state in self.lanes.items():
+            waits = sorted(state.recent_waits)
+
+            def percentile(p: float) -> float:
+                if not waits:
+                    return 0
+                return round(waits[min(len(waits) - 1, int(len(waits) * p))], 1)
+
+            lanes[name] = {
+                "name": LANE_NAMES.get(name, name),
+                "weight": get_lane_weight(name),
+                "queued": state.queued,
+                "waiting_users": len(state.queues),
+                "granted": state.granted,
+                "queued_total": state.queued_total,
+                "timeouts": state.timeouts,
+                "avg_wait_ms": round(state.total_wait_ms / state.granted, 1) if state.granted else 0,
+                "p50_wait_ms": percentile(0.5),
+                "p95_wait_ms": percentile(0.95),
+                "max_wait_ms": round(state.max_wait_ms, 1),
+            }
+        return {
+            "mode": self.mode,
+            "enabled": settings.fair_scheduler_enabled,
+            "capacity": self.capacity,
+            "inflight": self.inflight,
+            "lanes": lanes,
+        }
+
+
+# 全局调度器实例（每种凭证池一个）
+schedulers: Dict[str, FairScheduler] = {
+    "geminicli": FairScheduler("geminicli"),
+    "antigravity": FairScheduler("antigravity"),
+}
+
+
+def get_scheduler(mode: str = "geminicli") -> FairScheduler:
+    return schedulers.get(mode) or schedulers["geminicli"]
+
+
+async def acquire_pool_slot(db: AsyncSession, user, mode: str = "geminicli") -> SchedulerTicket:
+    """确定用户通道并申请凭证池并发名额"""
+    scheduler = get_scheduler(mode)
+    if not settings.fair_scheduler_enabled:
+        return SchedulerTicket(scheduler, "base", user.id).detach()
+    lane = await resolve_lane(db, user, mode)
+    return await scheduler.acquire(lane, user.id)
+
+
+async def release_when_done(ticket: SchedulerTicket, stream: AsyncIterator) -> AsyncIterator:
+    """包装流式响应：生成器结束、抛异常或客户端断开时都归还名额"""
+    try:
+        async for chunk in stream:
+            yield chunk
+    finally:
+        ticket.release()
+
+
+def get_all_stats() -> dict:
+    return {mode: scheduler.get_stats() for mode, scheduler in schedulers.items()}
@@ -2,17 +2,23 @@ import httpx
 import json
 from typing import AsyncGenerator, Optional, Dict, Any
 from app.config import settings
+from app.services.inline_media import json_request, parse_data_url, preview_json
+from app.services.prefix_cache import prefix_cache
+from app.services.protocol_ir import Blob, FileRef, GeminiResponse, Message, Part
+from app.services.request_coalescer import coalesced_generate
 
 
 class GeminiClient:
     """Gemini API 客户端 - 使用 Google 内部 API"""
     
     # 内部 API 端点
-    INTERNAL_API_BASE = "https://cloudcode-pa.googleapis.com"
+    INTERNAL_API_BASE = settings.code_assist_endpoint
     
-    def __init__(self, access_token: str, project_id: str = None):
+    def __init__(self, access_token: str, project_id: str = None, user_id: int = None):
         self.access_token = access_token
         self.project_id = project_id or ""
+        self.user_id = user_id  # 用于合并同一用户的相同在途请求
+        self.last_call_shared = False  # 最近一次非流式调用的结果是否共享自其他请求（未占用本凭证）
     
     async def generate_content(
         self,
@@ -76,7 +82,7 @@ class GeminiClient:
             pool=30.0        # 连接池超时
         )
         async with httpx.AsyncClient(timeout=timeout) as client:
-            response = await client.post(url, headers=headers, json=payload)
+            response = await client.post(url, **json_request(payload, headers))
             
             # 打印所有响应头（调试用）
             print(f"[GeminiClient] 响应头: {dict(response.headers)}", flush=True)
@@ -87,9 +93,29 @@ class GeminiClient:
                 raise Exception(f"API Error {response.status_code}: {error_text}")
             result = response.json()
             # 调试：打印原始响应
-            print(f"[GeminiClient] ✅ 原始响应: {json.dumps(result, ensure_ascii=False)[:1000]}", flush=True)
+            print(f"[GeminiClient] ✅ 原始响应: {preview_json(result, 1000)}", flush=True)
             return result
     
+    async def generate_content_coalesced(
+        self,
+        model: str,
+        contents: list,
+        generation_config: Optional[Dict] = None,
+        system_instruction: Optional[Dict] = None
+    ) -> Dict[str, Any]:
+        """生成内容 (非流式)，同一用户同时发起的相同请求只调用一次上游"""
+        self.last_call_shared = False
+        payload = {
+            "contents": contents,
+            "generationConfig": generation_config,
+            "systemInstruction": system_instruction,
+        }
+        result, self.last_call_shared = await coalesced_generate(
+            self.user_id, model, payload,
+            lambda: self.generate_content(model, contents, generation_config, system_instruction)
+        )
+        return result
+    
     async def generate_content_stream(
         self,
         model: str,
@@ -145,7 +171,7 @@ class GeminiClient:
         
         async with httpx.AsyncClient(timeout=120.0) as client:
             async with client.stream(
-                "POST", url, headers=headers, json=payload
+                "POST", url, **json_request(payload, headers)
             ) as response:
                 if response.status_code != 200:
                     error_text = await response.aread()
@@ -227,18 +253,33 @@ class GeminiClient:
         """检查是否使用假流式 - gcli 有假流，没有假非流"""
         return model.startswith("假流/")
     
+    def build_request_payload(self, model: str, messages: list, **kwargs) -> Dict[str, Any]:
+        """构建转换后的 Gemini 请求内容（只做格式转换，不需要凭证；可传给 chat_completions 的 prepared）"""
+        contents, system_instruction = self._convert_messages_to_contents(messages)
+        generation_config = self._build_generation_config(model, kwargs)
+        return {
+            "model": self._map_model_name(model),
+            "contents": contents,
+            "generationConfig": generation_config,
+            "systemInstruction": system_instruction,
+        }
+    
     async def chat_completions(
         self,
         model: str,
         messages: list,
+        prepared: Optional[Dict[str, Any]] = None,
         **kwargs
     ) -> Dict[str, Any]:
-        """OpenAI兼容的chat completions (非流式)"""
-        contents, system_instruction = self._convert_messages_to_contents(messages)
-        generation_config = self._build_generation_config(model, kwargs)
-        gemini_model = self._map_model_name(model)
-        
-        result = await self.generate_content(gemini_model, contents, generation_config, system_instruction)
+        """OpenAI兼容的chat completions (非流式)
+
+        prepared: build_request_payload 的结果（调用方已转换过时传入，避免重复转换）
+        """
+        if prepared is None:
+            prepared = self.build_request_payload(model, messages, **kwargs)
+        result = await self.generate_content_coalesced(
+            prepared["model"], prepared["contents"], prepared["generationConfig"], prepared["systemInstruction"]
+        )
         return self._convert_to_openai_response(result, model)
     
     async def chat_completions_stream(
@@ -280,7 +321,7 @@ class GeminiClient:
         
         # 创建请求任务
         request_task = asyncio.create_task(
-            self.generate_content(gemini_model, contents, generation_config, system_instruction)
+            self.generate_content_coalesced(gemini_model, contents, generation_config, system_instruction)
         )
         
         # 每2秒发送心跳，直到请求完成
@@ -380,88 +421,19 @@ class GeminiClient:
     def _convert_messages_to_contents(self, messages: list) -> tuple:
         """将OpenAI消息格式转换为Gemini contents格式
         
+        同一用户的多轮对话复用上一轮已经转换过的历史消息（见 prefix_cache），
+        返回的 content 与缓存共享，只发给上游、不做修改。
+        
         Returns:
             (contents, system_instruction): contents 列表和系统指令字典
         """
         contents = []
         system_instructions = []
-        
-        for msg in messages:
-            role = msg.get("role", "user")
-            content = msg.get("content", "")
-            
-            if role == "system":
-                # system 可能是字符串或列表
-                if isinstance(content, str):
-                    system_instructions.append(content)
-                elif isinstance(content, list):
-                    for item in content:
-                        if isinstance(item, dict) and item.get("type") == "text":
-                            system_instructions.append(item.get("text", ""))
-                        elif isinstance(item, str):
-                            system_instructions.append(item)
-                continue
-            
-            gemini_role = "user" if role == "user" else "model"
-            
-            # 处理多模态内容（图片+文本）
-            parts = []
-            if isinstance(content, str):
-                # 简单文本
-                parts.append({"text": content})
-            elif isinstance(content, list):
-                # 多模态内容列表
-                for item in content:
-                    if isinstance(item, dict):
-                        # OpenAI 格式: {"type": "text", "text": "..."}
-                        if item.get("type") == "text":
-                            parts.append({"text": item.get("text", "")})
-                        elif item.get("type") == "image_url":
-                            # 处理图片
-                            image_url = item.get("image_url", {})
-                            url = image_url.get("url", "") if isinstance(image_url, dict) else image_url
-                            if url.startswith("data:"):
-                                # Base64 编码的图片
-                                # 格式: data:image/jpeg;base64,/9j/4AAQ...
-                                try:
-                                    header, base64_data = url.split(",", 1)
-                                    mime_type = header.split(":")[1].split(";")[0]
-                                    parts.append({
-                                        "inlineData": {
-                                            "mimeType": mime_type,
-                                            "data": base64_data
-                                        }
-                                    })
-                                except Exception as e:
-                                    print(f"[GeminiClient] ⚠️ 解析图片数据失败: {e}", flush=True)
-                            else:
-                                # URL 图片
-                                parts.append({
-                                    "fileData": {
-                                        "mimeType": "image/jpeg",
-                                        "fileUri": url
-                                    }
-                                })
-                        # Gemini 原生格式: {"text": "..."} 或 {"inlineData": {...}} 或 {"fileData": {...}}
-                        elif "text" in item and "type" not in item:
-                            parts.append({"text": item["text"]})
-                        elif "inlineData" in item:
-                            parts.append({"inlineData": item["inlineData"]})
-                        elif "fileData" in item:
-                            parts.append({"fileData": item["fileData"]})
-                        else:
-                            # 未知格式，尝试作为文本处理
-                            print(f"[GeminiClient] ⚠️ 未知内容格式: {list(item.keys())}", flush=True)
-                    elif isinstance(item, str):
-                        parts.append({"text": item})
-            
-            if not parts:
-                parts.append({"text": ""})
-            
-            contents.append({
-                "role": gemini_role,
-                "parts": parts
-            })
+        converted = prefix_cache.convert(self.user_id, messages, self._convert_message, context="gemini_cli")
+        for texts, content in converted:
+            system_instructions.extend(texts)
+            if content is not None:
+                contents.append(content)
         
         # 构建 systemInstruction
         system_instruction = None
@@ -475,6 +447,77 @@ class GeminiClient:
         
         return contents, system_instruction
     
+    def _parse_message(self, msg: dict) -> tuple:
+        """解析单条 OpenAI 消息，返回 (system 文本列表, IR 消息或 None)"""
+        role = msg.get("role", "user")
+        content = msg.get("content", "")
+        system_instructions = []
+        
+        if role == "system":
+            # system 可能是字符串或列表
+            if isinstance(content, str):
+                system_instructions.append(content)
+            elif isinstance(content, list):
+                for item in content:
+                    if isinstance(item, dict) and item.get("type") == "text":
+                        system_instructions.append(item.get("text", ""))
+                    elif isinstance(item, str):
+                        system_instructions.append(item)
+            return system_instructions, None
+        
+        gemini_role = "user" if role == "user" else "model"
+        
+        # 处理多模态内容（图片+文本）
+        parts = []
+        if isinstance(content, str):
+            # 简单文本
+            parts.append(Part(text=content))
+        elif isinstance(content, list):
+            # 多模态内容列表
+            for item in content:
+                if isinstance(item, dict):
+                    # OpenAI 格式: {"type": "text", "text": "..."}
+                    if item.get("type") == "text":
+                        parts.append(Part(text=item.get("text") or ""))
+                    elif item.get("type") == "image_url":
+                        # 处理图片
+                        image_url = item.get("image_url", {})
+                        url = image_url.get("url", "") if isinstance(image_url, dict) else image_url
+                        if url.startswith("data:"):
+                            # Base64 编码的图片
+                            # 格式: data:image/jpeg;base64,/9j/4AAQ...
+                            # mime 无效或过大时 parse_data_url 抛出 InlineImageError，由路由返回 400
+                            inline = parse_data_url(url)
+                            if inline is not None:
+                                parts.append(Part(inline_data=Blob(*inline)))
+                            else:
+                                print("[GeminiClient] ⚠️ 不是 base64 data URL，已忽略", flush=True)
+                        else:
+                            # URL 图片
+                            parts.append(Part(file_data=FileRef("image/jpeg", url)))
+                    # Gemini 原生格式: {"text": "..."} 或 {"inlineData": {...}} 或 {"fileData": {...}}，原样透传
+                    elif "text" in item and "type" not in item:
+                        parts.append(Part(native=("text", item["text"])))
+                    elif "inlineData" in item:
+                        parts.append(Part(native=("inlineData", item["inlineData"])))
+                    elif "fileData" in item:
+                        parts.append(Part(native=("fileData", item["fileData"])))
+                    else:
+                        # 未知格式，尝试作为文本处理
+                        print(f"[GeminiClient] ⚠️ 未知内容格式: {list(item.keys())}", flush=True)
+                elif isinstance(item, str):
+                    parts.append(Part(text=item))
+        
+        if not parts:
+            parts.append(Part(text=""))
+        
+        return system_instructions, Message(gemini_role, parts)
+    
+    def _convert_message(self, msg: dict) -> tuple:
+        """转换单条消息，返回 (system 文本列表, content 或 None)"""
+        system_instructions, parsed = self._parse_message(msg)
+        return system_instructions, parsed.to_gemini() if parsed is not None else None
+    
     def _map_model_name(self, model: str) -> str:
         """映射模型名称 - 只清理前缀，保留后缀（-search, -maxthinking 等）供 generate_content 使用"""
         # 移除前缀（假流/流式抗截断）- gcli 有假流，没有假非流
@@ -534,24 +577,22 @@ class GeminiClient:
     
     # _get_search_config 已废弃，搜索检测直接在 generate_content 中进行
     
-    def _convert_to_openai_response(self, gemini_response: dict, model: str) -> dict:
-        """将Gemini响应转换为OpenAI格式"""
+    def _collect_text(self, gemini_response: dict) -> tuple:
+        """遍历一次响应的 IR parts，返回 (content, reasoning_content)；只区分 thought 标记，其它类型的 part 忽略"""
         content = ""
         reasoning_content = ""
-        
-        # 内部 API 返回格式是 {"response": {"candidates": ...}}
-        response_data = gemini_response.get("response", gemini_response)
-        
-        if "candidates" in response_data and response_data["candidates"]:
-            candidate = response_data["candidates"][0]
-            if "content" in candidate and "parts" in candidate["content"]:
-                for part in candidate["content"]["parts"]:
-                    text = part.get("text", "")
-                    # 检查是否是 thinking 内容
-                    if part.get("thought", False):
-                        reasoning_content += text
-                    else:
-                        content += text
+        for part in GeminiResponse.parse(gemini_response).parts:
+            text = part.text or ""
+            # 检查是否是 thinking 内容
+            if part.thought:
+                reasoning_content += text
+            else:
+                content += text
+        return content, reasoning_content
+    
+    def _convert_to_openai_response(self, gemini_response: dict, model: str) -> dict:
+        """将Gemini响应转换为OpenAI格式"""
+        content, reasoning_content = self._collect_text(gemini_response)
         
         message = {
             "role": "assistant",
@@ -581,22 +622,7 @@ class GeminiClient:
     def _convert_to_openai_stream(self, chunk_data: str, model: str) -> str:
         """将Gemini流式响应转换为OpenAI SSE格式"""
         try:
-            data = json.loads(chunk_data)
-            content = ""
-            reasoning_content = ""
-            
-            # 内部 API 返回格式是 {"response": {"candidates": ...}}
-            response_data = data.get("response", data)
-            
-            if "candidates" in response_data and response_data["candidates"]:
-                candidate = response_data["candidates"][0]
-                if "content" in candidate and "parts" in candidate["content"]:
-                    for part in candidate["content"]["parts"]:
-                        text = part.get("text", "")
-                        if part.get("thought", False):
-                            reasoning_content += text
-                        else:
-                            content += text
+            content, reasoning_content = self._collect_text(json.loads(chunk_data))
             
             # 构建 delta
             delta = {}
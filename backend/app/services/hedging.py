@@ -0,0 +1,190 @@
+"""
+非流式请求对冲（Hedged Requests）
+
+非流式请求默认会在一个凭证上一直等到 600 秒读超时才换凭证重试。
+开启对冲后，若首个上游调用在该模型历史延迟的指定分位数内仍未返回，
+就在另一个凭证上再发一次相同请求，谁先成功用谁，另一个取消。
+
+额外请求数受对冲预算限制（令牌桶：每个正常请求积累 hedge_budget_percent% 个令牌，
+每次对冲消耗 1 个），避免高峰期把凭证池额度翻倍消耗。
+"""
+import asyncio
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from app.config import settings
+
+
+class LatencyTracker:
+    """按模型记录最近成功请求的延迟"""
+
+    def __init__(self, max_samples: int = 200):
+        self.max_samples = max_samples
+        self.samples: Dict[str, deque] = {}
+
+    def record(self, model: str, latency: float):
+        if model not in self.samples:
+            self.samples[model] = deque(maxlen=self.max_samples)
+        self.samples[model].append(latency)
+
+    def percentile(self, model: str, p: float) -> Optional[float]:
+        """返回延迟分位数（秒），样本不足时返回 None"""
+        samples = self.samples.get(model)
+        if not samples or len(samples) < settings.hedge_min_samples:
+            return None
+        ordered = sorted(samples)
+        index = min(len(ordered) - 1, int(len(ordered) * p / 100))
+        return ordered[index]
+
+
+class HedgeBudget:
+    """对冲预算（令牌桶）"""
+
+    MAX_TOKENS = 10.0
+
+    def __init__(self):
+        self.tokens = 0.0
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.denied = 0
+
+    def on_request(self):
+        self.requests += 1
+        self.tokens = min(self.MAX_TOKENS, self.tokens + settings.hedge_budget_percent / 100)
+
+    def has_budget(self) -> bool:
+        if self.tokens < 1:
+            self.denied += 1
+            return False
+        return True
+
+    def spend(self):
+        """对冲请求确实发出后才扣除令牌"""
+        self.tokens = max(0.0, self.tokens - 1)
+        self.hedges += 1
+
+    def get_stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "denied": self.denied,
+            "hedge_rate": round(self.hedges / self.requests * 100, 2) if self.requests else 0,
+            "tokens": round(self.tokens, 2),
+        }
+
+
+latency_tracker = LatencyTracker()
+hedge_budget = HedgeBudget()
+
+
+def get_hedge_delay(model: str) -> Optional[float]:
+    """获取触发对冲的等待时间（秒），None 表示不对冲"""
+    if not settings.hedge_enabled:
+        return None
+    delay = latency_tracker.percentile(model, settings.hedge_percentile)
+    if delay is None:
+        return None
+    return max(delay, settings.hedge_min_delay)
+
+
+async def _timed(model: str, coro: Awaitable, record_cancelled: bool = False) -> Any:
+    """
+    执行调用并在成功时记录延迟
+
+    record_cancelled: 被取消时也记录已等待的时间（首个调用输给对冲请求时，
+    它的真实延迟至少是这么长；不记录的话慢请求永远不进样本，分位数会越来越低）
+    """
+    started = time.time()
+    try:
+        result = await coro
+    except asyncio.CancelledError:
+        if record_cancelled:
+            latency_tracker.record(model, time.time() - started)
+        raise
+    latency_tracker.record(model, time.time() - started)
+    return result
+
+
+async def run_hedged(
+    model: str,
+    primary: Awaitable,
+    start_backup: Callable[[], Awaitable[Optional[Tuple[Any, Awaitable]]]],
+    on_backup_failure: Optional[Callable[[Any, BaseException], Awaitable]] = None,
+) -> Tuple[Any, Any]:
+    """
+    执行一次可对冲的非流式调用
+
+    Args:
+        model: 模型名（用于按模型统计延迟）
+        primary: 首个上游调用
+        start_backup: 准备对冲请求的回调，返回 (标记, 调用) 或 None（无可用凭证）
+        on_backup_failure: 对冲请求失败时的回调 (标记, 异常)，用于处理对冲凭证的失败
+            （首个调用的失败由调用方处理）
+
+    Returns:
+        (结果, 对冲标记)；由首个调用返回时标记为 None
+    """
+    hedge_budget.on_request()
+    primary_task = asyncio.create_task(_timed(model, primary, record_cancelled=True))
+    backup_task = None
+    delay = get_hedge_delay(model)
+
+    try:
+        if delay is None:
+            return await primary_task, None
+
+        done, _ = await asyncio.wait({primary_task}, timeout=delay)
+        if done or not hedge_budget.has_budget():
+            return await primary_task, None
+
+        backup = await start_backup()
+        if backup is None:
+            return await primary_task, None
+        hedge_budget.spend()
+        tag, backup_call = backup
+        print(f"[Hedge] ⏱️ {model} 超过 {delay:.1f}s 未返回，发起对冲请求", flush=True)
+        backup_task = asyncio.create_task(_timed(model, backup_call))
+
+        pending = {primary_task, backup_task}
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task is backup_task and task.exception() is not None and on_backup_failure:
+                    await on_backup_failure(tag, task.exception())
+                if task.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    if task is backup_task:
+                        hedge_budget.hedge_wins += 1
+                        print(f"[Hedge] ✅ {model} 对冲请求先返回", flush=True)
+                        return task.result(), tag
+                    return task.result(), None
+
+        # 两个都失败：以首个调用的错误为准
+        raise primary_task.exception()
+    finally:
+        # 客户端断开或已有结果时，取消仍在进行的调用
+        for task in (primary_task, backup_task):
+            if task is not None and not task.done():
+                task.cancel()
+
+
+def get_stats() -> dict:
+    """获取对冲统计"""
+    models = {}
+    for model in latency_tracker.samples:
+        p = latency_tracker.percentile(model, settings.hedge_percentile)
+        models[model] = {
+            "samples": len(latency_tracker.samples[model]),
+            "hedge_delay": round(max(p, settings.hedge_min_delay), 2) if p is not None else None,
+        }
+    return {
+        "enabled": settings.hedge_enabled,
+        "percentile": settings.hedge_percentile,
+        "budget_percent": settings.hedge_budget_percent,
+        **hedge_budget.get_stats(),
+        "models": models,
+    }
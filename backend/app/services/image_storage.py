@@ -1,17 +1,39 @@
 """
 图片本地存储服务
 用于保存 Antigravity 生成的图片并返回可访问的 URL
-支持自动清理过期图片
+支持自动清理过期图片（ImageExpiryScheduler，待删除列表持久化，重启后继续）
+
+一张 4K 图片解码后有几 MB，整体 b64decode 再在事件循环线程里 write 会卡住所有请求。
+save_base64_image_async 在线程池中分块解码、写入临时文件并 fsync，完成后改名为正式文件名再返回 URL；
+同时写入的图片数（image_write_concurrency）和正在写入的总字节数（image_write_budget_mb）有上限。
+
+图片按内容寻址：文件名是 base64 数据的 sha256，重试等场景下上游返回的相同图片只写一次，
+同一个 URL 的内容永远不变（/images 路由据此返回 ETag 和 immutable 缓存头，见 routers/images.py）。
+每次保存算一个引用，各自有到期时间，所有引用都到期（或被 delete_image 释放）后才删除文件。
 """
 
 import os
+import json
+import time
+import heapq
 import base64
+import binascii
+import hashlib
 import uuid
 import asyncio
 import threading
-from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Set
+from typing import Dict, List, Optional, Tuple
+
+from app.config import settings
+
+
+# 每次解码的 base64 字符数（4 的倍数）
+_DECODE_CHUNK_CHARS = 256 * 1024
+# 存储目录中由本服务管理的文件后缀
+_IMAGE_SUFFIXES = (".png", ".jpg", ".jpeg", ".gif", ".webp", ".tmp")
+# 写入中途失败留下的临时文件超过该时间（秒）后删除
+_STALE_TMP_SECONDS = 3600
 
 
 class ImageStorage:
@@ -21,122 +43,228 @@ class ImageStorage:
     # backend/app/services/image_storage.py -> backend/static/images
     STORAGE_DIR = Path(__file__).parent.parent.parent / "static" / "images"
     
-    # 待删除的图片文件名集合（用于延迟删除）
-    _pending_deletions: Set[str] = set()
-    _deletion_lock = threading.Lock()
+    # 当前存储的图片数和总字节数（启动时由 image_expiry 扫描目录得到）
+    _stored_count = 0
+    _stored_bytes = 0
+    _stats_lock = threading.Lock()
+    # 相同内容的图片已存在、没有重复写入的次数
+    dedup_hits = 0
+    
+    # "文件是否存在 + 增加引用" 与 "没有引用 + 删除文件" 互斥，避免刚复用的文件被删除
+    _files_lock = threading.Lock()
     
     # 默认图片保留时间（秒）
     DEFAULT_RETENTION_SECONDS = 60  # 1分钟后自动删除
     
+    # 写入并发与字节预算（首次异步保存时创建）
+    _write_semaphore: Optional[asyncio.Semaphore] = None
+    _budget_cond: Optional[asyncio.Condition] = None
+    _writing_bytes = 0
+    
     @classmethod
     def init_storage(cls):
         """初始化存储目录"""
         cls.STORAGE_DIR.mkdir(parents=True, exist_ok=True)
         print(f"[ImageStorage] 图片存储目录: {cls.STORAGE_DIR}", flush=True)
-        # 启动时清理旧图片
-        cls.cleanup_old_images(max_age_hours=1)
+    
+    @staticmethod
+    def content_filename(base64_data: str, mime_type: str) -> str:
+        """按内容生成文件名：base64 数据的 sha256（前 32 位十六进制）+ MIME 对应的扩展名"""
+        ext_map = {
+            "image/png": ".png",
+            "image/jpeg": ".jpg",
+            "image/jpg": ".jpg",
+            "image/gif": ".gif",
+            "image/webp": ".webp",
+        }
+        ext = ext_map.get(mime_type, ".png")
+        digest = hashlib.sha256()
+        for start in range(0, len(base64_data), _DECODE_CHUNK_CHARS):
+            digest.update(base64_data[start:start + _DECODE_CHUNK_CHARS].encode("utf-8"))
+        return f"{digest.hexdigest()[:32]}{ext}"
+    
+    @classmethod
+    def _write_tmp(cls, base64_data: str, tmp_path: Path) -> int:
+        """
+        分块解码 base64 写入临时文件并 fsync，返回写入的字节数
+        
+        带换行等非 base64 字符的数据无法按块对齐解码，退回整体解码。
+        """
+        with open(tmp_path, "wb") as f:
+            written = 0
+            try:
+                for start in range(0, len(base64_data), _DECODE_CHUNK_CHARS):
+                    chunk = base64.b64decode(base64_data[start:start + _DECODE_CHUNK_CHARS], validate=True)
+                    f.write(chunk)
+                    written += len(chunk)
+            except (binascii.Error, ValueError):
+                f.seek(0)
+                f.truncate()
+                image_data = base64.b64decode(base64_data)
+                f.write(image_data)
+                written = len(image_data)
+            f.flush()
+            os.fsync(f.fileno())
+        return written
+    
+    @classmethod
+    def _store(cls, base64_data: str, mime_type: str, delay_seconds: float) -> Tuple[str, int, bool]:
+        """
+        保存图片并增加一个 delay_seconds 后到期的引用，返回 (文件名, 字节数, 是否新写入)
+        
+        相同内容的文件已存在时不再写入。
+        """
+        cls.STORAGE_DIR.mkdir(parents=True, exist_ok=True)
+        filename = cls.content_filename(base64_data, mime_type)
+        file_path = cls.STORAGE_DIR / filename
+        with cls._files_lock:
+            try:
+                size = file_path.stat().st_size
+            except FileNotFoundError:
+                size = None
+            if size is not None:
+                image_expiry.add_ref(filename, time.time() + delay_seconds)
+                cls.dedup_hits += 1
+                return filename, size, False
+        
+        # 临时文件名各不相同：同一张图片可能同时被两个请求写入
+        tmp_path = cls.STORAGE_DIR / f"{filename}.{uuid.uuid4().hex[:8]}.tmp"
+        try:
+            size = cls._write_tmp(base64_data, tmp_path)
+            with cls._files_lock:
+                is_new = not file_path.exists()
+                if is_new:
+                    os.replace(tmp_path, file_path)
+                    with cls._stats_lock:
+                        cls._stored_count += 1
+                        cls._stored_bytes += size
+                else:
+                    tmp_path.unlink()
+                    cls.dedup_hits += 1
+                image_expiry.add_ref(filename, time.time() + delay_seconds)
+            return filename, size, is_new
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+    
+    @classmethod
+    def _retention(cls, auto_delete_seconds: Optional[int]) -> int:
+        return auto_delete_seconds if auto_delete_seconds is not None else cls.DEFAULT_RETENTION_SECONDS
     
     @classmethod
     def save_base64_image(cls, base64_data: str, mime_type: str = "image/png", auto_delete_seconds: int = None) -> str:
         """
-        保存 base64 图片到本地并返回相对 URL
+        保存 base64 图片到本地并返回相对 URL（同步版本，会阻塞当前线程；事件循环中请用 save_base64_image_async）
         
         Args:
             base64_data: base64 编码的图片数据
             mime_type: 图片 MIME 类型
             auto_delete_seconds: 自动删除延迟（秒），None 表示使用默认值
-            
+        
         Returns:
-            图片的相对 URL 路径 (如 /images/xxx.png)
+            图片的相对 URL 路径 (如 /images/xxx.png)，失败时返回空字符串
         """
-        # 确保存储目录存在
-        cls.STORAGE_DIR.mkdir(parents=True, exist_ok=True)
-        
-        # 根据 MIME 类型确定扩展名
-        ext_map = {
-            "image/png": ".png",
-            "image/jpeg": ".jpg",
-            "image/jpg": ".jpg",
-            "image/gif": ".gif",
-            "image/webp": ".webp",
-        }
-        ext = ext_map.get(mime_type, ".png")
+        delay = cls._retention(auto_delete_seconds)
+        try:
+            filename, size, is_new = cls._store(base64_data, mime_type, delay)
+        except Exception as e:
+            print(f"[ImageStorage] ❌ 保存图片失败: {e}", flush=True)
+            return ""
+        return cls._saved(filename, size, is_new, delay)
+    
+    @classmethod
+    async def save_base64_image_async(cls, base64_data: str, mime_type: str = "image/png", auto_delete_seconds: int = None) -> str:
+        """
+        保存 base64 图片到本地并返回相对 URL，参数与 save_base64_image 相同
         
-        # 生成唯一文件名
-        timestamp = datetime.utcnow().strftime("%Y%m%d%H%M%S")
-        unique_id = str(uuid.uuid4())[:8]
-        filename = f"{timestamp}_{unique_id}{ext}"
+        解码和写入在线程池中进行，文件 fsync 并改名完成后才返回；
+        受 image_write_concurrency 和 image_write_budget_mb 限制，超出时排队等待。
+        """
+        if cls._write_semaphore is None:
+            cls._write_semaphore = asyncio.Semaphore(max(1, settings.image_write_concurrency))
+            cls._budget_cond = asyncio.Condition()
         
-        # 保存文件
-        file_path = cls.STORAGE_DIR / filename
+        size = len(base64_data) * 3 // 4
+        budget = max(1, settings.image_write_budget_mb) * 1024 * 1024
+        delay = cls._retention(auto_delete_seconds)
+        async with cls._budget_cond:
+            # 没有其它写入时即使单张超过预算也放行
+            await cls._budget_cond.wait_for(lambda: cls._writing_bytes == 0 or cls._writing_bytes + size <= budget)
+            cls._writing_bytes += size
         try:
-            image_data = base64.b64decode(base64_data)
-            with open(file_path, "wb") as f:
-                f.write(image_data)
-            print(f"[ImageStorage] ✅ 图片已保存: {filename} ({len(image_data)} bytes)", flush=True)
-            
-            # 安排自动删除
-            delete_delay = auto_delete_seconds if auto_delete_seconds is not None else cls.DEFAULT_RETENTION_SECONDS
-            cls.schedule_deletion(filename, delay_seconds=delete_delay)
-            
-            # 返回相对 URL
-            return f"/images/{filename}"
+            async with cls._write_semaphore:
+                filename, written, is_new = await asyncio.to_thread(cls._store, base64_data, mime_type, delay)
         except Exception as e:
             print(f"[ImageStorage] ❌ 保存图片失败: {e}", flush=True)
             return ""
+        finally:
+            async with cls._budget_cond:
+                cls._writing_bytes -= size
+                cls._budget_cond.notify_all()
+        return cls._saved(filename, written, is_new, delay)
+    
+    @classmethod
+    def _saved(cls, filename: str, size: int, is_new: bool, delay_seconds: int) -> str:
+        """文件已落盘：打印日志，返回相对 URL"""
+        if is_new:
+            print(f"[ImageStorage] ✅ 图片已保存: {filename} ({size} bytes)，{delay_seconds}s 后删除", flush=True)
+        else:
+            print(f"[ImageStorage] ♻️ 相同图片已存在，复用: {filename} ({size} bytes)，{delay_seconds}s 后释放引用", flush=True)
+        return f"/images/{filename}"
+    
+    @classmethod
+    def _remove_file(cls, filename: str) -> bool:
+        """删除存储目录中的文件并更新统计，文件不存在时返回 False"""
+        file_path = cls.STORAGE_DIR / filename
+        try:
+            size = file_path.stat().st_size
+            file_path.unlink()
+        except FileNotFoundError:
+            return False
+        if not filename.endswith(".tmp"):
+            with cls._stats_lock:
+                cls._stored_count = max(0, cls._stored_count - 1)
+                cls._stored_bytes = max(0, cls._stored_bytes - size)
+        return True
+    
+    @classmethod
+    def _remove_if_unreferenced(cls, filename: str) -> bool:
+        """文件没有任何引用时删除"""
+        with cls._files_lock:
+            if image_expiry.has_refs(filename):
+                return False
+            return cls._remove_file(filename)
     
     @classmethod
     def schedule_deletion(cls, filename: str, delay_seconds: int = 60):
         """
-        安排延迟删除图片
+        为图片增加一个 delay_seconds 后到期的引用（由 image_expiry 在所有引用到期后删除，可在任意线程调用）
         
         Args:
-            filename: 要删除的文件名
+            filename: 文件名
             delay_seconds: 延迟秒数
         """
-        def delete_after_delay():
-            import time
-            time.sleep(delay_seconds)
-            file_path = cls.STORAGE_DIR / filename
-            try:
-                if file_path.exists():
-                    file_path.unlink()
-                    print(f"[ImageStorage] 🗑️ 图片已自动删除: {filename}", flush=True)
-                with cls._deletion_lock:
-                    cls._pending_deletions.discard(filename)
-            except Exception as e:
-                print(f"[ImageStorage] ⚠️ 删除图片失败: {filename}, {e}", flush=True)
-        
-        with cls._deletion_lock:
-            if filename not in cls._pending_deletions:
-                cls._pending_deletions.add(filename)
-                thread = threading.Thread(target=delete_after_delay, daemon=True)
-                thread.start()
-                print(f"[ImageStorage] ⏰ 已安排 {delay_seconds}s 后删除: {filename}", flush=True)
+        image_expiry.add_ref(filename, time.time() + delay_seconds)
     
     @classmethod
     def delete_image(cls, relative_url: str) -> bool:
         """
-        立即删除图片
+        释放图片的一个引用，没有其它引用时立即删除
         
         Args:
             relative_url: 图片的相对 URL (如 /images/xxx.png)
-            
+        
         Returns:
-            是否删除成功
+            文件是否已删除
         """
         if not relative_url or not relative_url.startswith("/images/"):
             return False
         
         filename = relative_url.split("/")[-1]
-        file_path = cls.STORAGE_DIR / filename
-        
+        image_expiry.release(filename)
         try:
-            if file_path.exists():
-                file_path.unlink()
+            if cls._remove_if_unreferenced(filename):
                 print(f"[ImageStorage] 🗑️ 图片已删除: {filename}", flush=True)
-                with cls._deletion_lock:
-                    cls._pending_deletions.discard(filename)
                 return True
             return False
         except Exception as e:
@@ -144,46 +272,238 @@ class ImageStorage:
             return False
     
     @classmethod
-    def cleanup_old_images(cls, max_age_hours: int = 1):
-        """
-        清理过期图片
-        
-        Args:
-            max_age_hours: 图片最大保留时间（小时）
-        """
+    def get_stats(cls) -> dict:
+        with cls._stats_lock:
+            images, size = cls._stored_count, cls._stored_bytes
+        return {
+            "images": images,
+            "bytes": size,
+            "writing_bytes": cls._writing_bytes,
+            "dedup_hits": cls.dedup_hits,
+            **image_expiry.get_stats(),
+        }
+
+
+class ImageExpiryScheduler:
+    """
+    图片过期删除调度器
+    
+    以前每张图片开一个 sleep 的线程，生成图片的高峰期会堆积几百个线程。
+    现在所有引用的到期时间放在一个最小堆里，由事件循环中的一个任务（run_forever）处理：
+    引用到期后从该文件的引用列表中移除，文件没有引用时删除。
+    引用列表持久化到 image_expiry_state_file，重启后继续按原时间删除。
+    启动时存储目录中不在列表里的图片（旧版本或崩溃前来不及记录的）按修改时间 + 默认保留时间删除。
+    """
+    
+    # 待删除列表最多每隔多少秒写一次盘
+    SAVE_INTERVAL = 1.0
+    # 没有任何到期任务时的最长休眠时间（秒）
+    IDLE_SLEEP = 60.0
+    
+    def __init__(self):
+        # 文件名 -> 各引用的到期时间（Unix 时间戳）
+        self._refs: Dict[str, List[float]] = {}
+        # (到期时间, 文件名)；被提前释放的引用不会从堆中移除，弹出时与 _refs 比对后丢弃
+        self._heap: List[Tuple[float, str]] = []
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dirty = False
+        self._last_save = 0.0
+        self.deleted = 0
+    
+    def add_ref(self, filename: str, deadline: float):
+        """为文件增加一个在 deadline 到期的引用"""
+        with self._lock:
+            self._refs.setdefault(filename, []).append(deadline)
+            heapq.heappush(self._heap, (deadline, filename))
+            self._dirty = True
+        self._wake()
+    
+    def release(self, filename: str):
+        """提前释放文件最早到期的一个引用"""
+        with self._lock:
+            refs = self._refs.get(filename)
+            if not refs:
+                return
+            refs.remove(min(refs))
+            if not refs:
+                del self._refs[filename]
+            self._dirty = True
+    
+    def has_refs(self, filename: str) -> bool:
+        with self._lock:
+            return filename in self._refs
+    
+    def _wake(self):
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
         try:
-            if not cls.STORAGE_DIR.exists():
+            if asyncio.get_running_loop() is loop:
+                self._wakeup.set()
                 return
-            
-            cutoff_time = datetime.utcnow() - timedelta(hours=max_age_hours)
-            deleted_count = 0
-            
-            for file_path in cls.STORAGE_DIR.iterdir():
-                if file_path.is_file() and file_path.suffix in [".png", ".jpg", ".jpeg", ".gif", ".webp"]:
-                    try:
-                        # 从文件名中提取时间戳 (格式: 20260126005455_xxxxxxxx.ext)
-                        filename = file_path.stem
-                        if "_" in filename:
-                            timestamp_str = filename.split("_")[0]
-                            if len(timestamp_str) == 14:  # YYYYMMDDHHmmss
-                                file_time = datetime.strptime(timestamp_str, "%Y%m%d%H%M%S")
-                                if file_time < cutoff_time:
-                                    file_path.unlink()
-                                    deleted_count += 1
-                    except Exception as e:
-                        # 无法解析时间戳的文件，检查文件修改时间
-                        try:
-                            mtime = datetime.fromtimestamp(file_path.stat().st_mtime)
-                            if mtime < cutoff_time:
-                                file_path.unlink()
-                                deleted_count += 1
-                        except:
-                            pass
-            
-            if deleted_count > 0:
-                print(f"[ImageStorage] 🧹 已清理 {deleted_count} 个过期图片", flush=True)
+        except RuntimeError:
+            pass
+        loop.call_soon_threadsafe(self._wakeup.set)
+    
+    def _pop_due(self, now: float) -> List[str]:
+        """弹出所有到期的引用，返回因此失去全部引用的文件"""
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                deadline, filename = heapq.heappop(self._heap)
+                refs = self._refs.get(filename)
+                if not refs or deadline not in refs:
+                    continue
+                refs.remove(deadline)
+                self._dirty = True
+                if not refs:
+                    del self._refs[filename]
+                    due.append(filename)
+        return due
+    
+    def _next_deadline(self) -> Optional[float]:
+        with self._lock:
+            while self._heap and self._heap[0][0] not in self._refs.get(self._heap[0][1], ()):
+                heapq.heappop(self._heap)
+            return self._heap[0][0] if self._heap else None
+    
+    def _delete_files(self, filenames: List[str]):
+        for filename in filenames:
+            try:
+                if ImageStorage._remove_if_unreferenced(filename):
+                    self.deleted += 1
+                    print(f"[ImageStorage] 🗑️ 图片已自动删除: {filename}", flush=True)
+            except Exception as e:
+                print(f"[ImageStorage] ⚠️ 删除图片失败: {filename}, {e}", flush=True)
+    
+    # ===== 持久化 =====
+    
+    def _save_state(self, state: Dict[str, List[float]]):
+        path = settings.image_expiry_state_file
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, path)
+    
+    def _snapshot(self) -> Dict[str, List[float]]:
+        with self._lock:
+            self._dirty = False
+            return {filename: list(refs) for filename, refs in self._refs.items()}
+    
+    async def _save(self):
+        state = self._snapshot()
+        self._last_save = time.monotonic()
+        try:
+            await asyncio.to_thread(self._save_state, state)
+        except OSError as e:
+            print(f"[ImageStorage] ⚠️ 保存待删除列表失败: {e}", flush=True)
+    
+    def _recover(self):
+        """读取持久化的引用列表并扫描存储目录：重建图片统计，为没有记录的文件补上删除时间"""
+        try:
+            with open(settings.image_expiry_state_file, encoding="utf-8") as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            state = {}
+        except (OSError, ValueError) as e:
+            print(f"[ImageStorage] ⚠️ 读取待删除列表失败，按文件修改时间处理: {e}", flush=True)
+            state = {}
+        
+        count = 0
+        size = 0
+        recovered = 0
+        ImageStorage.STORAGE_DIR.mkdir(parents=True, exist_ok=True)
+        for file_path in ImageStorage.STORAGE_DIR.iterdir():
+            # .tmp 是写入中途失败（如进程退出）留下的临时文件
+            if not file_path.is_file() or file_path.suffix not in _IMAGE_SUFFIXES:
+                continue
+            try:
+                stat = file_path.stat()
+            except OSError:
+                continue
+            if file_path.suffix == ".tmp":
+                self.add_ref(file_path.name, stat.st_mtime + _STALE_TMP_SECONDS)
+                continue
+            count += 1
+            size += stat.st_size
+            # 旧版本的记录是单个到期时间
+            deadlines = state.get(file_path.name)
+            if isinstance(deadlines, (int, float)):
+                deadlines = [deadlines]
+            if isinstance(deadlines, list) and deadlines:
+                recovered += 1
+                for deadline in deadlines:
+                    self.add_ref(file_path.name, float(deadline))
+            else:
+                self.add_ref(file_path.name, stat.st_mtime + ImageStorage.DEFAULT_RETENTION_SECONDS)
+        
+        with ImageStorage._stats_lock:
+            ImageStorage._stored_count = count
+            ImageStorage._stored_bytes = size
+        print(f"[ImageStorage] 已恢复 {count} 张图片 ({size // 1024}KB)，其中 {recovered} 张沿用记录的删除时间", flush=True)
+    
+    async def run_forever(self):
+        """后台删除任务"""
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        try:
+            await asyncio.to_thread(self._recover)
         except Exception as e:
-            print(f"[ImageStorage] ⚠️ 清理过期图片失败: {e}", flush=True)
+            print(f"[ImageStorage] ⚠️ 恢复待删除列表失败: {e}", flush=True)
+        
+        try:
+            while True:
+                # 先清除唤醒标记，本轮处理期间新增的引用会让下面的等待立即返回
+                self._wakeup.clear()
+                try:
+                    due = self._pop_due(time.time())
+                    if due:
+                        await asyncio.to_thread(self._delete_files, due)
+                    
+                    timeout = self.IDLE_SLEEP
+                    if self._dirty:
+                        wait = self.SAVE_INTERVAL - (time.monotonic() - self._last_save)
+                        if wait <= 0:
+                            await self._save()
+                        else:
+                            timeout = wait
+                    next_deadline = self._next_deadline()
+                    if next_deadline is not None:
+                        timeout = min(timeout, max(0.0, next_deadline - time.time()))
+                except Exception as e:
+                    print(f"[ImageStorage] ⚠️ 过期删除任务异常: {e}", flush=True)
+                    timeout = self.IDLE_SLEEP
+                
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            # 关闭时把还没写盘的引用列表写下来
+            if self._dirty:
+                try:
+                    self._save_state(self._snapshot())
+                except OSError as e:
+                    print(f"[ImageStorage] ⚠️ 保存待删除列表失败: {e}", flush=True)
+    
+    def get_stats(self) -> dict:
+        next_deadline = self._next_deadline()
+        with self._lock:
+            files = len(self._refs)
+            references = sum(len(refs) for refs in self._refs.values())
+        return {
+            "pending_deletions": files,
+            "references": references,
+            "next_deletion_in": round(max(0.0, next_deadline - time.time()), 1) if next_deadline is not None else None,
+            "deleted": self.deleted,
+        }
+
+
+# 全局图片过期删除调度器
+image_expiry = ImageExpiryScheduler()
 
 
 # 初始化存储目录
@@ -0,0 +1,270 @@
+"""
+请求中的内联图片（base64）
+
+一张 4K 图片的 base64 有十几 MB，以前每个环节都要把它整体复制或遍历一遍：
+解析 data URL 时 split 两次、日志预览把整个请求 json.dumps 后只取前 2000 字符、
+合并请求时为了算哈希再序列化一次、发给上游时 json.dumps + encode 又复制两次。现在：
+- parse_data_url 只切一次片，mime 和大小在这里统一校验一次（inline_image_max_mb），
+  mime 无效或过大时抛出 InlineImageError，路由返回 400 并说明原因（不再静默丢掉图片）；之后 base64 字符串在 IR（protocol_ir.Blob）、对话前缀缓存和 Gemini 请求中都是同一个对象的引用
+- json_request 序列化上游请求时 base64 不经过 json.dumps，发送时按块编码，
+  不会在内存中同时存在整个请求体的几份副本
+- split_blobs 让合并请求的哈希直接读取 base64，不再整体序列化
+- preview_json 生成日志预览时用占位符代替 base64，且只处理预览范围内的内容
+"""
+import json
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.config import settings
+
+
+# 超过该长度的 inlineData.data 才单独处理（小图直接 json.dumps 更省事）
+_BLOB_MIN_CHARS = 16 * 1024
+# 发送/校验时每块的字符数
+_CHUNK_CHARS = 1024 * 1024
+# 请求骨架中 base64 的占位符前缀（每个进程随机，不会与请求内容冲突）
+_BLOB_TOKEN = f"__inline_blob_{uuid.uuid4().hex}_"
+# JSON 字符串中可以原样输出的字符（可打印 ASCII，不含引号和反斜杠），base64 只包含这些字符
+_JSON_SAFE_BYTES = bytes(range(0x20, 0x7f)).replace(b'"', b"").replace(b"\\", b"")
+# 日志预览中超过该长度的 base64 换成占位符
+_PREVIEW_BLOB_CHARS = 256
+
+
+class InlineImageError(ValueError):
+    """内联图片不合格（mime 无效或超过 inline_image_max_mb），路由应返回 400"""
+
+
+def _check_size(mime_type: Any, length: int) -> None:
+    """按 base64 长度估算图片大小并校验 mime，不读取数据本身"""
+    if not isinstance(mime_type, str) or "/" not in mime_type:
+        raise InlineImageError(f"内联图片的 mime 类型无效: {str(mime_type)[:50]}")
+    size = length * 3 // 4
+    if size > settings.inline_image_max_mb * 1024 * 1024:
+        raise InlineImageError(
+            f"内联图片过大: {mime_type}, {size / 1024 / 1024:.1f}MB，上限 {settings.inline_image_max_mb}MB"
+        )
+
+
+def check_inline_image(mime_type: Any, data: Any) -> None:
+    """校验内联图片的 mime 和大小，不合格时抛出 InlineImageError"""
+    if not isinstance(data, str):
+        raise InlineImageError(f"内联图片数据必须是 base64 字符串: {type(data).__name__}")
+    _check_size(mime_type, len(data))
+
+
+def _data_url_header(url: str) -> Optional[Tuple[str, int]]:
+    """校验 data URL 的大小和 mime，返回 (mime, 逗号位置)；不是 base64 data URL 时返回 None"""
+    if not url.startswith("data:"):
+        return None
+    comma = url.find(",", 5, 256)
+    if comma < 0:
+        return None
+    mime_type, sep, encoding = url[5:comma].partition(";")
+    if not sep or encoding != "base64":
+        return None
+    _check_size(mime_type, len(url) - comma - 1)
+    return mime_type, comma
+
+
+def parse_data_url(url: str) -> Optional[Tuple[str, str]]:
+    """
+    解析 data:<mime>;base64,<数据>，返回 (mime, base64 数据)
+
+    不是 base64 data URL 时返回 None；mime 无效或图片过大时抛出 InlineImageError。
+    只在取 base64 部分时切一次片。
+    """
+    header = _data_url_header(url)
+    if header is None:
+        return None
+    mime_type, comma = header
+    return mime_type, url[comma + 1:]
+
+
+def check_message_images(messages: Any) -> None:
+    """
+    转换前校验 OpenAI 格式消息中的 data URL 图片，不合格时抛出 InlineImageError
+
+    只检查头部和长度，不切片；路由在选凭证、建日志之前调用，直接返回 400。
+    """
+    if not isinstance(messages, list):
+        return
+    for message in messages:
+        content = message.get("content") if isinstance(message, dict) else None
+        if not isinstance(content, list):
+            continue
+        for item in content:
+            if not isinstance(item, dict) or item.get("type") != "image_url":
+                continue
+            image_url = item.get("image_url")
+            url = image_url.get("url") if isinstance(image_url, dict) else image_url
+            if isinstance(url, str):
+                _data_url_header(url)
+
+
+# ===== 上游请求体 =====
+
+def _marker(index: int) -> str:
+    return f"{_BLOB_TOKEN}{index}__"
+
+
+def _request_contents(payload: Dict[str, Any]) -> Tuple[Optional[str], Any]:
+    """Gemini 请求中的 contents 及其所在位置（内部 API 包装在 "request" 下）"""
+    request = payload.get("request")
+    if isinstance(request, dict):
+        return "request", request.get("contents")
+    return None, payload.get("contents")
+
+
+def split_blobs(payload: Dict[str, Any]) -> Tuple[Dict[str, Any], List[str]]:
+    """
+    把 Gemini 请求 contents 中较大的 inlineData.data 换成占位符
+
+    返回 (骨架, base64 列表)；只复制到达这些 part 的路径上的 dict/list，不修改原请求。
+    没有大块 base64 时骨架就是原请求。
+    """
+    wrapper, contents = _request_contents(payload)
+    if not isinstance(contents, list):
+        return payload, []
+
+    blobs: List[str] = []
+    new_contents = None
+    for i, content in enumerate(contents):
+        parts = content.get("parts") if isinstance(content, dict) else None
+        if not isinstance(parts, list):
+            continue
+        new_parts = None
+        for j, part in enumerate(parts):
+            inline = part.get("inlineData") if isinstance(part, dict) else None
+            data = inline.get("data") if isinstance(inline, dict) else None
+            if not isinstance(data, str) or len(data) < _BLOB_MIN_CHARS or not data.isascii():
+                continue
+            if new_parts is None:
+                new_parts = list(parts)
+            new_parts[j] = {**part, "inlineData": {**inline, "data": _marker(len(blobs))}}
+            blobs.append(data)
+        if new_parts is not None:
+            if new_contents is None:
+                new_contents = list(contents)
+            new_contents[i] = {**content, "parts": new_parts}
+
+    if new_contents is None:
+        return payload, []
+    if wrapper is None:
+        return {**payload, "contents": new_contents}, blobs
+    return {**payload, wrapper: {**payload[wrapper], "contents": new_contents}}, blobs
+
+
+def _is_json_safe(data: str) -> bool:
+    """base64 能否不转义直接放进 JSON 字符串（按块检查，不整体编码）"""
+    for start in range(0, len(data), _CHUNK_CHARS):
+        if data[start:start + _CHUNK_CHARS].encode("ascii").translate(None, _JSON_SAFE_BYTES):
+            return False
+    return True
+
+
+def _dumps(payload: Any) -> str:
+    """与 httpx 的 json= 相同的序列化方式"""
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":"), allow_nan=False)
+
+
+class _ChunkedJson:
+    """分块生成的请求体：JSON 片段原样输出，base64 发送时按块编码（可重复迭代，重试时重新生成）"""
+
+    __slots__ = ("_pieces",)
+
+    def __init__(self, pieces: List[Any]):
+        self._pieces = pieces
+
+    async def __aiter__(self):
+        for piece in self._pieces:
+            if isinstance(piece, bytes):
+                yield piece
+                continue
+            for start in range(0, len(piece), _CHUNK_CHARS):
+                yield piece[start:start + _CHUNK_CHARS].encode("ascii")
+
+
+def json_request(payload: Dict[str, Any], headers: Dict[str, str]) -> Dict[str, Any]:
+    """
+    上游 Gemini 请求的 httpx 参数（content / headers），代替 json=payload
+
+    请求体与 httpx 的 json= 完全相同（紧凑格式、ensure_ascii=False）；
+    带大块 base64 时 base64 不经过 json.dumps，发送时再按块编码，并显式给出 Content-Length。
+    """
+    headers = {"Content-Type": "application/json", **headers}
+    skeleton, blobs = split_blobs(payload)
+    if blobs and not all(_is_json_safe(blob) for blob in blobs):
+        skeleton, blobs = payload, []
+    text = _dumps(skeleton)
+    if not blobs:
+        return {"content": text.encode("utf-8"), "headers": headers}
+
+    pieces: List[Any] = []
+    length = 0
+    pos = 0
+    for i, blob in enumerate(blobs):
+        marker = _marker(i)
+        index = text.find(marker, pos)
+        if index < 0:
+            return {"content": _dumps(payload).encode("utf-8"), "headers": headers}
+        head = text[pos:index].encode("utf-8")
+        pieces.append(head)
+        pieces.append(blob)
+        length += len(head) + len(blob)
+        pos = index + len(marker)
+    tail = text[pos:].encode("utf-8")
+    pieces.append(tail)
+    length += len(tail)
+    return {"content": _ChunkedJson(pieces), "headers": {**headers, "Content-Length": str(length)}}
+
+
+# ===== 日志预览 =====
+
+def _blob_placeholder(value: str) -> str:
+    if value.startswith("data:"):
+        comma = value.find(",", 5, 256)
+        if comma > 0:
+            return f"{value[:comma]},<{len(value) - comma - 1} chars>"
+    return f"<base64 {len(value)} chars>"
+
+
+def preview_json(value: Any, limit: int = 2000, indent: Optional[int] = None) -> str:
+    """
+    请求/响应的日志预览，相当于 json.dumps(value, ensure_ascii=False, indent=indent)[:limit]
+
+    区别：base64（inlineData / source 的 data、data URL）换成只带长度的占位符；
+    超长字符串先截断到 limit；预览已经写满后不再遍历剩下的内容。
+    """
+    # 已输出字符数的下限估计，达到 limit 后剩下的内容不会出现在预览中
+    remaining = limit
+
+    def shrink(obj: Any, key: Any = None) -> Any:
+        nonlocal remaining
+        if isinstance(obj, str):
+            if len(obj) > _PREVIEW_BLOB_CHARS and (
+                obj.startswith("data:") or (key == "data" and " " not in obj[:_PREVIEW_BLOB_CHARS])
+            ):
+                obj = _blob_placeholder(obj)
+            elif len(obj) > limit:
+                obj = obj[:limit]
+            remaining -= len(obj) + 2
+            return obj
+        if isinstance(obj, dict):
+            result = {}
+            for k, v in obj.items():
+                if remaining <= 0:
+                    break
+                remaining -= len(str(k)) + 4
+                result[k] = shrink(v, k)
+            return result
+        if isinstance(obj, (list, tuple)):
+            result = []
+            for v in obj:
+                if remaining <= 0:
+                    break
+                result.append(shrink(v))
+            return result
+        remaining -= 1
+        return obj
+
+    return json.dumps(shrink(value), ensure_ascii=False, indent=indent, default=str)[:limit]
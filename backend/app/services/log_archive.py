@@ -0,0 +1,293 @@
+"""
+历史使用日志归档（按列压缩的每日文件）
+
+超过 log_retention_days 的日志被清理前写入 log_archive_dir，用于长期容量规划。
+
+文件格式（usage_logs-YYYY-MM-DD-<首行id>-<末行id>.ula，每次清理批次一个文件）：
+    MAGIC(6 字节) | 头部长度(4 字节大端) | 头部 JSON | 各列数据块
+头部记录行数、时间范围、压缩方式以及每一列数据块的 (偏移, 长度)。
+每一列单独序列化为 JSON 数组后压缩（安装了 zstandard 用 zstd，否则用 gzip），
+查询时只解压需要的列，逐个文件聚合，不会把整个范围的数据读进内存。
+
+写入分两步：write_rows 先写成 .tmp 文件，调用方删除日志并提交后再 publish 改为正式文件名。
+删除失败时这批行留在数据库里，下一轮重新归档，不会出现同一行既在库里又在归档里而被重复统计。
+
+request_body 等大字段存放在侧表 usage_log_payloads 中，不归档（体积大且对统计无用）。
+"""
+import asyncio
+import gzip
+import json
+import os
+import struct
+from collections import Counter
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from app.config import settings
+
+# 尝试导入 zstandard，如果不存在则使用 gzip
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+MAGIC = b"ULAR1\n"
+_EXCLUDED_COLUMNS = {"request_body"}
+# 可用于分组的虚拟列：按 UTC 日期
+DATE_COLUMN = "date"
+
+
+def _compress(data: bytes) -> Tuple[str, bytes]:
+    if zstandard is not None:
+        return "zstd", zstandard.ZstdCompressor(level=6).compress(data)
+    return "gzip", gzip.compress(data, compresslevel=6)
+
+
+def _decompress(codec: str, data: bytes) -> bytes:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("归档文件使用 zstd 压缩，但未安装 zstandard")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+def _encode_value(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return int(value.timestamp()) if value.tzinfo else int((value - datetime(1970, 1, 1)).total_seconds())
+    return value
+
+
+class LogArchive:
+    """归档写入与查询"""
+
+    @property
+    def directory(self) -> str:
+        return settings.log_archive_dir
+
+    # ===== 写入 =====
+
+    def write_rows(self, rows: List[dict]) -> List[str]:
+        """
+        按 UTC 日期把一批日志写成列式临时文件（同步，调用方放到线程池执行）
+
+        返回正式文件路径；日志删除提交后调用 publish 生效，失败时调用 discard。
+        """
+        by_day: Dict[str, List[dict]] = {}
+        for row in rows:
+            created_at = row.get("created_at")
+            day = created_at.strftime("%Y-%m-%d") if created_at else "unknown"
+            by_day.setdefault(day, []).append(row)
+        os.makedirs(self.directory, exist_ok=True)
+        return [self._write_file(day, day_rows) for day, day_rows in by_day.items()]
+
+    @staticmethod
+    def publish(paths: List[str]):
+        """把已写好的临时文件改为正式文件名（同名文件是同一批行，直接覆盖）"""
+        for path in paths:
+            os.replace(f"{path}.tmp", path)
+
+    @staticmethod
+    def discard(paths: List[str]):
+        for path in paths:
+            try:
+                os.remove(f"{path}.tmp")
+            except FileNotFoundError:
+                pass
+
+    def remove_stale_tmp(self, max_age: float = 86400) -> int:
+        """清理进程中途退出留下的临时文件"""
+        if not os.path.isdir(self.directory):
+            return 0
+        removed = 0
+        now = datetime.now().timestamp()
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith(".ula.tmp") and now - os.path.getmtime(path) > max_age:
+                os.remove(path)
+                removed += 1
+        return removed
+
+    def _write_file(self, day: str, rows: List[dict]) -> str:
+        columns = [c for c in rows[0].keys() if c not in _EXCLUDED_COLUMNS]
+        timestamps = [_encode_value(r.get("created_at")) for r in rows if r.get("created_at")]
+        chunks = []
+        codec = "gzip"
+        for name in columns:
+            values = [_encode_value(r.get(name)) for r in rows]
+            raw = json.dumps(values, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+            codec, compressed = _compress(raw)
+            chunks.append((name, compressed))
+
+        offset = 0
+        column_index = {}
+        for name, compressed in chunks:
+            column_index[name] = [offset, len(compressed)]
+            offset += len(compressed)
+        header = json.dumps({
+            "version": 1,
+            "day": day,
+            "codec": codec,
+            "rows": len(rows),
+            "min_ts": min(timestamps) if timestamps else None,
+            "max_ts": max(timestamps) if timestamps else None,
+            "columns": column_index,
+        }, separators=(",", ":")).encode("utf-8")
+
+        # 按 id 范围命名：重试时同一批行写到同一个文件
+        first_id = rows[0].get("id", 0)
+        last_id = rows[-1].get("id", 0)
+        path = os.path.join(self.directory, f"usage_logs-{day}-{first_id}-{last_id}.ula")
+        with open(f"{path}.tmp", "wb") as f:
+            f.write(MAGIC)
+            f.write(struct.pack(">I", len(header)))
+            f.write(header)
+            for _, compressed in chunks:
+                f.write(compressed)
+        return path
+
+    # ===== 读取 =====
+
+    @staticmethod
+    def _read_header(f) -> dict:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("不是有效的归档文件")
+        (length,) = struct.unpack(">I", f.read(4))
+        header = json.loads(f.read(length))
+        header["_data_start"] = len(MAGIC) + 4 + length
+        return header
+
+    @staticmethod
+    def _read_column(f, header: dict, name: str) -> List[Any]:
+        if name not in header["columns"]:
+            return [None] * header["rows"]
+        offset, length = header["columns"][name]
+        f.seek(header["_data_start"] + offset)
+        return json.loads(_decompress(header["codec"], f.read(length)))
+
+    def list_files(self, start: Optional[date] = None, end: Optional[date] = None) -> List[str]:
+        """按文件名中的日期筛选归档文件（end 不含）"""
+        if not os.path.isdir(self.directory):
+            return []
+        files = []
+        for name in sorted(os.listdir(self.directory)):
+            if not (name.startswith("usage_logs-") and name.endswith(".ula")):
+                continue
+            try:
+                day = datetime.strptime(name[len("usage_logs-"):len("usage_logs-") + 10], "%Y-%m-%d").date()
+            except ValueError:
+                continue
+            if (start and day < start) or (end and day >= end):
+                continue
+            files.append(os.path.join(self.directory, name))
+        return files
+
+    def _aggregate_sync(
+        self,
+        start: datetime,
+        end: datetime,
+        group_by: Sequence[str],
+        where: Optional[Dict[str, Any]],
+    ) -> Counter:
+        where = where or {}
+        start_ts = _encode_value(start)
+        end_ts = _encode_value(end)
+        counts: Counter = Counter()
+        for path in self.list_files(start.date(), end.date() + timedelta(days=1)):
+            with open(path, "rb") as f:
+                header = self._read_header(f)
+                if header["rows"] == 0:
+                    continue
+                if header.get("max_ts") is not None and (header["max_ts"] < start_ts or header["min_ts"] >= end_ts):
+                    continue
+                created = self._read_column(f, header, "created_at")
+                columns = {}
+                for name in set(group_by) | set(where.keys()):
+                    if name != DATE_COLUMN:
+                        columns[name] = self._read_column(f, header, name)
+            for i, ts in enumerate(created):
+                if ts is None or ts < start_ts or ts >= end_ts:
+                    continue
+                matched = True
+                for name, expected in where.items():
+                    value = columns[name][i]
+                    if isinstance(expected, (list, tuple, set)):
+                        if value not in expected:
+                            matched = False
+                            break
+                    elif value != expected:
+                        matched = False
+                        break
+                if not matched:
+                    continue
+                key = tuple(
+                    datetime.utcfromtimestamp(ts).strftime("%Y-%m-%d") if name == DATE_COLUMN else columns[name][i]
+                    for name in group_by
+                )
+                counts[key] += 1
+        return counts
+
+    async def aggregate(
+        self,
+        start: datetime,
+        end: datetime,
+        group_by: Sequence[str] = (),
+        where: Optional[Dict[str, Any]] = None,
+    ) -> Dict[tuple, int]:
+        """
+        统计 [start, end) 内归档日志的行数
+
+        group_by: 分组列（可用 "date" 按 UTC 日期分组），为空时返回 {(): 总数}
+        where: 等值过滤 {列: 值 或 值列表}
+        """
+        return dict(await asyncio.to_thread(self._aggregate_sync, start, end, list(group_by), where))
+
+    def get_summary(self) -> dict:
+        days: Dict[str, dict] = {}
+        total_bytes = 0
+        total_rows = 0
+        for path in self.list_files():
+            size = os.path.getsize(path)
+            try:
+                with open(path, "rb") as f:
+                    header = self._read_header(f)
+            except Exception:
+                continue
+            entry = days.setdefault(header["day"], {"files": 0, "rows": 0, "bytes": 0})
+            entry["files"] += 1
+            entry["rows"] += header["rows"]
+            entry["bytes"] += size
+            total_rows += header["rows"]
+            total_bytes += size
+        return {
+            "directory": self.directory,
+            "codec": "zstd" if zstandard is not None else "gzip",
+            "total_rows": total_rows,
+            "total_bytes": total_bytes,
+            "days": [{"day": day, **info} for day, info in sorted(days.items())],
+        }
+
+
+async def merge_archived_counts(
+    db,
+    since: datetime,
+    group_by: Sequence[str],
+    where: Optional[Dict[str, Any]] = None,
+) -> Dict[tuple, int]:
+    """
+    统计接口合并归档数据用：返回 [since, 数据库中最早一条日志) 区间内的归档计数
+
+    以数据库中最早的日志时间为分界，避免清理尚未完成时同一行被重复计算。
+    """
+    from sqlalchemy import select, func
+    from app.models.user import UsageLog
+
+    oldest = (await db.execute(select(func.min(UsageLog.created_at)))).scalar()
+    end = oldest or datetime.utcnow()
+    if end <= since:
+        return {}
+    return await log_archive.aggregate(since, end, group_by, where)
+
+
+# 全局归档实例
+log_archive = LogArchive()
@@ -0,0 +1,305 @@
+"""
+PostgreSQL 上按天分区的 usage_logs
+
+usage_logs 是最大、写入最频繁的表，配额检查、RPM 检查和统计查询都按 created_at 过滤。
+开启 usage_logs_partitioned 后（仅 PostgreSQL）：
+- usage_logs 变为按 created_at 按天 RANGE 分区的表（分区名 usage_logs_pYYYYMMDD，另有 DEFAULT 分区兜底）
+- 后台任务提前创建未来 usage_logs_partition_premake 天的分区
+- 带 created_at 范围条件的查询由 PG 自动做分区裁剪
+- 日志保留由 log_retention 直接 DROP 过期分区
+
+从普通表迁移是在线进行的：
+1. 建好空的分区表 usage_logs_new（含索引、外键），并在旧表上挂触发器，记录之后被更新/删除的行 id
+2. 分批复制 10 分钟之前的旧行，期间旧表照常读写（日志清理暂停）
+3. 短暂加锁（只阻塞写入）复制剩余的最新行，按触发器记录重新同步复制后被改动或删除的行，
+   然后交换表名、转移自增序列、删除旧表
+"""
+import asyncio
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from sqlalchemy import text
+
+from app.config import settings
+from app.database import async_session, engine, is_postgres
+from app.models.user import UsageLog
+
+
+PARENT = "usage_logs"
+STAGING = "usage_logs_new"
+DEFAULT_PARTITION = "usage_logs_pdefault"
+# 迁移期间记录旧表中被更新/删除的行 id
+CHANGES = "usage_logs_migrate_changes"
+CHANGES_TRIGGER = "usage_logs_track_change"
+
+# 分区表上的索引（名称与 init_db 中的索引一致，避免重启后重复创建）
+_INDEXES = [
+    ("ix_usage_logs_id", "id"),
+    ("idx_usage_logs_created_at", "created_at"),
+    ("idx_usage_logs_user_id", "user_id"),
+    ("idx_usage_logs_status_code", "status_code"),
+    ("idx_usage_logs_user_created", "user_id, created_at"),
+    ("idx_usage_logs_error_type", "error_type"),
+    ("idx_usage_logs_date_error", "created_at, error_type"),
+    ("ix_usage_logs_api_type", "api_type"),
+    ("ix_usage_logs_quota_class", "quota_class"),
+    ("ix_usage_logs_model_family", "model_family"),
+    ("idx_usage_logs_user_class", "user_id, created_at, api_type, quota_class"),
+    ("idx_usage_logs_created_id", "created_at, id"),
+]
+
+# 迁移时晚于该时间的行留到加锁阶段复制（这些行可能还在被更新状态）
+_SETTLE_SECONDS = 600
+
+
+def partition_name(day: datetime) -> str:
+    return f"{PARENT}_p{day.strftime('%Y%m%d')}"
+
+
+class UsageLogPartitioner:
+    """usage_logs 分区管理"""
+
+    def __init__(self):
+        self.state = "disabled"
+        self.copied = 0
+        self.last_error: Optional[str] = None
+        self.last_maintained_at: Optional[datetime] = None
+
+    @staticmethod
+    async def _is_partitioned(conn, table: str = PARENT) -> bool:
+        return bool((await conn.execute(text(
+            "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid WHERE c.relname = :t"
+        ), {"t": table})).scalar())
+
+    @staticmethod
+    async def _table_exists(conn, table: str) -> bool:
+        return bool((await conn.execute(text("SELECT to_regclass(:t)"), {"t": table})).scalar())
+
+    @staticmethod
+    async def _create_partitions(conn, parent: str, start: datetime, end: datetime) -> List[str]:
+        """为 [start, end) 的每一天创建分区（已存在则跳过）"""
+        created = []
+        day = start.replace(hour=0, minute=0, second=0, microsecond=0)
+        while day < end:
+            name = partition_name(day)
+            if parent != PARENT:
+                name = name.replace(PARENT, parent, 1)
+            next_day = day + timedelta(days=1)
+            if not (await conn.execute(text("SELECT to_regclass(:t)"), {"t": name})).scalar():
+                await conn.execute(text(
+                    f'CREATE TABLE "{name}" PARTITION OF "{parent}" '
+                    f"FOR VALUES FROM ('{day:%Y-%m-%d %H:%M:%S}') TO ('{next_day:%Y-%m-%d %H:%M:%S}')"
+                ))
+                created.append(name)
+            day = next_day
+        return created
+
+    # ===== 维护 =====
+
+    async def ensure_future_partitions(self) -> List[str]:
+        """提前创建今天起 usage_logs_partition_premake 天的分区"""
+        now = datetime.utcnow()
+        async with engine.begin() as conn:
+            if not await self._is_partitioned(conn):
+                return []
+            created = await self._create_partitions(
+                conn, PARENT, now, now + timedelta(days=settings.usage_logs_partition_premake + 1)
+            )
+        self.last_maintained_at = now
+        if created:
+            print(f"[LogPartitions] ✅ 已创建分区: {', '.join(created)}", flush=True)
+        return created
+
+    # ===== 在线迁移 =====
+
+    def _columns(self) -> List[str]:
+        return [c.name for c in UsageLog.__table__.columns]
+
+    def _select_columns(self) -> str:
+        # 分区键不能为 NULL
+        return ", ".join(
+            "COALESCE(created_at, (now() AT TIME ZONE 'utc'))" if c == "created_at" else f'"{c}"'
+            for c in self._columns()
+        )
+
+    @staticmethod
+    async def _track_changes(conn):
+        """在旧表上挂触发器，记录复制开始后被更新或删除的行（可重复执行）"""
+        await conn.execute(text(f'CREATE TABLE IF NOT EXISTS "{CHANGES}" (id bigint NOT NULL)'))
+        await conn.execute(text(
+            f'CREATE OR REPLACE FUNCTION "{CHANGES_TRIGGER}"() RETURNS trigger AS $$ '
+            f'BEGIN INSERT INTO "{CHANGES}" (id) VALUES (OLD.id); RETURN NULL; END '
+            "$$ LANGUAGE plpgsql"
+        ))
+        await conn.execute(text(f'DROP TRIGGER IF EXISTS "{CHANGES_TRIGGER}" ON "{PARENT}"'))
+        await conn.execute(text(
+            f'CREATE TRIGGER "{CHANGES_TRIGGER}" AFTER UPDATE OR DELETE ON "{PARENT}" '
+            f'FOR EACH ROW EXECUTE FUNCTION "{CHANGES_TRIGGER}"()'
+        ))
+
+    async def is_migrating(self) -> bool:
+        """是否有迁移正在进行（其它 worker 发起的迁移通过暂存表判断）"""
+        if self.state == "migrating":
+            return True
+        if not is_postgres:
+            return False
+        async with engine.connect() as conn:
+            return await self._table_exists(conn, STAGING)
+
+    async def _prepare_staging(self):
+        async with engine.begin() as conn:
+            # 与建表在同一事务里，保证复制的每一行之后的改动都会被记录
+            await self._track_changes(conn)
+            if await self._table_exists(conn, STAGING):
+                return  # 上次迁移中断，继续复制
+            await conn.execute(text(
+                f'CREATE TABLE "{STAGING}" (LIKE "{PARENT}" INCLUDING DEFAULTS) PARTITION BY RANGE (created_at)'
+            ))
+            await conn.execute(text(f'ALTER TABLE "{STAGING}" ALTER COLUMN created_at SET NOT NULL'))
+            await conn.execute(text(f'ALTER TABLE "{STAGING}" ADD CONSTRAINT "{STAGING}_pkey" PRIMARY KEY (id, created_at)'))
+            await conn.execute(text(
+                f'ALTER TABLE "{STAGING}" ADD FOREIGN KEY (user_id) REFERENCES users(id)'
+            ))
+            await conn.execute(text(
+                f'ALTER TABLE "{STAGING}" ADD FOREIGN KEY (api_key_id) REFERENCES api_keys(id)'
+            ))
+            await conn.execute(text(
+                f'ALTER TABLE "{STAGING}" ADD FOREIGN KEY (credential_id) REFERENCES credentials(id) ON DELETE SET NULL'
+            ))
+            await conn.execute(text(f'CREATE TABLE "{STAGING}_pdefault" PARTITION OF "{STAGING}" DEFAULT'))
+
+            oldest = (await conn.execute(text(f'SELECT min(created_at) FROM "{PARENT}"'))).scalar()
+            now = datetime.utcnow()
+            await self._create_partitions(
+                conn, STAGING, oldest or now, now + timedelta(days=settings.usage_logs_partition_premake + 1)
+            )
+            # 空表上建索引很快；交换后再改名为正式名称
+            for name, columns in _INDEXES:
+                await conn.execute(text(f'CREATE INDEX "{name}_new" ON "{STAGING}" ({columns})'))
+        print("[LogPartitions] 已创建分区表 usage_logs_new", flush=True)
+
+    async def _copy_settled_rows(self) -> int:
+        """分批复制已稳定的旧行，返回已复制的最大 id"""
+        columns = ", ".join(f'"{c}"' for c in self._columns())
+        select_columns = self._select_columns()
+        async with engine.connect() as conn:
+            last_id = (await conn.execute(text(f'SELECT COALESCE(max(id), 0) FROM "{STAGING}"'))).scalar()
+            settled_max = (await conn.execute(text(
+                f"SELECT COALESCE(max(id), 0) FROM \"{PARENT}\" "
+                f"WHERE created_at < (now() AT TIME ZONE 'utc') - interval '{_SETTLE_SECONDS} seconds'"
+            ))).scalar()
+
+        batch = settings.usage_logs_partition_batch
+        while last_id < settled_max:
+            upper = min(last_id + batch, settled_max)
+            async with engine.begin() as conn:
+                result = await conn.execute(text(
+                    f'INSERT INTO "{STAGING}" ({columns}) SELECT {select_columns} FROM "{PARENT}" '
+                    f"WHERE id > :lo AND id <= :hi"
+                ), {"lo": last_id, "hi": upper})
+                self.copied += result.rowcount or 0
+            last_id = upper
+            await asyncio.sleep(0.2)
+        return last_id
+
+    async def _swap(self, last_id: int):
+        """
+        加锁复制剩余行并交换表名（阻塞写入的时间只有复制最近几分钟数据的长度）
+
+        已复制的行在复制期间可能被更新（状态码、凭证置空）或删除，
+        按触发器记录的 id 先从新表删掉，再从旧表重新复制仍存在的行。
+        """
+        columns = ", ".join(f'"{c}"' for c in self._columns())
+        select_columns = self._select_columns()
+        async with engine.begin() as conn:
+            await conn.execute(text(f'LOCK TABLE "{PARENT}" IN EXCLUSIVE MODE'))
+            resynced = (await conn.execute(text(
+                f'DELETE FROM "{STAGING}" WHERE id IN (SELECT id FROM "{CHANGES}")'
+            ))).rowcount or 0
+            result = await conn.execute(text(
+                f'INSERT INTO "{STAGING}" ({columns}) SELECT {select_columns} FROM "{PARENT}" '
+                f'WHERE id > :lo OR id IN (SELECT id FROM "{CHANGES}")'
+            ), {"lo": last_id})
+            self.copied += (result.rowcount or 0) - resynced
+
+            sequence = (await conn.execute(text(f"SELECT pg_get_serial_sequence('{PARENT}', 'id')"))).scalar()
+            if sequence:
+                await conn.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY \"{STAGING}\".id"))
+            await conn.execute(text(f'DROP TABLE "{PARENT}"'))
+            await conn.execute(text(f'DROP FUNCTION IF EXISTS "{CHANGES_TRIGGER}"()'))
+            await conn.execute(text(f'DROP TABLE IF EXISTS "{CHANGES}"'))
+            await conn.execute(text(f'ALTER TABLE "{STAGING}" RENAME TO "{PARENT}"'))
+            await conn.execute(text(f'ALTER TABLE "{PARENT}" RENAME CONSTRAINT "{STAGING}_pkey" TO "{PARENT}_pkey"'))
+            for name, _ in _INDEXES:
+                await conn.execute(text(f'ALTER INDEX "{name}_new" RENAME TO "{name}"'))
+
+            # 分区改为正式名称
+            rows = (await conn.execute(text(
+                "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                f"WHERE i.inhparent = '{PARENT}'::regclass"
+            ))).all()
+            for (name,) in rows:
+                if name.startswith(STAGING):
+                    await conn.execute(text(
+                        f'ALTER TABLE "{name}" RENAME TO "{PARENT}{name[len(STAGING):]}"'
+                    ))
+
+    async def migrate(self):
+        """把普通 usage_logs 在线迁移为分区表"""
+        async with engine.connect() as conn:
+            if await self._is_partitioned(conn):
+                self.state = "partitioned"
+                return
+        self.state = "migrating"
+        # 大字段列必须先搬到侧表，否则按模型列复制时会丢失
+        from app.services.log_payloads import migrate_legacy_columns
+        await migrate_legacy_columns()
+        print("[LogPartitions] 开始在线迁移 usage_logs 为按天分区表...", flush=True)
+        await self._prepare_staging()
+        last_id = await self._copy_settled_rows()
+        await self._swap(last_id)
+        self.state = "partitioned"
+        print(f"[LogPartitions] ✅ usage_logs 已迁移为分区表（复制 {self.copied} 行）", flush=True)
+
+    async def run_forever(self):
+        if not is_postgres or not settings.usage_logs_partitioned:
+            return
+        while True:
+            try:
+                if self.state != "partitioned":
+                    await self.migrate()
+                await self.ensure_future_partitions()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                self.state = "error"
+                print(f"[LogPartitions] ⚠️ 分区维护失败: {e}", flush=True)
+            await asyncio.sleep(3600)
+
+    async def get_status(self) -> dict:
+        status = {
+            "enabled": settings.usage_logs_partitioned,
+            "supported": is_postgres,
+            "state": self.state,
+            "copied": self.copied,
+            "last_error": self.last_error,
+            "last_maintained_at": self.last_maintained_at.isoformat() + "Z" if self.last_maintained_at else None,
+            "partitions": [],
+        }
+        if not is_postgres:
+            return status
+        async with async_session() as db:
+            rows = (await db.execute(text(
+                "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid), c.reltuples::bigint "
+                "FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                f"WHERE i.inhparent = to_regclass('{PARENT}') ORDER BY c.relname"
+            ))).all()
+        status["partitions"] = [
+            {"name": name, "bound": bound, "estimated_rows": max(0, rows_estimate or 0)}
+            for name, bound, rows_estimate in rows
+        ]
+        return status
+
+
+# 全局分区管理实例
+log_partitioner = UsageLogPartitioner()
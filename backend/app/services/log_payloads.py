@@ -0,0 +1,284 @@
+"""
+使用日志大字段侧表
+
+usage_logs 是配额/RPM/统计查询每次都要扫描的热表，原来每行带着 request_body（最多 2000 字符）、
+error_message（最多 2000 字符）、user_agent 和 client_ip，行宽被撑大很多。现在：
+- usage_logs 只保留定长的数值列和短字符串列
+- 大字段放到 usage_log_payloads（按日志 id 一行），request_body 用 zlib 压缩
+- error_message / user_agent 按 sha256 去重存到 usage_log_texts（同样压缩），
+  大量重复的上游报错和客户端 UA 只存一份
+- 只有日志详情和报错列表接口通过 load_payloads 读取
+
+代码里仍然可以直接给 UsageLog 的 error_message 等属性赋值，flush 时由模型事件写入侧表。
+旧库中 usage_logs 上的这四列由 migrate_legacy_columns 在后台分批搬到侧表；
+旧列默认保留（便于回滚到旧版本），开启 log_payload_drop_legacy_columns 后才删除。
+"""
+import asyncio
+import hashlib
+import time
+import zlib
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import select, delete, text
+
+from app.config import settings, save_config_to_db
+from app.database import async_session, engine, is_sqlite
+from app.models.user import SystemConfig, UsageLogPayload, UsageLogText
+
+
+LEGACY_COLUMNS = ["error_message", "request_body", "client_ip", "user_agent"]
+
+# 内容哈希 -> (usage_log_texts.id, 缓存时间)（只缓存已提交的行）
+_text_id_cache: Dict[str, Tuple[int, float]] = {}
+_TEXT_CACHE_SIZE = 4096
+# 缓存有效期（秒）：其他进程清理了去重文本时，本进程最多在这段时间内还引用旧 id，
+# 清理只删除创建超过 log_text_prune_grace 的文本，两者配合把这个窗口压到极小
+_TEXT_CACHE_TTL = 300
+
+# PostgreSQL 咨询锁：写入引用（共享）和清理无引用文本（排他）互斥
+_TEXT_LOCK_KEY = 0x75736C74  # "uslt"
+
+# 迁移进度（已搬运到的最大日志 id），保留旧列时重启只需搬运新增的行
+_MIGRATED_ID_KEY = "log_payload_migrated_id"
+
+# 启动任务和分区迁移都会调用 migrate_legacy_columns，同一时间只跑一个
+_migrate_lock = asyncio.Lock()
+
+
+def _compress(value: str) -> bytes:
+    return zlib.compress(value.encode("utf-8"), 6)
+
+
+def _decompress(data: Optional[bytes]) -> Optional[str]:
+    if data is None:
+        return None
+    return zlib.decompress(data).decode("utf-8", errors="replace")
+
+
+def _get_text_id(connection, value: Optional[str]) -> Optional[int]:
+    """取得去重文本的 id，不存在则插入（同步，在 flush 的连接上执行）"""
+    if value is None or value == "":
+        return None
+    if not is_sqlite:
+        # 持有到本事务结束，清理任务拿不到排他锁，不会删掉这里即将引用的文本
+        # （SQLite 写事务本身是库级互斥的，清理的 DELETE 会等到本事务提交）
+        transaction = connection.get_transaction()
+        if connection.info.get("text_lock_tx") is not transaction:
+            connection.execute(text("SELECT pg_advisory_xact_lock_shared(:key)"), {"key": _TEXT_LOCK_KEY})
+            connection.info["text_lock_tx"] = transaction
+    digest = hashlib.sha256(value.encode("utf-8")).hexdigest()
+    now = time.monotonic()
+    cached = _text_id_cache.get(digest)
+    if cached is not None and now - cached[1] < _TEXT_CACHE_TTL:
+        return cached[0]
+    inserted = connection.execute(
+        text("INSERT INTO usage_log_texts (hash, content, created_at) VALUES (:hash, :content, :created_at) "
+             "ON CONFLICT (hash) DO NOTHING"),
+        {"hash": digest, "content": _compress(value), "created_at": datetime.utcnow()},
+    ).rowcount
+    text_id = connection.execute(
+        text("SELECT id FROM usage_log_texts WHERE hash = :hash"), {"hash": digest}
+    ).scalar()
+    # 本事务刚插入的行可能回滚，只缓存别人已经提交的行
+    if not inserted and text_id is not None:
+        if len(_text_id_cache) >= _TEXT_CACHE_SIZE:
+            _text_id_cache.clear()
+        _text_id_cache[digest] = (text_id, now)
+    return text_id
+
+
+def save_payload(connection, log_id: int, values: Dict[str, Optional[str]]) -> None:
+    """写入/更新一条日志的大字段（只覆盖 values 中出现的字段）"""
+    row = {}
+    if "request_body" in values:
+        body = values["request_body"]
+        row["request_body"] = _compress(body) if body else None
+    if "error_message" in values:
+        row["error_text_id"] = _get_text_id(connection, values["error_message"])
+    if "user_agent" in values:
+        row["user_agent_text_id"] = _get_text_id(connection, values["user_agent"])
+    if "client_ip" in values:
+        row["client_ip"] = values["client_ip"]
+    if not row:
+        return
+    columns = list(row.keys())
+    connection.execute(
+        text(
+            f"INSERT INTO usage_log_payloads (log_id, {', '.join(columns)}) "
+            f"VALUES (:log_id, {', '.join(':' + c for c in columns)}) "
+            f"ON CONFLICT (log_id) DO UPDATE SET {', '.join(f'{c} = excluded.{c}' for c in columns)}"
+        ),
+        {"log_id": log_id, **row},
+    )
+
+
+async def load_payloads(db, log_ids: Iterable[int]) -> Dict[int, dict]:
+    """批量读取日志的大字段，返回 {log_id: {error_message, request_body, client_ip, user_agent}}"""
+    ids = [i for i in set(log_ids) if i is not None]
+    if not ids:
+        return {}
+    payloads = (await db.execute(
+        select(UsageLogPayload).where(UsageLogPayload.log_id.in_(ids))
+    )).scalars().all()
+    text_ids = {p.error_text_id for p in payloads} | {p.user_agent_text_id for p in payloads}
+    text_ids.discard(None)
+    texts = {}
+    if text_ids:
+        rows = (await db.execute(
+            select(UsageLogText.id, UsageLogText.content).where(UsageLogText.id.in_(text_ids))
+        )).all()
+        texts = {text_id: _decompress(content) for text_id, content in rows}
+    return {
+        p.log_id: {
+            "error_message": texts.get(p.error_text_id),
+            "request_body": _decompress(p.request_body),
+            "client_ip": p.client_ip,
+            "user_agent": texts.get(p.user_agent_text_id),
+        }
+        for p in payloads
+    }
+
+
+async def load_payload(db, log_id: int) -> dict:
+    """读取单条日志的大字段（不存在时各字段为 None）"""
+    payload = (await load_payloads(db, [log_id])).get(log_id)
+    return payload or {name: None for name in LEGACY_COLUMNS}
+
+
+# ===== 清理 =====
+
+async def delete_payloads(db, log_ids: Iterable[int]) -> None:
+    """删除日志时一并删除侧表行（由调用方提交）"""
+    ids = list(log_ids)
+    if ids:
+        await db.execute(delete(UsageLogPayload).where(UsageLogPayload.log_id.in_(ids)))
+
+
+async def delete_orphan_payloads(db) -> int:
+    """按条件批量删除日志后清理侧表中已没有日志的行（由调用方提交）"""
+    result = await db.execute(text(
+        "DELETE FROM usage_log_payloads WHERE NOT EXISTS "
+        "(SELECT 1 FROM usage_logs l WHERE l.id = usage_log_payloads.log_id)"
+    ))
+    return result.rowcount or 0
+
+
+async def prune_orphan_texts(attempts: int = 30) -> int:
+    """
+    删除已经没有日志引用的去重文本
+
+    在 PostgreSQL 上先拿排他咨询锁：正在写入引用的事务提交前不会删除，删除期间新的写入等待。
+    拿锁用 try 重试而不是阻塞等待，避免排在锁队列里挡住后面的日志写入。
+    """
+    cutoff = datetime.utcnow() - timedelta(seconds=settings.log_text_prune_grace)
+    async with async_session() as db:
+        if not is_sqlite:
+            for _ in range(attempts):
+                locked = (await db.execute(
+                    text("SELECT pg_try_advisory_xact_lock(:key)"), {"key": _TEXT_LOCK_KEY}
+                )).scalar()
+                if locked:
+                    break
+                await db.rollback()
+                await asyncio.sleep(1)
+            else:
+                print("[LogPayloads] ⚠️ 日志写入繁忙，本次跳过清理去重文本", flush=True)
+                return 0
+        result = await db.execute(text(
+            "DELETE FROM usage_log_texts WHERE created_at < :cutoff "
+            "AND NOT EXISTS (SELECT 1 FROM usage_log_payloads p WHERE p.error_text_id = usage_log_texts.id) "
+            "AND NOT EXISTS (SELECT 1 FROM usage_log_payloads p WHERE p.user_agent_text_id = usage_log_texts.id)"
+        ), {"cutoff": cutoff})
+        await db.commit()
+        _text_id_cache.clear()
+        return result.rowcount or 0
+
+
+# ===== 旧库迁移 =====
+
+async def _legacy_columns(conn) -> list:
+    if is_sqlite:
+        rows = (await conn.execute(text("PRAGMA table_info(usage_logs)"))).all()
+        existing = {row[1] for row in rows}
+    else:
+        rows = (await conn.execute(text(
+            "SELECT column_name FROM information_schema.columns WHERE table_name = 'usage_logs'"
+        ))).all()
+        existing = {row[0] for row in rows}
+    return [c for c in LEGACY_COLUMNS if c in existing]
+
+
+async def migrate_legacy_columns(drop: Optional[bool] = None) -> int:
+    """
+    把旧库 usage_logs 上的大字段分批搬到侧表
+
+    新代码不再写这些列，所以搬运期间不会漏数据；进度记在 system_config 中，
+    中断或重启后从上次的位置继续（按 log_id 覆盖写入）。
+    只有 drop（默认取 log_payload_drop_legacy_columns）为真时才删除旧列。
+    """
+    if drop is None:
+        drop = settings.log_payload_drop_legacy_columns
+    async with _migrate_lock:
+        return await _migrate_legacy_columns(drop)
+
+
+async def _load_migrated_id() -> int:
+    async with async_session() as db:
+        value = (await db.execute(
+            select(SystemConfig.value).where(SystemConfig.key == _MIGRATED_ID_KEY)
+        )).scalar()
+    try:
+        return int(value or 0)
+    except ValueError:
+        return 0
+
+
+async def _migrate_legacy_columns(drop: bool) -> int:
+    async with engine.connect() as conn:
+        columns = await _legacy_columns(conn)
+    if not columns:
+        return 0
+
+    select_columns = ", ".join(columns)
+    has_value = " OR ".join(f"{c} IS NOT NULL" for c in columns)
+    moved = 0
+    last_id = await _load_migrated_id()
+    start_id = last_id
+    batch = settings.log_payload_migrate_batch
+    while True:
+        async with engine.begin() as conn:
+            rows = (await conn.execute(text(
+                f"SELECT id, {select_columns} FROM usage_logs "
+                f"WHERE id > :last_id AND ({has_value}) ORDER BY id LIMIT :limit"
+            ), {"last_id": last_id, "limit": batch})).mappings().all()
+            if not rows:
+                break
+
+            def _save(sync_conn):
+                for row in rows:
+                    save_payload(sync_conn, row["id"], {c: row[c] for c in columns})
+
+            await conn.run_sync(_save)
+        moved += len(rows)
+        last_id = rows[-1]["id"]
+        await save_config_to_db(_MIGRATED_ID_KEY, last_id)
+        await asyncio.sleep(0.2)
+
+    if moved:
+        print(f"[LogPayloads] ✅ 已把 {moved} 条日志的 {', '.join(columns)} 迁移到侧表（id {start_id} 之后）", flush=True)
+    if not drop:
+        return moved
+    async with engine.begin() as conn:
+        for column in columns:
+            await conn.execute(text(f"ALTER TABLE usage_logs DROP COLUMN {column}"))
+    print(f"[LogPayloads] 🗑️ 已删除 usage_logs 的旧列: {', '.join(columns)}", flush=True)
+    return moved
+
+
+async def run_migration():
+    """启动后台任务用：迁移失败只打印，不影响服务"""
+    try:
+        await migrate_legacy_columns()
+    except Exception as e:
+        print(f"[LogPayloads] ⚠️ 迁移日志大字段失败: {e}", flush=True)
@@ -0,0 +1,235 @@
+"""
+使用日志分批清理
+
+以前每 24 小时一条 DELETE 删掉所有过期日志：SQLite 上长时间持有写锁，
+Postgres 上产生很大的 WAL / vacuum 尖峰。现在改为：
+- 每 log_retention_interval 秒运行一次，每批最多删 log_retention_batch_size 行，批之间暂停
+- 可选：删除前把这一批写入列式归档文件（log_retention_archive，见 log_archive）
+- Postgres 上如果 usage_logs 是按时间分区的表，直接 DROP 整个过期分区
+- 侧表 usage_log_payloads 中对应的行一起删除，之后清理没有引用的去重文本
+- 记录进度，管理员可查看状态和手动触发
+"""
+import asyncio
+import re
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from sqlalchemy import select, delete, text
+
+from app.config import settings
+from app.database import async_session, is_postgres
+from app.models.user import UsageLog
+from app.services.log_archive import log_archive
+from app.services.log_partitions import log_partitioner
+from app.services.log_payloads import delete_payloads, prune_orphan_texts
+
+
+# pg_get_expr(relpartbound) 形如 FOR VALUES FROM ('2026-01-01 00:00:00') TO ('2026-01-02 00:00:00')
+_PARTITION_BOUND_RE = re.compile(r"TO \('([^']+)'\)")
+
+
+class LogRetention:
+    """使用日志分批清理器"""
+
+    def __init__(self):
+        self.running = False
+        self.last_run_at: Optional[datetime] = None
+        self.last_cutoff: Optional[datetime] = None
+        self.last_deleted = 0
+        self.last_archived = 0
+        self.last_dropped_partitions: List[str] = []
+        self.last_error: Optional[str] = None
+        self.current_deleted = 0
+        self.total_deleted = 0
+        self._lock = asyncio.Lock()
+
+    # ===== 分区 =====
+
+    async def _drop_expired_partitions(self, cutoff: datetime) -> Optional[List[str]]:
+        """
+        usage_logs 是分区表时删除上界不晚于 cutoff 的分区
+
+        返回删除的分区名；不是分区表时返回 None（走分批 DELETE）。
+        """
+        if not is_postgres:
+            return None
+        async with async_session() as db:
+            partitioned = (await db.execute(text(
+                "SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'usage_logs'::regclass"
+            ))).scalar()
+            if not partitioned:
+                return None
+            rows = (await db.execute(text(
+                "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid) "
+                "FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                "WHERE i.inhparent = 'usage_logs'::regclass"
+            ))).all()
+
+        dropped = []
+        for name, bound in rows:
+            match = _PARTITION_BOUND_RE.search(bound or "")
+            if not match:
+                continue  # DEFAULT 分区
+            try:
+                upper = datetime.fromisoformat(match.group(1).split("+")[0])
+            except ValueError:
+                continue
+            if upper > cutoff:
+                continue
+            archived = await self._clear_partition(name)
+            try:
+                async with async_session() as db:
+                    await db.execute(text(f'DROP TABLE IF EXISTS "{name}"'))
+                    await db.commit()
+            except BaseException:
+                await asyncio.to_thread(log_archive.discard, archived)
+                raise
+            await asyncio.to_thread(log_archive.publish, archived)
+            dropped.append(name)
+            print(f"[LogRetention] 🗑️ 删除过期分区 {name}", flush=True)
+            await asyncio.sleep(settings.log_retention_batch_pause)
+        return dropped
+
+    async def _clear_partition(self, name: str) -> List[str]:
+        """
+        删除分区前按 id 分批删除侧表行，开启归档时同时写入归档临时文件
+
+        返回待 publish 的归档文件；分区 DROP 提交后才生效。
+        """
+        archived: List[str] = []
+        columns = "*" if settings.log_retention_archive else "id"
+        last_id = 0
+        try:
+            while True:
+                async with async_session() as db:
+                    result = await db.execute(
+                        text(f'SELECT {columns} FROM "{name}" WHERE id > :last_id ORDER BY id LIMIT :limit'),
+                        {"last_id": last_id, "limit": settings.log_retention_batch_size},
+                    )
+                    rows = [dict(r) for r in result.mappings().all()]
+                    if not rows:
+                        return archived
+                    if settings.log_retention_archive:
+                        archived += await asyncio.to_thread(log_archive.write_rows, rows)
+                        self.last_archived += len(rows)
+                    await delete_payloads(db, [r["id"] for r in rows])
+                    await db.commit()
+                last_id = rows[-1]["id"]
+                await asyncio.sleep(settings.log_retention_batch_pause)
+        except BaseException:
+            await asyncio.to_thread(log_archive.discard, archived)
+            raise
+
+    # ===== 分批删除 =====
+
+    async def _delete_batch(self, cutoff: datetime) -> int:
+        table = UsageLog.__table__
+        async with async_session() as db:
+            if settings.log_retention_archive:
+                result = await db.execute(
+                    select(table)
+                    .where(table.c.created_at < cutoff)
+                    .order_by(table.c.id)
+                    .limit(settings.log_retention_batch_size)
+                )
+                rows = [dict(r) for r in result.mappings().all()]
+                ids = [r["id"] for r in rows]
+            else:
+                result = await db.execute(
+                    select(table.c.id)
+                    .where(table.c.created_at < cutoff)
+                    .order_by(table.c.id)
+                    .limit(settings.log_retention_batch_size)
+                )
+                rows = []
+                ids = [r[0] for r in result.all()]
+            if not ids:
+                return 0
+            archived = await asyncio.to_thread(log_archive.write_rows, rows) if rows else []
+            try:
+                await db.execute(delete(UsageLog).where(UsageLog.id.in_(ids)))
+                await delete_payloads(db, ids)
+                await db.commit()
+            except BaseException:
+                await asyncio.to_thread(log_archive.discard, archived)
+                raise
+            # 删除提交后归档才生效，失败重试时不会重复统计
+            await asyncio.to_thread(log_archive.publish, archived)
+            self.last_archived += len(rows)
+            return len(ids)
+
+    async def run_once(self) -> dict:
+        """执行一轮清理（同一时间只有一轮在运行）"""
+        retention_days = settings.log_retention_days
+        if retention_days <= 0:
+            return self.get_status()
+        if self._lock.locked():
+            return self.get_status()
+        # usage_logs 正在迁移为分区表时暂停，避免与复制过程互相干扰
+        if await log_partitioner.is_migrating():
+            print("[LogRetention] usage_logs 正在迁移为分区表，本轮清理跳过", flush=True)
+            return self.get_status()
+
+        async with self._lock:
+            self.running = True
+            self.current_deleted = 0
+            self.last_archived = 0
+            self.last_error = None
+            cutoff = datetime.utcnow() - timedelta(days=retention_days)
+            self.last_cutoff = cutoff
+            try:
+                if settings.log_retention_archive:
+                    await asyncio.to_thread(log_archive.remove_stale_tmp)
+                dropped = await self._drop_expired_partitions(cutoff)
+                self.last_dropped_partitions = dropped or []
+                # 分区表也跑一遍分批删除，清理仍落在未过期分区/默认分区里的旧行
+                while True:
+                    deleted = await self._delete_batch(cutoff)
+                    if not deleted:
+                        break
+                    self.current_deleted += deleted
+                    self.total_deleted += deleted
+                    if deleted < settings.log_retention_batch_size:
+                        break
+                    await asyncio.sleep(settings.log_retention_batch_pause)
+                if self.current_deleted or self.last_dropped_partitions:
+                    await prune_orphan_texts()
+                    print(
+                        f"🗑️ 自动清理了 {self.current_deleted} 条过期日志（{retention_days}天前）"
+                        + (f"，删除分区 {len(self.last_dropped_partitions)} 个" if self.last_dropped_partitions else ""),
+                        flush=True,
+                    )
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"⚠️ 日志清理失败: {e}", flush=True)
+            finally:
+                self.last_deleted = self.current_deleted
+                self.last_run_at = datetime.utcnow()
+                self.running = False
+        return self.get_status()
+
+    async def run_forever(self):
+        while True:
+            await self.run_once()
+            await asyncio.sleep(max(60, settings.log_retention_interval))
+
+    def get_status(self) -> dict:
+        return {
+            "retention_days": settings.log_retention_days,
+            "running": self.running,
+            "current_deleted": self.current_deleted,
+            "last_run_at": self.last_run_at.isoformat() + "Z" if self.last_run_at else None,
+            "last_cutoff": self.last_cutoff.isoformat() + "Z" if self.last_cutoff else None,
+            "last_deleted": self.last_deleted,
+            "last_archived": self.last_archived,
+            "last_dropped_partitions": self.last_dropped_partitions,
+            "last_error": self.last_error,
+            "total_deleted": self.total_deleted,
+            "batch_size": settings.log_retention_batch_size,
+            "interval": settings.log_retention_interval,
+            "archive": settings.log_retention_archive,
+        }
+
+
+# 全局日志清理实例
+log_retention = LogRetention()
@@ -0,0 +1,317 @@
+"""
+上游模型目录缓存
+
+客户端会频繁轮询 /v1/models，以前每次都要选一个凭证、刷新 token、再请求上游
+fetchAvailableModels。这里改为后台定时拉取各 api_type 的动态模型列表并缓存，
+过滤/扩展后的结果（流式抗截断/、假流/、图片 2k/4k 变体等）也一并缓存在内存中，
+列模型接口直接读内存，不占用凭证、不访问网络。
+
+目前只有 Antigravity 有动态模型列表，GeminiCLI 模型是静态的。
+"""
+import asyncio
+import time
+from typing import Dict, List, Optional
+
+from sqlalchemy import select
+
+from app.config import settings
+
+
+# ===== 过滤规则 =====
+
+_INTERNAL_PATTERNS = ["chat_", "rev", "tab_", "uic", "test", "exp", "lite_preview"]
+
+
+def _is_agy_25_pro(model_lower: str) -> bool:
+    # gemini-2.5-pro 在 Antigravity 上无法使用
+    return "gemini-2.5-pro" in model_lower or "gemini-2.5pro" in model_lower
+
+
+def _is_valid_antigravity_model(model_id: str) -> bool:
+    """Antigravity OpenAI 接口（/antigravity/v1/models）的过滤规则"""
+    model_lower = model_id.lower()
+    invalid_patterns = _INTERNAL_PATTERNS + ["gcli-", "search"]  # search模型反重力不支持
+    if any(pattern in model_lower for pattern in invalid_patterns):
+        return False
+    if _is_agy_25_pro(model_lower):
+        return False
+    valid_prefixes = [
+        "gemini-2.5", "gemini-3", "claude", "gpt-oss",
+        "agy-gemini-2.5", "agy-gemini-3", "agy-claude", "agy-gpt"
+    ]
+    return any(model_lower.startswith(prefix) for prefix in valid_prefixes)
+
+
+def _is_valid_mixed_model(model_id: str) -> bool:
+    """混合接口（/v1/models，agy- 前缀）的过滤规则"""
+    model_lower = model_id.lower()
+    invalid_patterns = _INTERNAL_PATTERNS + ["gcli-"]  # gcli- 前缀是 GeminiCLI 模型
+    if any(pattern in model_lower for pattern in invalid_patterns):
+        return False
+    if _is_agy_25_pro(model_lower):
+        return False
+    return any(model_lower.startswith(prefix) for prefix in ["gemini", "claude", "gpt-oss"])
+
+
+def _is_valid_gemini_model(model_id: str) -> bool:
+    """Gemini 原生接口（/v1beta/models）的过滤规则，只保留 gemini 系列"""
+    model_lower = model_id.lower()
+    if any(pattern in model_lower for pattern in _INTERNAL_PATTERNS):
+        return False
+    if _is_agy_25_pro(model_lower):
+        return False
+    return model_lower.startswith("gemini")
+
+
+def _needs_size_variants(model_id: str) -> bool:
+    model_lower = model_id.lower()
+    return "image" in model_lower and "2k" not in model_lower and "4k" not in model_lower
+
+
+def _append_missing(ids: List[str], variants: List[str]):
+    existing = set(ids)
+    for variant in variants:
+        if variant not in existing:
+            ids.append(variant)
+            existing.add(variant)
+
+
+# ===== 列表构建 =====
+
+def build_antigravity_ids(dynamic_ids: Optional[List[str]]) -> List[str]:
+    """/antigravity/v1/models 的模型 ID 列表"""
+    if not dynamic_ids:
+        # 回退到静态模型列表（不包含 gemini-2.5-pro）
+        base_models = [
+            "gemini-2.5-flash", "gemini-2.5-flash-lite", "gemini-2.5-flash-thinking",
+            "gemini-3-flash", "gemini-3-pro-low", "gemini-3-pro-high",
+            "gemini-3-pro-image", "gemini-3-pro-image-2k", "gemini-3-pro-image-4k",
+            "claude-sonnet-4-5", "claude-opus-4-5",
+            "gpt-oss-120b",
+        ]
+        thinking_suffixes = ["-maxthinking", "-nothinking", "-thinking"]
+        ids = []
+        for base in base_models:
+            ids.extend([f"agy-{base}", base, f"流式抗截断/{base}"])
+            # 思维模式变体 (仅 Claude 和部分 Gemini)
+            if base.startswith("claude") or "pro" in base:
+                for suffix in thinking_suffixes:
+                    ids.extend([f"agy-{base}{suffix}", f"{base}{suffix}"])
+        return ids
+
+    ids = []
+    for model_id in dynamic_ids:
+        if not _is_valid_antigravity_model(model_id):
+            continue
+        # 流式抗截断变体（假非流已自动处理，不需要单独列出）
+        ids.extend([model_id, f"流式抗截断/{model_id}"])
+        if _needs_size_variants(model_id):
+            ids.extend([f"{model_id}-2k", f"{model_id}-4k"])
+            if not model_id.startswith("agy-"):
+                ids.extend([f"agy-{model_id}-2k", f"agy-{model_id}-4k"])
+
+    # 强制添加 Claude 模型的不带 -thinking 后缀版本
+    existing = set(ids)
+    for base_model in ["claude-opus-4-5", "agy-claude-opus-4-5", "claude-sonnet-4-5", "agy-claude-sonnet-4-5"]:
+        if base_model not in existing:
+            ids.extend([base_model, f"流式抗截断/{base_model}"])
+
+    _append_missing(ids, [
+        "gemini-3-pro-image", "agy-gemini-3-pro-image",
+        "gemini-3-pro-image-2k", "agy-gemini-3-pro-image-2k",
+        "流式抗截断/gemini-3-pro-image-2k", "流式抗截断/agy-gemini-3-pro-image-2k",
+        "gemini-3-pro-image-4k", "agy-gemini-3-pro-image-4k",
+        "流式抗截断/gemini-3-pro-image-4k", "流式抗截断/agy-gemini-3-pro-image-4k",
+    ])
+    return ids
+
+
+def build_mixed_agy_ids(dynamic_ids: Optional[List[str]]) -> List[str]:
+    """/v1/models 中 agy- 前缀部分的模型 ID 列表"""
+    if not dynamic_ids:
+        fallback = [
+            "gemini-2.5-flash", "gemini-2.5-flash-lite", "gemini-2.5-flash-thinking",
+            "gemini-3-flash", "gemini-3-pro-low", "gemini-3-pro-high",
+            "gemini-3-pro-image", "gemini-3-pro-image-2k", "gemini-3-pro-image-4k",
+            "claude-opus-4-5", "claude-opus-4-5-thinking",
+            "claude-sonnet-4-5", "claude-sonnet-4-5-thinking",
+            "gpt-oss-120b-medium"
+        ]
+        return [f"agy-{base}" for base in fallback]
+
+    ids = []
+    for model_id in dynamic_ids:
+        if not _is_valid_mixed_model(model_id):
+            continue
+        ids.append(f"agy-{model_id}")
+        if _needs_size_variants(model_id):
+            ids.extend([f"agy-{model_id}-2k", f"agy-{model_id}-4k"])
+
+    _append_missing(ids, ["agy-gemini-3-pro-image", "agy-gemini-3-pro-image-2k", "agy-gemini-3-pro-image-4k"])
+    _append_missing(ids, [
+        "agy-claude-opus-4-5", "agy-claude-opus-4-5-thinking",
+        "agy-claude-sonnet-4-5", "agy-claude-sonnet-4-5-thinking",
+    ])
+    _append_missing(ids, ["agy-gemini-2.5-flash", "agy-gemini-2.5-flash-lite", "agy-gemini-2.5-flash-thinking"])
+    return ids
+
+
+def build_gemini_agy_ids(dynamic_ids: Optional[List[str]]) -> List[str]:
+    """/v1beta/models 中 agy- 前缀部分的模型 ID 列表（仅 gemini 系列）"""
+    if not dynamic_ids:
+        fallback = [
+            "gemini-2.5-flash", "gemini-2.5-flash-lite", "gemini-2.5-flash-thinking",
+            "gemini-3-flash", "gemini-3-pro-low", "gemini-3-pro-high",
+            "gemini-3-pro-image", "gemini-3-pro-image-2k", "gemini-3-pro-image-4k",
+        ]
+        return [f"agy-{base}" for base in fallback]
+
+    ids = []
+    for model_id in dynamic_ids:
+        if not _is_valid_gemini_model(model_id):
+            continue
+        ids.append(f"agy-{model_id}")
+        if _needs_size_variants(model_id):
+            ids.extend([f"agy-{model_id}-2k", f"agy-{model_id}-4k"])
+
+    _append_missing(ids, ["agy-gemini-2.5-flash", "agy-gemini-2.5-flash-lite", "agy-gemini-2.5-flash-thinking"])
+    _append_missing(ids, ["agy-gemini-3-pro-image", "agy-gemini-3-pro-image-2k", "agy-gemini-3-pro-image-4k"])
+    return ids
+
+
+def build_gcli_ids(has_tier3: bool) -> List[str]:
+    """GeminiCLI 模型 ID 列表（静态，含假流/、thinking、search 变体）"""
+    base_models = ["gemini-2.5-pro", "gemini-2.5-flash"]
+    if has_tier3:
+        base_models.extend(["gemini-3-pro-preview", "gemini-3-flash-preview"])
+    thinking_suffixes = ["-maxthinking", "-nothinking"]
+    search_suffix = "-search"
+
+    ids = []
+    for base in base_models:
+        ids.append(f"gcli-{base}")
+        ids.append(f"gcli-假流/{base}")
+        for suffix in thinking_suffixes:
+            ids.append(f"gcli-{base}{suffix}")
+            ids.append(f"gcli-假流/{base}{suffix}")
+        ids.append(f"gcli-{base}{search_suffix}")
+        for suffix in thinking_suffixes:
+            ids.append(f"gcli-{base}{suffix}{search_suffix}")
+    return ids
+
+
+_BUILDERS = {
+    "antigravity": build_antigravity_ids,
+    "mixed": build_mixed_agy_ids,
+    "gemini": build_gemini_agy_ids,
+}
+
+
+class ModelCatalog:
+    """模型目录：后台刷新的动态模型列表 + 构建好的各视图"""
+
+    def __init__(self):
+        # {api_type: [model_id, ...]}
+        self.dynamic: Dict[str, List[str]] = {}
+        self.fetched_at: Dict[str, float] = {}
+        self.last_error: Dict[str, str] = {}
+        # {view: [model_id, ...]}，动态列表变化时清空重建
+        self._views: Dict[str, List[str]] = {}
+        self._gcli_views: Dict[bool, List[str]] = {}
+        self._refresh_task: Optional[asyncio.Task] = None
+
+    def get_ids(self, view: str) -> List[str]:
+        """获取某个视图的模型 ID 列表（只读内存）"""
+        self._schedule_refresh_if_stale()
+        ids = self._views.get(view)
+        if ids is None:
+            ids = _BUILDERS[view](self.dynamic.get("antigravity"))
+            self._views[view] = ids
+        return ids
+
+    def get_gcli_ids(self, has_tier3: bool) -> List[str]:
+        ids = self._gcli_views.get(has_tier3)
+        if ids is None:
+            ids = build_gcli_ids(has_tier3)
+            self._gcli_views[has_tier3] = ids
+        return ids
+
+    def is_stale(self, api_type: str = "antigravity") -> bool:
+        fetched_at = self.fetched_at.get(api_type)
+        return fetched_at is None or time.time() - fetched_at > settings.model_catalog_ttl
+
+    def _schedule_refresh_if_stale(self):
+        """列表过期时在后台触发刷新，请求本身不等待"""
+        if not settings.antigravity_enabled or not self.is_stale():
+            return
+        if self._refresh_task and not self._refresh_task.done():
+            return
+        try:
+            self._refresh_task = asyncio.get_running_loop().create_task(self.refresh_antigravity())
+        except RuntimeError:
+            pass
+
+    async def refresh_antigravity(self) -> bool:
+        """从上游拉取 Antigravity 动态模型列表"""
+        from app.database import async_session
+        from app.models.user import Credential
+        from app.services.credential_pool import CredentialPool
+        from app.services.antigravity_client import AntigravityClient
+
+        # 先标记刷新时间，失败时也不会每个请求都触发
+        self.fetched_at["antigravity"] = time.time()
+        try:
+            async with async_session() as db:
+                # 只读挑选凭证，不走 get_available_credential（不更新使用时间/CD）
+                result = await db.execute(
+                    select(Credential)
+                    .where(Credential.api_type == "antigravity")
+                    .where(Credential.is_active == True)
+                    .order_by(Credential.is_public.desc(), Credential.id)
+                    .limit(3)
+                )
+                for credential in result.scalars().all():
+                    access_token = await CredentialPool.get_access_token(credential, db)
+                    if not access_token:
+                        continue
+                    client = AntigravityClient(access_token, credential.project_id or "")
+                    models = await client.fetch_available_models()
+                    ids = [m.get("id", "") for m in models if m.get("id")]
+                    if ids:
+                        self._set_dynamic("antigravity", ids)
+                        print(f"[ModelCatalog] ✅ Antigravity 模型目录已刷新: {len(ids)} 个模型", flush=True)
+                        return True
+            self.last_error["antigravity"] = "没有可用凭证或上游返回空列表"
+        except Exception as e:
+            self.last_error["antigravity"] = str(e)
+            print(f"[ModelCatalog] ⚠️ 刷新 Antigravity 模型目录失败: {e}", flush=True)
+        # 失败时 60 秒后允许再次触发
+        self.fetched_at["antigravity"] = time.time() - settings.model_catalog_ttl + 60
+        return False
+
+    def _set_dynamic(self, api_type: str, ids: List[str]):
+        if self.dynamic.get(api_type) != ids:
+            self.dynamic[api_type] = ids
+            self._views.clear()
+        self.last_error.pop(api_type, None)
+
+    async def run_forever(self):
+        """后台刷新任务"""
+        while True:
+            if settings.antigravity_enabled:
+                await self.refresh_antigravity()
+            await asyncio.sleep(max(60, settings.model_catalog_ttl))
+
+    def get_status(self) -> dict:
+        return {
+            api_type: {
+                "models": len(self.dynamic.get(api_type) or []),
+                "fetched_at": self.fetched_at.get(api_type),
+                "last_error": self.last_error.get(api_type),
+            }
+            for api_type in ("antigravity",)
+        }
+
+
+# 全局模型目录实例
+model_catalog = ModelCatalog()
@@ -0,0 +1,122 @@
+"""
+模型分类器（写日志时计算一次，存入 usage_logs 的索引列）
+
+以前统计和配额检查各自用 LIKE '%pro%'、'%3%' 之类的模式匹配模型名：
+无法走索引，而且 '%3%' 会误匹配 gemini-2.5-flash-lite-0325 这类带日期的模型。
+这里统一定义三种分类：
+- api_type: geminicli / antigravity（按模型前缀或端点判断）
+- quota_class: flash / pro / tier3（GeminiCLI 配额类别，与 CredentialPool.get_model_group 一致，gemini-3-* 都算 tier3）
+- model_family: claude / gemini / banana / other（Antigravity 配额类别）
+"""
+from typing import Dict, Optional
+
+from sqlalchemy import select, update
+
+
+API_TYPES = ["geminicli", "antigravity"]
+QUOTA_CLASSES = ["flash", "pro", "tier3"]
+MODEL_FAMILIES = ["claude", "gemini", "banana", "other"]
+
+# 日志中模型名的渠道前缀（antigravity/、antigravity-gemini/、假流/ 等）
+_LOCAL_PREFIXES = ["gcli-", "agy-", "假流/", "流式抗截断/", "假非流/"]
+
+
+def _base_model(model: str) -> str:
+    """去掉渠道前缀，得到小写的基础模型名"""
+    m = (model or "").lower()
+    if "/" in m and m.split("/", 1)[0].startswith("antigravity"):
+        m = m.split("/", 1)[1]
+    changed = True
+    while changed:
+        changed = False
+        for prefix in _LOCAL_PREFIXES:
+            if m.startswith(prefix):
+                m = m[len(prefix):]
+                changed = True
+    return m
+
+
+def classify_api_type(model: Optional[str], endpoint: Optional[str] = None) -> str:
+    m = (model or "").lower()
+    e = (endpoint or "").lower()
+    if m.startswith("antigravity") or "/agy/" in e or "/antigravity/" in e:
+        return "antigravity"
+    return "geminicli"
+
+
+def classify_quota_class(model: Optional[str]) -> str:
+    """GeminiCLI 配额类别（互斥：tier3 > pro > flash，其余都算 flash 额度）"""
+    m = _base_model(model)
+    if "gemini-3" in m or "3.0" in m or "tier3" in m or m.startswith("3-"):
+        return "tier3"
+    if "pro" in m:
+        return "pro"
+    return "flash"
+
+
+def classify_model_family(model: Optional[str]) -> str:
+    """模型品牌（Antigravity 配额类别：Claude / Gemini / Banana 图片模型 / 其他）"""
+    m = (model or "").lower()
+    if "claude" in m:
+        return "claude"
+    if "image" in m:
+        return "banana"
+    if "gemini" in m or "flash" in m or "pro" in m:
+        return "gemini"
+    return "other"
+
+
+def classify(model: Optional[str], endpoint: Optional[str] = None) -> Dict[str, str]:
+    return {
+        "api_type": classify_api_type(model, endpoint),
+        "quota_class": classify_quota_class(model),
+        "model_family": classify_model_family(model),
+    }
+
+
+def apply_classification(log) -> None:
+    """写入/更新 UsageLog 前填充分类列"""
+    for key, value in classify(log.model, log.endpoint).items():
+        setattr(log, key, value)
+
+
+async def backfill_model_classes() -> int:
+    """
+    为历史日志补全分类列
+
+    按 (model, endpoint) 的不同组合分批 UPDATE，不逐行加载日志。
+    """
+    from app.database import async_session
+    from app.models.user import UsageLog
+
+    updated = 0
+    try:
+        async with async_session() as db:
+            result = await db.execute(
+                select(UsageLog.model, UsageLog.endpoint)
+                .where(UsageLog.quota_class == None)
+                .distinct()
+            )
+            pairs = result.all()
+
+            # 早先版本把 gemini-3-flash 记成了 flash，这里改回 tier3（与 2.5pro 共享额度）
+            fixed = await db.execute(
+                update(UsageLog)
+                .where(UsageLog.quota_class == "flash")
+                .where(UsageLog.model.like("%gemini-3-%"))
+                .values(quota_class="tier3")
+            )
+            updated += fixed.rowcount or 0
+            await db.commit()
+            for model, endpoint in pairs:
+                stmt = update(UsageLog).where(UsageLog.quota_class == None)
+                stmt = stmt.where(UsageLog.model == model if model is not None else UsageLog.model == None)
+                stmt = stmt.where(UsageLog.endpoint == endpoint if endpoint is not None else UsageLog.endpoint == None)
+                res = await db.execute(stmt.values(**classify(model, endpoint)))
+                updated += res.rowcount or 0
+                await db.commit()
+        if updated:
+            print(f"[ModelClassifier] ✅ 已为 {updated} 条历史日志补全模型分类（{len(pairs)} 种组合）", flush=True)
+    except Exception as e:
+        print(f"[ModelClassifier] ⚠️ 补全模型分类失败: {e}", flush=True)
+    return updated
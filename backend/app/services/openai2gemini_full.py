@@ -4,10 +4,16 @@ OpenAI Transfer Module - Handles conversion between OpenAI and Gemini API format
 """
 
 import json
-import time
+import re
 import uuid
 import logging
-from typing import Any, Dict, List, Optional, Tuple, Union
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from app.services.inline_media import parse_data_url
+from app.services.prefix_cache import copy_contents, prefix_cache
+from app.services.protocol_ir import Blob, FunctionCall, FunctionResponse, Message, Part
+from app.services.tool_schema_cache import tool_schema_cache
 
 # 尝试导入 pypinyin，如果不存在则使用简单替代
 try:
@@ -118,62 +124,13 @@ async def merge_system_messages(request: Dict[str, Any]) -> Dict[str, Any]:
     return request
 
 
-def _convert_usage_metadata(usage_metadata: Dict[str, Any]) -> Dict[str, int]:
-    """
-    将Gemini的usageMetadata转换为OpenAI格式的usage字段
-
-    Args:
-        usage_metadata: Gemini API的usageMetadata字段
-
-    Returns:
-        OpenAI格式的usage字典，如果没有usage数据则返回None
-    """
-    if not usage_metadata:
-        return None
-
-    return {
-        "prompt_tokens": usage_metadata.get("promptTokenCount", 0),
-        "completion_tokens": usage_metadata.get("candidatesTokenCount", 0),
-        "total_tokens": usage_metadata.get("totalTokenCount", 0),
-    }
-
-
-def _build_message_with_reasoning(role: str, content: str, reasoning_content: str) -> dict:
-    """构建包含可选推理内容的消息对象"""
-    message = {"role": role, "content": content}
-
-    # 如果有thinking tokens，添加reasoning_content
-    if reasoning_content:
-        message["reasoning_content"] = reasoning_content
-
-    return message
-
-
-def _map_finish_reason(gemini_reason: str) -> str:
-    """
-    将Gemini结束原因映射到OpenAI结束原因
-
-    Args:
-        gemini_reason: 来自Gemini API的结束原因
-
-    Returns:
-        OpenAI兼容的结束原因
-    """
-    if gemini_reason == "STOP":
-        return "stop"
-    elif gemini_reason == "MAX_TOKENS":
-        return "length"
-    elif gemini_reason in ["SAFETY", "RECITATION"]:
-        return "content_filter"
-    else:
-        # 对于 None 或未知的 finishReason，返回 "stop" 作为默认值
-        # 避免返回 None 导致 MCP 客户端误判为响应未完成而循环调用
-        return "stop"
-
-
 # ==================== Tool Conversion Functions ====================
 
+_CHINESE_RE = re.compile(r"[\u4e00-\u9fff]")
+_ILLEGAL_NAME_CHARS_RE = re.compile(r"[^a-zA-Z0-9_.\-]")
+
 
+@lru_cache(maxsize=4096)
 def _normalize_function_name(name: str) -> str:
     """
     规范化函数名以符合 Gemini API 要求
@@ -195,13 +152,11 @@ def _normalize_function_name(name: str) -> str:
     Returns:
         规范化后的函数名
     """
-    import re
-
     if not name:
         return "_unnamed_function"
 
     # 步骤1：转换中文字符为拼音
-    if re.search(r"[\u4e00-\u9fff]", name):
+    if _CHINESE_RE.search(name):
         try:
             parts = []
             for char in name:
@@ -220,7 +175,7 @@ def _normalize_function_name(name: str) -> str:
 
     # 步骤2：将非法字符替换为下划线
     # 合法字符：a-z, A-Z, 0-9, _, ., -
-    normalized = re.sub(r"[^a-zA-Z0-9_.\-]", "_", normalized)
+    normalized = _ILLEGAL_NAME_CHARS_RE.sub("_", normalized)
 
     # 步骤3：确保以字母或下划线开头
     if normalized and not (normalized[0].isalpha() or normalized[0] == "_"):
@@ -620,6 +575,74 @@ def _clean_schema_for_gemini(schema: Any, root_schema: Optional[Dict[str, Any]]
     return result
 
 
+def _fix_number_arg(key: str, value: Any, param_type: str) -> Any:
+    # 如果值是字符串，尝试转换为数字
+    if not isinstance(value, str):
+        return value
+    try:
+        if param_type == "integer":
+            fixed = int(value)
+        else:
+            # 尝试转换为 float，如果是整数则保持为 int
+            num_value = float(value)
+            fixed = int(num_value) if num_value.is_integer() else num_value
+        log.debug(f"[OPENAI2GEMINI] 修正参数类型: {key} '{value}' -> {fixed} ({param_type})")
+        return fixed
+    except (ValueError, AttributeError):
+        # 转换失败，保持原样
+        log.warning(f"[OPENAI2GEMINI] 无法将参数 {key} 的值 '{value}' 转换为 {param_type}")
+        return value
+
+
+def _fix_boolean_arg(key: str, value: Any) -> Any:
+    # 如果值是字符串，转换为布尔值
+    if not isinstance(value, str):
+        return value
+    if value.lower() in ("true", "1", "yes"):
+        fixed = True
+    elif value.lower() in ("false", "0", "no"):
+        fixed = False
+    else:
+        return value
+    log.debug(f"[OPENAI2GEMINI] 修正参数类型: {key} '{value}' -> {fixed} (boolean)")
+    return fixed
+
+
+def _fix_string_arg(key: str, value: Any) -> Any:
+    # 如果值不是字符串，转换为字符串
+    if isinstance(value, str):
+        return value
+    fixed = str(value)
+    log.debug(f"[OPENAI2GEMINI] 修正参数类型: {key} {value} -> '{fixed}' (string)")
+    return fixed
+
+
+def _args_fixer_types(parameters_schema: Dict[str, Any]) -> Tuple[Tuple[str, str], ...]:
+    """参数 schema 中需要修正类型的参数：((参数名, 类型), ...)（其他类型如 array/object 不需要修正）"""
+    return tuple(
+        (key, param_schema.get("type"))
+        for key, param_schema in (parameters_schema.get("properties") or {}).items()
+        if isinstance(param_schema, dict) and param_schema.get("type") in ("number", "integer", "boolean", "string")
+    )
+
+
+def _compile_args_fixer(parameters_schema: Dict[str, Any]) -> Dict[str, Callable[[str, Any], Any]]:
+    """把参数 schema 编译成 {参数名: 类型修正函数}（其他类型如 array/object 不需要修正，不在表中）"""
+    return _compile_args_fixer_from_types(_args_fixer_types(parameters_schema))
+
+
+def _compile_args_fixer_from_types(arg_types: Tuple[Tuple[str, str], ...]) -> Dict[str, Callable[[str, Any], Any]]:
+    fixers: Dict[str, Callable[[str, Any], Any]] = {}
+    for key, param_type in arg_types:
+        if param_type in ("number", "integer"):
+            fixers[key] = lambda k, v, t=param_type: _fix_number_arg(k, v, t)
+        elif param_type == "boolean":
+            fixers[key] = _fix_boolean_arg
+        elif param_type == "string":
+            fixers[key] = _fix_string_arg
+    return fixers
+
+
 def fix_tool_call_args_types(
     args: Dict[str, Any],
     parameters_schema: Dict[str, Any]
@@ -627,7 +650,8 @@ def fix_tool_call_args_types(
     """
     根据工具的参数 schema 修正函数调用参数的类型
     
-    例如：将字符串 "5" 转换为数字 5，根据 schema 中的 type 定义
+    例如：将字符串 "5" 转换为数字 5，根据 schema 中的 type 定义。
+    同一请求中多次修正同一工具时，先用 _compile_args_fixer 编译一次再调用 apply_args_fixer。
     
     Args:
         args: 函数调用的参数字典
@@ -639,65 +663,60 @@ def fix_tool_call_args_types(
     if not args or not parameters_schema:
         return args
     
-    properties = parameters_schema.get("properties", {})
-    if not properties:
+    if not parameters_schema.get("properties"):
+        return args
+    
+    return apply_args_fixer(args, _compile_args_fixer(parameters_schema))
+
+
+def apply_args_fixer(args: Dict[str, Any], fixers: Dict[str, Callable[[str, Any], Any]]) -> Dict[str, Any]:
+    """用 _compile_args_fixer 编译好的修正器修正参数类型"""
+    if not args or not fixers:
         return args
     
     fixed_args = {}
     for key, value in args.items():
-        if key not in properties:
-            # 参数不在 schema 中，保持原样
-            fixed_args[key] = value
-            continue
-        
-        param_schema = properties[key]
-        param_type = param_schema.get("type")
-        
-        # 根据 schema 中的类型修正参数值
-        if param_type == "number" or param_type == "integer":
-            # 如果值是字符串，尝试转换为数字
-            if isinstance(value, str):
-                try:
-                    if param_type == "integer":
-                        fixed_args[key] = int(value)
-                    else:
-                        # 尝试转换为 float，如果是整数则保持为 int
-                        num_value = float(value)
-                        fixed_args[key] = int(num_value) if num_value.is_integer() else num_value
-                    log.debug(f"[OPENAI2GEMINI] 修正参数类型: {key} '{value}' -> {fixed_args[key]} ({param_type})")
-                except (ValueError, AttributeError):
-                    # 转换失败，保持原样
-                    fixed_args[key] = value
-                    log.warning(f"[OPENAI2GEMINI] 无法将参数 {key} 的值 '{value}' 转换为 {param_type}")
-            else:
-                fixed_args[key] = value
-        elif param_type == "boolean":
-            # 如果值是字符串，转换为布尔值
-            if isinstance(value, str):
-                if value.lower() in ("true", "1", "yes"):
-                    fixed_args[key] = True
-                elif value.lower() in ("false", "0", "no"):
-                    fixed_args[key] = False
-                else:
-                    fixed_args[key] = value
-                if fixed_args[key] != value:
-                    log.debug(f"[OPENAI2GEMINI] 修正参数类型: {key} '{value}' -> {fixed_args[key]} (boolean)")
-            else:
-                fixed_args[key] = value
-        elif param_type == "string":
-            # 如果值不是字符串，转换为字符串
-            if not isinstance(value, str):
-                fixed_args[key] = str(value)
-                log.debug(f"[OPENAI2GEMINI] 修正参数类型: {key} {value} -> '{fixed_args[key]}' (string)")
-            else:
-                fixed_args[key] = value
-        else:
-            # 其他类型（array, object 等）保持原样
-            fixed_args[key] = value
+        fixer = fixers.get(key)
+        # 参数不在 schema 中或类型无需修正，保持原样
+        fixed_args[key] = fixer(key, value) if fixer else value
     
     return fixed_args
 
 
+def _build_function_declaration(function: Dict[str, Any], is_claude_model: bool) -> Dict[str, Any]:
+    """把单个 OpenAI function 定义转换为 Gemini function declaration"""
+    # 获取并规范化函数名
+    original_name = function.get("name")
+    if not original_name:
+        log.warning("Tool missing 'name' field, using default")
+        original_name = "_unnamed_function"
+
+    normalized_name = _normalize_function_name(original_name)
+
+    # 如果名称被修改了，记录日志
+    if normalized_name != original_name:
+        log.debug(f"Function name normalized: '{original_name}' -> '{normalized_name}'")
+
+    # 构建 Gemini function declaration
+    declaration = {
+        "name": normalized_name,
+        "description": function.get("description", ""),
+    }
+
+    # 添加参数（如果有）- 根据模型选择不同的清理函数
+    if "parameters" in function:
+        if is_claude_model:
+            cleaned_params = _clean_schema_for_claude(function["parameters"])
+            log.debug(f"[OPENAI2GEMINI] Using Claude schema cleaning for tool: {normalized_name}")
+        else:
+            cleaned_params = _clean_schema_for_gemini(function["parameters"])
+
+        if cleaned_params:
+            declaration["parameters"] = cleaned_params
+
+    return declaration
+
+
 def convert_openai_tools_to_gemini(openai_tools: List, model: str = "") -> List[Dict[str, Any]]:
     """
     将 OpenAI tools 格式转换为 Gemini functionDeclarations 格式
@@ -714,49 +733,22 @@ def convert_openai_tools_to_gemini(openai_tools: List, model: str = "") -> List[
 
     # 判断是否为 Claude 模型
     is_claude_model = "claude" in model.lower()
+    family = "claude" if is_claude_model else "gemini"
 
-    function_declarations = []
-
-    for tool in openai_tools:
+    def convert_tool(tool):
         if tool.get("type") != "function":
             log.warning(f"Skipping non-function tool type: {tool.get('type')}")
-            continue
+            return None
 
         function = tool.get("function")
         if not function:
             log.warning("Tool missing 'function' field")
-            continue
-
-        # 获取并规范化函数名
-        original_name = function.get("name")
-        if not original_name:
-            log.warning("Tool missing 'name' field, using default")
-            original_name = "_unnamed_function"
-
-        normalized_name = _normalize_function_name(original_name)
-
-        # 如果名称被修改了，记录日志
-        if normalized_name != original_name:
-            log.debug(f"Function name normalized: '{original_name}' -> '{normalized_name}'")
-
-        # 构建 Gemini function declaration
-        declaration = {
-            "name": normalized_name,
-            "description": function.get("description", ""),
-        }
-
-        # 添加参数（如果有）- 根据模型选择不同的清理函数
-        if "parameters" in function:
-            if is_claude_model:
-                cleaned_params = _clean_schema_for_claude(function["parameters"])
-                log.debug(f"[OPENAI2GEMINI] Using Claude schema cleaning for tool: {normalized_name}")
-            else:
-                cleaned_params = _clean_schema_for_gemini(function["parameters"])
+            return None
 
-            if cleaned_params:
-                declaration["parameters"] = cleaned_params
+        return _build_function_declaration(function, is_claude_model)
 
-        function_declarations.append(declaration)
+    # 同样的工具定义（按内容哈希）直接复用上次的转换结果
+    function_declarations = tool_schema_cache.convert_all(openai_tools, family, convert_tool)
 
     if not function_declarations:
         return []
@@ -798,59 +790,6 @@ def convert_tool_choice_to_tool_config(tool_choice: Union[str, Dict[str, Any]])
     return {"functionCallingConfig": {"mode": "AUTO"}}
 
 
-def convert_tool_message_to_function_response(message, all_messages: List = None) -> Dict[str, Any]:
-    """
-    将 OpenAI 的 tool role 消息转换为 Gemini functionResponse
-
-    Args:
-        message: OpenAI 格式的工具消息
-        all_messages: 所有消息的列表，用于查找 tool_call_id 对应的函数名
-
-    Returns:
-        Gemini 格式的 functionResponse part
-    """
-    # 获取 name 字段
-    name = getattr(message, "name", None)
-    encoded_tool_call_id = getattr(message, "tool_call_id", None) or ""
-
-    # 解码获取原始ID（functionResponse不需要签名）
-    original_tool_call_id, _ = decode_tool_id_and_signature(encoded_tool_call_id)
-
-    # 如果没有 name，尝试从 all_messages 中查找对应的 tool_call_id
-    # 注意：使用编码ID查找，因为存储的是编码ID
-    if not name and encoded_tool_call_id and all_messages:
-        for msg in all_messages:
-            if getattr(msg, "role", None) == "assistant" and hasattr(msg, "tool_calls") and msg.tool_calls:
-                for tool_call in msg.tool_calls:
-                    if getattr(tool_call, "id", None) == encoded_tool_call_id:
-                        func = getattr(tool_call, "function", None)
-                        if func:
-                            name = getattr(func, "name", None)
-                            break
-                if name:
-                    break
-
-    # 最终兜底：如果仍然没有 name，使用默认值
-    if not name:
-        name = "unknown_function"
-        log.warning(f"Tool message missing function name, using default: {name}")
-
-    try:
-        # 尝试将 content 解析为 JSON
-        response_data = (
-            json.loads(message.content) if isinstance(message.content, str) else message.content
-        )
-    except (json.JSONDecodeError, TypeError):
-        # 如果不是有效的 JSON，包装为对象
-        response_data = {"result": str(message.content)}
-
-    # 确保 response_data 是字典类型（Gemini API 要求 response 必须是对象）
-    if not isinstance(response_data, dict):
-        response_data = {"result": response_data}
-
-    return {"functionResponse": {"id": original_tool_call_id, "name": name, "response": response_data}}
-
-
 def _reverse_transform_value(value: Any) -> Any:
     """
     将值转换回原始类型（Gemini 可能将所有值转为字符串）
@@ -921,95 +860,197 @@ def _reverse_transform_args(args: Any) -> Any:
     return result
 
 
-def extract_tool_calls_from_parts(
-    parts: List[Dict[str, Any]], is_streaming: bool = False
-) -> Tuple[List[Dict[str, Any]], str]:
+def build_openai_tool_call(part: Part, index: Optional[int] = None) -> Dict[str, Any]:
     """
-    从 Gemini response parts 中提取工具调用和文本内容
+    把一个带 functionCall 的 IR part 转换为 OpenAI tool_call
 
     Args:
-        parts: Gemini response 的 parts 数组
-        is_streaming: 是否为流式响应（流式响应需要添加 index 字段）
+        part: 带 function_call 的 IR part
+        index: 流式响应需要的 index 字段（part 在响应中的位置），非流式为 None
 
     Returns:
-        (tool_calls, text_content) 元组
+        OpenAI 格式的 tool_call
     """
-    tool_calls = []
-    text_content = ""
-
-    for idx, part in enumerate(parts):
-        # 检查是否是函数调用
-        if "functionCall" in part:
-            function_call = part["functionCall"]
-            # 获取原始ID或生成新ID
-            original_id = function_call.get("id") or f"call_{uuid.uuid4().hex[:24]}"
-            # 将thoughtSignature编码到ID中以便往返保留
-            signature = part.get("thoughtSignature")
-            encoded_id = encode_tool_id_with_signature(original_id, signature)
-
-            # 获取参数并转换类型
-            args = function_call.get("args", {})
-            # 将字符串类型的值转回原始类型
-            args = _reverse_transform_args(args)
-
-            tool_call = {
-                "id": encoded_id,
-                "type": "function",
-                "function": {
-                    "name": function_call.get("name", "nameless_function"),
-                    "arguments": json.dumps(args),
-                },
-            }
-            # 流式响应需要 index 字段
-            if is_streaming:
-                tool_call["index"] = idx
-            tool_calls.append(tool_call)
-
-        # 提取文本内容（排除 thinking tokens）
-        elif "text" in part and not part.get("thought", False):
-            text_content += part["text"]
-
-    return tool_calls, text_content
-
-
-def extract_images_from_content(content: Any) -> Dict[str, Any]:
+    function_call = part.function_call
+    # 获取原始ID或生成新ID
+    original_id = function_call.id or f"call_{uuid.uuid4().hex[:24]}"
+    # 将thoughtSignature编码到ID中以便往返保留
+    encoded_id = encode_tool_id_with_signature(original_id, part.signature)
+
+    # 将字符串类型的值转回原始类型
+    args = _reverse_transform_args(function_call.args)
+
+    tool_call = {
+        "id": encoded_id,
+        "type": "function",
+        "function": {
+            "name": function_call.name if function_call.name is not None else "nameless_function",
+            "arguments": json.dumps(args),
+        },
+    }
+    if index is not None:
+        tool_call["index"] = index
+    return tool_call
+
+
+def _get_arg_types(func_name: Any, tool_schemas: Dict[str, Any], tool_arg_types: Dict[str, Any]) -> Optional[Tuple[Tuple[str, str], ...]]:
+    """请求中工具的参数修正类型（按工具名缓存在 tool_arg_types 中），工具未声明时返回 None"""
+    if func_name not in tool_schemas:
+        return None
+    arg_types = tool_arg_types.get(func_name)
+    if arg_types is None:
+        arg_types = tool_arg_types[func_name] = _args_fixer_types(tool_schemas[func_name] or {})
+    return arg_types
+
+
+def _message_dependency(
+    message: Dict[str, Any],
+    tool_call_mapping: Dict[str, Tuple[str, str, str]],
+    tool_schemas: Dict[str, Any],
+    tool_arg_types: Dict[str, Any],
+) -> Any:
     """
-    从 OpenAI content 中提取文本和图片
-    
-    Args:
-        content: OpenAI 消息的 content 字段（可能是字符串或列表）
-    
-    Returns:
-        包含 text 和 images 的字典
+    单条消息的转换结果除消息本身以外依赖的信息（对话前缀缓存比较用）
+
+    - tool 消息：对应 tool_call 的名称和原始 ID
+    - 带 tool_calls 的消息：所调用工具的参数修正类型
     """
-    result = {"text": "", "images": []}
-
-    if isinstance(content, str):
-        result["text"] = content
-    elif isinstance(content, list):
-        for item in content:
-            if isinstance(item, dict):
-                if item.get("type") == "text":
-                    result["text"] += item.get("text", "")
-                elif item.get("type") == "image_url":
-                    image_url = item.get("image_url", {}).get("url", "")
-                    # 解析 data:image/png;base64,xxx 格式
-                    if image_url.startswith("data:image/"):
-                        import re
-                        match = re.match(r"^data:image/(\w+);base64,(.+)$", image_url)
-                        if match:
-                            mime_type = match.group(1)
-                            base64_data = match.group(2)
-                            result["images"].append({
-                                "inlineData": {
-                                    "mimeType": f"image/{mime_type}",
-                                    "data": base64_data
-                                }
-                            })
+    role = message.get("role", "user")
+    if role == "tool":
+        return tool_call_mapping.get(message.get("tool_call_id", ""))
+    if role == "system":
+        return None
+    tool_calls = message.get("tool_calls")
+    if not tool_calls or not isinstance(tool_calls, list):
+        return None
+    return tuple(
+        _get_arg_types((tc.get("function") or {}).get("name"), tool_schemas, tool_arg_types)
+        if isinstance(tc, dict) and isinstance(tc.get("function"), dict) else None
+        for tc in tool_calls
+    )
+
+
+def parse_openai_message(
+    message: Dict[str, Any],
+    tool_call_mapping: Dict[str, Tuple[str, str, str]],
+    tool_schemas: Dict[str, Any],
+    tool_arg_types: Dict[str, Any],
+    tool_fixers: Dict[str, Dict[str, Callable[[str, Any], Any]]],
+) -> Optional[Message]:
+    """把一条 OpenAI 消息解析为 IR 消息，没有内容时返回 None"""
+    role = message.get("role", "user")
+    content = message.get("content", "")
+
+    # 处理工具消息（tool role）
+    if role == "tool":
+        tool_call_id = message.get("tool_call_id", "")
+        func_name = message.get("name")
+
+        # 使用映射表查找（映射表包含所有带 ID 的 tool_call，查不到时只能用消息自带的 name）
+        if tool_call_id in tool_call_mapping:
+            func_name, original_id, _ = tool_call_mapping[tool_call_id]
+        else:
+            # 解码 tool_call_id 获取原始 ID
+            original_id, _ = decode_tool_id_and_signature(tool_call_id)
 
-    return result
+        # 最终兜底：确保 func_name 不为空
+        if not func_name:
+            func_name = "unknown_function"
+            log.warning(f"Tool message missing function name for tool_call_id={tool_call_id}, using default: {func_name}")
+
+        # 解析响应数据
+        try:
+            response_data = json.loads(content) if isinstance(content, str) else content
+        except (json.JSONDecodeError, TypeError):
+            response_data = {"result": str(content)}
 
-async def convert_openai_to_gemini_request(openai_request: Dict[str, Any]) -> Dict[str, Any]:
+        # 确保 response_data 是字典类型（Gemini API 要求 response 必须是对象）
+        if not isinstance(response_data, dict):
+            response_data = {"result": response_data}
+
+        # 使用原始 ID（不带签名）
+        return Message("user", [Part(function_response=FunctionResponse(original_id, func_name, response_data))])
+
+    # system 消息已经由 merge_system_messages 处理，这里跳过
+    if role == "system":
+        return None
+
+    # 将OpenAI角色映射到Gemini角色
+    if role == "assistant":
+        role = "model"
+
+    # 检查是否有tool_calls
+    tool_calls = message.get("tool_calls")
+    if tool_calls:
+        parts = []
+
+        # 如果有文本内容,先添加文本
+        if content:
+            parts.append(Part(text=content))
+
+        # 添加每个工具调用
+        for tool_call in tool_calls:
+            try:
+                args = (
+                    json.loads(tool_call["function"]["arguments"])
+                    if isinstance(tool_call["function"]["arguments"], str)
+                    else tool_call["function"]["arguments"]
+                )
+
+                # 根据工具的 schema 修正参数类型
+                func_name = tool_call["function"]["name"]
+                if func_name in tool_schemas:
+                    fixers = tool_fixers.get(func_name)
+                    if fixers is None:
+                        arg_types = _get_arg_types(func_name, tool_schemas, tool_arg_types)
+                        fixers = tool_fixers[func_name] = _compile_args_fixer_from_types(arg_types)
+                    args = apply_args_fixer(args, fixers)
+
+                # 解码工具ID和thoughtSignature（没有签名时生成 Gemini content 会使用占位符）
+                original_id, signature = decode_tool_id_and_signature(tool_call.get("id", ""))
+                parts.append(Part(function_call=FunctionCall(original_id, func_name, args), signature=signature or None))
+            except (json.JSONDecodeError, KeyError) as e:
+                log.error(f"Failed to parse tool call: {e}")
+                continue
+
+        if parts:
+            return Message(role, parts)
+        return None
+
+    # 处理普通内容
+    if isinstance(content, list):
+        parts = []
+        for part in content:
+            if part.get("type") == "text":
+                parts.append(Part(text=part.get("text") or ""))
+            elif part.get("type") == "image_url":
+                image_url = part.get("image_url", {}).get("url")
+                if image_url:
+                    # 不是 base64 data URL 时跳过；mime 无效或过大时抛出 InlineImageError，路由返回 400
+                    inline = parse_data_url(image_url)
+                    if inline is None:
+                        continue
+                    parts.append(Part(inline_data=Blob(*inline)))
+        if parts:
+            return Message(role, parts)
+    elif content:
+        return Message(role, [Part(text=content)])
+    return None
+
+
+def _convert_message_to_content(
+    message: Dict[str, Any],
+    tool_call_mapping: Dict[str, Tuple[str, str, str]],
+    tool_schemas: Dict[str, Any],
+    tool_arg_types: Dict[str, Any],
+    tool_fixers: Dict[str, Dict[str, Callable[[str, Any], Any]]],
+) -> Optional[Dict[str, Any]]:
+    """把一条 OpenAI 消息转换为 Gemini content，没有内容时返回 None"""
+    parsed = parse_openai_message(message, tool_call_mapping, tool_schemas, tool_arg_types, tool_fixers)
+    return parsed.to_gemini() if parsed is not None else None
+
+
+async def convert_openai_to_gemini_request(openai_request: Dict[str, Any], cache_key: Any = None) -> Dict[str, Any]:
     """
     将 OpenAI 格式请求体转换为 Gemini 格式请求体
 
@@ -1022,6 +1063,7 @@ async def convert_openai_to_gemini_request(openai_request: Dict[str, Any]) -> Di
             - temperature, top_p, max_tokens, stop 等生成参数
             - tools, tool_choice (可选)
             - response_format (可选)
+        cache_key: 对话前缀缓存的键（通常是用户 ID），为 None 时不使用缓存
 
     Returns:
         Gemini 格式的请求体字典,包含:
@@ -1033,8 +1075,6 @@ async def convert_openai_to_gemini_request(openai_request: Dict[str, Any]) -> Di
     # 处理连续的system消息（兼容性模式）
     openai_request = await merge_system_messages(openai_request)
 
-    contents = []
-
     # 提取消息列表
     messages = openai_request.get("messages", [])
     
@@ -1059,146 +1099,26 @@ async def convert_openai_to_gemini_request(openai_request: Dict[str, Any]) -> Di
                 func_name = function.get("name")
                 if func_name:
                     tool_schemas[func_name] = function.get("parameters", {})
-
-    for message in messages:
-        role = message.get("role", "user")
-        content = message.get("content", "")
-
-        # 处理工具消息（tool role）
-        if role == "tool":
-            tool_call_id = message.get("tool_call_id", "")
-            func_name = message.get("name")
-
-            # 使用映射表查找
-            if tool_call_id in tool_call_mapping:
-                func_name, original_id, _ = tool_call_mapping[tool_call_id]
-            else:
-                # 如果没有name,尝试从消息列表中查找
-                if not func_name and tool_call_id:
-                    for msg in messages:
-                        if msg.get("role") == "assistant" and msg.get("tool_calls"):
-                            for tc in msg["tool_calls"]:
-                                if tc.get("id") == tool_call_id:
-                                    func_name = tc.get("function", {}).get("name")
-                                    break
-                            if func_name:
-                                break
-
-                # 解码 tool_call_id 获取原始 ID
-                original_id, _ = decode_tool_id_and_signature(tool_call_id)
-
-            # 最终兜底：确保 func_name 不为空
-            if not func_name:
-                func_name = "unknown_function"
-                log.warning(f"Tool message missing function name for tool_call_id={tool_call_id}, using default: {func_name}")
-
-            # 解析响应数据
-            try:
-                response_data = json.loads(content) if isinstance(content, str) else content
-            except (json.JSONDecodeError, TypeError):
-                response_data = {"result": str(content)}
-
-            # 确保 response_data 是字典类型（Gemini API 要求 response 必须是对象）
-            if not isinstance(response_data, dict):
-                response_data = {"result": response_data}
-
-            # 使用原始 ID（不带签名）
-            contents.append({
-                "role": "user",
-                "parts": [{
-                    "functionResponse": {
-                        "id": original_id,
-                        "name": func_name,
-                        "response": response_data
-                    }
-                }]
-            })
-            continue
-
-        # system 消息已经由 merge_system_messages 处理，这里跳过
-        if role == "system":
-            continue
-
-        # 将OpenAI角色映射到Gemini角色
-        if role == "assistant":
-            role = "model"
-
-        # 检查是否有tool_calls
-        tool_calls = message.get("tool_calls")
-        if tool_calls:
-            parts = []
-
-            # 如果有文本内容,先添加文本
-            if content:
-                parts.append({"text": content})
-
-            # 添加每个工具调用
-            for tool_call in tool_calls:
-                try:
-                    args = (
-                        json.loads(tool_call["function"]["arguments"])
-                        if isinstance(tool_call["function"]["arguments"], str)
-                        else tool_call["function"]["arguments"]
-                    )
-                    
-                    # 根据工具的 schema 修正参数类型
-                    func_name = tool_call["function"]["name"]
-                    if func_name in tool_schemas:
-                        args = fix_tool_call_args_types(args, tool_schemas[func_name])
-
-                    # 解码工具ID和thoughtSignature
-                    encoded_id = tool_call.get("id", "")
-                    original_id, signature = decode_tool_id_and_signature(encoded_id)
-
-                    # 构建functionCall part
-                    function_call_part = {
-                        "functionCall": {
-                            "id": original_id,
-                            "name": func_name,
-                            "args": args
-                        }
-                    }
-
-                    # 如果有thoughtSignature则添加，否则使用占位符以满足 Gemini API 要求
-                    if signature:
-                        function_call_part["thoughtSignature"] = signature
-                    else:
-                        function_call_part["thoughtSignature"] = "skip_thought_signature_validator"
-
-                    parts.append(function_call_part)
-                except (json.JSONDecodeError, KeyError) as e:
-                    log.error(f"Failed to parse tool call: {e}")
-                    continue
-
-            if parts:
-                contents.append({"role": role, "parts": parts})
-            continue
-
-        # 处理普通内容
-        if isinstance(content, list):
-            parts = []
-            for part in content:
-                if part.get("type") == "text":
-                    parts.append({"text": part.get("text", "")})
-                elif part.get("type") == "image_url":
-                    image_url = part.get("image_url", {}).get("url")
-                    if image_url:
-                        try:
-                            mime_type, base64_data = image_url.split(";")
-                            _, mime_type = mime_type.split(":")
-                            _, base64_data = base64_data.split(",")
-                            parts.append({
-                                "inlineData": {
-                                    "mimeType": mime_type,
-                                    "data": base64_data,
-                                }
-                            })
-                        except ValueError:
-                            continue
-            if parts:
-                contents.append({"role": role, "parts": parts})
-        elif content:
-            contents.append({"role": role, "parts": [{"text": content}]})
+    # 每个工具的类型修正器只编译一次（历史消息中同一工具可能被调用很多次）
+    tool_arg_types: Dict[str, Tuple[Tuple[str, str], ...]] = {}
+    tool_fixers: Dict[str, Dict[str, Callable[[str, Any], Any]]] = {}
+
+    # 逐条转换消息；带 cache_key 时复用同一用户上一轮已经转换过的历史消息
+    dependencies = None
+    if cache_key is not None:
+        dependencies = [
+            _message_dependency(message, tool_call_mapping, tool_schemas, tool_arg_types) for message in messages
+        ]
+    converted = prefix_cache.convert(
+        cache_key,
+        messages,
+        lambda message: _convert_message_to_content(message, tool_call_mapping, tool_schemas, tool_arg_types, tool_fixers),
+        context="openai",
+        dependencies=dependencies,
+    )
+    contents = [content for content in converted if content is not None]
+    if cache_key is not None:
+        contents = copy_contents(contents)
 
     # 构建生成配置
     generation_config = {}
@@ -1270,346 +1190,3 @@ async def convert_openai_to_gemini_request(openai_request: Dict[str, Any]) -> Di
         gemini_request["toolConfig"] = convert_tool_choice_to_tool_config(openai_request["tool_choice"])
 
     return gemini_request
-
-
-def convert_gemini_to_openai_response(
-    gemini_response: Union[Dict[str, Any], Any],
-    model: str,
-    status_code: int = 200
-) -> Dict[str, Any]:
-    """
-    将 Gemini 格式非流式响应转换为 OpenAI 格式非流式响应
-
-    注意: 如果收到的不是 200 开头的响应,不做任何处理,直接转发原始响应
-
-    Args:
-        gemini_response: Gemini 格式的响应体 (字典或响应对象)
-        model: 模型名称
-        status_code: HTTP 状态码 (默认 200)
-
-    Returns:
-        OpenAI 格式的响应体字典,或原始响应 (如果状态码不是 2xx)
-    """
-    # 非 2xx 状态码直接返回原始响应
-    if not (200 <= status_code < 300):
-        if isinstance(gemini_response, dict):
-            return gemini_response
-        else:
-            # 如果是响应对象,尝试解析为字典
-            try:
-                if hasattr(gemini_response, "json"):
-                    return gemini_response.json()
-                elif hasattr(gemini_response, "body"):
-                    body = gemini_response.body
-                    if isinstance(body, bytes):
-                        return json.loads(body.decode())
-                    return json.loads(str(body))
-                else:
-                    return {"error": str(gemini_response)}
-            except:
-                return {"error": str(gemini_response)}
-
-    # 确保是字典格式
-    if not isinstance(gemini_response, dict):
-        try:
-            if hasattr(gemini_response, "json"):
-                gemini_response = gemini_response.json()
-            elif hasattr(gemini_response, "body"):
-                body = gemini_response.body
-                if isinstance(body, bytes):
-                    gemini_response = json.loads(body.decode())
-                else:
-                    gemini_response = json.loads(str(body))
-            else:
-                gemini_response = json.loads(str(gemini_response))
-        except:
-            return {"error": "Invalid response format"}
-
-    # 处理 GeminiCLI 的 response 包装格式
-    if "response" in gemini_response:
-        gemini_response = gemini_response["response"]
-
-    # 转换为 OpenAI 格式
-    choices = []
-
-    for candidate in gemini_response.get("candidates", []):
-        role = candidate.get("content", {}).get("role", "assistant")
-
-        # 将Gemini角色映射回OpenAI角色
-        if role == "model":
-            role = "assistant"
-
-        # 提取并分离thinking tokens和常规内容
-        parts = candidate.get("content", {}).get("parts", [])
-
-        # 提取工具调用和文本内容
-        tool_calls, text_content = extract_tool_calls_from_parts(parts)
-
-        # 提取多种类型的内容
-        content_parts = []
-        reasoning_parts = []
-        
-        for part in parts:
-            # 处理 executableCode（代码生成）
-            if "executableCode" in part:
-                exec_code = part["executableCode"]
-                lang = exec_code.get("language", "python").lower()
-                code = exec_code.get("code", "")
-                # 添加代码块（前后加换行符确保 Markdown 渲染正确）
-                content_parts.append(f"\n```{lang}\n{code}\n```\n")
-            
-            # 处理 codeExecutionResult（代码执行结果）
-            elif "codeExecutionResult" in part:
-                result = part["codeExecutionResult"]
-                outcome = result.get("outcome")
-                output = result.get("output", "")
-                
-                if output:
-                    label = "output" if outcome == "OUTCOME_OK" else "error"
-                    content_parts.append(f"\n```{label}\n{output}\n```\n")
-            
-            # 处理 thought（思考内容）
-            elif part.get("thought", False) and "text" in part:
-                reasoning_parts.append(part["text"])
-            
-            # 处理普通文本（非思考内容）
-            elif "text" in part and not part.get("thought", False):
-                # 这部分已经在 extract_tool_calls_from_parts 中处理
-                pass
-            
-            # 处理 inlineData（图片）
-            elif "inlineData" in part:
-                inline_data = part["inlineData"]
-                mime_type = inline_data.get("mimeType", "image/png")
-                base64_data = inline_data.get("data", "")
-                # 使用 Markdown 格式
-                content_parts.append(f"![gemini-generated-content](data:{mime_type};base64,{base64_data})")
-        
-        # 合并所有内容部分
-        if content_parts:
-            # 使用双换行符连接各部分，确保块之间有间距
-            additional_content = "\n\n".join(content_parts)
-            if text_content:
-                text_content = text_content + "\n\n" + additional_content
-            else:
-                text_content = additional_content
-        
-        # 合并 reasoning content
-        reasoning_content = "\n\n".join(reasoning_parts) if reasoning_parts else ""
-
-        # 构建消息对象
-        message = {"role": role}
-
-        # 获取 Gemini 的 finishReason
-        gemini_finish_reason = candidate.get("finishReason")
-        
-        # 如果有工具调用
-        if tool_calls:
-            message["tool_calls"] = tool_calls
-            message["content"] = text_content if text_content else None
-            # 只有在正常停止（STOP）时才设为 tool_calls，其他情况保持原始 finish_reason
-            # 这样可以避免在 SAFETY、MAX_TOKENS 等情况下仍然返回 tool_calls 导致循环
-            if gemini_finish_reason == "STOP":
-                finish_reason = "tool_calls"
-            else:
-                finish_reason = _map_finish_reason(gemini_finish_reason)
-        else:
-            message["content"] = text_content
-            finish_reason = _map_finish_reason(gemini_finish_reason)
-
-        # 添加 reasoning content (如果有)
-        if reasoning_content:
-            message["reasoning_content"] = reasoning_content
-
-        choices.append({
-            "index": candidate.get("index", 0),
-            "message": message,
-            "finish_reason": finish_reason,
-        })
-
-    # 转换 usageMetadata
-    usage = _convert_usage_metadata(gemini_response.get("usageMetadata"))
-
-    response_data = {
-        "id": str(uuid.uuid4()),
-        "object": "chat.completion",
-        "created": int(time.time()),
-        "model": model,
-        "choices": choices,
-    }
-
-    if usage:
-        response_data["usage"] = usage
-
-    return response_data
-
-
-def convert_gemini_to_openai_stream(
-    gemini_stream_chunk: str,
-    model: str,
-    response_id: str,
-    status_code: int = 200
-) -> Optional[str]:
-    """
-    将 Gemini 格式流式响应块转换为 OpenAI SSE 格式流式响应
-
-    注意: 如果收到的不是 200 开头的响应,不做任何处理,直接转发原始内容
-
-    Args:
-        gemini_stream_chunk: Gemini 格式的流式响应块 (字符串,通常是 "data: {json}" 格式)
-        model: 模型名称
-        response_id: 此流式响应的一致ID
-        status_code: HTTP 状态码 (默认 200)
-
-    Returns:
-        OpenAI SSE 格式的响应字符串 (如 "data: {json}\n\n"),
-        或原始内容 (如果状态码不是 2xx),
-        或 None (如果解析失败)
-    """
-    # 非 2xx 状态码直接返回原始内容
-    if not (200 <= status_code < 300):
-        return gemini_stream_chunk
-
-    # 解析 Gemini 流式块
-    try:
-        # 去除 "data: " 前缀
-        if isinstance(gemini_stream_chunk, bytes):
-            if gemini_stream_chunk.startswith(b"data: "):
-                payload_str = gemini_stream_chunk[len(b"data: "):].strip().decode("utf-8")
-            else:
-                payload_str = gemini_stream_chunk.strip().decode("utf-8")
-        else:
-            if gemini_stream_chunk.startswith("data: "):
-                payload_str = gemini_stream_chunk[len("data: "):].strip()
-            else:
-                payload_str = gemini_stream_chunk.strip()
-
-        # 跳过空块
-        if not payload_str:
-            return None
-
-        # 解析 JSON
-        gemini_chunk = json.loads(payload_str)
-    except (json.JSONDecodeError, UnicodeDecodeError):
-        # 解析失败,跳过此块
-        return None
-
-    # 处理 GeminiCLI 的 response 包装格式
-    if "response" in gemini_chunk:
-        gemini_response = gemini_chunk["response"]
-    else:
-        gemini_response = gemini_chunk
-
-    # 转换为 OpenAI 流式格式
-    choices = []
-
-    for candidate in gemini_response.get("candidates", []):
-        role = candidate.get("content", {}).get("role", "assistant")
-
-        # 将Gemini角色映射回OpenAI角色
-        if role == "model":
-            role = "assistant"
-
-        # 提取并分离thinking tokens和常规内容
-        parts = candidate.get("content", {}).get("parts", [])
-
-        # 提取工具调用和文本内容 (流式需要 index)
-        tool_calls, text_content = extract_tool_calls_from_parts(parts, is_streaming=True)
-
-        # 提取多种类型的内容
-        content_parts = []
-        reasoning_parts = []
-        
-        for part in parts:
-            # 处理 executableCode（代码生成）
-            if "executableCode" in part:
-                exec_code = part["executableCode"]
-                lang = exec_code.get("language", "python").lower()
-                code = exec_code.get("code", "")
-                content_parts.append(f"\n```{lang}\n{code}\n```\n")
-            
-            # 处理 codeExecutionResult（代码执行结果）
-            elif "codeExecutionResult" in part:
-                result = part["codeExecutionResult"]
-                outcome = result.get("outcome")
-                output = result.get("output", "")
-                
-                if output:
-                    label = "output" if outcome == "OUTCOME_OK" else "error"
-                    content_parts.append(f"\n```{label}\n{output}\n```\n")
-            
-            # 处理 thought（思考内容）
-            elif part.get("thought", False) and "text" in part:
-                reasoning_parts.append(part["text"])
-            
-            # 处理普通文本（非思考内容）
-            elif "text" in part and not part.get("thought", False):
-                # 这部分已经在 extract_tool_calls_from_parts 中处理
-                pass
-            
-            # 处理 inlineData（图片）
-            elif "inlineData" in part:
-                inline_data = part["inlineData"]
-                mime_type = inline_data.get("mimeType", "image/png")
-                base64_data = inline_data.get("data", "")
-                content_parts.append(f"![gemini-generated-content](data:{mime_type};base64,{base64_data})")
-        
-        # 合并所有内容部分
-        if content_parts:
-            additional_content = "\n\n".join(content_parts)
-            if text_content:
-                text_content = text_content + "\n\n" + additional_content
-            else:
-                text_content = additional_content
-        
-        # 合并 reasoning content
-        reasoning_content = "\n\n".join(reasoning_parts) if reasoning_parts else ""
-
-        # 构建 delta 对象
-        delta = {}
-
-        if tool_calls:
-            delta["tool_calls"] = tool_calls
-            if text_content:
-                delta["content"] = text_content
-        elif text_content:
-            delta["content"] = text_content
-
-        if reasoning_content:
-            delta["reasoning_content"] = reasoning_content
-
-        # 获取 Gemini 的 finishReason
-        gemini_finish_reason = candidate.get("finishReason")
-        finish_reason = _map_finish_reason(gemini_finish_reason)
-        
-        # 只有在正常停止（STOP）且有工具调用时才设为 tool_calls
-        # 避免在 SAFETY、MAX_TOKENS 等情况下仍然返回 tool_calls 导致循环
-        if tool_calls and gemini_finish_reason == "STOP":
-            finish_reason = "tool_calls"
-
-        choices.append({
-            "index": candidate.get("index", 0),
-            "delta": delta,
-            "finish_reason": finish_reason,
-        })
-
-    # 转换 usageMetadata (只在流结束时存在)
-    usage = _convert_usage_metadata(gemini_response.get("usageMetadata"))
-
-    # 构建 OpenAI 流式响应
-    response_data = {
-        "id": response_id,
-        "object": "chat.completion.chunk",
-        "created": int(time.time()),
-        "model": model,
-        "choices": choices,
-    }
-
-    # 只在有 usage 数据且有 finish_reason 时添加 usage
-    if usage:
-        has_finish_reason = any(choice.get("finish_reason") for choice in choices)
-        if has_finish_reason:
-            response_data["usage"] = usage
-
-    # 转换为 SSE 格式: "data: {json}\n\n"
-    return f"data: {json.dumps(response_data)}\n\n"
@@ -0,0 +1,240 @@
+"""
+对话前缀转换缓存
+
+多轮对话（尤其是 Agent 工具调用循环）每一轮都会把完整的历史消息重新发过来，
+以前每次请求都从头把所有消息转换成 Gemini contents，历史越长越慢，而其中只有最后几条是新的。
+这里按用户缓存最近几个对话的逐条转换结果：
+- 新请求与缓存的对话逐条比较（dict 相等比较，C 实现，比重新序列化/哈希快得多），
+  取最长的相同前缀直接复用，只转换后面新增的消息
+- 单条消息的转换如果还依赖其它消息（如 tool 消息要查对应的 tool_call 名称），
+  由调用方通过 dependencies 给出每条消息的这些依赖，依赖不同视为不同消息
+- 整个请求级别的上下文（如工具 schema）不同的对话互不复用
+- 每个用户最多 prefix_cache_entries_per_user 个对话，最多缓存 prefix_cache_max_users 个用户，
+  单个对话估算超过 prefix_cache_max_entry_bytes 时不缓存；
+  所有用户合计超过 prefix_cache_max_bytes 时，从最久未用的用户开始逐个淘汰对话
+
+缓存保存的是收到的消息的副本，调用方之后修改请求不会影响缓存；
+其中的长字符串（内联图片 base64 等）只保存长度和摘要，比较时再对新请求中的对应字符串求摘要，
+避免缓存额外持有一份大字段（转换结果里已经有一份）。
+转换结果会被后续请求共享，只能替换、不能原地修改；交给会改动 content 的代码前用 copy_contents 复制。
+注意：相等比较不区分 1 / 1.0 / True 这类 JSON 值，同一客户端重复发送的历史消息不会出现这种差异。
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+from app.config import settings
+
+
+def _approx_size(value: Any) -> int:
+    """粗略估算消息占用的字节数（字符串长度为主）"""
+    if isinstance(value, str):
+        return len(value) + 50
+    if isinstance(value, dict):
+        return 100 + sum(len(k) + _approx_size(v) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return 60 + sum(_approx_size(v) for v in value)
+    return 30
+
+
+# 不短于该长度的字符串在缓存的消息副本中只保存摘要
+_BLOB_MIN_CHARS = 4096
+
+
+class _BlobRef:
+    """缓存的消息副本中代替长字符串：与原字符串相等比较（长度相同时才计算摘要）"""
+    __slots__ = ("length", "digest")
+
+    def __init__(self, value: str):
+        self.length = len(value)
+        self.digest = _digest(value)
+
+    def __eq__(self, other):
+        if isinstance(other, _BlobRef):
+            return self.length == other.length and self.digest == other.digest
+        if isinstance(other, str):
+            return self.length == len(other) and self.digest == _digest(other)
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    __hash__ = None
+
+
+def _digest(value: str) -> bytes:
+    return hashlib.blake2b(value.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+
+
+def _freeze(value: Any) -> Any:
+    """复制消息结构用于缓存比较，长字符串替换为 _BlobRef"""
+    if isinstance(value, str):
+        return _BlobRef(value) if len(value) >= _BLOB_MIN_CHARS else value
+    if isinstance(value, dict):
+        return {k: _freeze(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_freeze(v) for v in value]
+    return value
+
+
+def copy_contents(contents: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """复制 contents 及其 parts 列表（下游会替换/插入 parts；part 本身在清理时会先 copy 再改写，可以共享）"""
+    return [{**content, "parts": list(content.get("parts", []))} for content in contents]
+
+
+class _Entry:
+    __slots__ = ("context", "messages", "deps", "results", "sizes", "total")
+
+    def __init__(self, context: Hashable, messages: list, deps: Optional[list], results: list, sizes: List[int]):
+        self.context = context
+        self.messages = messages
+        self.deps = deps
+        self.results = results
+        self.sizes = sizes
+        self.total = sum(sizes)
+
+    def common_prefix(self, context: Hashable, messages: list, deps: Optional[list]) -> int:
+        if self.context != context:
+            return 0
+        limit = min(len(self.messages), len(messages))
+        cached_messages = self.messages
+        cached_deps = self.deps
+        i = 0
+        while i < limit:
+            # 缓存侧在左：其中的 _BlobRef 才能参与比较
+            if cached_messages[i] != messages[i]:
+                break
+            if deps is not None and cached_deps[i] != deps[i]:
+                break
+            i += 1
+        return i
+
+
+class ConversationPrefixCache:
+    """按用户缓存对话的逐条转换结果"""
+
+    def __init__(self):
+        self._users: "OrderedDict[Hashable, List[_Entry]]" = OrderedDict()
+        self._bytes = 0  # 所有对话的估算大小合计
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.reused_messages = 0
+        self.converted_messages = 0
+
+    def convert(
+        self,
+        session_key: Optional[Hashable],
+        messages: List[Any],
+        convert_message: Callable[[Any], Any],
+        context: Hashable = None,
+        dependencies: Optional[List[Any]] = None,
+    ) -> List[Any]:
+        """
+        返回每条消息的转换结果列表（与 messages 一一对应）
+
+        session_key 为 None 或缓存关闭时直接逐条转换。
+        convert_message(msg) 的结果只能依赖 msg 本身、dependencies 中对应的一项和 context。
+        """
+        if session_key is None or not settings.prefix_cache_enabled:
+            return [convert_message(msg) for msg in messages]
+
+        deps = dependencies
+        with self._lock:
+            entries = list(self._users.get(session_key, ()))
+        best: Optional[_Entry] = None
+        best_len = 0
+        for entry in entries:
+            matched = entry.common_prefix(context, messages, deps)
+            if matched > best_len:
+                best, best_len = entry, matched
+
+        if best is not None:
+            results = best.results[:best_len]
+            self.hits += 1
+        else:
+            results = []
+            self.misses += 1
+        tail = messages[best_len:]
+        results.extend(convert_message(msg) for msg in tail)
+        self.reused_messages += best_len
+        self.converted_messages += len(tail)
+
+        # 请求只是某个已缓存对话的前缀（如重试），不需要再存
+        if best is not None and best_len == len(messages):
+            self._touch(session_key, best)
+            return results
+
+        sizes = (best.sizes[:best_len] if best is not None else []) + [_approx_size(msg) for msg in tail]
+        if sum(sizes) > settings.prefix_cache_max_entry_bytes:
+            return results
+        entry = _Entry(
+            context,
+            (best.messages[:best_len] if best is not None else []) + _freeze(tail),
+            deps,
+            list(results),
+            sizes,
+        )
+        # 完整延续了旧对话就替换它，否则（编辑了历史消息/另一个会话）作为新对话
+        replaced = best if best is not None and best_len == len(best.messages) else None
+        self._store(session_key, entry, replaced)
+        return results
+
+    def _touch(self, session_key: Hashable, entry: _Entry):
+        with self._lock:
+            entries = self._users.get(session_key)
+            if entries is None:
+                return
+            self._users.move_to_end(session_key)
+            if entry in entries:
+                entries.remove(entry)
+                entries.append(entry)
+
+    def _store(self, session_key: Hashable, entry: _Entry, replaced: Optional[_Entry]):
+        with self._lock:
+            entries = self._users.setdefault(session_key, [])
+            self._users.move_to_end(session_key)
+            if replaced is not None and replaced in entries:
+                entries.remove(replaced)
+                self._bytes -= replaced.total
+            entries.append(entry)
+            self._bytes += entry.total
+            while len(entries) > max(1, settings.prefix_cache_entries_per_user):
+                self._bytes -= entries.pop(0).total
+            while len(self._users) > max(1, settings.prefix_cache_max_users):
+                _, dropped = self._users.popitem(last=False)
+                self._bytes -= sum(e.total for e in dropped)
+            # 全局预算：从最久未用的用户开始，每次淘汰其最久未用的对话
+            while self._bytes > settings.prefix_cache_max_bytes and self._users:
+                oldest_key, oldest_entries = next(iter(self._users.items()))
+                self._bytes -= oldest_entries.pop(0).total
+                if not oldest_entries:
+                    del self._users[oldest_key]
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+            self._bytes = 0
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            users = len(self._users)
+            entries = sum(len(e) for e in self._users.values())
+            size = self._bytes
+        return {
+            "enabled": settings.prefix_cache_enabled,
+            "users": users,
+            "entries": entries,
+            "approx_bytes": size,
+            "max_bytes": settings.prefix_cache_max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "reused_messages": self.reused_messages,
+            "converted_messages": self.converted_messages,
+        }
+
+
+# 全局对话前缀缓存实例
+prefix_cache = ConversationPrefixCache()
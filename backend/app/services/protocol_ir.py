@@ -0,0 +1,217 @@
+"""
+协议转换中间表示（IR）
+
+OpenAI / Anthropic / Gemini 三种格式之间的转换都经过这里的类型：
+- 请求：各入站协议的解析器（openai2gemini_full.parse_openai_message、
+  anthropic2gemini.parse_anthropic_message、GeminiClient._parse_message）把消息解析成 Message，
+  再由 Message.to_gemini() 统一生成 Gemini contents
+- 响应：上游 Gemini 响应（非流式响应或一个流式 chunk）用 GeminiResponse.parse 解析一次，
+  各出站协议（OpenAI、Anthropic）直接遍历 IR 生成输出，不再各自反复 .get 原始字典
+
+类型都用 __slots__，字段只保存转换需要的信息；生成 Gemini 字典时键的顺序与以前手写的完全一致
+（一致性检查见 scripts/protocol_conformance.py）。
+"""
+from typing import Any, Dict, List, Optional
+
+
+# 没有 thoughtSignature 的 functionCall 使用的占位签名，满足 Gemini API 要求
+SKIP_SIGNATURE = "skip_thought_signature_validator"
+
+
+class FunctionCall:
+    __slots__ = ("id", "name", "args")
+
+    def __init__(self, id: Any, name: Any, args: Any):
+        self.id = id
+        self.name = name
+        self.args = args
+
+
+class FunctionResponse:
+    __slots__ = ("id", "name", "response")
+
+    def __init__(self, id: Any, name: Any, response: Any):
+        self.id = id
+        self.name = name
+        self.response = response
+
+
+class Blob:
+    """内联数据（inlineData）；data 是请求中 base64 字符串的引用，不复制"""
+    __slots__ = ("mime_type", "data")
+
+    def __init__(self, mime_type: Any, data: Any):
+        self.mime_type = mime_type
+        self.data = data
+
+
+class FileRef:
+    """文件引用（fileData）"""
+    __slots__ = ("mime_type", "uri")
+
+    def __init__(self, mime_type: Any, uri: Any):
+        self.mime_type = mime_type
+        self.uri = uri
+
+
+class ExecutableCode:
+    __slots__ = ("language", "code")
+
+    def __init__(self, language: Any, code: Any):
+        self.language = language
+        self.code = code
+
+
+class CodeResult:
+    """代码执行结果（codeExecutionResult）"""
+    __slots__ = ("outcome", "output")
+
+    def __init__(self, outcome: Any, output: Any):
+        self.outcome = outcome
+        self.output = output
+
+
+class Part:
+    """
+    一个内容片段，与 Gemini part 一一对应
+
+    text 为 None 表示没有文本；thought 保留上游的原始值（可能不是 bool）；
+    native 是客户端直接发来的 Gemini 原生 part 字段 (键, 值)，原样透传。
+    """
+    __slots__ = (
+        "text", "thought", "signature", "inline_data", "file_data",
+        "function_call", "function_response", "executable_code", "code_result", "native",
+    )
+
+    def __init__(
+        self,
+        text: Optional[str] = None,
+        thought: Any = False,
+        signature: Optional[str] = None,
+        inline_data: Optional[Blob] = None,
+        file_data: Optional[FileRef] = None,
+        function_call: Optional[FunctionCall] = None,
+        function_response: Optional[FunctionResponse] = None,
+        executable_code: Optional[ExecutableCode] = None,
+        code_result: Optional[CodeResult] = None,
+        native: Optional[tuple] = None,
+    ):
+        self.text = text
+        self.thought = thought
+        self.signature = signature
+        self.inline_data = inline_data
+        self.file_data = file_data
+        self.function_call = function_call
+        self.function_response = function_response
+        self.executable_code = executable_code
+        self.code_result = code_result
+        self.native = native
+
+    @property
+    def is_thinking(self) -> bool:
+        """思考内容：thought 为真，或带 thoughtSignature（Antigravity 的判断方式）"""
+        return bool(self.thought) or self.signature is not None
+
+    # ===== Gemini =====
+
+    @classmethod
+    def from_gemini(cls, part: Dict[str, Any]) -> "Part":
+        text = part.get("text")
+        thought = part.get("thought", False)
+        signature = part.get("thoughtSignature")
+        # 流式响应绝大多数 part 只有文本（和思考标记/签名），跳过其它字段的解析
+        if len(part) <= (text is not None) + ("thought" in part) + (signature is not None):
+            return cls(text, thought, signature)
+
+        function_call = None
+        if "functionCall" in part:
+            fc = part["functionCall"] or {}
+            function_call = FunctionCall(fc.get("id"), fc.get("name"), fc.get("args", {}))
+        inline_data = None
+        if "inlineData" in part:
+            inline = part["inlineData"] or {}
+            inline_data = Blob(inline.get("mimeType", "image/png"), inline.get("data", ""))
+        executable_code = None
+        if "executableCode" in part:
+            code = part["executableCode"] or {}
+            executable_code = ExecutableCode(code.get("language", "python"), code.get("code", ""))
+        code_result = None
+        if "codeExecutionResult" in part:
+            result = part["codeExecutionResult"] or {}
+            code_result = CodeResult(result.get("outcome"), result.get("output", ""))
+        return cls(text, thought, signature, inline_data, None, function_call, None, executable_code, code_result)
+
+    def to_gemini(self) -> Dict[str, Any]:
+        if self.native is not None:
+            return {self.native[0]: self.native[1]}
+        result: Dict[str, Any] = {}
+        if self.text is not None:
+            result["text"] = self.text
+            if self.thought:
+                result["thought"] = self.thought
+        if self.inline_data is not None:
+            result["inlineData"] = {"mimeType": self.inline_data.mime_type, "data": self.inline_data.data}
+        if self.file_data is not None:
+            result["fileData"] = {"mimeType": self.file_data.mime_type, "fileUri": self.file_data.uri}
+        if self.function_call is not None:
+            fc = self.function_call
+            result["functionCall"] = {"id": fc.id, "name": fc.name, "args": fc.args}
+            result["thoughtSignature"] = self.signature or SKIP_SIGNATURE
+            return result
+        if self.function_response is not None:
+            fr = self.function_response
+            result["functionResponse"] = {"id": fr.id, "name": fr.name, "response": fr.response}
+        if self.signature:
+            result["thoughtSignature"] = self.signature
+        return result
+
+
+class Message:
+    """一条消息；role 为 Gemini 角色（user / model），OpenAI 的其它角色原样保留"""
+    __slots__ = ("role", "parts")
+
+    def __init__(self, role: str, parts: List[Part]):
+        self.role = role
+        self.parts = parts
+
+    def to_gemini(self) -> Dict[str, Any]:
+        return {"role": self.role, "parts": [part.to_gemini() for part in self.parts]}
+
+
+class GeminiResponse:
+    """
+    Gemini 响应（非流式响应或一个流式 chunk）的第一个候选
+
+    兼容内部 API 的 {"response": {...}} 包装；非 dict 的 part 会被跳过。
+    """
+    __slots__ = ("parts", "finish_reason", "usage", "candidate_usage", "has_candidate")
+
+    def __init__(
+        self,
+        parts: List[Part],
+        finish_reason: Optional[str],
+        usage: Optional[Dict[str, Any]],
+        candidate_usage: Optional[Dict[str, Any]],
+        has_candidate: bool,
+    ):
+        self.parts = parts
+        self.finish_reason = finish_reason
+        self.usage = usage
+        self.candidate_usage = candidate_usage
+        self.has_candidate = has_candidate
+
+    @classmethod
+    def parse(cls, data: Dict[str, Any]) -> "GeminiResponse":
+        response = data.get("response", data)
+        candidates = response.get("candidates") or []
+        candidate = (candidates[0] if candidates else None) or {}
+        content = candidate.get("content") or {}
+        from_gemini = Part.from_gemini
+        parts = [from_gemini(p) for p in (content.get("parts") or ()) if isinstance(p, dict)]
+        return cls(
+            parts,
+            candidate.get("finishReason"),
+            response.get("usageMetadata"),
+            candidate.get("usageMetadata"),
+            bool(candidates),
+        )
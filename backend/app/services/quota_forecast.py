@@ -0,0 +1,249 @@
+"""
+凭证配额耗尽预测
+
+以前只有收到 429 之后才知道凭证配额用完了。这里按 (凭证, 配额组) 统计自上次重置以来的请求数，
+结合每日额度（GeminiCLI 以 stats_* 配置为先验，之后根据实际 429 时的计数修正；
+Antigravity 没有先验，只能从 429 学习）预测凭证何时耗尽：
+- 凭证选择时，预计即将耗尽的凭证提前跳过
+- 汇总整个凭证池每个配额组预计何时用完
+
+学到的额度保存在 credentials.quota_limits（JSON {"配额组": 额度}），重启不丢失；
+使用计数保存在内存中，启动时从今天的使用日志恢复。
+"""
+import json
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Deque, Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import select, func
+
+from app.config import settings
+from app.models.user import Credential, UsageLog
+
+
+# 各凭证类型的配额组
+QUOTA_GROUPS = {
+    "geminicli": ["flash", "premium"],
+    "antigravity": ["claude", "gemini", "banana"],
+}
+
+# 新观测值在学习额度中的权重
+_LEARN_WEIGHT = 0.3
+# 计数太少时的 429 不可能是每日配额耗尽（多半是计数未恢复完整），不用于学习
+_MIN_LEARN_COUNT = 5
+# 燃烧速率统计窗口（秒）
+_RATE_WINDOW = 3600
+
+
+def get_forecast_group(mode: str, model: str) -> str:
+    """
+    模型所属的配额组
+
+    GeminiCLI 的 2.5 Pro 和 3.0 共用 premium 额度，其余算 flash；
+    Antigravity 按 claude/gemini/banana 分组。
+    """
+    from app.services.credential_pool import CredentialPool
+    if mode == "antigravity":
+        return CredentialPool.get_antigravity_model_group(model)
+    return "flash" if CredentialPool.get_model_group(model) == "flash" else "premium"
+
+
+def get_prior_limit(mode: str, group: str, account_type: Optional[str]) -> int:
+    """配置中的每日额度（0 表示未知）"""
+    if mode == "antigravity":
+        return 0
+    is_pro = account_type == "pro"
+    if group == "flash":
+        return settings.stats_pro_flash if is_pro else settings.stats_free_flash
+    return settings.stats_pro_premium if is_pro else settings.stats_free_premium
+
+
+def get_daily_reset(now: datetime) -> Tuple[datetime, datetime]:
+    """每日配额窗口（Google 每日配额在 UTC 07:00 重置），返回 (开始, 结束)"""
+    today_7am = now.replace(hour=7, minute=0, second=0, microsecond=0)
+    start = today_7am if now >= today_7am else today_7am - timedelta(days=1)
+    return start, start + timedelta(days=1)
+
+
+# {credential_id: (quota_limits 原文, 解析结果)}，选凭证时每个候选都要读，避免反复解析 JSON
+_limits_cache: Dict[int, Tuple[str, Dict[str, int]]] = {}
+
+
+def load_learned_limits(credential: Credential) -> Dict[str, int]:
+    """凭证学到的额度（只读，修改前先复制）"""
+    raw = credential.quota_limits
+    if not raw:
+        return {}
+    cached = _limits_cache.get(credential.id)
+    if cached is not None and cached[0] == raw:
+        return cached[1]
+    try:
+        limits = json.loads(raw)
+    except Exception:
+        limits = {}
+    _limits_cache[credential.id] = (raw, limits)
+    return limits
+
+
+class _Counter:
+    """一个凭证一个配额组在当前窗口内的使用计数"""
+
+    __slots__ = ("used", "window_start", "reset_at")
+
+    def __init__(self, window_start: datetime, reset_at: datetime):
+        self.used = 0
+        self.window_start = window_start
+        self.reset_at = reset_at
+
+
+class QuotaForecaster:
+    """凭证配额耗尽预测器"""
+
+    def __init__(self):
+        self._counters: Dict[Tuple[int, str], _Counter] = {}
+        # {(api_type, group): 最近一小时的请求时间}
+        self._recent: Dict[Tuple[str, str], Deque[datetime]] = {}
+        self.skipped = 0  # 因预计耗尽而跳过了候选凭证的选择次数
+
+    def _counter(self, credential_id: int, group: str, now: datetime) -> _Counter:
+        key = (credential_id, group)
+        counter = self._counters.get(key)
+        if counter is None or now >= counter.reset_at:
+            start, end = get_daily_reset(now)
+            counter = _Counter(start, end)
+            self._counters[key] = counter
+        return counter
+
+    def get_limit(self, credential: Credential, group: str) -> int:
+        """凭证在该配额组的预计额度：优先使用 429 学到的额度，否则用配置先验"""
+        learned = load_learned_limits(credential).get(group)
+        if learned:
+            return int(learned)
+        return get_prior_limit(credential.api_type or "geminicli", group, credential.account_type)
+
+    def record_use(self, credential_id: int, mode: str, model: str):
+        """凭证成功完成一次请求（与启动时从成功日志恢复计数的口径一致）"""
+        now = datetime.utcnow()
+        group = get_forecast_group(mode, model)
+        self._counter(credential_id, group, now).used += 1
+        recent = self._recent.setdefault((mode, group), deque())
+        recent.append(now)
+        self._trim(recent, now)
+
+    def is_near_exhaustion(self, credential: Credential, mode: str, model: str) -> bool:
+        """预计该凭证在这个配额组上即将耗尽"""
+        if not settings.quota_forecast_enabled or not model:
+            return False
+        group = get_forecast_group(mode, model)
+        limit = self.get_limit(credential, group)
+        if limit <= 0:
+            return False
+        counter = self._counter(credential.id, group, datetime.utcnow())
+        return counter.used >= limit * settings.quota_forecast_stop_ratio
+
+    def observe_exhaustion(self, credential: Credential, group: str, reset_at: Optional[datetime] = None):
+        """
+        收到配额耗尽的 429：用当前计数修正学到的额度，并把计数窗口对齐到上游的重置时间
+
+        只修改 credential.quota_limits，由调用方提交。
+        """
+        now = datetime.utcnow()
+        counter = self._counter(credential.id, group, now)
+        observed = counter.used
+        if observed >= _MIN_LEARN_COUNT:
+            limits = dict(load_learned_limits(credential))
+            old = limits.get(group)
+            learned = observed if not old else round(old * (1 - _LEARN_WEIGHT) + observed * _LEARN_WEIGHT)
+            limits[group] = int(learned)
+            credential.quota_limits = json.dumps(limits)
+            print(f"[QuotaForecast] 📈 凭证 {credential.id} 配额组 {group} 在第 {observed} 次请求耗尽，额度修正为 {learned}", flush=True)
+        if reset_at and reset_at > now:
+            counter.reset_at = reset_at
+
+    async def load_from_db(self, db):
+        """启动时从今天的成功日志恢复使用计数"""
+        now = datetime.utcnow()
+        start, _ = get_daily_reset(now)
+        try:
+            result = await db.execute(
+                select(UsageLog.credential_id, Credential.api_type, UsageLog.model, func.count(UsageLog.id))
+                .join(Credential, UsageLog.credential_id == Credential.id)
+                .where(UsageLog.created_at >= start)
+                .where(UsageLog.status_code == 200)
+                .group_by(UsageLog.credential_id, Credential.api_type, UsageLog.model)
+            )
+            rows = result.all()
+        except Exception as e:
+            print(f"[QuotaForecast] ⚠️ 恢复使用计数失败: {e}", flush=True)
+            return
+        for cred_id, api_type, model, count in rows:
+            group = get_forecast_group(api_type or "geminicli", model or "")
+            self._counter(cred_id, group, now).used += count
+        print(f"[QuotaForecast] 已从使用日志恢复 {len(self._counters)} 个计数", flush=True)
+
+    @staticmethod
+    def _trim(recent: Deque[datetime], now: datetime):
+        cutoff = now - timedelta(seconds=_RATE_WINDOW)
+        while recent and recent[0] < cutoff:
+            recent.popleft()
+
+    def get_pool_forecast(self, credentials: Iterable[Credential]) -> dict:
+        """
+        预测凭证池每个配额组何时用完
+
+        剩余额度 = Σ(预计额度 - 已用)，消耗速率取最近一小时的请求数；
+        如果在用完之前就会到达重置时间，dry_at 为 None。
+        """
+        now = datetime.utcnow()
+        pools: Dict[str, Dict[str, dict]] = {}
+        for cred in credentials:
+            api_type = cred.api_type or "geminicli"
+            for group in QUOTA_GROUPS.get(api_type, []):
+                entry = pools.setdefault(api_type, {}).setdefault(group, {
+                    "credentials": 0,
+                    "unknown_limit": 0,
+                    "near_exhaustion": 0,
+                    "limit": 0,
+                    "used": 0,
+                    "remaining": 0,
+                    "next_reset": None,
+                })
+                entry["credentials"] += 1
+                limit = self.get_limit(cred, group)
+                counter = self._counter(cred.id, group, now)
+                if entry["next_reset"] is None or counter.reset_at < entry["next_reset"]:
+                    entry["next_reset"] = counter.reset_at
+                if limit <= 0:
+                    entry["unknown_limit"] += 1
+                    continue
+                entry["limit"] += limit
+                entry["used"] += min(counter.used, limit)
+                entry["remaining"] += max(0, limit - counter.used)
+                if counter.used >= limit * settings.quota_forecast_stop_ratio:
+                    entry["near_exhaustion"] += 1
+
+        for api_type, groups in pools.items():
+            for group, entry in groups.items():
+                recent = self._recent.get((api_type, group))
+                if recent:
+                    self._trim(recent, now)
+                rate = len(recent) / _RATE_WINDOW if recent else 0  # 每秒请求数
+                entry["requests_last_hour"] = len(recent) if recent else 0
+                dry_at = None
+                if entry["limit"] > 0 and rate > 0:
+                    dry_at = now + timedelta(seconds=entry["remaining"] / rate)
+                    if dry_at >= entry["next_reset"]:
+                        dry_at = None  # 重置前用不完
+                entry["dry_at"] = dry_at.isoformat() + "Z" if dry_at else None
+                entry["next_reset"] = entry["next_reset"].isoformat() + "Z" if entry["next_reset"] else None
+
+        return {
+            "enabled": settings.quota_forecast_enabled,
+            "stop_ratio": settings.quota_forecast_stop_ratio,
+            "skipped": self.skipped,
+            "pools": pools,
+        }
+
+
+# 全局配额预测实例
+quota_forecaster = QuotaForecaster()
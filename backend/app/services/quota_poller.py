@@ -0,0 +1,362 @@
+"""
+凭证配额后台轮询
+
+以前管理员查看配额时要逐个凭证实时请求 Google，凭证多了要串行等很久。
+这里由后台任务定时刷新所有活跃凭证的剩余配额并保存快照：
+- 自适应轮询间隔：剩余越少查得越勤，耗尽后等到重置时间再查，查询失败指数退避
+- 配额接口和管理页面优先读快照
+- 汇总出凭证池各模型组的剩余容量
+- 供凭证选择器使用：快照显示已耗尽的凭证在返回 429 之前就被跳过
+"""
+import asyncio
+import json
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
+
+from sqlalchemy import select
+
+from app.config import settings
+from app.database import async_session
+from app.models.user import Credential, CredentialQuotaSnapshot
+
+
+# 模型名前后缀（请求时使用的模型名 → 上游配额里的模型名）
+_MODEL_PREFIXES = ["gcli-", "agy-", "假流/", "流式抗截断/", "假非流/"]
+_MODEL_SUFFIXES = ["-2k", "-4k", "-maxthinking", "-nothinking", "-search"]
+
+
+def normalize_quota_model(model: str) -> str:
+    """去掉渠道前缀和本地扩展后缀，得到上游配额中的模型名"""
+    name = model or ""
+    changed = True
+    while changed:
+        changed = False
+        for prefix in _MODEL_PREFIXES:
+            if name.startswith(prefix):
+                name = name[len(prefix):]
+                changed = True
+    for suffix in _MODEL_SUFFIXES:
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+    return name
+
+
+def get_quota_group(api_type: str, model: str) -> str:
+    """模型所属配额组（GeminiCLI: flash/pro/30，Antigravity: claude/gemini/banana）"""
+    from app.services.credential_pool import CredentialPool
+    if api_type == "antigravity":
+        return CredentialPool.get_antigravity_model_group(model)
+    return CredentialPool.get_model_group(model)
+
+
+def _parse_reset_time(reset_time: str) -> Optional[datetime]:
+    """解析上游的 resetTime，返回 UTC naive datetime"""
+    if not reset_time:
+        return None
+    try:
+        parsed = datetime.fromisoformat(reset_time.replace("Z", "+00:00"))
+        if parsed.tzinfo is not None:
+            parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+        return parsed
+    except Exception:
+        return None
+
+
+class QuotaPoller:
+    """凭证配额轮询器"""
+
+    def __init__(self):
+        # {credential_id: snapshot dict}
+        self.snapshots: Dict[int, dict] = {}
+        self._failures: Dict[int, int] = {}
+        self._loaded = False
+        self._running: set = set()
+
+    # ===== 快照 =====
+
+    def _build_snapshot(self, cred: Credential, result: dict) -> dict:
+        now = datetime.utcnow()
+        models = result.get("models", {}) if result.get("success") else {}
+        groups: Dict[str, dict] = {}
+        for model_id, info in models.items():
+            group = get_quota_group(cred.api_type, model_id)
+            remaining = float(info.get("remaining", 0) or 0)
+            reset_at = _parse_reset_time(info.get("resetTime", ""))
+            g = groups.setdefault(group, {"min": remaining, "max": remaining, "sum": 0.0, "count": 0, "reset_at": None})
+            g["min"] = min(g["min"], remaining)
+            g["max"] = max(g["max"], remaining)
+            g["sum"] += remaining
+            g["count"] += 1
+            if reset_at and (g["reset_at"] is None or reset_at < g["reset_at"]):
+                g["reset_at"] = reset_at
+        return {
+            "credential_id": cred.id,
+            "api_type": cred.api_type,
+            "email": cred.email,
+            "account_type": cred.account_type,
+            "is_public": cred.is_public,
+            "success": bool(result.get("success")),
+            "error": None if result.get("success") else result.get("error", "未知错误"),
+            "models": models,
+            "groups": groups,
+            "fetched_at": now,
+        }
+
+    def _next_interval(self, snapshot: dict) -> int:
+        """根据快照计算下次轮询间隔（秒）"""
+        base = settings.quota_poll_interval
+        low = settings.quota_poll_interval_low
+        max_interval = settings.quota_poll_interval_max
+        cred_id = snapshot["credential_id"]
+
+        if not snapshot["success"]:
+            # 失败指数退避（GeminiCLI 凭证通常无权查询配额）
+            failures = self._failures.get(cred_id, 0)
+            return min(max_interval, base * (2 ** min(failures, 8)))
+
+        groups = snapshot["groups"]
+        if not groups:
+            return base
+        min_remaining = min(g["min"] for g in groups.values())
+        if min_remaining <= 0:
+            # 已耗尽：等到最早的重置时间
+            resets = [g["reset_at"] for g in groups.values() if g["max"] <= 0 and g["reset_at"]]
+            if resets:
+                wait = (min(resets) - datetime.utcnow()).total_seconds() + 30
+                return int(max(low, min(max_interval, wait)))
+            return low
+        if min_remaining < 0.2:
+            return low
+        if min_remaining < 0.5:
+            return max(low, base // 2)
+        return base
+
+    async def _save(self, snapshot: dict, next_poll_at: datetime):
+        """持久化快照（重启后可直接使用）"""
+        try:
+            async with async_session() as db:
+                result = await db.execute(
+                    select(CredentialQuotaSnapshot)
+                    .where(CredentialQuotaSnapshot.credential_id == snapshot["credential_id"])
+                )
+                row = result.scalar_one_or_none()
+                if not row:
+                    row = CredentialQuotaSnapshot(credential_id=snapshot["credential_id"])
+                    db.add(row)
+                row.api_type = snapshot["api_type"]
+                row.success = snapshot["success"]
+                row.data = json.dumps(snapshot["models"], ensure_ascii=False)
+                row.error = snapshot["error"]
+                row.fetched_at = snapshot["fetched_at"]
+                row.next_poll_at = next_poll_at
+                await db.commit()
+        except Exception as e:
+            print(f"[QuotaPoller] ⚠️ 保存配额快照失败: {e}", flush=True)
+
+    async def load_from_db(self):
+        """启动时从数据库加载上次的快照"""
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            async with async_session() as db:
+                result = await db.execute(
+                    select(CredentialQuotaSnapshot, Credential)
+                    .join(Credential, CredentialQuotaSnapshot.credential_id == Credential.id)
+                    .where(Credential.is_active == True)
+                )
+                for row, cred in result.all():
+                    models = json.loads(row.data) if row.data else {}
+                    snapshot = self._build_snapshot(cred, {"success": row.success, "models": models, "error": row.error})
+                    snapshot["fetched_at"] = row.fetched_at
+                    snapshot["next_poll_at"] = row.next_poll_at
+                    self.snapshots[cred.id] = snapshot
+            print(f"[QuotaPoller] 已加载 {len(self.snapshots)} 个配额快照", flush=True)
+        except Exception as e:
+            print(f"[QuotaPoller] ⚠️ 加载配额快照失败: {e}", flush=True)
+
+    # ===== 查询 =====
+
+    async def fetch_live(self, cred: Credential, db) -> dict:
+        """实时查询单个凭证的配额（返回 fetch_quota_info 格式）"""
+        from app.services.credential_pool import CredentialPool
+        try:
+            access_token = await CredentialPool.get_access_token(cred, db)
+        except Exception as e:
+            return {"success": False, "error": f"获取 token 失败: {str(e)[:50]}"}
+        if not access_token:
+            return {"success": False, "error": "无法获取 access token"}
+
+        if cred.api_type == "antigravity":
+            from app.services.antigravity_client import AntigravityClient
+            client = AntigravityClient(access_token, cred.project_id)
+        else:
+            if not cred.project_id:
+                return {"success": False, "error": "无法获取 access_token 或缺少 project_id"}
+            from app.services.gemini_client import GeminiClient
+            client = GeminiClient(access_token, cred.project_id)
+        try:
+            return await client.fetch_quota_info()
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+
+    async def poll(self, cred: Credential, db) -> dict:
+        """查询并记录一个凭证的配额快照"""
+        result = await self.fetch_live(cred, db)
+        if result.get("success"):
+            self._failures.pop(cred.id, None)
+        else:
+            self._failures[cred.id] = self._failures.get(cred.id, 0) + 1
+        snapshot = self._build_snapshot(cred, result)
+        next_poll_at = datetime.utcnow() + timedelta(seconds=self._next_interval(snapshot))
+        snapshot["next_poll_at"] = next_poll_at
+        self.snapshots[cred.id] = snapshot
+        await self._save(snapshot, next_poll_at)
+        return snapshot
+
+    async def get_quota(self, cred: Credential, db, refresh: bool = False) -> dict:
+        """
+        获取凭证配额（fetch_quota_info 格式）
+
+        快照足够新时直接返回快照，否则实时查询并更新快照。
+        """
+        snapshot = self.snapshots.get(cred.id)
+        if not refresh and snapshot and snapshot["success"]:
+            age = (datetime.utcnow() - snapshot["fetched_at"]).total_seconds()
+            if age <= settings.quota_snapshot_max_age:
+                return {"success": True, "models": snapshot["models"], "cached": True, "fetched_at": snapshot["fetched_at"].isoformat() + "Z"}
+        snapshot = await self.poll(cred, db)
+        if snapshot["success"]:
+            return {"success": True, "models": snapshot["models"], "cached": False, "fetched_at": snapshot["fetched_at"].isoformat() + "Z"}
+        return {"success": False, "error": snapshot["error"]}
+
+    def is_exhausted(self, credential_id: int, api_type: str, model: str) -> bool:
+        """快照显示该凭证对该模型的配额已耗尽（且未到重置时间）"""
+        if not settings.quota_poller_enabled or not model:
+            return False
+        snapshot = self.snapshots.get(credential_id)
+        if not snapshot or not snapshot["success"]:
+            return False
+        now = datetime.utcnow()
+
+        # 优先按具体模型判断
+        info = snapshot["models"].get(normalize_quota_model(model))
+        if info is not None:
+            if float(info.get("remaining", 0) or 0) > 0:
+                return False
+            reset_at = _parse_reset_time(info.get("resetTime", ""))
+            return reset_at is None or reset_at > now
+
+        # 没有该模型的数据时，只有整个配额组都耗尽才跳过
+        group = snapshot["groups"].get(get_quota_group(api_type, model))
+        if not group or group["max"] > 0:
+            return False
+        return group["reset_at"] is None or group["reset_at"] > now
+
+    def get_pool_capacity(self) -> dict:
+        """汇总凭证池各模型组的剩余容量"""
+        pools: Dict[str, Dict[str, dict]] = {}
+        now = datetime.utcnow()
+        for snapshot in self.snapshots.values():
+            if not snapshot["success"]:
+                continue
+            api_type = snapshot["api_type"] or "geminicli"
+            for group_name, group in snapshot["groups"].items():
+                avg = group["sum"] / group["count"] if group["count"] else 0
+                entry = pools.setdefault(api_type, {}).setdefault(group_name, {
+                    "credentials": 0,
+                    "exhausted": 0,
+                    "full_equivalent": 0.0,
+                    "estimated_requests": 0,
+                    "next_reset": None,
+                })
+                entry["credentials"] += 1
+                if group["max"] <= 0 and (group["reset_at"] is None or group["reset_at"] > now):
+                    entry["exhausted"] += 1
+                entry["full_equivalent"] += avg
+                limit = self._daily_limit(api_type, group_name, snapshot["account_type"])
+                if limit:
+                    entry["estimated_requests"] += int(avg * limit)
+                if group["reset_at"] and (entry["next_reset"] is None or group["reset_at"] < entry["next_reset"]):
+                    entry["next_reset"] = group["reset_at"]
+
+        for groups in pools.values():
+            for entry in groups.values():
+                entry["full_equivalent"] = round(entry["full_equivalent"], 2)
+                entry["avg_remaining"] = round(entry["full_equivalent"] / entry["credentials"] * 100, 1) if entry["credentials"] else 0
+                if entry["next_reset"]:
+                    entry["next_reset"] = entry["next_reset"].isoformat() + "Z"
+
+        polled = len(self.snapshots)
+        failed = sum(1 for s in self.snapshots.values() if not s["success"])
+        return {"enabled": settings.quota_poller_enabled, "polled": polled, "failed": failed, "pools": pools}
+
+    @staticmethod
+    def _daily_limit(api_type: str, group: str, account_type: str) -> int:
+        """GeminiCLI 按账号类型估算每日额度（Antigravity 只给比例）"""
+        if api_type == "antigravity":
+            return 0
+        is_pro = account_type == "pro"
+        if group == "flash":
+            return settings.stats_pro_flash if is_pro else settings.stats_free_flash
+        return settings.stats_pro_premium if is_pro else settings.stats_free_premium
+
+    # ===== 后台任务 =====
+
+    async def _poll_one(self, cred_id: int, semaphore: asyncio.Semaphore):
+        async with semaphore:
+            try:
+                async with async_session() as db:
+                    cred = await db.get(Credential, cred_id)
+                    if cred and cred.is_active:
+                        await self.poll(cred, db)
+            except Exception as e:
+                print(f"[QuotaPoller] ⚠️ 轮询凭证 {cred_id} 失败: {e}", flush=True)
+            finally:
+                self._running.discard(cred_id)
+
+    async def run_once(self):
+        """轮询所有到期的活跃凭证"""
+        async with async_session() as db:
+            result = await db.execute(
+                select(Credential.id)
+                .where(Credential.is_active == True)
+                .where(Credential.api_type.in_(["geminicli", "antigravity"]))
+            )
+            active_ids = [row[0] for row in result.all()]
+
+        # 清理已删除/禁用凭证的快照
+        active_set = set(active_ids)
+        for cred_id in list(self.snapshots.keys()):
+            if cred_id not in active_set:
+                del self.snapshots[cred_id]
+
+        now = datetime.utcnow()
+        due = []
+        for cred_id in active_ids:
+            if cred_id in self._running:
+                continue
+            snapshot = self.snapshots.get(cred_id)
+            if snapshot is None or not snapshot.get("next_poll_at") or snapshot["next_poll_at"] <= now:
+                due.append(cred_id)
+        if not due:
+            return
+
+        semaphore = asyncio.Semaphore(max(1, settings.quota_poll_concurrency))
+        self._running.update(due)
+        await asyncio.gather(*(self._poll_one(cred_id, semaphore) for cred_id in due))
+        print(f"[QuotaPoller] 本轮刷新 {len(due)} 个凭证配额", flush=True)
+
+    async def run_forever(self):
+        await self.load_from_db()
+        while True:
+            if settings.quota_poller_enabled:
+                try:
+                    await self.run_once()
+                except Exception as e:
+                    print(f"[QuotaPoller] ⚠️ 轮询失败: {e}", flush=True)
+            await asyncio.sleep(30)
+
+
+# 全局配额轮询器实例
+quota_poller = QuotaPoller()
@@ -0,0 +1,142 @@
+"""
+相同非流式请求合并（Request Coalescing）
+
+SillyTavern、各类 Agent 框架经常重复发送完全相同的非流式请求（客户端重试、标题生成、
+hi_check 覆盖不到的探活等）。这里按 (用户, 模型, 转换后的 Gemini payload) 的规范化哈希
+合并同时在途的相同请求：只发一次上游调用，所有等待者共享同一份结果。
+
+只合并"同时在途"的请求，调用结束后立即移除，不做结果缓存。
+上游调用由首个请求（leader）的凭证发出，因此：
+- 只共享成功结果：leader 失败时，其他等待者改用自己的凭证各自调用，错误总是属于调用方自己的凭证
+- 共享到的结果标记为 shared，调用方不应给自己的凭证计入使用次数
+"""
+import asyncio
+import copy
+import hashlib
+import json
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from app.config import settings
+from app.services.inline_media import split_blobs
+
+
+# 内联图片 base64 计入哈希时每块的字符数
+_HASH_CHUNK_CHARS = 1024 * 1024
+
+
+def make_coalesce_key(user_id: int, model: str, payload: Dict[str, Any]) -> str:
+    """
+    生成合并键：对 payload 做键排序的规范化序列化后取 sha256
+
+    较大的内联图片 base64 不参与序列化，按顺序以 "长度:" 前缀直接分块计入哈希。
+    """
+    skeleton, blobs = split_blobs(payload)
+    canonical = json.dumps(
+        {"user": user_id, "model": model, "payload": skeleton},
+        sort_keys=True,
+        ensure_ascii=False,
+        separators=(",", ":"),
+        default=str,
+    )
+    digest = hashlib.sha256(canonical.encode("utf-8"))
+    for blob in blobs:
+        digest.update(f"{len(blob)}:".encode("ascii"))
+        for start in range(0, len(blob), _HASH_CHUNK_CHARS):
+            digest.update(blob[start:start + _HASH_CHUNK_CHARS].encode("ascii"))
+    return digest.hexdigest()
+
+
+class _Flight:
+    """一次在途的上游调用"""
+
+    __slots__ = ("task", "waiters", "joined")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0  # 当前仍在等待的调用方
+        self.joined = 0   # 累计加入的调用方
+
+
+class RequestCoalescer:
+    """在途请求合并器"""
+
+    def __init__(self):
+        self._inflight: Dict[str, _Flight] = {}
+        self.leaders = 0
+        self.coalesced = 0
+        self.fallbacks = 0  # leader 失败后等待者自行调用的次数
+
+    async def run(self, key: str, call: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        执行或加入一次调用
+
+        同一 key 已有在途调用时直接等待其结果；所有等待者都断开后取消上游调用。
+        返回 (结果, 是否共享自其他请求)，共享的结果是深拷贝，调用方可以放心修改。
+        在途调用失败时，等待者不接收它的错误，而是用自己的 call 重新调用一次。
+        """
+        flight = self._inflight.get(key)
+        leader = flight is None
+        if leader:
+            flight = _Flight(asyncio.create_task(call()))
+            self._inflight[key] = flight
+            flight.task.add_done_callback(lambda _: self._forget(key, flight))
+            self.leaders += 1
+        else:
+            self.coalesced += 1
+            print(f"[Coalesce] 🔗 合并相同的在途请求 (key={key[:12]}, 等待者 {flight.waiters + 1})", flush=True)
+
+        flight.waiters += 1
+        flight.joined += 1
+        try:
+            result = await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            if not flight.task.done() and flight.waiters <= 1:
+                flight.task.cancel()
+            raise
+        except Exception:
+            if leader:
+                raise
+            # 错误来自 leader 的凭证，用自己的凭证重新调用
+            self.fallbacks += 1
+            return await call(), False
+        finally:
+            flight.waiters -= 1
+
+        if leader:
+            # 只有一个调用方时无需拷贝
+            return (copy.deepcopy(result) if flight.joined > 1 else result), False
+        return copy.deepcopy(result), True
+
+    def _forget(self, key: str, flight: _Flight):
+        if self._inflight.get(key) is flight:
+            del self._inflight[key]
+
+    def get_stats(self) -> dict:
+        return {
+            "enabled": settings.coalesce_enabled,
+            "inflight": len(self._inflight),
+            "leaders": self.leaders,
+            "coalesced": self.coalesced,
+            "fallbacks": self.fallbacks,
+        }
+
+
+# 全局合并器实例
+request_coalescer = RequestCoalescer()
+
+
+async def coalesced_generate(
+    user_id: Optional[int],
+    model: str,
+    payload: Dict[str, Any],
+    call: Callable[[], Awaitable[Any]],
+) -> Tuple[Any, bool]:
+    """
+    未启用或未提供用户时直接调用，否则按 (用户, 模型, payload) 合并
+
+    返回 (结果, 是否共享自其他请求)
+    """
+    if not settings.coalesce_enabled or user_id is None:
+        return await call(), False
+    key = make_coalesce_key(user_id, model, payload)
+    return await request_coalescer.run(key, call)
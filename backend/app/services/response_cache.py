@@ -0,0 +1,276 @@
+"""
+确定性请求的精确匹配响应缓存
+
+很多请求是确定性的（temperature=0、工具固定提示词、重复探测等），结果完全可以复用。
+缓存键为实际发往上游的转换后 payload（规范化序列化后取 sha256）加上入口端点
+（不同端点缓存的响应格式不同），可按用户隔离或全局共享。
+
+接入的非流式入口：GeminiCLI 的 OpenAI / Gemini 原生接口，Antigravity 的 OpenAI / Gemini 原生 / Anthropic 接口。
+各入口在选凭证之前先转换请求、查缓存，命中时直接返回，不占用凭证也不计入凭证用量。
+
+两级存储：
+- 内存层：按字节预算做 LRU 淘汰
+- 磁盘层：内存淘汰的条目溢出写入磁盘，同样有字节预算，命中后提升回内存
+
+非确定性的生成配置（未设置 temperature=0 / topK=1、多候选、联网搜索）一律不缓存。
+"""
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+from app.config import settings
+from app.services.websocket import notify_log_update, notify_stats_update
+
+
+def is_deterministic(model: str, generation_config: Optional[Dict]) -> bool:
+    """判断生成配置是否确定性（只有确定性请求才允许缓存）"""
+    if "-search" in model:
+        return False  # 联网搜索结果随时间变化
+    if not generation_config:
+        return False
+    if (generation_config.get("candidateCount") or 1) > 1:
+        return False
+    temperature = generation_config.get("temperature")
+    if temperature is not None:
+        try:
+            if float(temperature) == 0:
+                return True
+        except (TypeError, ValueError):
+            return False
+    return generation_config.get("topK") == 1
+
+
+def _uses_search(payload: Dict[str, Any]) -> bool:
+    tools = payload.get("tools") or []
+    return any(isinstance(tool, dict) and "googleSearch" in tool for tool in tools)
+
+
+def make_cache_key(user_id: int, endpoint: str, model: str, payload: Dict[str, Any]) -> str:
+    """生成缓存键（global 作用域时不包含用户）"""
+    scope = "global" if settings.response_cache_scope == "global" else f"user:{user_id}"
+    canonical = json.dumps(
+        {"scope": scope, "endpoint": endpoint, "model": model, "payload": payload},
+        sort_keys=True,
+        ensure_ascii=False,
+        separators=(",", ":"),
+        default=str,
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def cache_key_for(user_id: int, endpoint: str, model: str, payload: Dict[str, Any]) -> Optional[str]:
+    """
+    响应缓存开启且请求确定性时返回缓存键，否则返回 None
+
+    payload 为发往上游的 Gemini 请求体（含 contents / generationConfig 等），
+    调用方应把同一个 payload 用于实际请求，保证键与发出的内容一致。
+    """
+    if not settings.response_cache_enabled:
+        return None
+    if _uses_search(payload) or not is_deterministic(model, payload.get("generationConfig")):
+        return None
+    return make_cache_key(user_id, endpoint, model, payload)
+
+
+async def record_cache_hit(db, log, username: str, start_time: float):
+    """缓存命中：日志记为成功并标记 cache_hit（不关联凭证），推送实时通知"""
+    latency = (time.time() - start_time) * 1000
+    log.status_code = 200
+    log.latency_ms = latency
+    log.cache_hit = True
+    db.add(log)
+    await db.commit()
+    print(f"[ResponseCache] 💾 响应缓存命中: user={username}, model={log.model}", flush=True)
+    await notify_log_update({
+        "username": username,
+        "model": log.model,
+        "status_code": 200,
+        "error_type": None,
+        "cache_hit": True,
+        "latency_ms": round(latency, 0),
+        "created_at": datetime.utcnow().isoformat()
+    })
+    await notify_stats_update()
+
+
+class ResponseCache:
+    """内存 LRU + 磁盘溢出的两级响应缓存"""
+
+    def __init__(self):
+        # {key: (expires_at, data_bytes)}
+        self._memory: "OrderedDict[str, Tuple[float, bytes]]" = OrderedDict()
+        self._memory_bytes = 0
+        # {key: (expires_at, size)}，磁盘层索引
+        self._disk: "OrderedDict[str, Tuple[float, int]]" = OrderedDict()
+        self._disk_bytes = 0
+        self._disk_loaded = False
+        self._lock = asyncio.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @property
+    def _dir(self) -> str:
+        return settings.response_cache_dir
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self._dir, f"{key}.json")
+
+    def _load_disk_index(self):
+        """首次使用时扫描磁盘目录重建索引（服务重启后磁盘层仍可用）"""
+        if self._disk_loaded:
+            return
+        self._disk_loaded = True
+        if not os.path.isdir(self._dir):
+            return
+        entries = []
+        for name in os.listdir(self._dir):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self._dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            # 文件修改时间 + TTL 作为过期时间
+            entries.append((stat.st_mtime, name[:-5], stat.st_size))
+        for mtime, key, size in sorted(entries):
+            self._disk[key] = (mtime + settings.response_cache_ttl, size)
+            self._disk_bytes += size
+
+    async def get(self, key: str) -> Optional[Any]:
+        now = time.time()
+        async with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                expires_at, data = entry
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    return json.loads(data)
+                self._drop_memory(key)
+
+            self._load_disk_index()
+            disk_entry = self._disk.get(key)
+            if disk_entry is None:
+                self.misses += 1
+                return None
+            expires_at, _ = disk_entry
+            if expires_at <= now:
+                await self._drop_disk(key)
+                self.misses += 1
+                return None
+
+        try:
+            data = await asyncio.to_thread(self._read_file, self._path(key))
+        except OSError:
+            async with self._lock:
+                self._forget_disk(key)
+                self.misses += 1
+            return None
+
+        async with self._lock:
+            # 提升回内存层
+            await self._drop_disk(key)
+            await self._put_memory(key, expires_at, data)
+            self.hits += 1
+            self.disk_hits += 1
+        return json.loads(data)
+
+    async def set(self, key: str, value: Any):
+        data = json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        if len(data) > settings.response_cache_max_bytes:
+            return  # 单条超过内存预算，不缓存
+        expires_at = time.time() + settings.response_cache_ttl
+        async with self._lock:
+            self._load_disk_index()
+            if key in self._disk:
+                await self._drop_disk(key)
+            self._drop_memory(key)
+            await self._put_memory(key, expires_at, data)
+
+    async def _put_memory(self, key: str, expires_at: float, data: bytes):
+        self._memory[key] = (expires_at, data)
+        self._memory_bytes += len(data)
+        # LRU 淘汰，淘汰的条目溢出到磁盘
+        while self._memory_bytes > settings.response_cache_max_bytes and self._memory:
+            old_key, (old_expires, old_data) = self._memory.popitem(last=False)
+            self._memory_bytes -= len(old_data)
+            if old_expires > time.time():
+                await self._spill(old_key, old_expires, old_data)
+
+    async def _spill(self, key: str, expires_at: float, data: bytes):
+        if settings.response_cache_disk_max_bytes <= 0:
+            return
+        try:
+            await asyncio.to_thread(self._write_file, self._path(key), data)
+        except OSError as e:
+            print(f"[ResponseCache] ⚠️ 写入磁盘缓存失败: {e}", flush=True)
+            return
+        self._disk[key] = (expires_at, len(data))
+        self._disk_bytes += len(data)
+        while self._disk_bytes > settings.response_cache_disk_max_bytes and self._disk:
+            old_key = next(iter(self._disk))
+            await self._drop_disk(old_key)
+
+    def _drop_memory(self, key: str):
+        entry = self._memory.pop(key, None)
+        if entry is not None:
+            self._memory_bytes -= len(entry[1])
+
+    def _forget_disk(self, key: str):
+        entry = self._disk.pop(key, None)
+        if entry is not None:
+            self._disk_bytes -= entry[1]
+
+    async def _drop_disk(self, key: str):
+        if key not in self._disk:
+            return
+        self._forget_disk(key)
+        try:
+            await asyncio.to_thread(os.remove, self._path(key))
+        except OSError:
+            pass
+
+    def _write_file(self, path: str, data: bytes):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _read_file(self, path: str) -> bytes:
+        with open(path, "rb") as f:
+            return f.read()
+
+    async def clear(self):
+        async with self._lock:
+            self._load_disk_index()
+            for key in list(self._disk.keys()):
+                await self._drop_disk(key)
+            self._memory.clear()
+            self._memory_bytes = 0
+
+    def get_stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "enabled": settings.response_cache_enabled,
+            "scope": settings.response_cache_scope,
+            "memory_entries": len(self._memory),
+            "memory_bytes": self._memory_bytes,
+            "disk_entries": len(self._disk),
+            "disk_bytes": self._disk_bytes,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total * 100, 2) if total else 0,
+        }
+
+
+# 全局响应缓存实例
+response_cache = ResponseCache()
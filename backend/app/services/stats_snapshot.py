@@ -0,0 +1,133 @@
+"""
+统计概览快照
+
+/api/manage/stats/overview 和 /api/public/stats 原本每次调用都要跑十来个 COUNT，
+公共接口还用 func.date(created_at) == today 过滤，用不上 created_at 索引。
+这里用 3 条查询算出全部数字：
+- usage_logs：一次按 created_at 范围扫描最近 30 天，用条件聚合同时得到今日/本周/本月/成功数/活跃用户
+- credentials：按 (api_type, is_active) 分组计数
+- users / 总请求数：各一条 COUNT
+
+结果缓存 stats_snapshot_ttl 秒。过期后由一个调用方刷新（single-flight），
+刷新期间其他请求直接返回旧快照，公共接口被频繁请求也不会打到数据库。
+"""
+import asyncio
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import select, func, case, distinct
+
+from app.config import settings
+from app.database import async_session
+from app.models.user import User, Credential, UsageLog
+
+
+class StatsSnapshot:
+    """统计概览快照（带 single-flight 刷新）"""
+
+    def __init__(self):
+        self._data: Optional[dict] = None
+        self._updated_at = 0.0
+        self._refresh_task: Optional[asyncio.Task] = None
+        self.refreshes = 0
+
+    async def get(self) -> dict:
+        """获取快照：新鲜直接返回；过期时只触发一次刷新，已有旧快照的调用方不等待"""
+        if self._data is not None and time.time() - self._updated_at < settings.stats_snapshot_ttl:
+            return self._data
+
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._refresh())
+
+        if self._data is not None:
+            return self._data
+        # 首次计算：所有调用方共同等待同一次刷新
+        return await asyncio.shield(self._refresh_task)
+
+    def invalidate(self):
+        self._updated_at = 0.0
+
+    async def _refresh(self) -> dict:
+        try:
+            data = await self._compute()
+        except Exception as e:
+            print(f"[StatsSnapshot] ⚠️ 计算统计快照失败: {e}", flush=True)
+            if self._data is not None:
+                return self._data
+            raise
+        self._data = data
+        self._updated_at = time.time()
+        self.refreshes += 1
+        return data
+
+    async def _compute(self) -> dict:
+        now = datetime.utcnow()
+        start_of_day = settings.get_start_of_day()
+        week_ago = now - timedelta(days=7)
+        month_ago = now - timedelta(days=30)
+        range_start = min(start_of_day, month_ago)
+
+        async with async_session() as db:
+            # 1. 最近 30 天日志：一次范围扫描 + 条件聚合
+            is_today = UsageLog.created_at >= start_of_day
+            is_week = UsageLog.created_at >= week_ago
+            is_month = UsageLog.created_at >= month_ago
+            row = (await db.execute(
+                select(
+                    func.sum(case((is_today, 1), else_=0)),
+                    func.sum(case((is_today & (UsageLog.status_code == 200), 1), else_=0)),
+                    func.sum(case((is_week, 1), else_=0)),
+                    func.sum(case((is_month, 1), else_=0)),
+                    func.count(distinct(case((is_week, UsageLog.user_id), else_=None))),
+                ).where(UsageLog.created_at >= range_start)
+            )).one()
+            today_requests, today_success, week_requests, month_requests, active_users = (int(v or 0) for v in row)
+
+            # 2. 凭证按类型和状态分组
+            cred_rows = (await db.execute(
+                select(Credential.api_type, Credential.is_active, func.count(Credential.id))
+                .group_by(Credential.api_type, Credential.is_active)
+            )).all()
+
+            # 3. 用户数 / 总请求数
+            user_count = (await db.execute(select(func.count(User.id)))).scalar() or 0
+            total_requests = (await db.execute(select(func.count(UsageLog.id)))).scalar() or 0
+
+        total_credentials = active_credentials = cli_credentials = agy_credentials = 0
+        for api_type, is_active, count in cred_rows:
+            total_credentials += count
+            if not is_active:
+                continue
+            active_credentials += count
+            if api_type == "antigravity":
+                agy_credentials += count
+            elif api_type in (None, "", "geminicli"):
+                # CLI 凭证（api_type 为空、None 或 'geminicli'）
+                cli_credentials += count
+
+        return {
+            "requests": {
+                "today": today_requests,
+                "today_success": today_success,
+                "today_failed": today_requests - today_success,
+                "week": week_requests,
+                "month": month_requests,
+                "total": total_requests,
+            },
+            "users": {
+                "total": user_count,
+                "active_this_week": active_users,
+            },
+            "credentials": {
+                "total": total_credentials,
+                "active": active_credentials,
+                "cli": cli_credentials,
+                "agy": agy_credentials,
+            },
+            "generated_at": now.isoformat() + "Z",
+        }
+
+
+# 全局统计快照实例
+stats_snapshot = StatsSnapshot()
@@ -1,77 +1,289 @@
 """
-简单的 token 估算模块
+Token 估算模块
 
-不追求精确，提供粗略估算用于计量
-从 gcli2api 移植
+不追求精确，提供估算用于计量、count_tokens / countTokens 和上游没有返回 usage 时的兜底。
+最早从 gcli2api 移植（字符数 / 4），现在：
+- 只遍历承载文本的字段（跳过 id、签名、mime 等元数据），图片按固定值计，不再遍历 base64
+- 按文字区分：中日韩文字约 1 字 1 token，其它文字约 4 字符 1 token；
+  两类的系数用上游 usageMetadata 校准（纯文本回复的 candidatesTokenCount 与估算值之比，指数滑动平均）
+- 多轮对话每次都会重新发送历史消息，单条消息的字符统计按内容哈希缓存
+- OutputTokenCounter 在流式响应经过时逐块累计输出 token
 """
 from __future__ import annotations
 
-from typing import Any, Dict
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.config import settings
+
+
+# 每张图片按固定 token 计
+IMAGE_INPUT_TOKENS = 300
+IMAGE_OUTPUT_TOKENS = 500
+
+# 中日韩文字（假名、汉字、谚文、全角符号）
+_CJK_RE = re.compile(
+    "[\u3000-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]"
+)
+
+# 不承载文本的字段（元数据、标识、签名等），不计入估算
+_SKIP_KEYS = frozenset({
+    "role", "type", "id", "tool_call_id", "tool_use_id", "index",
+    "mimeType", "mime_type", "media_type", "cache_control",
+    "thoughtSignature", "thought_signature", "signature", "thought",
+})
+
+# 校准：只用足够长、几乎只含一类文字的回复；系数限制在合理范围内
+_CALIBRATION_MIN_CHARS = 200
+_CALIBRATION_DOMINANCE = 0.9
+_CALIBRATION_ALPHA = 0.1
+_FACTOR_RANGE = (0.5, 2.0)
+
+
+def count_chars(text: str) -> Tuple[int, int]:
+    """返回 (中日韩字符数, 其它字符数)"""
+    if text.isascii():
+        return 0, len(text)
+    cjk = len(_CJK_RE.findall(text))
+    return cjk, len(text) - cjk
+
+
+_IMAGE_TYPES = frozenset({"image", "image_url", "input_image"})
+
+
+def _collect_texts(obj: Any, texts: List[str]) -> int:
+    """收集 obj 中承载文本的字符串，返回图片数"""
+    kind = type(obj)
+    if kind is str:
+        texts.append(obj)
+        return 0
+    images = 0
+    if kind is dict:
+        if obj.get("type") in _IMAGE_TYPES or "inlineData" in obj or "inline_data" in obj or "fileData" in obj:
+            return 1
+        for key, value in obj.items():
+            if key in _SKIP_KEYS:
+                continue
+            if type(value) is str:
+                texts.append(value)
+            else:
+                images += _collect_texts(value, texts)
+    elif kind is list:
+        for item in obj:
+            if type(item) is str:
+                texts.append(item)
+            else:
+                images += _collect_texts(item, texts)
+    return images
+
+
+class TokenEstimator:
+    """按文字类型估算 token，系数由上游 usage 校准"""
+
+    def __init__(self):
+        # 校准系数（相对于默认的 1 字 1 token / 4 字符 1 token）
+        self.cjk_factor = 1.0
+        self.latin_factor = 1.0
+        self.calibrations = 0
+        self._lock = threading.Lock()
+        # 单条消息内容哈希 -> (中日韩字符数, 其它字符数, 图片数)
+        self._cache: "OrderedDict[int, Tuple[int, int, int]]" = OrderedDict()
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def tokens(self, cjk: int, other: int) -> int:
+        return round(cjk * self.cjk_factor + other * self.latin_factor / 4)
+
+    # ===== 输入 =====
+
+    def _message_counts(self, message: Any) -> Tuple[int, int, int]:
+        """单条消息（或 system / tools 等其它片段）的字符统计，按内容哈希缓存"""
+        texts: List[str] = []
+        images = _collect_texts(message, texts)
+        # 字符串的哈希由解释器计算并缓存在对象上，比逐字符分类便宜得多
+        key = hash((images, *texts))
+        with self._lock:
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self.cache_hits += 1
+                return cached
+        cjk = other = 0
+        for text in texts:
+            c, o = count_chars(text)
+            cjk += c
+            other += o
+        counts = (cjk, other, images)
+        with self._lock:
+            self.cache_misses += 1
+            self._cache[key] = counts
+            while len(self._cache) > max(1, settings.token_estimate_cache_size):
+                self._cache.popitem(last=False)
+        return counts
+
+    def _request_parts(self, payload: Dict[str, Any]) -> List[Any]:
+        """请求中需要估算的片段：逐条消息 + system / tools（兼容 OpenAI、Anthropic、Gemini 及其包装）"""
+        inner = payload.get("request") or payload.get("generateContentRequest")
+        if isinstance(inner, dict):
+            return self._request_parts(inner)
+        parts: List[Any] = []
+        for key in ("messages", "contents"):
+            messages = payload.get(key)
+            if isinstance(messages, list):
+                parts.extend(messages)
+            elif messages is not None:
+                parts.append(messages)
+        for key in ("system", "systemInstruction", "system_instruction", "tools"):
+            value = payload.get(key)
+            if value:
+                parts.append(value)
+        # 认不出的格式整体估算
+        return parts or [payload]
+
+    def estimate_input(self, payload: Dict[str, Any]) -> int:
+        cjk = other = images = 0
+        for part in self._request_parts(payload):
+            c, o, i = self._message_counts(part)
+            cjk += c
+            other += o
+            images += i
+        return max(1, self.tokens(cjk, other) + images * IMAGE_INPUT_TOKENS)
+
+    # ===== 输出 =====
+
+    def estimate_output(self, response: Dict[str, Any]) -> int:
+        texts: List[str] = []
+        images = _collect_texts(response.get("response", response).get("candidates") or [], texts)
+        cjk = other = 0
+        for text in texts:
+            c, o = count_chars(text)
+            cjk += c
+            other += o
+        return max(1, self.tokens(cjk, other) + images * IMAGE_OUTPUT_TOKENS)
+
+    def calibrate(self, cjk: int, other: int, actual_tokens: Any):
+        """
+        用上游返回的实际 token 数校准系数
+
+        只接受足够长、几乎只含一类文字的纯文本样本，按该类文字更新对应系数。
+        """
+        if not isinstance(actual_tokens, int) or actual_tokens <= 0:
+            return
+        total = cjk + other
+        if total < _CALIBRATION_MIN_CHARS:
+            return
+        with self._lock:
+            # 少量的另一类字符按当前系数扣除，剩余的 token 归给主要的一类
+            if cjk >= total * _CALIBRATION_DOMINANCE:
+                observed = (actual_tokens - other * self.latin_factor / 4) / cjk
+                self.cjk_factor = self._blend(self.cjk_factor, observed)
+            elif other >= total * _CALIBRATION_DOMINANCE:
+                observed = (actual_tokens - cjk * self.cjk_factor) * 4 / other
+                self.latin_factor = self._blend(self.latin_factor, observed)
+            else:
+                return
+            self.calibrations += 1
+
+    @staticmethod
+    def _blend(current: float, observed: float) -> float:
+        low, high = _FACTOR_RANGE
+        observed = min(max(observed, low), high)
+        return current + (observed - current) * _CALIBRATION_ALPHA
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            cache_entries = len(self._cache)
+        return {
+            "cjk_tokens_per_char": round(self.cjk_factor, 4),
+            "latin_chars_per_token": round(4 / self.latin_factor, 3),
+            "calibrations": self.calibrations,
+            "cache_entries": cache_entries,
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+        }
+
+
+class OutputTokenCounter:
+    """
+    输出 token 计数
+
+    流式响应在 chunk 经过时逐块累计（每块只统计新增的文本），非流式响应逐 part 累计；思考内容单独统计（上游的 candidatesTokenCount 不含思考），
+    出现工具调用、图片等非文本输出后不再用于校准。
+    """
+
+    __slots__ = ("cjk", "other", "thought_cjk", "thought_other", "images", "text_only")
+
+    def __init__(self):
+        self.cjk = 0
+        self.other = 0
+        self.thought_cjk = 0
+        self.thought_other = 0
+        self.images = 0
+        self.text_only = True
+
+    def add_text(self, text: str, thought: bool = False):
+        if not text:
+            return
+        cjk, other = count_chars(text)
+        if thought:
+            self.thought_cjk += cjk
+            self.thought_other += other
+        else:
+            self.cjk += cjk
+            self.other += other
+
+    def add_non_text(self, image: bool = False):
+        self.text_only = False
+        if image:
+            self.images += 1
+
+    @property
+    def tokens(self) -> int:
+        """估算的输出 token 数（含思考内容）"""
+        return (
+            token_estimator.tokens(self.cjk + self.thought_cjk, self.other + self.thought_other)
+            + self.images * IMAGE_OUTPUT_TOKENS
+        )
+
+    def finish(self, usage: Optional[Dict[str, Any]]) -> int:
+        """
+        响应结束时调用：上游给了 candidatesTokenCount 就用它校准并返回，否则返回估算值
+        """
+        actual = usage.get("candidatesTokenCount") if isinstance(usage, dict) else None
+        if isinstance(actual, int) and actual > 0:
+            if self.text_only:
+                token_estimator.calibrate(self.cjk, self.other, actual)
+            return actual
+        return self.tokens
+
+
+# 全局估算器实例
+token_estimator = TokenEstimator()
 
 
 def estimate_input_tokens(payload: Dict[str, Any]) -> int:
     """
-    粗略估算 token 数：字符数 / 4 + 图片固定值
-    
+    估算请求的输入 token 数
+
     Args:
         payload: 请求体，可以是 OpenAI、Anthropic 或 Gemini 格式
-        
+
     Returns:
         估算的 token 数量
     """
-    total_chars = 0
-    image_count = 0
-
-    def count_str(obj: Any) -> None:
-        nonlocal total_chars, image_count
-        if isinstance(obj, str):
-            total_chars += len(obj)
-        elif isinstance(obj, dict):
-            # 检测图片
-            if obj.get("type") == "image" or "inlineData" in obj:
-                image_count += 1
-            elif obj.get("type") == "image_url":
-                image_count += 1
-            for v in obj.values():
-                count_str(v)
-        elif isinstance(obj, list):
-            for item in obj:
-                count_str(item)
-
-    count_str(payload)
-
-    # 粗略估算：字符数/4 + 每张图片300 tokens
-    return max(1, total_chars // 4 + image_count * 300)
+    return token_estimator.estimate_input(payload)
 
 
 def estimate_output_tokens(response: Dict[str, Any]) -> int:
     """
-    粗略估算输出 token 数
-    
+    估算 Gemini 响应的输出 token 数
+
     Args:
         response: 响应体
-        
+
     Returns:
         估算的 token 数量
     """
-    total_chars = 0
-    image_count = 0
-
-    def count_str(obj: Any) -> None:
-        nonlocal total_chars, image_count
-        if isinstance(obj, str):
-            total_chars += len(obj)
-        elif isinstance(obj, dict):
-            # 检测图片
-            if "inlineData" in obj:
-                image_count += 1
-            for v in obj.values():
-                count_str(v)
-        elif isinstance(obj, list):
-            for item in obj:
-                count_str(item)
-
-    count_str(response)
-
-    # 粗略估算：字符数/4 + 每张图片500 tokens
-    return max(1, total_chars // 4 + image_count * 500)
\ No newline at end of file
+    return token_estimator.estimate_output(response)
@@ -0,0 +1,98 @@
+"""
+工具声明转换缓存
+
+Agent 类客户端每一轮都会带上同样的 20~80 个工具定义，以前每次请求都要对每个工具
+重新规范化函数名、递归清理 schema（解析 $ref 等）。这里按内容哈希缓存转换结果：
+- 整个工具列表一个键：完全相同的工具列表只做一次序列化+哈希就能拿到全部结果
+- 单个工具一个键：列表有增减时，没变的工具仍然命中
+- 键包含目标模型族（gemini / claude / anthropic），不同清理规则互不影响
+- LRU，各最多 _MAX_ENTRIES 条
+
+哈希基于 JSON 序列化（不排序键，同一客户端每次发送的键顺序相同），
+缓存的转换结果会被多个请求共享，调用方只能替换、不能原地修改其中的对象；
+返回的外层列表是新的，可以追加（如 googleSearch）。
+"""
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, List, Optional
+
+
+_MAX_ENTRIES = 2048
+
+
+def schema_key(value: Any, family: str) -> str:
+    """工具定义的内容哈希"""
+    raw = json.dumps(value, separators=(",", ":"), default=str)
+    digest = hashlib.blake2b(raw.encode("utf-8"), digest_size=16)
+    digest.update(b"\x00" + family.encode("utf-8"))
+    return digest.hexdigest()
+
+
+class _LRU:
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._data: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            value = self._data.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: str, value: Any):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {"size": len(self._data), "max": self.max_entries, "hits": self.hits, "misses": self.misses}
+
+
+class ToolSchemaCache:
+    """工具声明转换结果缓存"""
+
+    def __init__(self, max_entries: int = _MAX_ENTRIES):
+        self._lists = _LRU(max_entries)
+        self._tools = _LRU(max_entries)
+
+    def convert_one(self, tool: Any, family: str, converter: Callable[[Any], Any]) -> Any:
+        """单个工具的转换结果（converter 返回 None 表示跳过该工具，不缓存）"""
+        key = schema_key(tool, family)
+        cached = self._tools.get(key)
+        if cached is not None:
+            return cached
+        result = converter(tool)
+        if result is not None:
+            self._tools.put(key, result)
+        return result
+
+    def convert_all(self, tools: List[Any], family: str, converter: Callable[[Any], Any]) -> List[Any]:
+        """整个工具列表的转换结果（跳过 converter 返回 None 的工具）"""
+        key = schema_key(tools, family)
+        cached = self._lists.get(key)
+        if cached is None:
+            cached = []
+            for tool in tools:
+                result = self.convert_one(tool, family, converter)
+                if result is not None:
+                    cached.append(result)
+            self._lists.put(key, cached)
+        return list(cached)
+
+    def stats(self) -> dict:
+        return {"lists": self._lists.stats(), "tools": self._tools.stats()}
+
+
+# 全局工具声明缓存实例
+tool_schema_cache = ToolSchemaCache()
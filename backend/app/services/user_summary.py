@@ -0,0 +1,187 @@
+"""
+用户汇总表（管理后台用户列表）
+
+以前 /api/admin/users 每次都加载全部用户，再对 usage_logs / credentials 跑七八条分组聚合，
+用户越多越慢。现在每个用户在 user_summaries 中有一行：
+- 今日用量（总数、CLI/Antigravity、按配额类别）：写日志时（UsageLog after_insert）原子累加，
+  统计日变化时自动从 0 开始
+- 活跃凭证数量（CLI、CLI 3.0、Antigravity、公开 Antigravity）：凭证增删改时（Credential 事件）
+  对该用户重算
+- 后台每 user_summary_reconcile_interval 秒全量校准一次，修正批量 UPDATE/DELETE 等绕过 ORM 事件的改动
+
+用户列表直接 join 这张表分页、搜索、排序。
+"""
+import asyncio
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy import DateTime, bindparam, select, func, text
+
+from app.config import settings
+from app.database import async_session
+
+
+USAGE_COLUMNS = [
+    "usage_total", "usage_cli", "usage_agy",
+    "usage_flash", "usage_pro", "usage_tier3",
+    "usage_claude", "usage_gemini", "usage_banana",
+]
+CREDENTIAL_COLUMNS = ["cli_cred_count", "cli_cred_30_count", "agy_cred_count", "agy_public_cred_count"]
+
+
+def today_key() -> str:
+    """当前统计日的标识（按 stats_timezone 的 0 点）"""
+    return settings.get_start_of_day().strftime("%Y-%m-%d %H:%M")
+
+
+def _usage_increments(api_type: Optional[str], quota_class: Optional[str], model_family: Optional[str]) -> Dict[str, int]:
+    """一条日志对各用量列的贡献"""
+    values = {c: 0 for c in USAGE_COLUMNS}
+    values["usage_total"] = 1
+    if api_type == "antigravity":
+        values["usage_agy"] = 1
+        if model_family in ("claude", "gemini", "banana"):
+            values[f"usage_{model_family}"] = 1
+    else:
+        values["usage_cli"] = 1
+        if quota_class in ("flash", "pro", "tier3"):
+            values[f"usage_{quota_class}"] = 1
+    return values
+
+
+# 统计日相同则累加，否则从本次的值重新开始
+_RECORD_SQL = text(
+    f"INSERT INTO user_summaries (user_id, day, {', '.join(USAGE_COLUMNS)}) "
+    f"VALUES (:user_id, :day, {', '.join(':' + c for c in USAGE_COLUMNS)}) "
+    "ON CONFLICT (user_id) DO UPDATE SET "
+    + ", ".join(
+        f"{c} = CASE WHEN user_summaries.day = excluded.day THEN user_summaries.{c} ELSE 0 END + excluded.{c}"
+        for c in USAGE_COLUMNS
+    )
+    + ", day = excluded.day"
+)
+
+_ACTIVE_CRED = "FROM credentials WHERE user_id = :user_id AND is_active = :true"
+_CREDENTIAL_SQL = text(
+    f"INSERT INTO user_summaries (user_id, day, {', '.join(CREDENTIAL_COLUMNS)}) VALUES (:user_id, '', "
+    f"(SELECT count(*) {_ACTIVE_CRED} AND api_type != 'antigravity'), "
+    f"(SELECT count(*) {_ACTIVE_CRED} AND api_type != 'antigravity' AND model_tier = '3'), "
+    f"(SELECT count(*) {_ACTIVE_CRED} AND api_type = 'antigravity'), "
+    f"(SELECT count(*) {_ACTIVE_CRED} AND api_type = 'antigravity' AND is_public = :true)) "
+    "ON CONFLICT (user_id) DO UPDATE SET "
+    + ", ".join(f"{c} = excluded.{c}" for c in CREDENTIAL_COLUMNS)
+)
+
+
+# 校准今日用量：在一条语句里从 usage_logs 聚合并写入，各列口径与 _usage_increments 一致。
+# 若先查询再回写绝对值，查询与回写之间 record_log 做的累加会被覆盖
+_NOT_AGY = "COALESCE(api_type, '') != 'antigravity'"
+_USAGE_AGGREGATES = {
+    "usage_total": "count(*)",
+    "usage_cli": f"sum(CASE WHEN {_NOT_AGY} THEN 1 ELSE 0 END)",
+    "usage_agy": "sum(CASE WHEN api_type = 'antigravity' THEN 1 ELSE 0 END)",
+    **{
+        f"usage_{q}": f"sum(CASE WHEN {_NOT_AGY} AND quota_class = '{q}' THEN 1 ELSE 0 END)"
+        for q in ("flash", "pro", "tier3")
+    },
+    **{
+        f"usage_{f}": f"sum(CASE WHEN api_type = 'antigravity' AND model_family = '{f}' THEN 1 ELSE 0 END)"
+        for f in ("claude", "gemini", "banana")
+    },
+}
+# 末尾的 WHERE 不能省：SQLite 要求 INSERT ... SELECT ... ON CONFLICT 的 SELECT 带 WHERE 以消除歧义
+_REBUILD_USAGE_SQL = text(
+    f"INSERT INTO user_summaries (user_id, day, {', '.join(USAGE_COLUMNS)}, updated_at) "
+    f"SELECT users.id, :day, {', '.join(f'COALESCE(l.{c}, 0)' for c in USAGE_COLUMNS)}, :updated_at "
+    "FROM users LEFT JOIN ("
+    f"SELECT user_id, {', '.join(f'{expr} AS {c}' for c, expr in _USAGE_AGGREGATES.items())} "
+    "FROM usage_logs WHERE created_at >= :start GROUP BY user_id"
+    ") l ON l.user_id = users.id WHERE users.id IS NOT NULL "
+    "ON CONFLICT (user_id) DO UPDATE SET "
+    + ", ".join(f"{c} = excluded.{c}" for c in ["day"] + USAGE_COLUMNS + ["updated_at"])
+).bindparams(bindparam("start", type_=DateTime), bindparam("updated_at", type_=DateTime))
+
+
+def record_log(connection, log) -> None:
+    """写入一条日志后累加今日用量（同步，在 flush 的连接上执行）"""
+    if log.user_id is None:
+        return
+    params = _usage_increments(log.api_type, log.quota_class, log.model_family)
+    connection.execute(_RECORD_SQL, {"user_id": log.user_id, "day": today_key(), **params})
+
+
+def refresh_credential_counts(connection, user_ids: Iterable[int]) -> None:
+    """重算指定用户的活跃凭证数量（同步，在 flush 的连接上执行）"""
+    for user_id in user_ids:
+        connection.execute(_CREDENTIAL_SQL, {"user_id": user_id, "true": True})
+
+
+class UserSummaryReconciler:
+    """定期全量校准用户汇总"""
+
+    def __init__(self):
+        self.last_rebuild_at: Optional[datetime] = None
+        self.last_error: Optional[str] = None
+
+    async def rebuild(self) -> int:
+        """用两条分组查询重算所有用户的汇总（后台运行，用户多时也只是两次扫描）"""
+        from app.models.user import User, Credential
+
+        day = today_key()
+        now = datetime.utcnow()
+        async with async_session() as db:
+            user_ids = [row[0] for row in (await db.execute(select(User.id))).all()]
+
+            # 今日用量在数据库里一次算完并写入
+            await db.execute(_REBUILD_USAGE_SQL, {
+                "day": day, "start": settings.get_start_of_day(), "updated_at": now,
+            })
+
+            creds: Dict[int, Dict[str, int]] = defaultdict(lambda: {c: 0 for c in CREDENTIAL_COLUMNS})
+            rows = (await db.execute(
+                select(Credential.user_id, Credential.api_type, Credential.model_tier, Credential.is_public, func.count(Credential.id))
+                .where(Credential.is_active == True)
+                .where(Credential.user_id != None)
+                .group_by(Credential.user_id, Credential.api_type, Credential.model_tier, Credential.is_public)
+            )).all()
+            for user_id, api_type, model_tier, is_public, count in rows:
+                entry = creds[user_id]
+                if api_type == "antigravity":
+                    entry["agy_cred_count"] += count
+                    if is_public:
+                        entry["agy_public_cred_count"] += count
+                elif api_type is not None:
+                    # 与 api_type != 'antigravity' 的 SQL 语义一致（NULL 不计）
+                    entry["cli_cred_count"] += count
+                    if model_tier == "3":
+                        entry["cli_cred_30_count"] += count
+
+            # 上面已为每个用户建好汇总行，这里只更新凭证数量
+            upsert = text(
+                f"UPDATE user_summaries SET {', '.join(f'{c} = :{c}' for c in CREDENTIAL_COLUMNS)} "
+                "WHERE user_id = :user_id"
+            )
+            params = [{"user_id": user_id, **creds[user_id]} for user_id in user_ids]
+            for i in range(0, len(params), 500):
+                await db.execute(upsert, params[i:i + 500])
+            # 清理已删除用户的汇总
+            await db.execute(text("DELETE FROM user_summaries WHERE user_id NOT IN (SELECT id FROM users)"))
+            await db.commit()
+
+        self.last_rebuild_at = datetime.utcnow()
+        return len(user_ids)
+
+    async def run_forever(self):
+        while True:
+            try:
+                await self.rebuild()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"[UserSummary] ⚠️ 校准用户汇总失败: {e}", flush=True)
+            await asyncio.sleep(max(60, settings.user_summary_reconcile_interval))
+
+
+# 全局用户汇总校准实例
+user_summary = UserSummaryReconciler()
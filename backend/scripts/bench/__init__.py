@@ -0,0 +1,7 @@
+"""
+协议转换 / 流式转换热路径的基准测试（离线运行，不访问上游）
+
+- fixtures.py：固定种子生成的样本（长对话、50 个工具的 Agent 请求、内联图片、思考块、长 SSE 流）
+- cases.py：用例（请求转换、非流式响应转换、流式转换、假流式）
+- baseline.json：基线结果，运行方式见 __main__.py
+"""
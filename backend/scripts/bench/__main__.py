@@ -0,0 +1,200 @@
+"""
+协议转换 / 流式转换基准测试
+
+    cd backend
+    python -m scripts.bench                      # 运行全部用例并与 baseline.json 比较，有回退时退出码为 1
+    python -m scripts.bench -k stream            # 只运行名称或分组包含 stream 的用例
+    python -m scripts.bench --save-baseline      # 用当前结果覆盖 baseline.json（确认变化是预期的之后）
+    python -m scripts.bench --no-compare         # 只输出结果
+
+每个用例：预热后重复运行，记录中位数和最小耗时（流式用例另外折算为每 chunk 耗时），
+再单独运行一次用 tracemalloc 统计峰值内存。
+
+回退判定用最小耗时（中位数受调度抖动影响太大，亚毫秒用例一次运行就能差出 20%~70%），
+并按校准循环的耗时折算机器当前的快慢；超出阈值的用例会重测一次再判定。
+
+baseline.json 只对录制它的那台机器有意义：换机器（或 CI 节点类型）后先用 --save-baseline 重新录制，
+不要提交别的机器上录制的基线。
+"""
+import argparse
+import asyncio
+import contextlib
+import gc
+import inspect
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+# 最小耗时 / 峰值内存超过基线的比例，且绝对差值超过下限时视为回退（小用例的抖动不算）
+TIME_THRESHOLD = 0.20
+TIME_FLOOR_MS = 0.25
+MEMORY_THRESHOLD = 0.10
+MEMORY_FLOOR_KB = 64
+
+
+def calibrate(rounds: int = 50, warmup: int = 5) -> float:
+    """固定的纯 Python 负载（JSON 序列化 + 字典/字符串操作），返回最小耗时 ms，用于折算机器快慢"""
+    data = [{"role": "user", "parts": [{"text": "校准 calibration " * 20, "n": i}]} for i in range(400)]
+    best = float("inf")
+    for i in range(warmup + rounds):
+        start = time.perf_counter()
+        encoded = json.dumps(data, ensure_ascii=False)
+        decoded = json.loads(encoded)
+        "".join(part["text"] for item in decoded for part in item["parts"]).upper()
+        if i >= warmup:
+            best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+async def _call(fn, data):
+    result = fn(data)
+    if inspect.isawaitable(result):
+        result = await result
+    return result
+
+
+async def measure(case, repeat: int, warmup: int) -> dict:
+    """运行一个用例，返回中位数 / 最小耗时、每 chunk 耗时和峰值内存"""
+    inputs = [case.make_input() for _ in range(warmup + repeat + 1)]
+    items = case.items(inputs[-1]) if case.items else None
+
+    timings = []
+    # 转换器的调试输出不计入终端，但仍然照常执行
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for i in range(warmup + repeat):
+            if case.setup:
+                await case.setup()
+            gc.collect()
+            start = time.perf_counter()
+            await _call(case.run, inputs[i])
+            elapsed = time.perf_counter() - start
+            if i >= warmup:
+                timings.append(elapsed * 1000)
+
+        if case.setup:
+            await case.setup()
+        gc.collect()
+        tracemalloc.start()
+        await _call(case.run, inputs[-1])
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    median = statistics.median(timings)
+    result = {
+        "median_ms": round(median, 3),
+        "min_ms": round(min(timings), 3),
+        "peak_kb": round(peak / 1024, 1),
+    }
+    if items:
+        result["items"] = items
+        result["per_item_us"] = round(median * 1000 / items, 2)
+    return result
+
+
+def compare(result: dict, base: dict, scale: float = 1.0) -> list:
+    """与基线比较（基线耗时先乘以机器快慢系数 scale），返回回退说明列表"""
+    problems = []
+    if not base:
+        return problems
+    old, new = base.get("min_ms"), result["min_ms"]
+    if old:
+        old *= scale
+    if old and new > old * (1 + TIME_THRESHOLD) and new - old > TIME_FLOOR_MS:
+        problems.append(f"最小耗时 {old:.3f} → {new:.3f} ms (+{(new / old - 1) * 100:.0f}%)")
+    old, new = base.get("peak_kb"), result["peak_kb"]
+    if old and new > old * (1 + MEMORY_THRESHOLD) and new - old > MEMORY_FLOOR_KB:
+        problems.append(f"峰值内存 {old:.0f} → {new:.0f} KB (+{(new / old - 1) * 100:.0f}%)")
+    return problems
+
+
+def _delta(result: dict, base: dict, scale: float) -> str:
+    if not base or not base.get("min_ms"):
+        return "   (新)"
+    return f"{(result['min_ms'] / (base['min_ms'] * scale) - 1) * 100:+6.1f}%"
+
+
+def _environment() -> dict:
+    return {"python": platform.python_version(), "machine": platform.machine(), "processor": platform.processor() or platform.node()}
+
+
+async def main(args) -> int:
+    from app.services.image_storage import ImageStorage
+    from scripts.bench.cases import build_cases
+    from scripts.protocol_conformance import _fake_save_image
+
+    # 响应中的图片不落盘
+    ImageStorage.save_base64_image_async = staticmethod(_fake_save_image)
+
+    baseline = {}
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH, encoding="utf-8") as f:
+            baseline = json.load(f)
+    base_results = baseline.get("results", {})
+    if baseline and not args.no_compare and baseline.get("environment") != _environment():
+        print(f"⚠️ 基线录制环境 {baseline.get('environment')} 与当前 {_environment()} 不同，比较结果仅供参考")
+
+    cases = [c for c in build_cases() if not args.k or args.k in c.name or args.k == c.group]
+    results = {}
+    regressions = 0
+    calibration_ms = calibrate()
+    scale = 1.0
+    if baseline.get("calibration_ms") and not args.no_compare:
+        scale = calibration_ms / baseline["calibration_ms"]
+        print(f"校准循环 {calibration_ms:.2f} ms（基线 {baseline['calibration_ms']:.2f} ms），基线耗时按 ×{scale:.2f} 比较")
+    print(f"{'用例':<32}{'中位数 ms':>11}{'最小 ms':>10}{'每chunk µs':>12}{'峰值 KB':>11}{'最小对比基线':>10}")
+    for case in cases:
+        result = await measure(case, args.repeat, args.warmup)
+        base = base_results.get(case.name)
+        if not args.no_compare and compare(result, base, scale):
+            # 疑似回退时重测一次取较快的结果，排除偶发的调度抖动
+            retry = await measure(case, args.repeat, args.warmup)
+            if retry["min_ms"] < result["min_ms"]:
+                result = retry
+        results[case.name] = result
+        per_item = f"{result['per_item_us']:.2f}" if "per_item_us" in result else "-"
+        delta = "" if args.no_compare else _delta(result, base, scale)
+        print(f"{case.name:<32}{result['median_ms']:>11.3f}{result['min_ms']:>10.3f}{per_item:>12}{result['peak_kb']:>11.1f}{delta:>10}")
+        if not args.no_compare:
+            for problem in compare(result, base, scale):
+                regressions += 1
+                print(f"   ❌ {problem}")
+
+    if args.save_baseline:
+        if args.k and base_results:
+            # 只运行了部分用例时保留其它用例的基线
+            results = {**base_results, **results}
+        with open(BASELINE_PATH, "w", encoding="utf-8") as f:
+            json.dump({
+                "environment": _environment(),
+                "calibration_ms": round(calibration_ms, 3),
+                "repeat": args.repeat,
+                "results": results,
+            }, f, ensure_ascii=False, indent=1)
+            f.write("\n")
+        print(f"已保存基线 ({len(results)} 个用例): {BASELINE_PATH}")
+        return 0
+    if args.no_compare:
+        return 0
+    if regressions:
+        print(f"{regressions} 项回退")
+        return 1
+    print("没有回退")
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m scripts.bench", description="协议转换 / 流式转换基准测试")
+    parser.add_argument("-k", default="", help="只运行名称包含该字符串（或分组等于该值）的用例")
+    parser.add_argument("--repeat", type=int, default=30, help="每个用例计时的次数")
+    parser.add_argument("--warmup", type=int, default=3, help="计时前的预热次数")
+    parser.add_argument("--save-baseline", action="store_true", help="用当前结果覆盖 baseline.json")
+    parser.add_argument("--no-compare", action="store_true", help="不与基线比较")
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,165 @@
+"""
+基准测试用例
+
+每个用例准备好输入后只计时转换本身：
+- request / response：单次转换耗时
+- stream：整条流的转换耗时，按 chunk 数折算为每 chunk 耗时
+输入在计时前逐次拷贝好（转换器可能原地修改请求），setup 在计时外执行（例如预热前缀缓存）。
+"""
+import copy
+from typing import Any, Awaitable, Callable, List, Optional
+
+from scripts.bench import fixtures
+
+BASE_URL = "http://bench.local"
+
+
+class Case:
+    """一个基准用例"""
+
+    def __init__(
+        self,
+        name: str,
+        group: str,
+        make_input: Callable[[], Any],
+        run: Callable[[Any], Any],
+        items: Optional[Callable[[Any], int]] = None,
+        setup: Optional[Callable[[], Awaitable[None]]] = None,
+    ):
+        self.name = name
+        self.group = group
+        self._make_input = make_input
+        self._template = None
+        self.run = run
+        self.items = items
+        self.setup = setup
+
+    def make_input(self) -> Any:
+        """返回一份独立的输入（生成一次，之后深拷贝）"""
+        if self._template is None:
+            self._template = self._make_input()
+        return copy.deepcopy(self._template)
+
+
+async def _drain(agen) -> int:
+    count = 0
+    async for _ in agen:
+        count += 1
+    return count
+
+
+async def _aiter(chunks: List[bytes]):
+    for chunk in chunks:
+        yield chunk
+
+
+def _sse(chunks: List[str]) -> List[bytes]:
+    return [f"data: {chunk}".encode("utf-8") for chunk in chunks]
+
+
+def build_cases() -> List[Case]:
+    from app.services.anthropic2gemini import (
+        anthropic_to_gemini_request, gemini_to_anthropic_response, gemini_stream_to_anthropic_stream,
+    )
+    from app.services.antigravity_client import AntigravityClient
+    from app.services.fake_stream import (
+        build_anthropic_fake_stream_chunks, build_gemini_fake_stream_chunks, build_openai_fake_stream_chunks,
+        parse_response_for_fake_stream,
+    )
+    from app.services.gemini_client import GeminiClient
+    from app.services.gemini_fix import normalize_gemini_request
+    from app.services.openai2gemini_full import convert_openai_to_gemini_request
+    from app.services.prefix_cache import prefix_cache
+
+    agy = AntigravityClient("")
+    gcli = GeminiClient("")
+
+    async def agy_stream(chunks: List[str]):
+        for chunk in chunks:
+            await agy._convert_to_openai_stream(chunk, "gemini-2.5-pro", BASE_URL)
+
+    def gcli_stream(chunks: List[str]):
+        for chunk in chunks:
+            gcli._convert_to_openai_stream(chunk, "gemini-2.5-pro")
+
+    def fake_stream(build):
+        def run(response):
+            content, reasoning, finish_reason, images = parse_response_for_fake_stream(response)
+            return build(content, reasoning, finish_reason, images)
+        return run
+
+    def fake_stream_items(build):
+        def items(response):
+            content, reasoning, finish_reason, images = parse_response_for_fake_stream(response)
+            return len(build(content, reasoning, finish_reason, images))
+        return items
+
+    def previous_turn(request: dict) -> dict:
+        """上一轮的请求：去掉最后一轮问答"""
+        prev = copy.deepcopy(request)
+        prev["messages"] = prev["messages"][:-2]
+        return prev
+
+    openai_chat = fixtures.openai_long_chat()
+    anthropic_agent = fixtures.anthropic_agent()
+
+    async def prime_openai():
+        prefix_cache.clear()
+        await convert_openai_to_gemini_request(previous_turn(openai_chat), cache_key="bench")
+
+    async def prime_anthropic():
+        prefix_cache.clear()
+        await anthropic_to_gemini_request(previous_turn(anthropic_agent), cache_key="bench")
+
+    async def no_cache():
+        prefix_cache.clear()
+
+    stream_items = len
+    openai_fake = lambda c, r, f, i: build_openai_fake_stream_chunks(c, r, f, "gemini-2.5-pro", i)
+    anthropic_fake = lambda c, r, f, i: build_anthropic_fake_stream_chunks(c, r, f, "gemini-2.5-pro", i)
+
+    return [
+        # ===== 请求转换 =====
+        Case("openai_long_chat", "request", lambda: openai_chat,
+             convert_openai_to_gemini_request, setup=no_cache),
+        Case("openai_long_chat_next_turn", "request", lambda: openai_chat,
+             lambda data: convert_openai_to_gemini_request(data, cache_key="bench"), setup=prime_openai),
+        Case("openai_agent_50_tools", "request", fixtures.openai_agent,
+             convert_openai_to_gemini_request, setup=no_cache),
+        Case("openai_images", "request", fixtures.openai_images,
+             convert_openai_to_gemini_request, setup=no_cache),
+        Case("anthropic_agent_50_tools", "request", lambda: anthropic_agent,
+             anthropic_to_gemini_request, setup=no_cache),
+        Case("anthropic_agent_next_turn", "request", lambda: anthropic_agent,
+             lambda data: anthropic_to_gemini_request(data, cache_key="bench"), setup=prime_anthropic),
+        Case("anthropic_images", "request", fixtures.anthropic_images,
+             anthropic_to_gemini_request, setup=no_cache),
+        Case("gcli_long_chat", "request", lambda: openai_chat["messages"],
+             gcli._convert_messages_to_contents, setup=no_cache),
+        Case("normalize_gemini_antigravity", "request", fixtures.gemini_native,
+             lambda data: normalize_gemini_request(data, mode="antigravity")),
+        Case("normalize_gemini_geminicli", "request", fixtures.gemini_native,
+             lambda data: normalize_gemini_request(data, mode="geminicli")),
+
+        # ===== 非流式响应转换 =====
+        Case("antigravity_openai_response", "response", fixtures.gemini_response,
+             lambda data: agy._convert_to_openai_response(data, "gemini-2.5-pro", BASE_URL)),
+        Case("gcli_openai_response", "response", fixtures.gemini_response,
+             lambda data: gcli._convert_to_openai_response(data, "gemini-2.5-pro")),
+        Case("anthropic_response", "response", fixtures.gemini_response,
+             lambda data: gemini_to_anthropic_response(data, "claude-sonnet-4-5")),
+
+        # ===== 流式转换 =====
+        Case("antigravity_openai_stream", "stream", fixtures.gemini_stream, agy_stream, items=stream_items),
+        Case("gcli_openai_stream", "stream", fixtures.gemini_stream, gcli_stream, items=stream_items),
+        Case("anthropic_stream", "stream", lambda: _sse(fixtures.gemini_stream()),
+             lambda data: _drain(gemini_stream_to_anthropic_stream(_aiter(data), "claude-sonnet-4-5")),
+             items=stream_items),
+        Case("fake_stream_openai", "stream", fixtures.gemini_response,
+             fake_stream(openai_fake), items=fake_stream_items(openai_fake)),
+        Case("fake_stream_anthropic", "stream", fixtures.gemini_response,
+             fake_stream(anthropic_fake), items=fake_stream_items(anthropic_fake)),
+        Case("fake_stream_gemini", "stream", fixtures.gemini_response,
+             fake_stream(build_gemini_fake_stream_chunks), items=fake_stream_items(build_gemini_fake_stream_chunks)),
+    ]
+
@@ -0,0 +1,274 @@
+"""
+基准测试样本
+
+样本由固定种子的生成器构造（每次运行、每台机器上都完全相同），结构仿照线上的真实请求：
+长对话历史（中英混合、代码块）、50 个工具的 Agent 请求、内联图片、带签名的思考块、
+几千个 chunk 的 SSE 流。不提交生成后的 JSON —— 图片样本有几 MB，生成器本身就是录制结果。
+"""
+import base64
+import json
+import random
+from typing import Any, Dict, List
+
+_WORDS = (
+    "the request proxy credential model stream token response upstream client server cache "
+    "function result error retry config user message content schema field value index list "
+    "return async await import class def self data json parse convert build update check"
+).split()
+_CJK_PHRASES = (
+    "这个函数", "返回结果", "需要检查", "上游接口", "凭证池", "流式响应", "配置文件", "请帮我",
+    "看一下", "为什么会", "报错了", "我们可以", "修改一下", "数据库", "日志里", "没有问题",
+)
+_CODE = '''```python
+async def fetch(client, url, retries=3):
+    for attempt in range(retries):
+        resp = await client.get(url, timeout=30)
+        if resp.status_code == 429:
+            await asyncio.sleep(2 ** attempt)
+            continue
+        return resp.json()
+    raise RuntimeError("too many retries")
+```'''
+
+# 1x1 PNG 头 + 随机数据，解码后约 384KB
+_IMAGE_BYTES = 384 * 1024
+
+
+def _text(rng: random.Random, words: int, cjk_ratio: float = 0.3) -> str:
+    out = []
+    for _ in range(words):
+        out.append(rng.choice(_CJK_PHRASES) if rng.random() < cjk_ratio else rng.choice(_WORDS))
+    return " ".join(out)
+
+
+def _paragraphs(rng: random.Random, count: int, code_ratio: float = 0.2) -> str:
+    parts = []
+    for _ in range(count):
+        parts.append(_CODE if rng.random() < code_ratio else _text(rng, rng.randint(20, 80)))
+    return "\n\n".join(parts)
+
+
+def _signature(rng: random.Random) -> str:
+    return base64.b64encode(rng.randbytes(300)).decode("ascii")
+
+
+def _image_b64(rng: random.Random) -> str:
+    return base64.b64encode(b"\x89PNG\r\n\x1a\n" + rng.randbytes(_IMAGE_BYTES)).decode("ascii")
+
+
+# ===== 工具定义 =====
+
+def _tool_schema(rng: random.Random, i: int) -> Dict[str, Any]:
+    """带嵌套对象、数组、枚举、anyOf、$ref 和默认值的参数 schema"""
+    properties: Dict[str, Any] = {
+        "path": {"type": "string", "description": f"file path for tool {i}"},
+        "limit": {"type": "integer", "minimum": 1, "maximum": 1000, "default": 100},
+        "ratio": {"type": "number", "exclusiveMinimum": 0},
+        "recursive": {"type": "boolean", "default": False},
+        "mode": {"type": "string", "enum": ["read", "write", "append"]},
+        "tags": {"type": "array", "items": {"type": "string"}, "minItems": 0},
+        "options": {
+            "type": "object",
+            "properties": {
+                "encoding": {"type": ["string", "null"]},
+                "filter": {"anyOf": [{"type": "string"}, {"$ref": "#/$defs/Filter"}]},
+            },
+            "additionalProperties": False,
+        },
+    }
+    for j in range(rng.randint(0, 6)):
+        properties[f"extra_{j}"] = {"type": rng.choice(["string", "integer", "number", "boolean"]), "description": _text(rng, 8, 0)}
+    return {
+        "type": "object",
+        "$schema": "http://json-schema.org/draft-07/schema#",
+        "properties": properties,
+        "required": ["path", "mode"],
+        "$defs": {"Filter": {"type": "object", "properties": {"pattern": {"type": "string"}, "exclude": {"type": "boolean"}}}},
+    }
+
+
+def _tools(rng: random.Random, count: int) -> List[Dict[str, Any]]:
+    return [
+        {"name": f"tool_{i}_{rng.choice(_WORDS)}", "description": _text(rng, 40, 0.1), "parameters": _tool_schema(rng, i)}
+        for i in range(count)
+    ]
+
+
+def _tool_args(rng: random.Random) -> Dict[str, Any]:
+    return {
+        "path": f"/srv/app/{rng.choice(_WORDS)}/{rng.choice(_WORDS)}.py",
+        "limit": str(rng.randint(1, 500)),
+        "mode": rng.choice(["read", "write"]),
+        "recursive": rng.choice(["true", False]),
+        "tags": [rng.choice(_WORDS) for _ in range(3)],
+    }
+
+
+# ===== OpenAI 请求 =====
+
+def openai_long_chat(turns: int = 120, seed: int = 1) -> Dict[str, Any]:
+    """长对话：system + 多轮中英混合问答，部分回复带代码块"""
+    rng = random.Random(seed)
+    messages: List[Dict[str, Any]] = [{"role": "system", "content": _paragraphs(rng, 3, 0)}]
+    for _ in range(turns):
+        messages.append({"role": "user", "content": _paragraphs(rng, rng.randint(1, 2))})
+        messages.append({"role": "assistant", "content": _paragraphs(rng, rng.randint(2, 5))})
+    messages.append({"role": "user", "content": _text(rng, 30)})
+    return {"model": "gemini-2.5-pro", "temperature": 0.7, "max_tokens": 8192, "stream": True, "messages": messages}
+
+
+def openai_agent(tool_count: int = 50, rounds: int = 30, seed: int = 2) -> Dict[str, Any]:
+    """Agent 请求：50 个工具，多轮并行工具调用和工具结果"""
+    rng = random.Random(seed)
+    tools = _tools(rng, tool_count)
+    messages: List[Dict[str, Any]] = [
+        {"role": "system", "content": _paragraphs(rng, 4, 0)},
+        {"role": "user", "content": _text(rng, 60)},
+    ]
+    for r in range(rounds):
+        calls = []
+        for k in range(rng.randint(1, 3)):
+            tool = rng.choice(tools)
+            calls.append({
+                "id": f"call_{r}_{k}",
+                "type": "function",
+                "function": {"name": tool["name"], "arguments": json.dumps(_tool_args(rng))},
+            })
+        messages.append({"role": "assistant", "content": _text(rng, 15) if rng.random() < 0.5 else None, "tool_calls": calls})
+        for call in calls:
+            messages.append({"role": "tool", "tool_call_id": call["id"], "content": _paragraphs(rng, rng.randint(1, 3), 0.4)})
+    messages.append({"role": "user", "content": _text(rng, 20)})
+    return {
+        "model": "claude-sonnet-4-5",
+        "stream": True,
+        "tools": [{"type": "function", "function": tool} for tool in tools],
+        "tool_choice": "auto",
+        "messages": messages,
+    }
+
+
+def openai_images(count: int = 4, seed: int = 3) -> Dict[str, Any]:
+    """多模态请求：每张图片约 384KB 的内联 data URL"""
+    rng = random.Random(seed)
+    content: List[Dict[str, Any]] = [{"type": "text", "text": _text(rng, 40)}]
+    for _ in range(count):
+        content.append({"type": "image_url", "image_url": {"url": f"data:image/png;base64,{_image_b64(rng)}"}})
+    return {"model": "gemini-2.5-flash", "messages": [{"role": "user", "content": content}]}
+
+
+# ===== Anthropic 请求 =====
+
+def anthropic_agent(tool_count: int = 50, rounds: int = 30, seed: int = 4) -> Dict[str, Any]:
+    """Claude Code 风格的请求：50 个工具，每轮带签名的思考块 + tool_use / tool_result"""
+    rng = random.Random(seed)
+    tools = _tools(rng, tool_count)
+    messages: List[Dict[str, Any]] = [{"role": "user", "content": [{"type": "text", "text": _text(rng, 60)}]}]
+    for r in range(rounds):
+        blocks: List[Dict[str, Any]] = [
+            {"type": "thinking", "thinking": _paragraphs(rng, 2, 0), "signature": _signature(rng)},
+            {"type": "text", "text": _text(rng, 20)},
+        ]
+        uses = []
+        for k in range(rng.randint(1, 3)):
+            tool = rng.choice(tools)
+            uses.append(f"toolu_{r}_{k}")
+            blocks.append({"type": "tool_use", "id": uses[-1], "name": tool["name"], "input": _tool_args(rng)})
+        messages.append({"role": "assistant", "content": blocks})
+        messages.append({"role": "user", "content": [
+            {"type": "tool_result", "tool_use_id": use_id, "content": [{"type": "text", "text": _paragraphs(rng, 2, 0.4)}]}
+            for use_id in uses
+        ]})
+    messages[-1]["content"].append({"type": "text", "text": _text(rng, 20), "cache_control": {"type": "ephemeral"}})
+    return {
+        "model": "claude-sonnet-4-5",
+        "max_tokens": 16000,
+        "stream": True,
+        "thinking": {"type": "enabled", "budget_tokens": 8000},
+        "system": [{"type": "text", "text": _paragraphs(rng, 6, 0), "cache_control": {"type": "ephemeral"}}],
+        "tools": [{"name": t["name"], "description": t["description"], "input_schema": t["parameters"]} for t in tools],
+        "messages": messages,
+    }
+
+
+def anthropic_images(count: int = 4, seed: int = 5) -> Dict[str, Any]:
+    rng = random.Random(seed)
+    content: List[Dict[str, Any]] = [{"type": "text", "text": _text(rng, 40)}]
+    for _ in range(count):
+        content.append({"type": "image", "source": {"type": "base64", "media_type": "image/png", "data": _image_b64(rng)}})
+    return {"model": "claude-sonnet-4-5", "max_tokens": 4096, "messages": [{"role": "user", "content": content}]}
+
+
+# ===== Gemini 原生请求 =====
+
+def gemini_native(turns: int = 80, tool_count: int = 20, seed: int = 6) -> Dict[str, Any]:
+    """Gemini 原生格式（normalize_gemini_request 的输入）"""
+    rng = random.Random(seed)
+    contents = []
+    for _ in range(turns):
+        contents.append({"role": "user", "parts": [{"text": _paragraphs(rng, rng.randint(1, 2))}]})
+        contents.append({"role": "model", "parts": [
+            {"text": _paragraphs(rng, 1, 0), "thought": True, "thoughtSignature": _signature(rng)},
+            {"text": _paragraphs(rng, rng.randint(1, 4))},
+        ]})
+    contents.append({"role": "user", "parts": [{"text": _text(rng, 30)}]})
+    return {
+        "model": "gemini-2.5-pro",
+        "contents": contents,
+        "systemInstruction": {"parts": [{"text": _paragraphs(rng, 3, 0)}]},
+        "tools": [{"functionDeclarations": _tools(rng, tool_count)}],
+        "generationConfig": {"temperature": 0.8, "topP": 0.95, "topK": 64, "maxOutputTokens": 65536,
+                             "thinkingConfig": {"thinkingBudget": 8192, "includeThoughts": True}},
+    }
+
+
+# ===== Gemini 响应 =====
+
+def _usage(rng: random.Random) -> Dict[str, Any]:
+    prompt = rng.randint(20000, 80000)
+    candidates = rng.randint(500, 4000)
+    return {"promptTokenCount": prompt, "candidatesTokenCount": candidates, "thoughtsTokenCount": 1024,
+            "totalTokenCount": prompt + candidates + 1024}
+
+
+def gemini_response(seed: int = 7) -> Dict[str, Any]:
+    """长的非流式响应：思考 + 正文 + 3 个工具调用（Antigravity 的 response 包装）"""
+    rng = random.Random(seed)
+    parts: List[Dict[str, Any]] = [
+        {"text": _paragraphs(rng, 8, 0), "thought": True},
+        {"text": _paragraphs(rng, 20), "thoughtSignature": _signature(rng)},
+    ]
+    for k in range(3):
+        parts.append({"functionCall": {"id": f"fc_{k}", "name": f"tool_{k}_read", "args": _tool_args(rng)}})
+    return {"response": {
+        "candidates": [{"content": {"role": "model", "parts": parts}, "finishReason": "STOP"}],
+        "usageMetadata": _usage(rng),
+        "modelVersion": "gemini-2.5-pro",
+        "responseId": "bench-response",
+    }}
+
+
+def gemini_stream(chunks: int = 2000, seed: int = 8) -> List[str]:
+    """
+    长 SSE 流（每项是一个 chunk 的 JSON 字符串，不含 "data: " 前缀）
+
+    前 1/4 是思考内容（中途换一次签名），之后是中英混合正文，最后一个工具调用，
+    结束块带 finishReason 和 usageMetadata。
+    """
+    rng = random.Random(seed)
+    out = []
+    thinking = chunks // 4
+    for i in range(chunks):
+        if i < thinking:
+            part: Dict[str, Any] = {"text": _text(rng, rng.randint(3, 12), 0.2), "thought": True}
+            if i in (0, thinking // 2):
+                part["thoughtSignature"] = _signature(rng)
+        else:
+            part = {"text": _text(rng, rng.randint(3, 12))}
+        out.append(json.dumps({"response": {"candidates": [{"content": {"role": "model", "parts": [part]}}]}}, ensure_ascii=False))
+    out.append(json.dumps({"response": {
+        "candidates": [{"content": {"role": "model", "parts": [
+            {"functionCall": {"id": "fc_end", "name": "tool_0_read", "args": _tool_args(rng)}, "thoughtSignature": _signature(rng)},
+        ]}, "finishReason": "STOP"}],
+        "usageMetadata": _usage(rng),
+    }}))
+    return out
@@ -0,0 +1,8 @@
+"""
+本地压测工具（不消耗真实的 Google 配额）
+
+- mock_upstream.py：模拟 Code Assist / Antigravity / OAuth 上游，可配置延迟、chunk 节奏、429 / 5xx 注入和配额耗尽
+- seed.py：创建压测用户、API Key 和指向模拟上游的凭证
+- driver.py：向代理发送 OpenAI / Anthropic / Gemini 格式的请求，统计吞吐量、p50 / p99、首 token 时间和重试数
+- __main__.py：一条命令启动模拟上游和代理并跑完全部场景
+"""
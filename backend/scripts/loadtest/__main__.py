@@ -0,0 +1,125 @@
+"""
+端到端压测：启动模拟上游和代理，创建压测数据，跑完场景后输出报告
+
+    cd backend
+    python -m scripts.loadtest                                        # 全部场景，baseline 配置
+    python -m scripts.loadtest --scenario openai_gcli_stream,anthropic_agy_stream --profile baseline,flaky -c 64 -n 1000
+    python -m scripts.loadtest --keep                                  # 保留工作目录（数据库、代理日志）
+
+代理以子进程运行（独立的工作目录和 SQLite 数据库，不影响 data/ 下的正式数据），
+所有上游地址通过环境变量指向模拟上游，全程不访问 Google。代理输出写入工作目录下的 proxy.log。
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from scripts.loadtest.driver import add_driver_arguments, finish, run_all
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_ready(url: str, process: subprocess.Popen, name: str, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f"{name} 启动失败（退出码 {process.returncode}）")
+        try:
+            if httpx.get(url, timeout=2).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise SystemExit(f"{name} 在 {timeout:.0f} 秒内没有就绪: {url}")
+
+
+def _stop(process: subprocess.Popen):
+    if process.poll() is None:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m scripts.loadtest", description="端到端压测（模拟上游 + 代理）")
+    parser.add_argument("--geminicli", type=int, default=8, help="GeminiCLI 凭证数")
+    parser.add_argument("--antigravity", type=int, default=8, help="Antigravity 凭证数")
+    parser.add_argument("--workdir", default="", help="工作目录（默认临时目录）")
+    parser.add_argument("--keep", action="store_true", help="结束后保留工作目录")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="传给代理的额外配置，例如 FAIR_SCHEDULER_ENABLED=true")
+    add_driver_arguments(parser)
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="loadtest-")
+    os.makedirs(os.path.join(workdir, "data"), exist_ok=True)
+    mock_port, app_port = _free_port(), _free_port()
+    mock_url = f"http://127.0.0.1:{mock_port}"
+    base_url = f"http://127.0.0.1:{app_port}"
+
+    env = {
+        **os.environ,
+        "PYTHONPATH": BACKEND_DIR + os.pathsep + os.environ.get("PYTHONPATH", ""),
+        "DATABASE_URL": "sqlite+aiosqlite:///./data/loadtest.db",
+        "CODE_ASSIST_ENDPOINT": mock_url,
+        "ANTIGRAVITY_API_BASE": mock_url,
+        "GOOGLE_TOKEN_URL": f"{mock_url}/token",
+    }
+    for item in args.env:
+        key, _, value = item.partition("=")
+        env[key.upper()] = value
+
+    processes = []
+    log = open(os.path.join(workdir, "proxy.log"), "wb")
+    try:
+        mock = subprocess.Popen(
+            [sys.executable, "-m", "scripts.loadtest.mock_upstream", "--port", str(mock_port)],
+            cwd=BACKEND_DIR, env=env, stdout=log, stderr=subprocess.STDOUT,
+        )
+        processes.append(mock)
+        _wait_ready(f"{mock_url}/_mock/stats", mock, "模拟上游")
+
+        seeded = subprocess.run(
+            [sys.executable, "-m", "scripts.loadtest.seed", "--geminicli", str(args.geminicli), "--antigravity", str(args.antigravity)],
+            cwd=workdir, env=env, capture_output=True, text=True,
+        )
+        if seeded.returncode != 0:
+            raise SystemExit(f"创建压测数据失败:\n{seeded.stderr[-2000:]}")
+        api_key = seeded.stdout.strip().splitlines()[-1]
+
+        app = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(app_port), "--log-level", "warning"],
+            cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT,
+        )
+        processes.append(app)
+        _wait_ready(f"{base_url}/api/health", app, "代理")
+        print(f"[LoadTest] 模拟上游 {mock_url}，代理 {base_url}，工作目录 {workdir}", flush=True)
+
+        args.base_url, args.api_key, args.mock_url = base_url, api_key, mock_url
+        finish(asyncio.run(run_all(args)), args.json)
+    finally:
+        for process in reversed(processes):
+            _stop(process)
+        log.close()
+        if args.keep or args.workdir:
+            print(f"[LoadTest] 工作目录: {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
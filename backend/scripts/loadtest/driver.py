@@ -0,0 +1,260 @@
+"""
+压测驱动：向代理发送 OpenAI / Anthropic / Gemini 格式的请求并统计结果
+
+    cd backend
+    python -m scripts.loadtest.driver --base-url http://127.0.0.1:5001 --api-key sk-... \\
+        --mock-url http://127.0.0.1:9100 --scenario openai_gcli_stream --profile flaky -c 32 -n 500
+
+每个场景先用 profile 配置模拟上游（延迟、chunk 节奏、429 / 5xx、配额），清空模拟上游的统计，
+再以固定并发（闭环）发送请求。输出吞吐量、延迟 p50 / p99、首 token 时间（流式）、
+错误分布，以及从模拟上游统计得到的上游调用数和重试数（上游生成调用数 - 客户端请求数）。
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import sys
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+PROMPT = "Summarize the tradeoffs of connection pooling for a streaming HTTP proxy in three sentences."
+
+
+def _openai(model: str, stream: bool, prompt: str) -> Dict[str, Any]:
+    return {"model": model, "stream": stream, "max_tokens": 512,
+            "messages": [{"role": "system", "content": "You are concise."}, {"role": "user", "content": prompt}]}
+
+
+def _anthropic(model: str, stream: bool, prompt: str) -> Dict[str, Any]:
+    return {"model": model, "stream": stream, "max_tokens": 512, "system": "You are concise.",
+            "messages": [{"role": "user", "content": [{"type": "text", "text": prompt}]}]}
+
+
+def _gemini(model: str, stream: bool, prompt: str) -> Dict[str, Any]:
+    return {"contents": [{"role": "user", "parts": [{"text": prompt}]}],
+            "systemInstruction": {"parts": [{"text": "You are concise."}]},
+            "generationConfig": {"maxOutputTokens": 512}}
+
+
+# 场景：请求路径、请求体构造（格式、模型）、是否流式
+SCENARIOS: Dict[str, Dict[str, Any]] = {
+    "openai_gcli": {"path": "/v1/chat/completions", "build": _openai, "model": "gemini-2.5-flash", "stream": False},
+    "openai_gcli_stream": {"path": "/v1/chat/completions", "build": _openai, "model": "gemini-2.5-flash", "stream": True},
+    "openai_agy_stream": {"path": "/v1/chat/completions", "build": _openai, "model": "agy-gemini-2.5-flash", "stream": True},
+    "anthropic_agy": {"path": "/v1/messages", "build": _anthropic, "model": "agy-claude-sonnet-4-5", "stream": False},
+    "anthropic_agy_stream": {"path": "/v1/messages", "build": _anthropic, "model": "agy-claude-sonnet-4-5", "stream": True},
+    "gemini_gcli_stream": {"path": "/v1beta/models/gemini-2.5-flash:streamGenerateContent?alt=sse",
+                           "build": _gemini, "model": "gemini-2.5-flash", "stream": True},
+    "gemini_agy": {"path": "/antigravity/v1beta/models/gemini-2.5-flash:generateContent",
+                   "build": _gemini, "model": "gemini-2.5-flash", "stream": False},
+    "gemini_agy_stream": {"path": "/antigravity/v1beta/models/gemini-2.5-flash:streamGenerateContent?alt=sse",
+                          "build": _gemini, "model": "gemini-2.5-flash", "stream": True},
+}
+
+# 模拟上游的配置组合（字段见 mock_upstream.MockConfig）
+PROFILES: Dict[str, Dict[str, Any]] = {
+    "baseline": {"latency": 0.2, "chunk_interval": 0.02, "chunks": 20, "rate_429": 0.0, "rate_5xx": 0.0, "quota": 0},
+    "slow": {"latency": 1.5, "chunk_interval": 0.1, "chunks": 40, "rate_429": 0.0, "rate_5xx": 0.0, "quota": 0},
+    "flaky": {"latency": 0.2, "chunk_interval": 0.02, "chunks": 20, "rate_429": 0.1, "rate_5xx": 0.05, "quota": 0},
+    "quota": {"latency": 0.2, "chunk_interval": 0.02, "chunks": 20, "rate_429": 0.0, "rate_5xx": 0.0, "quota": 20},
+}
+
+# 上游的生成接口（统计重试用）
+_GENERATE_CALLS = ("generateContent", "streamGenerateContent")
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    """最近秩百分位"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def _stream_error(line: str) -> bool:
+    """SSE 中的错误事件（代理在已返回 200 之后失败时，以事件的形式下发错误）"""
+    return line.startswith("event: error") or (line.startswith("data:") and '"error"' in line[:64])
+
+
+async def one_request(client: httpx.AsyncClient, scenario: Dict[str, Any], api_key: str, seq: int) -> Dict[str, Any]:
+    # 每个请求的内容不同，避免被相同请求合并 / 响应缓存吸收
+    body = scenario["build"](scenario["model"], scenario["stream"], f"{PROMPT} (#{seq})")
+    headers = {"Authorization": f"Bearer {api_key}", "x-goog-api-key": api_key, "anthropic-version": "2023-06-01"}
+    start = time.perf_counter()
+    ttft = None
+    outcome = "ok"
+    try:
+        if scenario["stream"]:
+            async with client.stream("POST", scenario["path"], json=body, headers=headers) as resp:
+                if resp.status_code != 200:
+                    await resp.aread()
+                    outcome = str(resp.status_code)
+                else:
+                    async for line in resp.aiter_lines():
+                        if not line:
+                            continue
+                        if _stream_error(line):
+                            outcome = "stream_error"
+                        elif ttft is None and line.startswith("data:") and line != "data: [DONE]":
+                            ttft = time.perf_counter() - start
+        else:
+            resp = await client.post(scenario["path"], json=body, headers=headers)
+            if resp.status_code != 200:
+                outcome = str(resp.status_code)
+    except httpx.HTTPError as e:
+        outcome = type(e).__name__
+    return {"latency": time.perf_counter() - start, "ttft": ttft, "outcome": outcome}
+
+
+async def _mock(client: Optional[httpx.AsyncClient], method: str, path: str, body: Optional[dict] = None) -> Dict[str, Any]:
+    if client is None:
+        return {}
+    resp = await client.request(method, path, json=body)
+    resp.raise_for_status()
+    return resp.json()
+
+
+async def run_scenario(
+    name: str,
+    profile: str,
+    base_url: str,
+    api_key: str,
+    mock_url: Optional[str],
+    concurrency: int,
+    requests: int,
+    timeout: float,
+) -> Dict[str, Any]:
+    """以固定并发跑完一个场景，返回汇总结果"""
+    scenario = SCENARIOS[name]
+    mock = httpx.AsyncClient(base_url=mock_url, timeout=10) if mock_url else None
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    results: List[Dict[str, Any]] = []
+    try:
+        await _mock(mock, "POST", "/_mock/config", PROFILES[profile])
+        await _mock(mock, "POST", "/_mock/reset")
+
+        async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+            sent = 0
+
+            async def worker():
+                nonlocal sent
+                while sent < requests:
+                    sent += 1
+                    results.append(await one_request(client, scenario, api_key, sent))
+
+            started = time.perf_counter()
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+            elapsed = time.perf_counter() - started
+
+        upstream = await _mock(mock, "GET", "/_mock/stats")
+    finally:
+        if mock is not None:
+            await mock.aclose()
+
+    latencies = [r["latency"] * 1000 for r in results]
+    ttfts = [r["ttft"] * 1000 for r in results if r["ttft"] is not None]
+    outcomes = Counter(r["outcome"] for r in results)
+    calls = upstream.get("calls", {})
+    generate_calls = sum(calls.get(key, 0) for key in _GENERATE_CALLS)
+    return {
+        "scenario": name,
+        "profile": profile,
+        "concurrency": concurrency,
+        "requests": len(results),
+        "ok": outcomes.get("ok", 0),
+        "errors": {k: v for k, v in outcomes.items() if k != "ok"},
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(len(results) / elapsed, 2) if elapsed else None,
+        "latency_ms": {"p50": _round(percentile(latencies, 50)), "p99": _round(percentile(latencies, 99))},
+        "ttft_ms": {"p50": _round(percentile(ttfts, 50)), "p99": _round(percentile(ttfts, 99))} if scenario["stream"] else None,
+        "upstream_calls": generate_calls if mock_url else None,
+        "retries": max(0, generate_calls - len(results)) if mock_url else None,
+        "upstream": upstream or None,
+    }
+
+
+def _round(value: Optional[float]) -> Optional[float]:
+    return None if value is None else round(value, 1)
+
+
+def print_report(reports: List[Dict[str, Any]]):
+    header = f"{'场景':<24}{'配置':<10}{'并发':>5}{'请求':>6}{'成功':>6}{'req/s':>8}{'p50 ms':>9}{'p99 ms':>9}{'TTFT p50':>10}{'TTFT p99':>10}{'上游':>6}{'重试':>6}"
+    print(header)
+    for r in reports:
+        ttft = r["ttft_ms"] or {}
+        cells = [
+            f"{r['scenario']:<24}", f"{r['profile']:<10}", f"{r['concurrency']:>5}", f"{r['requests']:>6}", f"{r['ok']:>6}",
+            f"{r['throughput_rps']:>8}", f"{r['latency_ms']['p50']:>9}", f"{r['latency_ms']['p99']:>9}",
+            f"{str(ttft.get('p50', '-')):>10}", f"{str(ttft.get('p99', '-')):>10}",
+            f"{str(r['upstream_calls'] if r['upstream_calls'] is not None else '-'):>6}",
+            f"{str(r['retries'] if r['retries'] is not None else '-'):>6}",
+        ]
+        print("".join(cells))
+        if r["errors"]:
+            print(f"   错误: {r['errors']}")
+        injected = (r.get("upstream") or {}).get("injected")
+        if injected:
+            print(f"   上游注入: {injected}")
+
+
+async def run_all(args) -> List[Dict[str, Any]]:
+    names = list(SCENARIOS) if args.scenario == "all" else args.scenario.split(",")
+    profiles = args.profile.split(",")
+    for name in names:
+        if name not in SCENARIOS:
+            raise SystemExit(f"未知场景: {name}（可选: {', '.join(SCENARIOS)}）")
+    for profile in profiles:
+        if profile not in PROFILES:
+            raise SystemExit(f"未知配置: {profile}（可选: {', '.join(PROFILES)}）")
+    if any(p != "baseline" for p in profiles) and not args.mock_url:
+        raise SystemExit("非 baseline 配置需要 --mock-url")
+
+    reports = []
+    for profile in profiles:
+        for name in names:
+            report = await run_scenario(
+                name, profile, args.base_url, args.api_key, args.mock_url,
+                args.concurrency, args.requests, args.timeout,
+            )
+            reports.append(report)
+            print(f"[LoadTest] {name} / {profile}: {report['ok']}/{report['requests']} 成功, "
+                  f"{report['throughput_rps']} req/s, p99 {report['latency_ms']['p99']} ms", flush=True)
+    return reports
+
+
+def add_driver_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--scenario", default="all", help=f"场景（逗号分隔或 all）: {', '.join(SCENARIOS)}")
+    parser.add_argument("--profile", default="baseline", help=f"模拟上游配置（逗号分隔）: {', '.join(PROFILES)}")
+    parser.add_argument("-c", "--concurrency", type=int, default=16, help="并发数")
+    parser.add_argument("-n", "--requests", type=int, default=200, help="每个场景的请求数")
+    parser.add_argument("--timeout", type=float, default=120, help="单个请求超时（秒）")
+    parser.add_argument("--json", default="", help="把结果写入该 JSON 文件")
+
+
+def finish(reports: List[Dict[str, Any]], json_path: str):
+    print()
+    print_report(reports)
+    if json_path:
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(reports, f, ensure_ascii=False, indent=1)
+        print(f"结果已写入 {json_path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m scripts.loadtest.driver", description="代理压测驱动")
+    parser.add_argument("--base-url", default="http://127.0.0.1:5001", help="代理地址")
+    parser.add_argument("--api-key", required=True, help="压测用户的 API Key（见 scripts.loadtest.seed）")
+    parser.add_argument("--mock-url", default="", help="模拟上游地址（用于切换配置和统计重试）")
+    add_driver_arguments(parser)
+    args = parser.parse_args()
+    finish(asyncio.run(run_all(args)), args.json)
+
+
+if __name__ == "__main__":
+    main()
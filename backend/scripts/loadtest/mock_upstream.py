@@ -0,0 +1,318 @@
+"""
+模拟上游（GeminiCLI Code Assist / Antigravity / Google OAuth）
+
+    cd backend
+    python -m scripts.loadtest.mock_upstream --port 9100 --latency 0.3 --chunk-interval 0.02 --rate-429 0.05
+
+代理通过以下配置指向它（见 app/config.py）：
+    CODE_ASSIST_ENDPOINT=http://127.0.0.1:9100
+    ANTIGRAVITY_API_BASE=http://127.0.0.1:9100
+    GOOGLE_TOKEN_URL=http://127.0.0.1:9100/token
+
+模拟的接口：
+- POST /token：refresh_token 换 access_token
+- POST /v1internal:loadCodeAssist / onboardUser：返回 project_id
+- POST /v1internal:fetchAvailableModels：模型列表 + 每个凭证的剩余配额
+- POST /v1internal:generateContent / streamGenerateContent?alt=sse：按配置的延迟、chunk 节奏生成回复，
+  按比例注入 429 / 5xx，每个凭证每个模型超过配额后返回 QUOTA_EXHAUSTED
+
+控制接口（压测驱动用）：
+- GET /_mock/stats：各接口调用次数、注入的错误数
+- GET / POST /_mock/config：查看 / 修改配置（POST 的字段会覆盖当前值）
+- POST /_mock/reset：清空统计和配额用量
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+MODELS = (
+    "gemini-2.5-flash", "gemini-2.5-pro", "gemini-3-pro-preview", "gemini-3-flash",
+    "claude-sonnet-4-5", "claude-sonnet-4-5-thinking", "claude-opus-4-5-thinking",
+)
+
+_WORDS = "the proxy model stream token upstream request response credential cache 模拟 回复 内容 测试".split()
+
+
+class MockConfig:
+    """模拟上游的行为配置（运行中可以通过 /_mock/config 修改）"""
+
+    def __init__(self):
+        self.latency = 0.2            # 首个 chunk（非流式为整个响应）前的延迟（秒）
+        self.latency_jitter = 0.05    # 延迟的随机抖动（秒）
+        self.chunk_interval = 0.02    # 流式 chunk 间隔（秒）
+        self.chunks = 20              # 每个回复的 chunk 数
+        self.chunk_words = 8          # 每个 chunk 的词数
+        self.thought_chunks = 0       # 正文前的思考 chunk 数
+        self.rate_429 = 0.0           # 注入 429（RATE_LIMIT_EXCEEDED）的比例
+        self.rate_5xx = 0.0           # 注入 500 / 503 的比例
+        self.quota = 0                # 每个凭证每个模型可用的请求数（0=不限）
+        self.quota_reset = 3600       # 配额耗尽后的重置时间（秒后）
+        self.token_expires_in = 3599  # 签发的 access_token 有效期（秒）
+        self.seed: Optional[int] = None
+
+    def update(self, values: Dict[str, Any]) -> Dict[str, Any]:
+        for key, value in values.items():
+            if key.startswith("_") or not hasattr(self, key):
+                raise ValueError(f"未知配置项: {key}")
+            current = getattr(self, key)
+            setattr(self, key, type(current)(value) if current is not None and value is not None else value)
+        return self.as_dict()
+
+    def as_dict(self) -> Dict[str, Any]:
+        return dict(vars(self))
+
+
+class MockState:
+    """调用统计、签发的 token、配额用量"""
+
+    def __init__(self, config: MockConfig):
+        self.config = config
+        self.rng = random.Random(config.seed)
+        self.reset()
+
+    def reset(self):
+        self.calls: Counter = Counter()
+        self.injected: Counter = Counter()
+        self.statuses: Counter = Counter()
+        self.active_streams = 0
+        self.max_active_streams = 0
+        # access_token -> 凭证标识（refresh_token 的哈希）
+        self.tokens: Dict[str, str] = {}
+        # (凭证标识, 模型) -> 已用请求数
+        self.usage: Dict[tuple, int] = defaultdict(int)
+
+    def identity(self, request: Request) -> str:
+        token = request.headers.get("authorization", "").removeprefix("Bearer ").strip()
+        return self.tokens.get(token, token or "anonymous")
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "calls": dict(self.calls),
+            "injected": dict(self.injected),
+            "statuses": {str(k): v for k, v in self.statuses.items()},
+            "max_active_streams": self.max_active_streams,
+            "credentials": len(set(self.tokens.values())),
+        }
+
+
+def _google_error(code: int, status: str, message: str, details: Optional[list] = None) -> JSONResponse:
+    error: Dict[str, Any] = {"code": code, "message": message, "status": status}
+    if details:
+        error["details"] = details
+    return JSONResponse(status_code=code, content={"error": error})
+
+
+def _model_of(body: Dict[str, Any]) -> str:
+    return str(body.get("model") or "unknown")
+
+
+def create_app(config: Optional[MockConfig] = None) -> FastAPI:
+    config = config or MockConfig()
+    state = MockState(config)
+    app = FastAPI(title="Mock Upstream", docs_url=None, redoc_url=None)
+    app.state.mock = state
+
+    async def _delay(seconds: float):
+        if seconds > 0:
+            await asyncio.sleep(seconds)
+
+    def _first_latency() -> float:
+        return max(0.0, config.latency + state.rng.uniform(-config.latency_jitter, config.latency_jitter))
+
+    def _text() -> str:
+        return " ".join(state.rng.choice(_WORDS) for _ in range(config.chunk_words)) + " "
+
+    def _usage(chunks: int) -> Dict[str, int]:
+        output = chunks * config.chunk_words
+        return {"promptTokenCount": 128, "candidatesTokenCount": output, "totalTokenCount": 128 + output}
+
+    def _check_failure(request: Request, body: Dict[str, Any]) -> Optional[JSONResponse]:
+        """按配置注入错误 / 扣减配额；返回错误响应或 None"""
+        model = _model_of(body)
+        key = (state.identity(request), model)
+        if config.quota and state.usage[key] >= config.quota:
+            state.injected["quota_exhausted"] += 1
+            reset_at = datetime.now(timezone.utc) + timedelta(seconds=config.quota_reset)
+            return _google_error(429, "RESOURCE_EXHAUSTED", "You have exhausted your capacity on this model.", [{
+                "@type": "type.googleapis.com/google.rpc.ErrorInfo",
+                "reason": "QUOTA_EXHAUSTED",
+                "domain": "cloudcode-pa.googleapis.com",
+                "metadata": {
+                    "model": model,
+                    "quotaResetTimeStamp": reset_at.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                    "quotaResetDelay": f"{config.quota_reset}s",
+                },
+            }])
+        roll = state.rng.random()
+        if roll < config.rate_429:
+            state.injected["429"] += 1
+            return _google_error(429, "RESOURCE_EXHAUSTED", "Resource has been exhausted (e.g. check quota).", [{
+                "@type": "type.googleapis.com/google.rpc.ErrorInfo",
+                "reason": "RATE_LIMIT_EXCEEDED",
+                "domain": "cloudcode-pa.googleapis.com",
+                "metadata": {"model": model},
+            }])
+        if roll < config.rate_429 + config.rate_5xx:
+            code = state.rng.choice((500, 503))
+            state.injected[str(code)] += 1
+            status = "INTERNAL" if code == 500 else "UNAVAILABLE"
+            return _google_error(code, status, "The service is currently unavailable.")
+        state.usage[key] += 1
+        return None
+
+    def _chunk(parts: list, finish: bool = False, chunks: int = 0) -> Dict[str, Any]:
+        candidate: Dict[str, Any] = {"content": {"role": "model", "parts": parts}}
+        response: Dict[str, Any] = {"candidates": [candidate], "modelVersion": "mock", "responseId": "mock-response"}
+        if finish:
+            candidate["finishReason"] = "STOP"
+            response["usageMetadata"] = _usage(chunks)
+        return {"response": response, "traceId": "mock-trace"}
+
+    @app.middleware("http")
+    async def _count(request: Request, call_next):
+        name = request.url.path.rsplit(":", 1)[-1] if ":" in request.url.path else request.url.path
+        if not name.startswith("/_mock"):
+            state.calls[name] += 1
+        response = await call_next(request)
+        if not name.startswith("/_mock"):
+            state.statuses[response.status_code] += 1
+        return response
+
+    # ===== OAuth =====
+
+    @app.post("/token")
+    async def token(request: Request):
+        form = await request.form()
+        refresh_token = str(form.get("refresh_token") or "")
+        if not refresh_token:
+            return JSONResponse(status_code=400, content={"error": "invalid_request", "error_description": "Missing refresh_token"})
+        identity = hashlib.sha256(refresh_token.encode()).hexdigest()[:16]
+        access_token = f"mock-at-{identity}-{state.calls['/token']}"
+        state.tokens[access_token] = identity
+        return {"access_token": access_token, "expires_in": config.token_expires_in, "token_type": "Bearer",
+                "scope": "https://www.googleapis.com/auth/cloud-platform"}
+
+    # ===== Code Assist 账号 =====
+
+    @app.post("/v1internal:loadCodeAssist")
+    async def load_code_assist(request: Request):
+        return {
+            "currentTier": {"id": "standard-tier", "name": "Gemini Code Assist"},
+            "allowedTiers": [{"id": "standard-tier", "isDefault": True}],
+            "cloudaicompanionProject": f"mock-project-{state.identity(request)[:8]}",
+        }
+
+    @app.post("/v1internal:onboardUser")
+    async def onboard_user(request: Request):
+        return {"done": True, "response": {"cloudaicompanionProject": {"id": f"mock-project-{state.identity(request)[:8]}"}}}
+
+    @app.post("/v1internal:fetchAvailableModels")
+    async def fetch_available_models(request: Request):
+        identity = state.identity(request)
+        reset_at = (datetime.now(timezone.utc) + timedelta(seconds=config.quota_reset)).strftime("%Y-%m-%dT%H:%M:%SZ")
+        models = {}
+        for model in MODELS:
+            used = state.usage[(identity, model)]
+            remaining = 1.0 if not config.quota else max(0.0, 1 - used / config.quota)
+            models[model] = {"displayName": model, "quotaInfo": {"remainingFraction": remaining, "resetTime": reset_at}}
+        return {"models": models}
+
+    # ===== 生成 =====
+
+    @app.post("/v1internal:generateContent")
+    async def generate_content(request: Request):
+        body = await request.json()
+        await _delay(_first_latency())
+        failure = _check_failure(request, body)
+        if failure is not None:
+            return failure
+        # 非流式：生成全部内容所需的时间
+        await _delay(config.chunk_interval * (config.chunks + config.thought_chunks))
+        parts = []
+        if config.thought_chunks:
+            parts.append({"text": "".join(_text() for _ in range(config.thought_chunks)), "thought": True})
+        parts.append({"text": "".join(_text() for _ in range(config.chunks))})
+        return _chunk(parts, finish=True, chunks=config.chunks)
+
+    @app.post("/v1internal:streamGenerateContent")
+    async def stream_generate_content(request: Request):
+        body = await request.json()
+        await _delay(_first_latency())
+        failure = _check_failure(request, body)
+        if failure is not None:
+            return failure
+
+        async def events():
+            state.active_streams += 1
+            state.max_active_streams = max(state.max_active_streams, state.active_streams)
+            try:
+                total = config.thought_chunks + config.chunks
+                for i in range(total):
+                    if i:
+                        await _delay(config.chunk_interval)
+                    part: Dict[str, Any] = {"text": _text()}
+                    if i < config.thought_chunks:
+                        part["thought"] = True
+                    payload = _chunk([part], finish=i == total - 1, chunks=config.chunks)
+                    yield f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8")
+            finally:
+                state.active_streams -= 1
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    # ===== 控制接口 =====
+
+    @app.get("/_mock/stats")
+    async def mock_stats():
+        return state.snapshot()
+
+    @app.get("/_mock/config")
+    async def get_mock_config():
+        return config.as_dict()
+
+    @app.post("/_mock/config")
+    async def set_mock_config(request: Request):
+        try:
+            return config.update(await request.json())
+        except (ValueError, TypeError) as e:
+            return JSONResponse(status_code=400, content={"error": str(e)})
+
+    @app.post("/_mock/reset")
+    async def mock_reset():
+        state.reset()
+        return {"ok": True, "time": time.time()}
+
+    return app
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m scripts.loadtest.mock_upstream", description="模拟上游")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    defaults = MockConfig()
+    for key, value in defaults.as_dict().items():
+        kind = int if key == "seed" else type(value)
+        parser.add_argument(f"--{key.replace('_', '-')}", type=kind, default=value)
+    return parser
+
+
+def main():
+    import uvicorn
+
+    args = build_parser().parse_args()
+    config = MockConfig()
+    config.update({key: getattr(args, key) for key in config.as_dict()})
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+压测数据：创建压测用户、API Key 和指向模拟上游的凭证
+
+    cd <压测工作目录>
+    DATABASE_URL=sqlite+aiosqlite:///./data/loadtest.db python -m scripts.loadtest.seed --geminicli 8 --antigravity 8
+
+凭证只有 refresh_token 和 project_id（凭证池只选有 project_id 的凭证），没有 access_token，
+代理第一次使用时会向模拟上游刷新 token，这部分开销也计入压测。输出 API Key。
+"""
+import argparse
+import asyncio
+import os
+import secrets
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+LOADTEST_USERNAME = "loadtest"
+
+
+async def seed(geminicli: int, antigravity: int) -> str:
+    from sqlalchemy import delete, select
+
+    from app.database import async_session, init_db
+    from app.models.user import APIKey, Credential, User
+    from app.services.auth import get_password_hash
+    from app.services.crypto import encrypt_credential
+
+    await init_db(skip_migration_check=True)
+    async with async_session() as db:
+        user = (await db.execute(select(User).where(User.username == LOADTEST_USERNAME))).scalar_one_or_none()
+        if user is None:
+            user = User(username=LOADTEST_USERNAME, hashed_password=get_password_hash(secrets.token_urlsafe(16)))
+            db.add(user)
+        # 管理员不受 RPM 和每日配额限制，压测只衡量代理和上游
+        user.is_admin = True
+        user.is_active = True
+        user.custom_rpm = 1_000_000
+        await db.flush()
+
+        await db.execute(delete(Credential).where(Credential.user_id == user.id))
+        for api_type, count in (("geminicli", geminicli), ("antigravity", antigravity)):
+            for i in range(count):
+                db.add(Credential(
+                    user_id=user.id,
+                    name=f"loadtest-{api_type}-{i}",
+                    api_key="",
+                    refresh_token=encrypt_credential(f"loadtest-{api_type}-{i}-{secrets.token_hex(8)}"),
+                    project_id=f"loadtest-{api_type}-{i}",
+                    api_type=api_type,
+                    credential_type="oauth",
+                    model_tier="3",
+                    account_type="pro",
+                    email=f"loadtest-{api_type}-{i}@example.com",
+                    is_public=True,
+                    is_active=True,
+                ))
+
+        key = (await db.execute(select(APIKey).where(APIKey.user_id == user.id, APIKey.is_active == True))).scalars().first()
+        if key is None:
+            key = APIKey(user_id=user.id, key=f"sk-loadtest-{secrets.token_hex(16)}", name="loadtest")
+            db.add(key)
+        await db.commit()
+        return key.key
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m scripts.loadtest.seed", description="创建压测用户和凭证")
+    parser.add_argument("--geminicli", type=int, default=8, help="GeminiCLI 凭证数")
+    parser.add_argument("--antigravity", type=int, default=8, help="Antigravity 凭证数")
+    args = parser.parse_args()
+    print(asyncio.run(seed(args.geminicli, args.antigravity)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+协议转换一致性检查
+
+把 scripts/fixtures/protocol_conformance.json 中录制的请求/响应样本重新跑一遍当前的转换代码，
+与录制时的输出逐字节比较（JSON 序列化后比较）。修改转换器后运行：
+
+    cd backend
+    python scripts/protocol_conformance.py            # 比较，有差异时退出码为 1
+    python scripts/protocol_conformance.py --record   # 用当前代码重新录制期望输出（确认行为变化是预期的之后）
+
+样本类型（kind）：
+- openai_request / anthropic_request / gcli_request：请求转换（openai 与 anthropic 同时检查带对话前缀缓存的路径）
+- antigravity_openai_response / antigravity_openai_stream：Antigravity 响应转 OpenAI
+- gcli_openai_response / gcli_openai_stream：Gemini CLI 响应转 OpenAI
+- anthropic_response / anthropic_stream：Gemini 响应转 Anthropic
+"""
+import argparse
+import asyncio
+import copy
+import json
+import os
+import re
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+FIXTURE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "protocol_conformance.json")
+
+# 响应中随机生成的消息 ID
+_RANDOM_ID_RE = re.compile(r"msg_[0-9a-f]{32}")
+
+
+def _dump(value) -> str:
+    return _RANDOM_ID_RE.sub("msg_<random>", json.dumps(value, ensure_ascii=False))
+
+
+async def _fake_save_image(base64_data: str, mime_type: str = "image/png", auto_delete_seconds: int = None) -> str:
+    """不落盘：按数据长度生成固定的图片 URL"""
+    return f"/images/fixture-{len(base64_data)}.{mime_type.split('/')[-1]}"
+
+
+async def _collect(agen) -> list:
+    return [chunk.decode("utf-8") if isinstance(chunk, bytes) else chunk async for chunk in agen]
+
+
+async def _iterate(chunks):
+    for chunk in chunks:
+        yield chunk.encode("utf-8")
+
+
+async def run_case(case: dict):
+    """按样本类型运行当前代码，返回可 JSON 序列化的输出"""
+    from app.services.anthropic2gemini import (
+        anthropic_to_gemini_request, gemini_to_anthropic_response, gemini_stream_to_anthropic_stream,
+    )
+    from app.services.antigravity_client import AntigravityClient
+    from app.services.gemini_client import GeminiClient
+    from app.services.openai2gemini_full import convert_openai_to_gemini_request
+    from app.services.prefix_cache import prefix_cache
+
+    kind = case["kind"]
+    data = copy.deepcopy(case["input"])
+    if kind == "openai_request":
+        plain = await convert_openai_to_gemini_request(copy.deepcopy(data))
+        prefix_cache.clear()
+        cached = [await convert_openai_to_gemini_request(copy.deepcopy(data), cache_key="conformance") for _ in range(2)]
+        return {"plain": plain, "cached": cached}
+    if kind == "anthropic_request":
+        plain = await anthropic_to_gemini_request(copy.deepcopy(data))
+        prefix_cache.clear()
+        cached = [await anthropic_to_gemini_request(copy.deepcopy(data), cache_key="conformance") for _ in range(2)]
+        return {"plain": plain, "cached": cached}
+    if kind == "gcli_request":
+        contents, system_instruction = GeminiClient("")._convert_messages_to_contents(data)
+        return {"contents": contents, "systemInstruction": system_instruction}
+    if kind == "antigravity_openai_response":
+        return await AntigravityClient("")._convert_to_openai_response(data, case.get("model", "model"), case.get("base_url"))
+    if kind == "antigravity_openai_stream":
+        client = AntigravityClient("")
+        return [await client._convert_to_openai_stream(chunk, case.get("model", "model"), case.get("base_url")) for chunk in data]
+    if kind == "gcli_openai_response":
+        return GeminiClient("")._convert_to_openai_response(data, case.get("model", "model"))
+    if kind == "gcli_openai_stream":
+        client = GeminiClient("")
+        return [client._convert_to_openai_stream(chunk, case.get("model", "model")) for chunk in data]
+    if kind == "anthropic_response":
+        return gemini_to_anthropic_response(data, case.get("model", "model"))
+    if kind == "anthropic_stream":
+        return await _collect(gemini_stream_to_anthropic_stream(_iterate(data), case.get("model", "model")))
+    raise ValueError(f"未知样本类型: {kind}")
+
+
+async def main(record: bool) -> int:
+    from app.services.image_storage import ImageStorage
+    ImageStorage.save_base64_image_async = staticmethod(_fake_save_image)
+
+    with open(FIXTURE_PATH, encoding="utf-8") as f:
+        cases = json.load(f)
+
+    failed = 0
+    for case in cases:
+        output = await run_case(case)
+        if record:
+            case["expected"] = json.loads(json.dumps(output))
+            continue
+        if _dump(output) != _dump(case.get("expected")):
+            failed += 1
+            print(f"❌ {case['kind']}: {case['name']}")
+            print(f"   期望: {_dump(case.get('expected'))[:500]}")
+            print(f"   实际: {_dump(output)[:500]}")
+
+    if record:
+        with open(FIXTURE_PATH, "w", encoding="utf-8") as f:
+            json.dump(cases, f, ensure_ascii=False, indent=1)
+            f.write("\n")
+        print(f"已录制 {len(cases)} 个样本")
+        return 0
+    print(f"{len(cases) - failed}/{len(cases)} 个样本一致")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="协议转换一致性检查")
+    parser.add_argument("--record", action="store_true", help="用当前代码重新录制期望输出")
+    args = parser.parse_args()
+    sys.exit(asyncio.run(main(args.record)))
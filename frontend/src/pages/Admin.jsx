@@ -16,7 +16,7 @@ import {
     Users,
     X,
 } from "lucide-react";
-import { useCallback, useEffect, useState } from "react";
+import { useCallback, useEffect, useRef, useState } from "react";
 import { Link } from "react-router-dom";
 import api from "../api";
 import { useAuth } from "../App";
@@ -42,6 +42,8 @@ export default function Admin() {
   const { user } = useAuth();
   const [tab, setTab] = useState("users");
   const [users, setUsers] = useState([]);
+  const [userTotal, setUserTotal] = useState(0);
+  const fetchUsersRef = useRef(null);
   const [credentials, setCredentials] = useState([]);
   const [logs, setLogs] = useState([]);
   const [loading, setLoading] = useState(true);
@@ -162,11 +164,8 @@ export default function Admin() {
   const handleWsMessage = useCallback((data) => {
     console.log("WS:", data.type);
     if (data.type === "user_update") {
-      // 实时更新用户列表
-      api
-        .get("/api/admin/users")
-        .then((res) => setUsers(res.data.users))
-        .catch(() => {});
+      // 实时更新用户列表（按当前页、搜索、排序重新获取）
+      fetchUsersRef.current?.();
     } else if (data.type === "credential_update") {
       // 实时更新凭证列表
       api
@@ -185,8 +184,7 @@ export default function Admin() {
     setLoading(true);
     try {
       if (tab === "users") {
-        const res = await api.get("/api/admin/users");
-        setUsers(res.data.users);
+        await fetchUsers();
       } else if (tab === "credentials") {
         const res = await api.get("/api/admin/credentials");
         setCredentials(res.data.credentials);
@@ -205,6 +203,11 @@ export default function Admin() {
   };
 
   useEffect(() => {
+    // 用户页由下方的用户列表 effect 统一拉取，这里只负责切换时显示加载态
+    if (tab === "users") {
+      setLoading(true);
+      return;
+    }
     fetchData();
   }, [tab]);
 
@@ -601,40 +604,50 @@ export default function Admin() {
   const [userSearch, setUserSearch] = useState("");
   const [userSort, setUserSort] = useState({ field: "id", order: "asc" });
   const [userPage, setUserPage] = useState(1);
+  // 防抖后真正用于查询的关键字
+  const [userQuery, setUserQuery] = useState("");
+  // 请求序号：只采用最后一次发出的请求结果，丢弃过期响应
+  const usersRequestSeq = useRef(0);
   const usersPerPage = 20;
 
-  // 处理用户列表：搜索 -> 排序 -> 分页
-  const processedUsers = (() => {
-    let result = [...users];
-    // 搜索
-    if (userSearch.trim()) {
-      const search = userSearch.toLowerCase();
-      result = result.filter(
-        (u) =>
-          u.username?.toLowerCase().includes(search) ||
-          u.discord_name?.toLowerCase().includes(search) ||
-          u.discord_id?.includes(search) ||
-          String(u.id).includes(search),
-      );
+  // 获取用户列表（搜索、排序、分页都在服务端完成）
+  const fetchUsers = async () => {
+    const seq = ++usersRequestSeq.current;
+    try {
+      const params = new URLSearchParams();
+      params.append("page", userPage);
+      params.append("page_size", usersPerPage);
+      params.append("sort", userSort.field);
+      params.append("order", userSort.order);
+      if (userQuery) params.append("search", userQuery);
+
+      const res = await api.get(`/api/admin/users?${params.toString()}`);
+      if (seq !== usersRequestSeq.current) return;
+      setUsers(res.data.users);
+      setUserTotal(res.data.total);
+    } catch (err) {
+      console.error("获取用户失败", err);
     }
-    // 排序
-    result.sort((a, b) => {
-      let aVal = a[userSort.field];
-      let bVal = b[userSort.field];
-      if (typeof aVal === "string") aVal = aVal.toLowerCase();
-      if (typeof bVal === "string") bVal = bVal.toLowerCase();
-      if (aVal < bVal) return userSort.order === "asc" ? -1 : 1;
-      if (aVal > bVal) return userSort.order === "asc" ? 1 : -1;
-      return 0;
-    });
-    return result;
-  })();
+  };
+  fetchUsersRef.current = fetchUsers;
 
-  const totalUserPages = Math.ceil(processedUsers.length / usersPerPage);
-  const paginatedUsers = processedUsers.slice(
-    (userPage - 1) * usersPerPage,
-    userPage * usersPerPage,
-  );
+  const totalUserPages = Math.max(1, Math.ceil(userTotal / usersPerPage));
+  const paginatedUsers = users;
+
+  // 切换到用户页、翻页、排序、搜索变化时统一在这里获取
+  useEffect(() => {
+    if (tab !== "users") return;
+    fetchUsers().finally(() => setLoading(false));
+  }, [tab, userPage, userSort, userQuery]);
+
+  // 搜索防抖：只更新查询关键字并回到第一页，由上面的 effect 发请求
+  useEffect(() => {
+    const timer = setTimeout(() => {
+      setUserQuery(userSearch.trim());
+      setUserPage(1);
+    }, 300);
+    return () => clearTimeout(timer);
+  }, [userSearch]);
 
   const handleUserSort = (field) => {
     setUserSort((prev) => ({
@@ -822,13 +835,12 @@ export default function Admin() {
                       value={userSearch}
                       onChange={(e) => {
                         setUserSearch(e.target.value);
-                        setUserPage(1);
                       }}
                       className="px-4 py-2 bg-dark-800 border border-dark-600 rounded-lg text-white placeholder-gray-500 w-64"
                     />
                     <span className="text-gray-400 text-sm">
-                      共 {processedUsers.length} 个用户
-                      {userSearch && ` (筛选自 ${users.length} 个)`}
+                      共 {userTotal} 个用户
+                      {userSearch && " (筛选结果)"}
                     </span>
                   </div>
                 </div>